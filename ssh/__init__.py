@@ -1,18 +1,13 @@
-import logging
-import sys
-
-
-logger = logging.getLogger('ssh')
-logger.setLevel(logging.DEBUG)
+"""
+SSH server and client built on paramiko.
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+Importing the package does no I/O and attaches no handlers; entry points
+call `.log.configure_logging`, and library users configure the ``ssh``
+logger as they like.
+"""
 
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setFormatter(formatter)
-logger.addHandler(stream_handler)
-
-file_handler = logging.FileHandler('ssh.log')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+import logging
 
 
+logger = logging.getLogger('ssh')
+logger.addHandler(logging.NullHandler())
@@ -0,0 +1,177 @@
+"""
+Admission control for new connections.
+
+Key exchange is the most expensive part of a session, and it starts as
+soon as a connection is accepted, before the client has proven anything.
+`AdmissionControl` decides first whether to serve a connection at all:
+
+- each source IP has a token bucket refilled at ``rate`` connections per
+  second and holding up to ``burst`` of them;
+- at most ``max_handshakes`` connections may be between being accepted
+  and authenticating at once;
+- an IP whose clients fail authentication ``max_ip_failures`` times is
+  refused until its failure allowance refills, over ``failure_window``
+  seconds.
+
+Refused connections are closed before the server sends its banner. The
+per-IP state is an LRU table of at most ``max_tracked`` addresses, so a
+flood from many addresses cannot grow it without bound; an address that
+is evicted starts afresh. Authentication attempts on one connection are
+limited by `.SSHServerInterface` with ``max_auth_tries``.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+FAILURE_WINDOW = 60.0
+MAX_TRACKED = 65536
+MAX_AUTH_TRIES = 6
+
+# Reasons `AdmissionControl.admit` refuses a connection, and the counter
+# each one increments.
+REJECTED_COUNTERS = {
+    'rate': 'rejected_rate',
+    'auth_failures': 'rejected_auth_failures',
+    'handshakes': 'rejected_handshakes',
+}
+
+
+class _Source:
+
+    __slots__ = ('tokens', 'failures', 'updated')
+
+    def __init__(self, tokens, failures, updated):
+        self.tokens = tokens
+        self.failures = failures
+        self.updated = updated
+
+
+class AdmissionControl:
+    """Per-IP rate and failure limits and a cap on handshakes in flight."""
+
+    def __init__(
+        self,
+        rate=None,
+        burst=None,
+        max_handshakes=None,
+        max_ip_failures=None,
+        failure_window=FAILURE_WINDOW,
+        max_tracked=MAX_TRACKED,
+        metrics=None
+    ):
+        """
+        :param float rate:
+            new connections per second allowed from one IP, or ``None``
+        :param int burst:
+            connections one IP may open at once; defaults to ``rate``,
+            and at least 1
+        :param int max_handshakes:
+            connections that may be accepted but not yet authenticated at
+            once, or ``None``
+        :param int max_ip_failures:
+            failed authentication attempts allowed from one IP within
+            ``failure_window`` seconds, or ``None``
+        :param float failure_window: see ``max_ip_failures``
+        :param int max_tracked: IP addresses to keep state for
+        :param .Metrics metrics:
+            counts refused connections and tracks ``handshakes_in_flight``
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.max_handshakes = max_handshakes
+        self.max_ip_failures = max_ip_failures
+        self.failure_window = failure_window
+        self.max_tracked = max_tracked
+        self.metrics = metrics
+        self.handshakes = 0
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sources)
+
+    @property
+    def tracks_sources(self):
+        return bool(self.rate or self.max_ip_failures)
+
+    def admit(self, session):
+        """
+        Decide whether to serve ``session``, a `.Session` that has not
+        started key exchange. If it is admitted it holds a handshake slot
+        until passed to `release`.
+
+        :return: ``None`` if admitted, else the reason it was refused:
+            ``"rate"``, ``"auth_failures"`` or ``"handshakes"``
+        """
+        now = time.monotonic()
+        reason = None
+        with self._lock:
+            source = None
+            if self.tracks_sources:
+                source = self._source(session.addr[0], now)
+                if self.max_ip_failures and source.failures < 1:
+                    reason = 'auth_failures'
+                elif self.rate and source.tokens < 1:
+                    reason = 'rate'
+            if reason is None and self.max_handshakes is not None and (
+                self.handshakes >= self.max_handshakes
+            ):
+                reason = 'handshakes'
+            if reason is None:
+                if self.rate:
+                    source.tokens -= 1
+                self.handshakes += 1
+                session.handshaking = True
+        if self.metrics is not None:
+            if reason is None:
+                self.metrics.gauge('handshakes_in_flight', 1)
+            else:
+                self.metrics.inc(REJECTED_COUNTERS[reason])
+        return reason
+
+    def release(self, session):
+        """
+        Give back ``session``'s handshake slot once it has authenticated
+        or closed. Safe to call more than once.
+        """
+        with self._lock:
+            if not session.handshaking:
+                return
+            session.handshaking = False
+            self.handshakes -= 1
+        if self.metrics is not None:
+            self.metrics.gauge('handshakes_in_flight', -1)
+
+    def auth_failed(self, ip):
+        """Record a failed authentication attempt from ``ip``."""
+        if not self.max_ip_failures:
+            return
+        with self._lock:
+            source = self._source(ip, time.monotonic())
+            source.failures = max(0.0, source.failures - 1)
+
+    def _source(self, ip, now):
+        """The refilled state of ``ip``, as the most recently used."""
+        source = self._sources.get(ip)
+        if source is None:
+            source = _Source(self.burst, self.max_ip_failures or 0, now)
+            self._sources[ip] = source
+            if len(self._sources) > self.max_tracked:
+                self._sources.popitem(last=False)
+            return source
+        self._sources.move_to_end(ip)
+        elapsed = now - source.updated
+        source.updated = now
+        if self.rate:
+            source.tokens = min(
+                self.burst, source.tokens + elapsed * self.rate
+            )
+        if self.max_ip_failures:
+            source.failures = min(
+                self.max_ip_failures,
+                source.failures
+                + elapsed * self.max_ip_failures / self.failure_window
+            )
+        return source
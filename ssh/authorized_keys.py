@@ -0,0 +1,330 @@
+"""
+Indexed ``authorized_keys`` store.
+
+Each file is parsed once into a dictionary keyed by ``(key type, key
+blob)``, so a lookup is a single exact-match dictionary access no matter
+how many keys are listed. A file is re-read only when its inode, mtime or
+size changes, and that is checked at most once per ``check_interval``
+seconds.
+
+Lines may carry OpenSSH ``authorized_keys`` options, for example::
+
+    from="10.0.0.0/8,!10.0.0.1",no-pty ssh-ed25519 AAAAC3... user@host
+
+`AuthorizedKeys` combines a global file with optional per-user files
+given as a path template in which ``%u`` is replaced by the username.
+"""
+
+import base64
+import binascii
+import fnmatch
+import hashlib
+import ipaddress
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger('ssh')
+
+AUTHORIZED_KEYS_PATH = 'keys/server/authorized_keys'
+CHECK_INTERVAL = 1.0
+MAX_USER_FILES = 1024
+
+# Options that may be given more than once; their values are collected.
+MULTI_OPTIONS = frozenset(('environment', 'permitlisten', 'permitopen'))
+
+
+class AuthorizedKey:
+
+    __slots__ = ('key_type', 'blob', 'comment', 'options')
+
+    def __init__(self, key_type, blob, comment='', options=None):
+        self.key_type = key_type
+        self.blob = blob
+        self.comment = comment
+        self.options = options or {}
+
+    def __repr__(self):
+        return f'<AuthorizedKey {self.key_type} {self.comment!r}>'
+
+    @property
+    def fingerprint(self):
+        """The key's fingerprint as OpenSSH prints it, ``SHA256:...``."""
+        digest = base64.b64encode(hashlib.sha256(self.blob).digest())
+        return 'SHA256:' + digest.decode().rstrip('=')
+
+    def allows(self, feature):
+        """
+        Return ``True`` if the options on this key permit ``feature``
+        (``"port-forwarding"``, ``"pty"``, ``"agent-forwarding"``, ...).
+
+        ``no-<feature>`` disables a feature; ``restrict`` disables all of
+        them except those re-enabled by name.
+        """
+        if f'no-{feature}' in self.options:
+            return False
+        if 'restrict' in self.options:
+            return feature in self.options
+        return True
+
+    def allows_address(self, address):
+        """
+        Check a client IP address against the ``from=`` option, if any.
+
+        Patterns are comma-separated and may use ``*`` and ``?`` wildcards,
+        CIDR networks, and ``!`` to negate. A negated match always denies.
+        """
+        patterns = self.options.get('from')
+        if patterns is None:
+            return True
+        if address is None:
+            return False
+
+        allowed = False
+        for pattern in patterns.split(','):
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:]
+            if _address_matches(address, pattern):
+                if negate:
+                    return False
+                allowed = True
+        return allowed
+
+
+def _address_matches(address, pattern):
+    if '/' in pattern:
+        try:
+            return ipaddress.ip_address(address) in ipaddress.ip_network(
+                pattern, strict=False
+            )
+        except ValueError:
+            return False
+    return fnmatch.fnmatchcase(address, pattern)
+
+
+def parse_options(text):
+    """
+    Parse an ``authorized_keys`` option string into a `dict`.
+
+    Flags map to ``True``, valued options to their unquoted value, and
+    options that may repeat (``permitopen`` and friends) to a `list`.
+    """
+    options = {}
+    for item in _split_unquoted(text, ','):
+        name, sep, value = item.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        if not sep:
+            options[name] = True
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1].replace('\\"', '"')
+        if name in MULTI_OPTIONS:
+            options.setdefault(name, []).append(value)
+        else:
+            options[name] = value
+    return options
+
+
+def _split_unquoted(text, separator):
+    """Split ``text`` on ``separator`` outside of double quotes."""
+    parts = []
+    start = 0
+    quoted = False
+    escaped = False
+    for i, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_line(line):
+    """
+    Parse one ``authorized_keys`` line.
+
+    :return: an `AuthorizedKey`, or ``None`` for blank, comment and
+        malformed lines
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    options = {}
+    fields = line.split(None, 2)
+    if len(fields) < 2:
+        return None
+    if not _is_key_type(fields[0]):
+        # Leading options end at the first space outside of quotes.
+        head = _split_unquoted(line, ' ')[0]
+        options = parse_options(head)
+        fields = line[len(head):].split(None, 2)
+        if len(fields) < 2 or not _is_key_type(fields[0]):
+            return None
+
+    key_type, key_base64 = fields[0], fields[1]
+    try:
+        blob = base64.b64decode(key_base64, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    comment = fields[2] if len(fields) > 2 else ''
+    return AuthorizedKey(key_type, blob, comment, options)
+
+
+def _is_key_type(field):
+    return (
+        field.startswith(('ssh-', 'ecdsa-sha2-', 'sk-', 'rsa-sha2-'))
+        and '=' not in field
+    )
+
+
+class AuthorizedKeysFile:
+
+    def __init__(self, path, check_interval=CHECK_INTERVAL):
+        """
+        :param str path: the ``authorized_keys`` file
+        :param float check_interval:
+            minimum seconds between checks of the file for changes
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.index = {}
+        self._signature = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self.refresh()
+        return len(self.index)
+
+    def lookup(self, key_type, blob):
+        """Return the `AuthorizedKey` for ``(key_type, blob)`` or ``None``."""
+        self.refresh()
+        return self.index.get((key_type, blob))
+
+    def refresh(self, force=False):
+        """Re-read the file if it has changed on disk."""
+        if not force and self._fresh():
+            return
+        with self._lock:
+            # Another thread may have refreshed while we waited.
+            if not force and self._fresh():
+                return
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                if self._signature is not None:
+                    logger.info('Authorized keys file %s removed', self.path)
+                self.index = {}
+                self._signature = None
+                self._checked = time.monotonic()
+                return
+            signature = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+            if signature == self._signature and not force:
+                self._checked = time.monotonic()
+                return
+            self.index = self._load()
+            self._signature = signature
+            self._checked = time.monotonic()
+            logger.info(
+                'Loaded %d authorized keys from %s',
+                len(self.index),
+                self.path
+            )
+
+    def _fresh(self):
+        return time.monotonic() - self._checked < self.check_interval
+
+    def _load(self):
+        index = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    entry = parse_line(line)
+                    if entry is not None:
+                        index[(entry.key_type, entry.blob)] = entry
+        except OSError as exc:
+            logger.info('Failed to read %s: %r', self.path, exc)
+        return index
+
+
+class AuthorizedKeys:
+
+    def __init__(
+        self,
+        path=AUTHORIZED_KEYS_PATH,
+        user_path=None,
+        check_interval=CHECK_INTERVAL
+    ):
+        """
+        :param str path: global ``authorized_keys`` file, or ``None``
+        :param str user_path:
+            per-user file template, e.g. ``"keys/server/users/%u"``; keys
+            listed there are only accepted for that user
+        :param float check_interval:
+            minimum seconds between checks of each file for changes
+        """
+        self.check_interval = check_interval
+        self.global_file = (
+            AuthorizedKeysFile(path, check_interval) if path else None
+        )
+        self.user_path = user_path
+        self._user_files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, username, key):
+        """
+        Find the entry authorizing the paramiko ``key`` for ``username``.
+
+        :param str username: the authenticating user
+        :param .PKey key: the key offered by the client
+        :return: the matching `AuthorizedKey`, or ``None``
+        """
+        return self.lookup_blob(username, key.get_name(), key.asbytes())
+
+    def lookup_blob(self, username, key_type, blob):
+        """As `lookup`, for a key given as its type and blob."""
+        user_file = self._user_file(username)
+        if user_file is not None:
+            entry = user_file.lookup(key_type, blob)
+            if entry is not None:
+                return entry
+        if self.global_file is not None:
+            return self.global_file.lookup(key_type, blob)
+        return None
+
+    def _user_file(self, username):
+        if not self.user_path or not _safe_username(username):
+            return None
+        with self._lock:
+            user_file = self._user_files.get(username)
+            if user_file is None:
+                user_file = AuthorizedKeysFile(
+                    self.user_path.replace('%u', username),
+                    self.check_interval
+                )
+                self._user_files[username] = user_file
+                if len(self._user_files) > MAX_USER_FILES:
+                    self._user_files.popitem(last=False)
+            else:
+                self._user_files.move_to_end(username)
+            return user_file
+
+
+def _safe_username(username):
+    return bool(username) and '/' not in username and username not in (
+        '.', '..'
+    )
@@ -0,0 +1,193 @@
+"""
+Benchmarks for the SSH server and client.
+
+Run a scenario with ``python3 -m ssh.bench [scenario] [options]``; the
+default is the end-to-end ``session`` benchmark. Each
+scenario is a module in this package with an ``add_arguments(parser)``
+function and a ``run(args)`` function returning a JSON-serialisable
+`dict` of results.
+
+Benchmarks that need a running server start ``python3 -m ssh.server`` in a
+subprocess on localhost, so they use the keys under ``keys/`` and must be
+run from the repository root.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import paramiko
+
+from ..keys import private_key
+
+
+CLIENT_KEY_PATH = 'keys/client/id_ecdsa'
+
+
+def free_port(host='127.0.0.1'):
+    """Return a TCP port that is currently free on ``host``."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host, port, timeout=10.0):
+    """Block until something accepts connections on ``(host, port)``."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def start_server(host, port, *args, env=None):
+    """
+    Start ``python3 -m ssh.server`` in a subprocess with extra CLI ``args``
+    and wait until it is listening.
+
+    :param dict env: extra environment variables for the server
+    :return: the `subprocess.Popen` of the server
+    """
+    command = [
+        sys.executable, '-m', 'ssh.server',
+        '-a', host, '-p', str(port), *args
+    ]
+    proc = subprocess.Popen(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=dict(os.environ, **(env or {}))
+    )
+    try:
+        wait_for_port(host, port)
+    except OSError:
+        proc.kill()
+        raise
+    return proc
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def rss_bytes(pid, field='VmRSS'):
+    """
+    Resident set size of process ``pid`` in bytes (Linux only). With
+    ``field='RssAnon'``, only anonymous memory, leaving out file mappings.
+    """
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def cpu_seconds(pid):
+    """User and system CPU time used by process ``pid`` (Linux only)."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def load_client_key(path=CLIENT_KEY_PATH):
+    if not os.path.exists(path):
+        raise SystemExit(f'Client key {path!r} not found')
+    return private_key(path)
+
+
+def connect(host, port, pkey, username='user', timeout=30):
+    """Open an authenticated paramiko client connection."""
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(
+        hostname=host,
+        port=port,
+        username=username,
+        pkey=pkey,
+        timeout=timeout,
+        allow_agent=False,
+        look_for_keys=False
+    )
+    return client
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples``; ``None`` if empty."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Common latency statistics for a list of durations in seconds."""
+    return {
+        'count': len(samples),
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'max': max(samples) if samples else None,
+    }
+
+
+# Metric names where a larger number is better; any path containing one
+# of these is compared that way.
+HIGHER_IS_BETTER = ('per_sec', 'per_gb', 'speedup')
+# Metric names where a smaller number is better.
+LOWER_IS_BETTER = ('p50', 'p90', 'p99', 'max', 'bytes_per_session')
+LOWER_IS_BETTER_SUFFIXES = ('_ns', '_us', '_ms')
+
+
+def _direction(path):
+    if any(name in part for part in path for name in HIGHER_IS_BETTER):
+        return 1
+    last = path[-1]
+    if last in LOWER_IS_BETTER or last.endswith(LOWER_IS_BETTER_SUFFIXES):
+        return -1
+    return 0
+
+
+def compare(baseline, current, tolerance=0.1, path=()):
+    """
+    Compare two result trees and list the metrics that regressed.
+
+    Only metrics with a known direction (see `HIGHER_IS_BETTER` and
+    `LOWER_IS_BETTER`) are compared.
+
+    :return: a list of ``(dotted path, baseline value, current value)``
+    """
+    regressions = []
+    if isinstance(baseline, dict) and isinstance(current, dict):
+        for key in sorted(baseline.keys() & current.keys()):
+            regressions.extend(
+                compare(baseline[key], current[key], tolerance, path + (key,))
+            )
+        return regressions
+
+    numeric = (int, float)
+    if not (
+        path
+        and isinstance(baseline, numeric)
+        and isinstance(current, numeric)
+        and not isinstance(baseline, bool)
+        and baseline
+    ):
+        return regressions
+
+    direction = _direction(path)
+    change = (current - baseline) / abs(baseline)
+    if direction and change * direction < -tolerance:
+        regressions.append(('.'.join(path), baseline, current))
+    return regressions
@@ -0,0 +1,135 @@
+"""
+Run a benchmark scenario.
+
+``python3 -m ssh.bench [scenario] [options] [-o FILE] [--baseline FILE]``
+
+Without a scenario the end-to-end ``session`` benchmark runs. Results are
+printed as JSON and can be written to a file with ``--output``. Given a
+``--baseline`` file from an earlier run, metrics that got worse by more
+than ``--tolerance`` are reported and the exit status is 1.
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+
+import paramiko
+
+from . import compare
+
+
+SCENARIOS = {
+    'session': 'Handshake rate, auth and channel-open latency, echo '
+               'round trips and bulk throughput (default)',
+    'engine': 'Compare server engines: memory per session and accept '
+              'latency under a connection storm',
+    'handshake': 'Handshakes per second with --workers N prefork servers',
+    'authkeys': 'Authorized-keys lookup latency from 10 to 100k keys',
+    'logs': 'Logging cost per record and per handshake, sync vs queued',
+    'metrics': 'Cost of recording counters and phase timings',
+    'throughput': 'Multi-GB stream through one session by chunk size',
+    'channels': 'Throughput and fairness with 1, 10 and 100 channels on '
+                'one connection',
+    'pool': 'Short jobs through the connection pool versus one connection '
+            'each',
+    'fanout': 'Fan-out wall time from 10 to 250 hosts',
+    'pipeline': 'Pipelined versus one-at-a-time messages over a delayed '
+                'link',
+    'forward': 'Local port forwarding latency, throughput and hundreds of '
+               'concurrent tunnels versus direct TCP',
+    'remote_forward': 'Remote port forwarding connection setup rate and '
+                      'throughput with many forwards over many clients',
+    'sftp': 'SFTP download and upload of a large file with paramiko and '
+            'OpenSSH clients',
+    'exec': 'Command start latency and output throughput with many '
+            'concurrent execs',
+    'flood': 'Legitimate login latency during a handshake flood, with and '
+             'without admission limits',
+    'algorithms': 'Handshake cost and bulk throughput for each key '
+                  'exchange, host key, cipher and MAC, and each profile',
+    'keygen': 'Keys per second for each key algorithm, generated and '
+              'written to files, by number of processes',
+    'startup': 'Cold start: import time and first connection in fresh '
+               'processes',
+    'keepalive': 'Keepalive check cost from 50 to 50k sessions, and how '
+                 'fast a server reaps clients that stopped answering',
+    'recording': 'Echo throughput with and without session recording, '
+                 'and replay and seek speed of a recording',
+    'hostkeys': 'Client known_hosts parsing, lookup and host key '
+                'writes from 10 to 100k hosts, and per-connection setup',
+    'certs': 'User certificate checks versus listed keys from 10 to 10k '
+             'users, and auth latency of each',
+    'restart': 'Dropped connections and handshake spikes through a '
+               'restart, an upgrade and a reload',
+    'churn': 'Memory over millions of short sessions and connections',
+}
+DEFAULT_SCENARIO = 'session'
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in SCENARIOS and argv[0] not in (
+        '-h', '--help'
+    ):
+        argv.insert(0, DEFAULT_SCENARIO)
+
+    parser = argparse.ArgumentParser('python3 -m ssh.bench')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+    for name, help_text in SCENARIOS.items():
+        module = importlib.import_module(f'.{name}', __package__)
+        sub = subparsers.add_parser(name, help=help_text)
+        module.add_arguments(sub)
+        sub.add_argument(
+            '-o',
+            '--output',
+            help='also write the results as JSON to this file'
+        )
+        sub.add_argument(
+            '--baseline',
+            help='JSON results of an earlier run to compare against'
+        )
+        sub.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.1,
+            help='allowed relative regression against --baseline'
+        )
+        sub.set_defaults(run=module.run)
+
+    args = parser.parse_args(argv)
+    report = {
+        'scenario': args.scenario,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'paramiko': paramiko.__version__,
+        'args': {
+            key: value for key, value in vars(args).items()
+            if key not in ('run', 'output', 'baseline', 'tolerance')
+        },
+        'results': args.run(args),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            baseline['results'],
+            report['results'],
+            args.tolerance
+        )
+        for path, old, new in regressions:
+            print(f'REGRESSION {path}: {old} -> {new}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+    return report
+
+
+if __name__ == '__main__':
+    main()
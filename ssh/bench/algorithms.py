@@ -0,0 +1,215 @@
+"""
+Handshake cost and bulk throughput by algorithm.
+
+A server offering every algorithm paramiko supports is started, and a
+client that offers a single choice measures:
+
+- ``kex``: ``--handshakes`` key exchanges, one at a time, for every key
+  exchange and host key type, reported as unavailable where the server
+  has no such host key or cannot run that exchange;
+- ``ciphers``: ``--mb`` MB echoed through one session for every cipher,
+  and for every MAC with ciphers that are not AEAD.
+
+Then, for each ``--profiles`` profile, a server and client both using it
+are measured the same way, with the algorithms they agreed on. Host key
+types other than Ed25519 need ``keys/server/id_ecdsa`` or
+``keys/server/id_rsa``.
+"""
+
+import logging
+import socket
+import threading
+import time
+
+import paramiko
+
+from . import free_port, load_client_key, start_server, stop_server, summarize
+from ..profiles import PROFILES, SecurityProfile
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+# Ciphers with built-in integrity, which use no separate MAC.
+AEAD = ('aes128-gcm@openssh.com', 'aes256-gcm@openssh.com')
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--handshakes', type=int, default=30)
+    parser.add_argument('--mb', type=float, default=32)
+    parser.add_argument(
+        '--profiles',
+        nargs='+',
+        choices=sorted(PROFILES),
+        default=sorted(PROFILES)
+    )
+    parser.add_argument(
+        '--no-single',
+        action='store_true',
+        help='only measure the profiles'
+    )
+
+
+def run(args):
+    pkey = load_client_key()
+    results = {'engine': args.engine}
+    # Unavailable combinations would each log a traceback.
+    logging.getLogger('paramiko').disabled = True
+    if not args.no_single:
+        port = free_port(HOST)
+        proc = start_server(HOST, port, '--engine', args.engine)
+        try:
+            results['kex'] = _kex(port, args)
+            results['ciphers'] = _ciphers(port, pkey, args)
+        finally:
+            stop_server(proc)
+    results['profiles'] = {}
+    for name in args.profiles:
+        port = free_port(HOST)
+        proc = start_server(
+            HOST, port, '--engine', args.engine, '--profile', name
+        )
+        try:
+            results['profiles'][name] = _profile(
+                port, pkey, PROFILES[name], args
+            )
+        finally:
+            stop_server(proc)
+    return results
+
+
+class _Transport(paramiko.Transport):
+    """A `.Transport` that remembers the key exchange it agreed on."""
+
+    agreed_kex = None
+
+    def _parse_kex_init(self, m):
+        super()._parse_kex_init(m)
+        # ``kex_engine`` is dropped once the exchange is done.
+        engine = type(self.kex_engine)
+        self.agreed_kex = next(
+            name for name in self.preferred_kex
+            if self._kex_info[name] is engine
+        )
+
+
+def _transport(port, profile):
+    sock = socket.create_connection((HOST, port), timeout=30)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return profile.apply(_Transport(sock))
+
+
+def _handshakes(port, profile, count):
+    """Time ``count`` key exchanges; the last transport is returned open."""
+    samples = []
+    transport = None
+    for index in range(count):
+        start = time.perf_counter()
+        transport = _transport(port, profile)
+        transport.start_client(timeout=30)
+        samples.append(time.perf_counter() - start)
+        if index < count - 1:
+            transport.close()
+    return samples, transport
+
+
+def _handshake_result(samples):
+    stats = summarize(samples)
+    return {
+        'p50_ms': round(stats['p50'] * 1000, 2),
+        'p90_ms': round(stats['p90'] * 1000, 2),
+        'handshakes_per_sec': round(len(samples) / sum(samples), 1),
+    }
+
+
+def _kex(port, args):
+    results = {}
+    for kex in paramiko.Transport._preferred_kex:
+        for key_type in paramiko.Transport._preferred_keys:
+            profile = SecurityProfile(
+                'single', kex=(kex,), key_types=(key_type,)
+            )
+            try:
+                samples, transport = _handshakes(
+                    port, profile, args.handshakes
+                )
+            except (paramiko.SSHException, OSError, EOFError):
+                results[f'{kex} {key_type}'] = 'unavailable'
+                continue
+            transport.close()
+            results[f'{kex} {key_type}'] = _handshake_result(samples)
+    return results
+
+
+def _ciphers(port, pkey, args):
+    results = {}
+    all_macs = paramiko.Transport._preferred_macs
+    for cipher in paramiko.Transport._preferred_ciphers:
+        for mac in (None,) if cipher in AEAD else all_macs:
+            profile = SecurityProfile(
+                'single',
+                ciphers=(cipher,),
+                macs=None if mac is None else (mac,)
+            )
+            name = cipher if mac is None else f'{cipher} {mac}'
+            transport = _transport(port, profile)
+            try:
+                transport.start_client(timeout=30)
+                transport.auth_publickey('user', pkey)
+                results[name] = round(_echo(transport, args.mb), 1)
+            finally:
+                transport.close()
+    return results
+
+
+def _profile(port, pkey, profile, args):
+    samples, transport = _handshakes(port, profile, args.handshakes)
+    try:
+        transport.auth_publickey('user', pkey)
+        agreed = {
+            'cipher': transport.local_cipher,
+            'mac': None if transport.local_cipher in AEAD
+            else transport.local_mac,
+            'kex': transport.agreed_kex,
+            'host_key_type': transport.host_key_type,
+        }
+        mb_per_sec = _echo(transport, args.mb)
+    finally:
+        transport.close()
+    return {
+        'agreed': agreed,
+        'handshake': _handshake_result(samples),
+        'mb_per_sec': round(mb_per_sec, 1),
+    }
+
+
+def _echo(transport, mb):
+    """Stream ``mb`` MB through an echo session; return MB/s each way."""
+    channel = transport.open_session(timeout=30)
+    try:
+        while not channel.recv(1024).endswith(b'\n'):
+            pass
+        total = int(mb * MB)
+        payload = memoryview(bytes(CHUNK_SIZE))
+
+        def send():
+            remaining = total
+            while remaining > 0:
+                size = min(remaining, CHUNK_SIZE)
+                channel.sendall(payload[:size])
+                remaining -= size
+
+        sender = threading.Thread(target=send, daemon=True)
+        start = time.perf_counter()
+        sender.start()
+        received = 0
+        while received < total:
+            data = channel.recv(CHUNK_SIZE)
+            if not data:
+                raise EOFError('session closed')
+            received += len(data)
+        sender.join()
+        return total / MB / (time.perf_counter() - start)
+    finally:
+        channel.close()
@@ -0,0 +1,82 @@
+"""
+Authorized-keys lookup latency as the file grows.
+
+For each size an ``authorized_keys`` file is written with that many keys,
+the client key last. Reports the mean time per lookup for the previous
+read-and-scan check and for the indexed `.AuthorizedKeys` store.
+"""
+
+import base64
+import os
+import struct
+import tempfile
+import time
+
+from ..authorized_keys import AuthorizedKeys
+from . import load_client_key
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=[10, 100, 1000, 10000, 100000]
+    )
+    parser.add_argument('--lookups', type=int, default=200)
+
+
+def _fake_ed25519_line(index):
+    blob = (
+        struct.pack('>I', 11) + b'ssh-ed25519'
+        + struct.pack('>I', 32) + os.urandom(32)
+    )
+    return f'ssh-ed25519 {base64.b64encode(blob).decode()} fake{index}\n'
+
+
+def _scan(path, key):
+    """The lookup as it was before the index: read and substring-scan."""
+    with open(path, 'r') as f:
+        authorized_keys = f.read().splitlines()
+    key_base64 = key.get_base64()
+    for auth_key in authorized_keys:
+        if key_base64 in auth_key:
+            return True
+    return False
+
+
+def _mean(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def run(args):
+    key = load_client_key()
+    target = f'{key.get_name()} {key.get_base64()} bench\n'
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f'authorized_keys.{size}')
+            with open(path, 'w') as f:
+                f.writelines(_fake_ed25519_line(i) for i in range(size - 1))
+                f.write(target)
+
+            store = AuthorizedKeys(path)
+            start = time.perf_counter()
+            assert store.lookup('user', key) is not None
+            load = time.perf_counter() - start
+
+            scan_lookups = max(1, min(args.lookups, 2_000_000 // size))
+            results[str(size)] = {
+                'scan_us': round(
+                    _mean(lambda: _scan(path, key), scan_lookups) * 1e6, 2
+                ),
+                'indexed_us': round(
+                    _mean(lambda: store.lookup('user', key), args.lookups)
+                    * 1e6, 2
+                ),
+                'index_load_ms': round(load * 1e3, 2),
+            }
+    return results
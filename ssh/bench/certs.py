@@ -0,0 +1,189 @@
+"""
+User certificate checks as the number of users grows, against listing
+every user's key in ``authorized_keys``.
+
+- ``lookup``: for each size, that many client keys are listed in an
+  ``authorized_keys`` file, and as many certificates are signed by one
+  CA. Reported: the time to load the file, which grows with every user
+  added, a lookup in it, and a certificate check by `.UserCertificates`
+  the first time a certificate is seen, with its signature verified,
+  and later, from the cache. The server's state for certificates is one
+  CA line whatever the size.
+- ``auth``: ``--connections`` clients authenticate in turn to a server
+  whose ``authorized_keys`` lists ``--entries`` keys, with a listed key
+  and with a certificate from a CA in ``--trusted-user-ca-keys``.
+  Reported: the auth latency of each.
+"""
+
+import os
+import random
+import socket
+import struct
+import tempfile
+import time
+
+import paramiko
+from paramiko.pkey import PublicBlob
+
+from ..authorized_keys import AuthorizedKeys
+from ..certificates import UserCertificates, sign_certificate
+from . import (
+    CLIENT_KEY_PATH,
+    free_port,
+    start_server,
+    stop_server,
+    summarize,
+)
+
+
+HOST = '127.0.0.1'
+USERNAME = 'user'
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=[10, 1000, 10000]
+    )
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--connections', type=int, default=20)
+    parser.add_argument('--engine', default='thread')
+
+
+def run(args):
+    ca_key = paramiko.ECDSAKey.generate()
+    with tempfile.TemporaryDirectory() as directory:
+        return {
+            'lookup': {
+                str(size): _lookup(args, directory, ca_key, size)
+                for size in args.sizes
+            },
+            'auth': _auth(args, directory, ca_key),
+        }
+
+
+def _fake_key(index):
+    blob = (
+        struct.pack('>I', 11) + b'ssh-ed25519'
+        + struct.pack('>I', 32) + os.urandom(32)
+    )
+    return paramiko.PKey.from_type_string('ssh-ed25519', blob)
+
+
+def _line(key, comment=''):
+    return f'{key.get_name()} {key.get_base64()} {comment}\n'
+
+
+def _with_certificate(key, blob):
+    key.public_blob = PublicBlob(_type(blob), blob)
+    return key
+
+
+def _type(blob):
+    (length,) = struct.unpack_from('>I', blob)
+    return blob[4:4 + length].decode()
+
+
+def _lookup(args, directory, ca_key, size):
+    keys = [_fake_key(i) for i in range(size)]
+    path = os.path.join(directory, f'authorized_keys.{size}')
+    with open(path, 'w') as f:
+        f.writelines(_line(key, f'fake{i}') for i, key in enumerate(keys))
+    trusted = os.path.join(directory, 'trusted_cas')
+    with open(trusted, 'w') as f:
+        f.write(_line(ca_key, 'ca'))
+
+    start = time.perf_counter()
+    authorized_keys = AuthorizedKeys(path)
+    authorized_keys.lookup(USERNAME, keys[0])
+    load = time.perf_counter() - start
+    sample = random.sample(keys, min(size, args.lookups))
+    start = time.perf_counter()
+    for key in sample:
+        assert authorized_keys.lookup(USERNAME, key) is not None
+    listed = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    certified = [
+        _with_certificate(key, sign_certificate(
+            ca_key, key, f'fake{i}', [USERNAME]
+        ))
+        for i, key in enumerate(keys)
+    ]
+    signed = (time.perf_counter() - start) / size
+    certificates = UserCertificates(trusted_ca_path=trusted)
+    first = []
+    for key in certified:
+        start = time.perf_counter()
+        assert certificates.lookup(USERNAME, key, HOST) is not None
+        first.append(time.perf_counter() - start)
+    cached = []
+    for key in random.sample(certified, min(size, args.lookups)):
+        start = time.perf_counter()
+        assert certificates.lookup(USERNAME, key, HOST) is not None
+        cached.append(time.perf_counter() - start)
+    return {
+        'authorized_keys_load_ms': round(load * 1e3, 2),
+        'authorized_keys_lookup_us': round(listed * 1e6, 2),
+        'sign_us': round(signed * 1e6, 1),
+        'certificate_first_p50_us': round(summarize(first)['p50'] * 1e6, 1),
+        'certificate_cached_p50_us': round(
+            summarize(cached)['p50'] * 1e6, 2
+        ),
+    }
+
+
+def _auth(args, directory, ca_key):
+    listed = paramiko.ECDSAKey.from_private_key_file(CLIENT_KEY_PATH)
+    certified = paramiko.ECDSAKey.from_private_key_file(CLIENT_KEY_PATH)
+    _with_certificate(certified, sign_certificate(
+        ca_key, certified, 'bench', [USERNAME]
+    ))
+    path = os.path.join(directory, 'authorized_keys.auth')
+    with open(path, 'w') as f:
+        f.writelines(
+            _line(_fake_key(i), f'fake{i}') for i in range(args.entries)
+        )
+        f.write(_line(listed, 'client'))
+    trusted = os.path.join(directory, 'trusted_cas.auth')
+    with open(trusted, 'w') as f:
+        f.write(_line(ca_key, 'ca'))
+
+    port = free_port(HOST)
+    proc = start_server(
+        HOST,
+        port,
+        '--engine', args.engine,
+        '--authorized-keys', path,
+        '--trusted-user-ca-keys', trusted
+    )
+    try:
+        return {
+            'entries': args.entries,
+            'listed_key': _connections(args, port, listed),
+            'certificate': _connections(args, port, certified),
+        }
+    finally:
+        stop_server(proc)
+
+
+def _connections(args, port, key):
+    samples = []
+    for _ in range(args.connections):
+        sock = socket.create_connection((HOST, port), timeout=30)
+        # As `.SSHClient` does, so delayed ACKs do not stall either side.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(sock)
+        transport.start_client(timeout=30)
+        start = time.perf_counter()
+        transport.auth_publickey(USERNAME, key)
+        samples.append(time.perf_counter() - start)
+        transport.close()
+    stats = summarize(samples)
+    return {
+        'auth_p50_ms': round(stats['p50'] * 1e3, 2),
+        'auth_p90_ms': round(stats['p90'] * 1e3, 2),
+    }
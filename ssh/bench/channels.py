@@ -0,0 +1,107 @@
+"""
+Many channels on one connection.
+
+For each ``--channels`` count, one client connection opens that many
+session channels and streams ``--mb`` MB through each at the same time,
+reading the echo back. Reported per count: total throughput, each
+channel's throughput, and fairness as Jain's index (1.0 when every
+channel gets the same rate) and the slowest/fastest channel ratio.
+"""
+
+import threading
+import time
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+CHUNK_SIZE = 32 * 1024
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--channels',
+        type=int,
+        nargs='+',
+        default=[1, 10, 100]
+    )
+    parser.add_argument('--mb', type=float, default=4)
+    parser.add_argument('--engine', default='thread')
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    proc = start_server(HOST, port, '--engine', args.engine)
+    try:
+        results = {'engine': args.engine}
+        for count in args.channels:
+            results[f'channels_{count}'] = _streams(port, pkey, count, args)
+        return results
+    finally:
+        stop_server(proc)
+
+
+def _streams(port, pkey, count, args):
+    client = connect(HOST, port, pkey)
+    transport = client.get_transport()
+    channels = [transport.open_session() for _ in range(count)]
+    for channel in channels:
+        while not channel.recv(1024).endswith(b'\n'):
+            pass
+
+    total = int(args.mb * MB)
+    payload = memoryview(bytes(CHUNK_SIZE))
+    elapsed = [None] * count
+    barrier = threading.Barrier(count * 2 + 1)
+
+    def send(channel):
+        barrier.wait()
+        remaining = total
+        while remaining > 0:
+            size = min(remaining, CHUNK_SIZE)
+            channel.sendall(payload[:size])
+            remaining -= size
+
+    def receive(index, channel):
+        barrier.wait()
+        start = time.perf_counter()
+        received = 0
+        while received < total:
+            data = channel.recv(CHUNK_SIZE)
+            if not data:
+                raise EOFError('channel closed')
+            received += len(data)
+        elapsed[index] = time.perf_counter() - start
+
+    threads = []
+    for index, channel in enumerate(channels):
+        threads.append(threading.Thread(target=send, args=(channel,)))
+        threads.append(threading.Thread(target=receive, args=(index, channel)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    client.close()
+
+    rates = [total / MB / seconds for seconds in elapsed]
+    return {
+        'total_mb_per_sec': round(total * count / MB / wall, 1),
+        'channel_mb_per_sec': summarize(rates),
+        'jain_index': round(sum(rates) ** 2 / (count * sum(
+            rate * rate for rate in rates
+        )), 3),
+        'min_max_ratio': round(min(rates) / max(rates), 3),
+    }
@@ -0,0 +1,100 @@
+"""
+Connection churn: memory stays flat over many short sessions.
+
+* registry: ``--sessions`` admit/remove cycles through a
+  `.SessionRegistry` in this process, with a login timer armed and
+  cancelled for each one, reporting cycles per second and the heap growth
+  measured by `tracemalloc` between the first and last tenth of the run;
+* server: ``--connections`` TCP connections opened and closed against a
+  server, reporting its RSS after each round of ``--round`` connections.
+"""
+
+import socket
+import time
+import tracemalloc
+
+from . import free_port, rss_bytes, start_server, stop_server
+from ..sessions import SessionRegistry
+from ..timers import TimerWheel
+
+
+HOST = '127.0.0.1'
+
+
+class _Socket:
+
+    def close(self):
+        pass
+
+
+def add_arguments(parser):
+    parser.add_argument('--sessions', type=int, default=1000000)
+    parser.add_argument('--connections', type=int, default=5000)
+    parser.add_argument('--round', type=int, default=1000)
+    parser.add_argument('--engine', default='thread')
+
+
+def run(args):
+    return {
+        'registry': _registry(args),
+        'server': _server(args),
+    }
+
+
+def _registry(args):
+    registry = SessionRegistry(
+        max_sessions=None,
+        max_per_ip=4,
+        idle_timeout=300,
+        login_timeout=60,
+        wheel=TimerWheel()
+    )
+    sock = _Socket()
+    tenth = args.sessions // 10
+    early = 0
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(args.sessions):
+        if i == tenth:
+            early, _ = tracemalloc.get_traced_memory()
+        addr = (f'10.0.{i >> 8 & 255}.{i & 255}', i & 65535)
+        session = registry.admit(addr, sock)
+        registry.logged_in(session)
+        registry.remove(session)
+    elapsed = time.perf_counter() - start
+    late, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'sessions': args.sessions,
+        'cycles_per_sec': round(args.sessions / elapsed),
+        'heap_growth': late - early,
+        'live_sessions': len(registry),
+        'live_timers': len(registry.wheel),
+    }
+
+
+def _server(args):
+    port = free_port(HOST)
+    proc = start_server(HOST, port, '--engine', args.engine)
+    rss = []
+    try:
+        time.sleep(0.5)
+        rss.append(rss_bytes(proc.pid))
+        done = 0
+        while done < args.connections:
+            for _ in range(min(args.round, args.connections - done)):
+                with socket.create_connection((HOST, port), timeout=30) as sock:
+                    sock.recv(64)
+                done += 1
+            time.sleep(0.5)
+            rss.append(rss_bytes(proc.pid))
+    finally:
+        stop_server(proc)
+
+    return {
+        'connections': args.connections,
+        'rss': rss,
+        'rss_growth': rss[-1] - rss[1] if len(rss) > 2 else 0,
+    }
@@ -0,0 +1,136 @@
+"""
+Compare the ``thread`` and ``event`` server engines.
+
+For each engine this measures:
+
+* memory: server RSS growth while holding ``--sessions`` authenticated
+  sessions open, reported as bytes per session and sessions per GB;
+* storm: time from ``connect()`` to receiving the server's SSH banner
+  while ``--storm`` clients connect at the same moment.
+"""
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    rss_bytes,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+GB = 1024 ** 3
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--engines',
+        nargs='+',
+        default=['thread', 'event'],
+        choices=('thread', 'event')
+    )
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--storm', type=int, default=500)
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--pool-size', type=int, default=32)
+
+
+def run(args):
+    pkey = load_client_key()
+    results = {}
+    for engine in args.engines:
+        results[engine] = {
+            'memory': _memory(engine, args, pkey),
+            'storm': _storm(engine, args),
+        }
+    return results
+
+
+def _server(engine, args):
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', engine,
+        '--backlog', str(args.backlog),
+        '--pool-size', str(args.pool_size)
+    )
+    return proc, port
+
+
+def _memory(engine, args, pkey):
+    proc, port = _server(engine, args)
+    clients = []
+    try:
+        time.sleep(0.5)
+        baseline = rss_bytes(proc.pid)
+
+        def open_session(_):
+            client = connect(HOST, port, pkey)
+            channel = client.get_transport().open_session()
+            channel.recv(1024)
+            return client, channel
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            clients = list(pool.map(open_session, range(args.sessions)))
+        time.sleep(0.5)
+        held = rss_bytes(proc.pid)
+    finally:
+        for client, _ in clients:
+            client.close()
+        stop_server(proc)
+
+    per_session = max(1, held - baseline) / max(1, args.sessions)
+    return {
+        'sessions': args.sessions,
+        'baseline_rss': baseline,
+        'held_rss': held,
+        'bytes_per_session': round(per_session),
+        'sessions_per_gb': round(GB / per_session),
+    }
+
+
+def _storm(engine, args):
+    proc, port = _server(engine, args)
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.storm)
+
+    def connect_once():
+        nonlocal failures
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((HOST, port), timeout=30) as sock:
+                if not sock.recv(64).startswith(b'SSH-'):
+                    raise OSError('no banner')
+                elapsed = time.perf_counter() - start
+        except OSError:
+            with lock:
+                failures += 1
+            return
+        with lock:
+            latencies.append(elapsed)
+
+    try:
+        threads = [
+            threading.Thread(target=connect_once, daemon=True)
+            for _ in range(args.storm)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        stop_server(proc)
+
+    stats = summarize(latencies)
+    stats['failures'] = failures
+    return stats
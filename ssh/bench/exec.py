@@ -0,0 +1,136 @@
+"""
+Commands run through the server's process pool.
+
+The server is started with ``--exec`` and ``--max-processes``. Measured:
+
+- start latency: ``--commands`` ``echo`` commands, ``--concurrency`` at
+  a time over ``--connections`` client connections, from the exec
+  request to the first byte of output and to the exit status;
+- output throughput: ``--mb`` MB written to stdout by one command, and
+  by ``--streams`` commands running at once.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--commands', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--max-processes', type=int, default=64)
+    parser.add_argument('--mb', type=float, default=256)
+    parser.add_argument('--streams', type=int, default=16)
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--exec',
+        '--max-processes', str(args.max_processes)
+    )
+    clients = []
+    try:
+        clients = [
+            connect(HOST, port, pkey) for _ in range(max(1, args.connections))
+        ]
+        transports = [client.get_transport() for client in clients]
+        results = {'engine': args.engine}
+        results['start'] = _start(transports, args)
+        results['throughput'] = _throughput(transports, args)
+        return results
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(proc)
+
+
+def _run(transport, command):
+    """
+    Run ``command`` and read all of its output.
+
+    :return: ``(seconds to first byte, seconds to exit, bytes, status)``
+    """
+    channel = transport.open_session()
+    try:
+        start = time.perf_counter()
+        channel.exec_command(command)
+        first = None
+        received = 0
+        while True:
+            data = channel.recv(CHUNK_SIZE)
+            if not data:
+                break
+            if first is None:
+                first = time.perf_counter() - start
+            received += len(data)
+        status = channel.recv_exit_status()
+        return first, time.perf_counter() - start, received, status
+    finally:
+        channel.close()
+
+
+def _start(transports, args):
+    def one(index):
+        return _run(transports[index % len(transports)], 'echo ready')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        runs = list(executor.map(one, range(args.commands)))
+    wall = time.perf_counter() - start
+    return {
+        'commands': len(runs),
+        'commands_per_sec': round(len(runs) / wall, 1),
+        'first_byte': summarize([r[0] for r in runs if r[0] is not None]),
+        'exit': summarize([r[1] for r in runs]),
+        'failures': sum(1 for r in runs if r[3] != 0),
+    }
+
+
+def _throughput(transports, args):
+    total = int(args.mb * MB)
+    command = f'head -c {total} /dev/zero'
+    _, single, received, _ = _run(transports[0], command)
+    if received != total:
+        raise EOFError(f'received {received} of {total} bytes')
+
+    sizes = [0] * args.streams
+
+    def stream(index):
+        sizes[index] = _run(transports[index % len(transports)], command)[2]
+
+    threads = [
+        threading.Thread(target=stream, args=(index,), daemon=True)
+        for index in range(args.streams)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return {
+        'single_mb_per_sec': round(total / MB / single, 1),
+        'streams': args.streams,
+        'total_mb_per_sec': round(sum(sizes) / MB / wall, 1),
+        'incomplete_streams': sum(1 for size in sizes if size != total),
+    }
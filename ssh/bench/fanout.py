@@ -0,0 +1,71 @@
+"""
+Fan-out wall time as the host count grows.
+
+Starts one server listening on all addresses and treats
+``127.0.0.1``, ``127.0.0.2``, ... as separate hosts, so every host gets
+its own connection. For each ``--hosts`` count, `.fan_out` sends a small
+payload to that many hosts with ``--concurrency`` in flight, reporting
+the total wall time, hosts per second and per-host latency.
+"""
+
+import time
+
+from . import (
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+from ..fanout import fan_out
+from ..pool import ConnectionPool
+
+
+PAYLOAD = b'x' * 64
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--hosts',
+        type=int,
+        nargs='+',
+        default=[10, 50, 100, 250]
+    )
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--engine', default='event')
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port('0.0.0.0')
+    proc = start_server(
+        '0.0.0.0', port,
+        '--engine', args.engine,
+        '--backlog', '1024'
+    )
+    results = {'engine': args.engine, 'concurrency': args.concurrency}
+    try:
+        for count in args.hosts:
+            hosts = [
+                (f'127.0.{i // 250}.{i % 250 + 1}', port)
+                for i in range(count)
+            ]
+            pool = ConnectionPool(pkey, max_transports=count)
+            start = time.perf_counter()
+            outcome = fan_out(
+                hosts,
+                payload=PAYLOAD,
+                concurrency=args.concurrency,
+                pool=pool
+            )
+            elapsed = time.perf_counter() - start
+            pool.close()
+            results[f'hosts_{count}'] = {
+                'wall_seconds': round(elapsed, 3),
+                'hosts_per_sec': round(count / elapsed, 1),
+                'latency': summarize([r.elapsed for r in outcome]),
+                'failures': sum(not r.ok for r in outcome),
+            }
+    finally:
+        stop_server(proc)
+    return results
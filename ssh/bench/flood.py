@@ -0,0 +1,190 @@
+"""
+Legitimate handshakes during a handshake flood.
+
+``--attackers`` threads in a separate process connect from
+``--flood-ip`` (another loopback address) as fast as they can, each
+running a full key exchange and then failing authentication with an
+unknown key. Meanwhile a client on
+127.0.0.1 logs in every ``--interval`` seconds. Three runs of
+``--duration`` seconds each are compared:
+
+- ``quiet``: no flood;
+- ``unprotected``: the flood, with no admission limits;
+- ``protected``: the flood, with ``--rate-per-ip``, ``--max-handshakes``
+  and ``--max-auth-failures-per-ip``.
+
+Reported for each: the legitimate login latency, failed logins, flood
+connections and completed key exchanges per second, and the server's
+rejection counters.
+"""
+
+import json
+import logging
+import multiprocessing
+import socket
+import threading
+import time
+import urllib.request
+
+import paramiko
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--attackers', type=int, default=32)
+    parser.add_argument('--flood-ip', default='127.0.0.2')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=0.1)
+    parser.add_argument('--rate-per-ip', type=float, default=20)
+    parser.add_argument('--max-handshakes', type=int, default=16)
+    parser.add_argument('--max-auth-failures-per-ip', type=int, default=20)
+
+
+def run(args):
+    pkey = load_client_key()
+    limits = (
+        '--rate-per-ip', str(args.rate_per_ip),
+        '--max-handshakes', str(args.max_handshakes),
+        '--max-auth-failures-per-ip', str(args.max_auth_failures_per_ip),
+    )
+    results = {'engine': args.engine}
+    for name, flood, server_args in (
+        ('quiet', False, ()),
+        ('unprotected', True, ()),
+        ('protected', True, limits),
+    ):
+        results[name] = _run(args, pkey, flood, server_args)
+    quiet = results['quiet']['login']['p50']
+    for name in ('unprotected', 'protected'):
+        p50 = results[name]['login']['p50']
+        if quiet and p50:
+            results[name]['p50_vs_quiet'] = round(p50 / quiet, 2)
+    return results
+
+
+def _run(args, pkey, flood, server_args):
+    port = free_port(HOST)
+    metrics_port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--metrics-port', str(metrics_port),
+        *server_args
+    )
+    stop = multiprocessing.Event()
+    # Connections made and key exchanges completed by the flood.
+    totals = multiprocessing.Array('q', 2)
+    attacker = None
+    try:
+        if flood:
+            attacker = multiprocessing.Process(
+                target=_flood,
+                args=(args.flood_ip, port, args.attackers, stop, totals),
+                daemon=True
+            )
+            attacker.start()
+        start = time.perf_counter()
+        samples, failures = _logins(port, pkey, args)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        if attacker is not None:
+            attacker.join(15)
+        counters = _counters(metrics_port)
+    finally:
+        stop.set()
+        if attacker is not None and attacker.is_alive():
+            attacker.kill()
+        stop_server(proc)
+    return {
+        'login': summarize(samples),
+        'login_failures': failures,
+        'flood_connections_per_sec': round(totals[0] / elapsed, 1),
+        'flood_kex_per_sec': round(totals[1] / elapsed, 1),
+        'rejected': {
+            name: counters.get(name, 0)
+            for name in (
+                'rejected_rate',
+                'rejected_auth_failures',
+                'rejected_handshakes',
+            )
+        },
+    }
+
+
+def _logins(port, pkey, args):
+    samples = []
+    failures = 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            connect(HOST, port, pkey, timeout=10).close()
+        except (OSError, paramiko.SSHException):
+            failures += 1
+        else:
+            samples.append(time.perf_counter() - start)
+        time.sleep(args.interval)
+    return samples, failures
+
+
+def _flood(source, port, attackers, stop, totals):
+    """Run in the attacking process until ``stop`` is set."""
+    # Refused connections would each log a traceback.
+    logging.getLogger('paramiko').disabled = True
+    # Generating the unauthorized key once keeps the flood's own CPU use
+    # down.
+    bad_key = paramiko.ECDSAKey.generate()
+    attempts = [0] * attackers
+    exchanges = [0] * attackers
+    threads = [
+        threading.Thread(
+            target=_attack,
+            args=(source, port, bad_key, stop, index, attempts, exchanges),
+            daemon=True
+        )
+        for index in range(attackers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    totals[0] = sum(attempts)
+    totals[1] = sum(exchanges)
+
+
+def _attack(source, port, bad_key, stop, index, attempts, exchanges):
+    while not stop.is_set():
+        attempts[index] += 1
+        try:
+            sock = socket.create_connection(
+                (HOST, port), timeout=10, source_address=(source, 0)
+            )
+        except OSError:
+            continue
+        transport = paramiko.Transport(sock)
+        try:
+            transport.start_client(timeout=10)
+            exchanges[index] += 1
+            transport.auth_publickey('user', bad_key)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+        finally:
+            transport.close()
+
+
+def _counters(metrics_port):
+    url = f'http://{HOST}:{metrics_port}/stats'
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.load(response)['counters']
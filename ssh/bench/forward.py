@@ -0,0 +1,239 @@
+"""
+Local port forwarding through the server.
+
+A TCP echo target runs in this process and the server is started with
+``--allow-forward`` for it. Measured, each against the same target over
+plain TCP:
+
+- round-trip latency of ``--size`` byte messages through one tunnel,
+  and the latency the tunnel adds;
+- throughput of ``--mb`` MB streamed through one tunnel;
+- ``--tunnels`` tunnels open at once over ``--connections`` client
+  connections, each doing ``--round-trips`` round trips: aggregate round
+  trips per second and the latency distribution.
+"""
+
+import socket
+import threading
+import time
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class EchoTarget:
+    """A TCP echo server on a free port, one thread per connection."""
+
+    def __init__(self):
+        self.listener = socket.create_server((HOST, 0), backlog=1024)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(
+                target=self._echo,
+                args=(sock,),
+                daemon=True
+            ).start()
+
+    def _echo(self, sock):
+        with sock:
+            while True:
+                try:
+                    data = sock.recv(CHUNK_SIZE)
+                    if not data:
+                        return
+                    sock.sendall(data)
+                except OSError:
+                    return
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--round-trips', type=int, default=200)
+    parser.add_argument('--mb', type=float, default=64)
+    parser.add_argument('--tunnels', type=int, default=200)
+    parser.add_argument('--connections', type=int, default=4)
+
+
+def run(args):
+    pkey = load_client_key()
+    target = EchoTarget()
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--allow-forward', f'{HOST}:{target.port}'
+    )
+    clients = []
+    try:
+        def tunnel(transport):
+            return transport.open_channel(
+                'direct-tcpip',
+                (HOST, target.port),
+                ('127.0.0.1', 0)
+            )
+
+        def direct():
+            sock = socket.create_connection((HOST, target.port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+
+        clients = [
+            connect(HOST, port, pkey) for _ in range(max(1, args.connections))
+        ]
+        transports = [client.get_transport() for client in clients]
+        for transport in transports:
+            transport.sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+            )
+
+        results = {'engine': args.engine}
+        results['latency'] = _latency(
+            direct, lambda: tunnel(transports[0]), args
+        )
+        results['throughput'] = _throughput(
+            direct, lambda: tunnel(transports[0]), args
+        )
+        results['concurrent'] = _concurrent(tunnel, transports, args)
+        return results
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(proc)
+        target.close()
+
+
+def _round_trips(stream, count, size):
+    message = b'x' * size
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        stream.sendall(message)
+        received = 0
+        while received < size:
+            data = stream.recv(CHUNK_SIZE)
+            if not data:
+                raise EOFError('stream closed')
+            received += len(data)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _latency(direct, tunnel, args):
+    results = {}
+    for name, opener in (('direct', direct), ('tunnel', tunnel)):
+        stream = opener()
+        try:
+            samples = _round_trips(stream, args.round_trips, args.size)
+        finally:
+            stream.close()
+        results[name] = summarize(samples)
+    results['added_p50_us'] = round(
+        (results['tunnel']['p50'] - results['direct']['p50']) * 1e6, 1
+    )
+    return results
+
+
+def _stream(stream, total):
+    payload = memoryview(bytes(CHUNK_SIZE))
+
+    def send():
+        remaining = total
+        while remaining > 0:
+            size = min(remaining, CHUNK_SIZE)
+            stream.sendall(payload[:size])
+            remaining -= size
+
+    sender = threading.Thread(target=send, daemon=True)
+    start = time.perf_counter()
+    sender.start()
+    received = 0
+    while received < total:
+        data = stream.recv(CHUNK_SIZE)
+        if not data:
+            raise EOFError('stream closed')
+        received += len(data)
+    sender.join()
+    return time.perf_counter() - start
+
+
+def _throughput(direct, tunnel, args):
+    total = int(args.mb * MB)
+    results = {}
+    for name, opener in (('direct', direct), ('tunnel', tunnel)):
+        stream = opener()
+        try:
+            elapsed = _stream(stream, total)
+        finally:
+            stream.close()
+        results[f'{name}_mb_per_sec'] = round(total / MB / elapsed, 1)
+    return results
+
+
+def _concurrent(tunnel, transports, args):
+    start = time.perf_counter()
+    channels = [
+        tunnel(transports[index % len(transports)])
+        for index in range(args.tunnels)
+    ]
+    open_elapsed = time.perf_counter() - start
+    samples = [None] * len(channels)
+    errors = []
+    barrier = threading.Barrier(len(channels) + 1)
+
+    def work(index, channel):
+        barrier.wait()
+        try:
+            samples[index] = _round_trips(
+                channel, args.round_trips, args.size
+            )
+        except (EOFError, OSError) as exc:
+            errors.append(repr(exc))
+        finally:
+            channel.close()
+
+    threads = [
+        threading.Thread(target=work, args=(index, channel), daemon=True)
+        for index, channel in enumerate(channels)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = [
+        sample for tunnel_samples in samples if tunnel_samples
+        for sample in tunnel_samples
+    ]
+    return {
+        'tunnels': len(channels),
+        'tunnels_opened_per_sec': round(len(channels) / open_elapsed, 1),
+        'round_trips_per_sec': round(len(latencies) / wall, 1),
+        'round_trip': summarize(latencies),
+        'errors': len(errors),
+    }
@@ -0,0 +1,95 @@
+"""
+Handshake throughput against a prefork server.
+
+For each value of ``--workers`` a server is started with
+``--workers N`` and ``--clients`` load-generator processes open, authenticate
+and close connections as fast as they can for ``--duration`` seconds.
+Reports handshakes per second and the speedup over the first worker count.
+"""
+
+import multiprocessing
+import os
+import time
+
+from . import free_port, start_server, stop_server
+
+
+HOST = '127.0.0.1'
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--workers',
+        nargs='+',
+        type=int,
+        default=[1, 2, os.cpu_count() or 1]
+    )
+    parser.add_argument(
+        '--clients',
+        type=int,
+        default=2 * (os.cpu_count() or 1),
+        help='load-generator processes'
+    )
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--shared-socket', action='store_true')
+
+
+def _load(port, duration, results):
+    from . import connect, load_client_key
+
+    pkey = load_client_key()
+    done = failed = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            client = connect(HOST, port, pkey)
+        except Exception:
+            failed += 1
+            continue
+        client.close()
+        done += 1
+    results.put((done, failed))
+
+
+def run(args):
+    results = {}
+    baseline = None
+    for workers in dict.fromkeys(args.workers):
+        port = free_port(HOST)
+        extra = ['--shared-socket'] if args.shared_socket else []
+        proc = start_server(
+            HOST, port,
+            '--workers', str(workers),
+            '--backlog', '1024',
+            *extra
+        )
+        try:
+            time.sleep(1)
+            queue = multiprocessing.Queue()
+            loaders = [
+                multiprocessing.Process(
+                    target=_load,
+                    args=(port, args.duration, queue)
+                )
+                for _ in range(args.clients)
+            ]
+            start = time.perf_counter()
+            for loader in loaders:
+                loader.start()
+            counts = [queue.get() for _ in loaders]
+            elapsed = time.perf_counter() - start
+            for loader in loaders:
+                loader.join()
+        finally:
+            stop_server(proc)
+
+        handshakes = sum(done for done, _ in counts)
+        rate = handshakes / elapsed
+        baseline = baseline or rate
+        results[str(workers)] = {
+            'handshakes': handshakes,
+            'failures': sum(failed for _, failed in counts),
+            'handshakes_per_sec': round(rate, 1),
+            'speedup': round(rate / baseline, 2),
+        }
+    return {'cpus': os.cpu_count(), 'clients': args.clients, 'runs': results}
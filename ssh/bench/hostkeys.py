@@ -0,0 +1,218 @@
+"""
+Client host key checks as ``known_hosts`` grows, before and after the
+shared `.KnownHosts` store.
+
+- ``lookup``: for each size a ``known_hosts`` file is written with that
+  many hosts, the one looked up last, once with plain and once with
+  hashed names. Reported: the time to parse the file and to look a host
+  up with paramiko's `HostKeys`, as each client did before, and with
+  `.KnownHosts`, for the first lookup of a host and later ones.
+  paramiko checks each line against every line before it while parsing,
+  so it is only timed up to ``--paramiko-max`` hosts.
+- ``add``: ``--new-hosts`` unknown hosts are trusted in a file of
+  ``--entries`` hosts, saved as ``AutoAddPolicy`` did, rewriting the
+  file for each, and with `.KnownHosts.add` and one flush.
+- ``connect``: ``--connections`` clients connect in turn to a server
+  listed in a file of ``--entries`` hosts. Before: a paramiko client
+  loading the file with ``load_host_keys`` and reading the key file, as
+  `.SSHClient` did. After: `.SSHClient` with the shared store and key.
+  ``setup_ms`` is the time to create the client, ``connect_ms`` the time
+  to connect and authenticate.
+"""
+
+import base64
+import os
+import struct
+import tempfile
+import time
+
+import paramiko
+
+from ..client import SSHClient
+from ..known_hosts import KnownHosts, hash_host, host_name
+from . import (
+    CLIENT_KEY_PATH,
+    free_port,
+    start_server,
+    stop_server,
+    summarize,
+)
+
+
+HOST = '127.0.0.1'
+SERVER_KEY_PATH = 'keys/server/id_ed25519.pub'
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=[10, 100, 1000, 10000, 100000]
+    )
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--paramiko-max', type=int, default=10000)
+    parser.add_argument('--entries', type=int, default=2000)
+    parser.add_argument('--new-hosts', type=int, default=100)
+    parser.add_argument('--connections', type=int, default=20)
+    parser.add_argument('--engine', default='thread')
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        return {
+            'lookup': {
+                kind: {
+                    str(size): _lookup(args, directory, size, hashed)
+                    for size in args.sizes
+                }
+                for kind, hashed in (('plain', False), ('hashed', True))
+            },
+            'add': _add(args, directory),
+            'connect': _connect(args, directory),
+        }
+
+
+def _fake_line(index, hashed):
+    blob = (
+        struct.pack('>I', 11) + b'ssh-ed25519'
+        + struct.pack('>I', 32) + os.urandom(32)
+    )
+    host = f'host{index}.example'
+    if hashed:
+        host = hash_host(host)
+    return f'{host} ssh-ed25519 {base64.b64encode(blob).decode()}\n'
+
+
+def _write(path, size, target=None, hashed=False):
+    """Write ``size`` hosts to ``path``, ``target`` last if given."""
+    with open(path, 'w') as f:
+        count = size - 1 if target is not None else size
+        f.writelines(_fake_line(i, hashed) for i in range(count))
+        if target is not None:
+            host, line = target
+            f.write(f'{hash_host(host) if hashed else host} {line}\n')
+
+
+def _server_line():
+    with open(SERVER_KEY_PATH) as f:
+        return ' '.join(f.read().split()[:2])
+
+
+def _mean(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def _lookup(args, directory, size, hashed):
+    target = host_name(HOST, 2222)
+    path = os.path.join(directory, f'known_hosts.{size}')
+    _write(path, size, (target, _server_line()), hashed)
+
+    result = {}
+    if size <= args.paramiko_max:
+        start = time.perf_counter()
+        host_keys = paramiko.HostKeys(path)
+        parse = time.perf_counter() - start
+        scan_lookups = max(1, min(args.lookups, 200_000 // size))
+        scan = _mean(lambda: host_keys.lookup(target), scan_lookups)
+        result['paramiko_parse_ms'] = round(parse * 1e3, 2)
+        result['paramiko_lookup_us'] = round(scan * 1e6, 2)
+
+    store = KnownHosts(path)
+    start = time.perf_counter()
+    store.refresh()
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    assert store.get(target) is not None
+    first = time.perf_counter() - start
+    result['load_ms'] = round(load * 1e3, 2)
+    result['first_lookup_us'] = round(first * 1e6, 2)
+    result['lookup_us'] = round(
+        _mean(lambda: store.get(target), args.lookups) * 1e6, 2
+    )
+    return result
+
+
+def _add(args, directory):
+    key = paramiko.PKey.from_path(CLIENT_KEY_PATH)
+    hosts = [f'new{i}.example' for i in range(args.new_hosts)]
+
+    path = os.path.join(directory, 'known_hosts.save')
+    _write(path, args.entries)
+    host_keys = paramiko.HostKeys(path)
+    start = time.perf_counter()
+    for host in hosts:
+        host_keys.add(host, key.get_name(), key)
+        host_keys.save(path)
+    saved = time.perf_counter() - start
+
+    path = os.path.join(directory, 'known_hosts.add')
+    _write(path, args.entries)
+    store = KnownHosts(path)
+    store.refresh()
+    start = time.perf_counter()
+    for host in hosts:
+        store.add(host, key)
+    store.flush()
+    added = time.perf_counter() - start
+    assert len(KnownHosts(path)) == args.entries + args.new_hosts
+    return {
+        'hosts': args.new_hosts,
+        'save_per_host_us': round(saved / args.new_hosts * 1e6, 1),
+        'batched_per_host_us': round(added / args.new_hosts * 1e6, 1),
+    }
+
+
+def _connect(args, directory):
+    port = free_port(HOST)
+    path = os.path.join(directory, 'known_hosts.connect')
+    _write(path, args.entries, (host_name(HOST, port), _server_line()))
+
+    def before():
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.load_host_keys(path)
+        pkey = paramiko.ECDSAKey.from_private_key_file(CLIENT_KEY_PATH)
+        return client, lambda: client.connect(
+            HOST,
+            port,
+            username='user',
+            pkey=pkey,
+            allow_agent=False,
+            look_for_keys=False
+        )
+
+    def after():
+        client = SSHClient(
+            HOST, port, known_hosts_path=path, host_key_policy='yes'
+        )
+        return client.ssh, client.connect
+
+    proc = start_server(HOST, port, '--engine', args.engine)
+    try:
+        return {
+            'before': _connections(args, before),
+            'after': _connections(args, after),
+        }
+    finally:
+        stop_server(proc)
+
+
+def _connections(args, create):
+    setups = []
+    connects = []
+    for _ in range(args.connections):
+        start = time.perf_counter()
+        client, connect = create()
+        created = time.perf_counter()
+        connect()
+        connects.append(time.perf_counter() - created)
+        setups.append(created - start)
+        client.close()
+    return {
+        'setup_ms': round(summarize(setups)['p50'] * 1e3, 2),
+        'connect_ms': round(summarize(connects)['p50'] * 1e3, 2),
+    }
@@ -0,0 +1,205 @@
+"""
+Keepalive cost as sessions grow, and how fast dead peers are reaped.
+
+- ``overhead``: for each ``--sessions`` count, that many idle transports
+  are watched by a `.Keepalive` on a `.TimerWheel`, and the wheel is
+  driven through ``--simulated`` seconds. Reported: the time to start
+  watching a transport, to run one tick, and to run one silence check.
+  ``cpu_share`` is the fraction of one core the checks would use in real
+  time. ``scan_cpu_share`` is the same figure for a loop that looks at
+  every session on every tick. The transports are stand-ins that never
+  answer, with their last packet kept recent, so only the bookkeeping
+  is measured.
+- ``reap``: a server runs with ``--interval`` and ``--count-max``. A
+  separate process opens ``--connections`` sessions and is then stopped
+  with ``SIGSTOP``, so its sockets stay open but it never answers again.
+  Reported: the seconds until the server has reaped every one, against
+  ``interval * count_max``, and whether an idle live client connected
+  throughout is still open.
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import time
+import urllib.request
+
+from paramiko.common import MSG_REQUEST_FAILURE, MSG_REQUEST_SUCCESS
+
+from ..keepalive import Keepalive
+from ..timers import TICK, TimerWheel
+from . import connect, free_port, load_client_key, start_server, stop_server
+
+
+HOST = '127.0.0.1'
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--sessions',
+        nargs='+',
+        type=int,
+        default=[50, 500, 5000, 50000]
+    )
+    parser.add_argument('--simulated', type=float, default=60)
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--count-max', type=int, default=3)
+
+
+def run(args):
+    return {
+        'overhead': {
+            str(count): _overhead(count, args)
+            for count in args.sessions
+        },
+        'reap': _reap(args),
+    }
+
+
+class _Packetizer:
+
+    def read_message(self):
+        raise EOFError
+
+    def set_keepalive(self, interval, callback):
+        pass
+
+
+class _IdleTransport:
+    """Just enough of a `.Transport` to be watched."""
+
+    def __init__(self):
+        self.packetizer = _Packetizer()
+        self._handler_table = dict.fromkeys(
+            (MSG_REQUEST_SUCCESS, MSG_REQUEST_FAILURE)
+        )
+
+    def is_active(self):
+        return True
+
+
+def _overhead(count, args):
+    wheel = TimerWheel()
+    keepalive = Keepalive(args.interval, args.count_max, wheel=wheel)
+    transports = [_IdleTransport() for _ in range(count)]
+    start = time.perf_counter()
+    watches = [keepalive.watch(transport) for transport in transports]
+    watched = time.perf_counter() - start
+
+    ticks = int(args.simulated / TICK)
+    now = wheel._last
+    elapsed = 0.0
+    for tick in range(ticks):
+        if tick % int(1 / TICK) == 0:
+            # Every simulated second, hear from every peer, so checks
+            # re-arm however long the simulation takes in real time.
+            received = time.monotonic()
+            for watch in watches:
+                watch.received = received
+        now += TICK
+        start = time.perf_counter()
+        wheel.advance(now)
+        elapsed += time.perf_counter() - start
+    checks = count * args.simulated / keepalive.timeout
+
+    # The alternative: look at every session on every tick.
+    scan_ticks = max(1, min(ticks, 2_000_000 // count))
+    start = time.perf_counter()
+    for _ in range(scan_ticks):
+        now = time.monotonic()
+        for watch in watches:
+            if now - watch.received >= keepalive.timeout:
+                pass
+    scan = (time.perf_counter() - start) / scan_ticks
+    for watch in watches:
+        keepalive.cancel(watch)
+    return {
+        'watch_us': round(watched / count * 1e6, 2),
+        'tick_us': round(elapsed / ticks * 1e6, 2),
+        'check_us': round(elapsed / checks * 1e6, 2),
+        'cpu_share': round(elapsed / args.simulated, 6),
+        'scan_cpu_share': round(scan / TICK, 6),
+    }
+
+
+def _reap(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    metrics_port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--metrics-port', str(metrics_port),
+        '--keepalive-interval', str(args.interval),
+        '--keepalive-count-max', str(args.count_max)
+    )
+    ready = multiprocessing.Event()
+    holder = multiprocessing.Process(
+        target=_hold,
+        args=(port, args.connections, ready),
+        daemon=True
+    )
+    live = None
+    try:
+        live = connect(HOST, port, pkey)
+        live.get_transport().open_session(timeout=30)
+        holder.start()
+        if not ready.wait(60):
+            raise RuntimeError('connections were not opened in time')
+        _wait(metrics_port, lambda stats: (
+            stats['gauges']['active_sessions'] >= args.connections + 1
+        ))
+        os.kill(holder.pid, signal.SIGSTOP)
+        stopped = time.perf_counter()
+        stats = _wait(metrics_port, lambda stats: (
+            stats['counters']['dead_peers'] >= args.connections
+        ), timeout=args.interval * args.count_max * 4 + 30)
+        reaped = time.perf_counter() - stopped
+        return {
+            'connections': args.connections,
+            'expected_seconds': args.interval * args.count_max,
+            'reap_seconds': round(reaped, 2),
+            'dead_peers': stats['counters']['dead_peers'],
+            'keepalives_sent': stats['counters']['keepalives'],
+            'live_client_kept': live.get_transport().is_active(),
+        }
+    finally:
+        if holder.pid is not None:
+            holder.kill()
+            holder.join()
+        if live is not None:
+            live.close()
+        stop_server(proc)
+
+
+def _hold(port, connections, ready):
+    """Run in the stopped process: open sessions and wait."""
+    pkey = load_client_key()
+    clients = []
+    for _ in range(connections):
+        client = connect(HOST, port, pkey)
+        client.get_transport().open_session(timeout=30)
+        clients.append(client)
+    ready.set()
+    while True:
+        time.sleep(60)
+
+
+def _stats(metrics_port):
+    url = f'http://{HOST}:{metrics_port}/stats'
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.load(response)
+
+
+def _wait(metrics_port, done, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        stats = _stats(metrics_port)
+        if done(stats):
+            return stats
+        if time.monotonic() > deadline:
+            raise TimeoutError('the server did not get there in time')
+        time.sleep(0.05)
@@ -0,0 +1,61 @@
+"""
+Keys per second for each key algorithm.
+
+For each ``--processes`` count, ``--count`` keys of every ``--types``
+algorithm are generated with `.keygen.generate` (RSA keys, which are far
+slower, ``--rsa-count``), then the same keys are also written to files
+in a temporary directory with `.keygen.write_keys`.
+"""
+
+import os
+import tempfile
+import time
+
+from ..keygen import ALGORITHMS, generate, write_keys
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--types',
+        nargs='+',
+        choices=list(ALGORITHMS),
+        default=list(ALGORITHMS)
+    )
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--rsa-count', type=int, default=20)
+    parser.add_argument(
+        '--processes',
+        nargs='+',
+        type=int,
+        default=sorted({1, os.cpu_count() or 1})
+    )
+
+
+def run(args):
+    results = {'cpus': os.cpu_count()}
+    for processes in args.processes:
+        by_type = results[f'processes_{processes}'] = {}
+        for algorithm in args.types:
+            count = (
+                args.rsa_count if algorithm.startswith('rsa-')
+                else args.count
+            )
+            start = time.perf_counter()
+            for _ in generate(algorithm, count, processes):
+                pass
+            generated = count / (time.perf_counter() - start)
+            with tempfile.TemporaryDirectory() as directory:
+                written = write_keys(
+                    directory,
+                    algorithm,
+                    count,
+                    processes=processes,
+                    authorized_keys=os.path.join(
+                        directory, 'authorized_keys'
+                    )
+                )
+            by_type[algorithm] = {
+                'keys_per_sec': round(generated, 1),
+                'written_keys_per_sec': round(written, 1),
+            }
+    return results
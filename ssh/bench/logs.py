@@ -0,0 +1,126 @@
+"""
+Cost of logging on session threads.
+
+* emit: time spent on the calling thread per log record, with handlers
+  attached synchronously versus the queued pipeline in `ssh.log`;
+* handshake: connect-and-authenticate latency against a server started
+  with ``SSH_LOG_QUEUE=0`` (synchronous) and ``SSH_LOG_QUEUE=1`` (queued),
+  with ``--clients`` clients connecting concurrently.
+"""
+
+import logging
+import os
+import queue
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import log as ssh_log
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+
+
+def add_arguments(parser):
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--handshakes', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--level', default='DEBUG')
+
+
+def _emit(queued, records):
+    """
+    Mean seconds per record spent in the logging call, and the number of
+    records the queued pipeline dropped rather than block.
+    """
+    name = f'ssh.bench.{"queued" if queued else "sync"}'
+    bench_logger = logging.getLogger(name)
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        stream = open(os.path.join(tmp, 'stdout'), 'w')
+        handlers = [
+            logging.StreamHandler(stream),
+            logging.FileHandler(os.path.join(tmp, 'ssh.log')),
+        ]
+        for handler in handlers:
+            handler.setFormatter(ssh_log.FieldsFormatter(ssh_log.FORMAT))
+
+        listener = queue_handler = None
+        if queued:
+            queue_handler = ssh_log.DropQueueHandler(
+                queue.Queue(ssh_log.QUEUE_SIZE)
+            )
+            listener = ssh_log.BlockingSentinelListener(
+                queue_handler.queue, *handlers
+            )
+            listener.start()
+            bench_logger.addHandler(queue_handler)
+        else:
+            for handler in handlers:
+                bench_logger.addHandler(handler)
+
+        log = ssh_log.ConnectionLogger(bench_logger, peer='127.0.0.1:50000')
+        start = time.perf_counter()
+        for i in range(records):
+            log.info('Closing connection with %r', ('127.0.0.1', i))
+        elapsed = time.perf_counter() - start
+
+        dropped = 0
+        if listener is not None:
+            listener.stop()
+            dropped = queue_handler.dropped
+        for handler in list(bench_logger.handlers):
+            bench_logger.removeHandler(handler)
+            handler.close()
+        stream.close()
+    return elapsed / records, dropped
+
+
+def _handshakes(queued, args, pkey):
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--log-level', args.level,
+        env={'SSH_LOG_QUEUE': '1' if queued else '0'}
+    )
+
+    def handshake(_):
+        start = time.perf_counter()
+        client = connect(HOST, port, pkey)
+        elapsed = time.perf_counter() - start
+        client.close()
+        return elapsed
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            latencies = list(pool.map(handshake, range(args.handshakes)))
+        elapsed = time.perf_counter() - start
+    finally:
+        stop_server(proc)
+
+    stats = summarize(latencies)
+    stats['handshakes_per_sec'] = round(args.handshakes / elapsed, 1)
+    return stats
+
+
+def run(args):
+    pkey = load_client_key()
+    results = {}
+    for mode, queued in (('sync', False), ('queued', True)):
+        per_record, dropped = _emit(queued, args.records)
+        results[mode] = {
+            'emit_us': round(per_record * 1e6, 2),
+            'dropped': dropped,
+            'handshake': _handshakes(queued, args, pkey),
+        }
+    return results
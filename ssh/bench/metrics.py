@@ -0,0 +1,53 @@
+"""
+Cost of recording metrics.
+
+Times `.Metrics.inc` and `.Metrics.observe` from ``--threads`` threads at
+once, as session threads would under load, and reports nanoseconds per
+call.
+"""
+
+import threading
+import time
+
+from ..metrics import Metrics
+
+
+def add_arguments(parser):
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 8, 64])
+
+
+def _per_call(threads, calls, record):
+    barrier = threading.Barrier(threads + 1)
+    per_thread = max(1, calls // threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            record()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / (per_thread * threads)
+
+
+def run(args):
+    results = {}
+    for threads in args.threads:
+        metrics = Metrics()
+        results[str(threads)] = {
+            'inc_ns': round(
+                _per_call(threads, args.calls,
+                          lambda: metrics.inc('bytes_in', 1024)) * 1e9
+            ),
+            'observe_ns': round(
+                _per_call(threads, args.calls,
+                          lambda: metrics.observe('kex', 0.01)) * 1e9
+            ),
+        }
+    return results
@@ -0,0 +1,152 @@
+"""
+Request/response versus pipelined messages over a slow link.
+
+A `LatencyProxy` between client and server delays every chunk by
+``--delay-ms`` in each direction. ``--messages`` small messages are then
+sent one at a time, each waiting for its echo, and again through
+`.pipelined` with ``--window`` in flight. Reported: messages per second
+for both and the speedup.
+"""
+
+import heapq
+import socket
+import threading
+import time
+
+import paramiko
+
+from . import free_port, load_client_key, start_server, stop_server
+from ..pipeline import LengthFramer, pipelined
+
+
+HOST = '127.0.0.1'
+
+
+class LatencyProxy:
+    """
+    Forward one TCP connection at a time to ``target``, delivering each
+    chunk ``delay`` seconds after it was read.
+    """
+
+    def __init__(self, target, delay):
+        self.target = target
+        self.delay = delay
+        self.listener = socket.create_server((HOST, 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection(self.target)
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._pump(client, server)
+            self._pump(server, client)
+
+    def _pump(self, source, sink):
+        queue = []
+        cond = threading.Condition()
+
+        def read():
+            seq = 0
+            while True:
+                try:
+                    data = source.recv(65536)
+                except OSError:
+                    data = b''
+                with cond:
+                    seq += 1
+                    heapq.heappush(
+                        queue, (time.monotonic() + self.delay, seq, data)
+                    )
+                    cond.notify()
+                if not data:
+                    return
+
+        def write():
+            while True:
+                with cond:
+                    while not queue:
+                        cond.wait()
+                    due, _, data = queue[0]
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        cond.wait(wait)
+                        continue
+                    heapq.heappop(queue)
+                if not data:
+                    sink.shutdown(socket.SHUT_WR)
+                    return
+                try:
+                    sink.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+
+def add_arguments(parser):
+    parser.add_argument('--delay-ms', type=float, default=25)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--sequential-messages', type=int, default=100)
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--window', type=int, default=64)
+
+
+def _channel(port, pkey):
+    transport = paramiko.Transport(socket.create_connection((HOST, port)))
+    transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    transport.start_client(timeout=30)
+    transport.auth_publickey('user', pkey)
+    channel = transport.open_session(timeout=30)
+    while not channel.recv(1024).endswith(b'\n'):
+        pass
+    return transport, channel
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    proc = start_server(HOST, port)
+    proxy = LatencyProxy((HOST, port), args.delay_ms / 1000)
+    payload = b'x' * args.message_size
+    framer = LengthFramer()
+    try:
+        transport, channel = _channel(proxy.port, pkey)
+        decoder = framer.decoder()
+        start = time.perf_counter()
+        for _ in range(args.sequential_messages):
+            channel.sendall(framer.encode(payload))
+            replies = []
+            while not replies:
+                replies = decoder.feed(channel.recv(65536))
+        sequential = args.sequential_messages / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        count = sum(1 for _ in pipelined(
+            channel,
+            (payload for _ in range(args.messages)),
+            framer,
+            args.window
+        ))
+        pipelined_rate = count / (time.perf_counter() - start)
+        transport.close()
+    finally:
+        proxy.close()
+        stop_server(proc)
+
+    return {
+        'delay_ms': args.delay_ms,
+        'window': args.window,
+        'sequential_per_sec': round(sequential, 1),
+        'pipelined_per_sec': round(pipelined_rate, 1),
+        'speedup': round(pipelined_rate / sequential, 1),
+    }
@@ -0,0 +1,100 @@
+"""
+Pooled versus unpooled short jobs.
+
+Each job opens a channel, reads the welcome line, sends one message and
+reads the echo. ``--jobs`` jobs run through a `.ConnectionPool` from
+``--clients`` threads, and ``--unpooled-jobs`` jobs each open and close
+their own connection. Reported: jobs per second and handshakes for both,
+and the speedup per job.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+from ..pool import ConnectionPool
+
+
+HOST = '127.0.0.1'
+MESSAGE = b'x' * 64
+
+
+def add_arguments(parser):
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--unpooled-jobs', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--engine', default='thread')
+
+
+def _job(channel):
+    while not channel.recv(1024).endswith(b'\n'):
+        pass
+    channel.sendall(MESSAGE)
+    received = 0
+    while received < len(MESSAGE):
+        received += len(channel.recv(1024))
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    proc = start_server(HOST, port, '--engine', args.engine)
+    try:
+        pooled = _pooled(port, pkey, args)
+        unpooled = _unpooled(port, pkey, args)
+    finally:
+        stop_server(proc)
+    return {
+        'pooled': pooled,
+        'unpooled': unpooled,
+        'speedup': round(pooled['jobs_per_sec'] / unpooled['jobs_per_sec'], 1),
+    }
+
+
+def _pooled(port, pkey, args):
+    pool = ConnectionPool(pkey)
+
+    def job(_):
+        start = time.perf_counter()
+        with pool.session(HOST, port) as channel:
+            _job(channel)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        latencies = list(executor.map(job, range(args.jobs)))
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return {
+        'jobs': args.jobs,
+        'jobs_per_sec': round(args.jobs / elapsed, 1),
+        'latency': summarize(latencies),
+        **pool.stats,
+    }
+
+
+def _unpooled(port, pkey, args):
+    def job(_):
+        start = time.perf_counter()
+        client = connect(HOST, port, pkey)
+        _job(client.get_transport().open_session())
+        client.close()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        latencies = list(executor.map(job, range(args.unpooled_jobs)))
+    elapsed = time.perf_counter() - start
+    return {
+        'jobs': args.unpooled_jobs,
+        'jobs_per_sec': round(args.unpooled_jobs / elapsed, 1),
+        'latency': summarize(latencies),
+        'handshakes': args.unpooled_jobs,
+    }
@@ -0,0 +1,185 @@
+"""
+Cost of session recording, and how fast recordings are read back.
+
+- ``throughput``: ``--gb`` GB streamed through one echo session, as in
+  the ``throughput`` scenario, against a server without recording and
+  one with ``--record-dir``. Reported for each: MB/s, the server's CPU
+  time and peak RSS and, with recording, the size of the recording and
+  the throughput and CPU time lost. On a loaded or single-core machine
+  the CPU time is the steadier figure.
+- ``read``: a recording of ``--frames`` frames, alternating keystroke
+  sized input and ``--frame-size`` output, is written with a `.Recorder`.
+  Reported: the write rate, the read rate of a full replay, and the time
+  to reach ``--seeks`` random points with the index and, for comparison,
+  by scanning from the start as a format without an index would.
+"""
+
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import paramiko
+
+from ..recording import FRAME, Recorder, RecordingReader
+from . import (
+    cpu_seconds,
+    free_port,
+    load_client_key,
+    rss_bytes,
+    start_server,
+    stop_server,
+    summarize,
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+GB = 1024 * MB
+BUFFER_SIZE = MB
+WINDOW_SIZE = 8 * MB
+
+
+def add_arguments(parser):
+    parser.add_argument('--gb', type=float, default=2)
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--frames', type=int, default=200000)
+    parser.add_argument('--frame-size', type=int, default=2048)
+    parser.add_argument('--seeks', type=int, default=50)
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix='ssh-bench-recording-')
+    try:
+        off = _stream(args, None)
+        on = _stream(args, os.path.join(directory, 'stream'))
+        on['overhead'] = round(1 - on['mb_per_sec'] / off['mb_per_sec'], 3)
+        on['cpu_overhead'] = round(
+            on['server_cpu_seconds'] / off['server_cpu_seconds'] - 1, 3
+        )
+        return {
+            'throughput': {'off': off, 'on': on},
+            'read': _read(args, os.path.join(directory, 'read')),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _stream(args, record_dir):
+    port = free_port(HOST)
+    extra = () if record_dir is None else ('--record-dir', record_dir)
+    proc = start_server(HOST, port, '--engine', args.engine, *extra)
+    try:
+        transport = paramiko.Transport(
+            socket.create_connection((HOST, port), timeout=30),
+            default_window_size=WINDOW_SIZE
+        )
+        transport.start_client(timeout=30)
+        transport.auth_publickey('user', load_client_key())
+        channel = transport.open_session(timeout=30)
+        while not channel.recv(1024).endswith(b'\n'):
+            pass
+
+        total = int(args.gb * GB)
+        payload = memoryview(bytes(BUFFER_SIZE))
+
+        def send():
+            remaining = total
+            while remaining > 0:
+                size = min(remaining, BUFFER_SIZE)
+                channel.sendall(payload[:size])
+                remaining -= size
+
+        peak = 0
+        received = 0
+        next_sample = 0
+        sender = threading.Thread(target=send, daemon=True)
+        start = time.perf_counter()
+        sender.start()
+        while received < total:
+            data = channel.recv(BUFFER_SIZE)
+            if not data:
+                raise EOFError('channel closed')
+            received += len(data)
+            if received >= next_sample:
+                peak = max(peak, rss_bytes(proc.pid))
+                next_sample += 64 * MB
+        elapsed = time.perf_counter() - start
+        sender.join()
+        transport.close()
+        cpu = cpu_seconds(proc.pid)
+    finally:
+        stop_server(proc)
+
+    result = {
+        'seconds': round(elapsed, 2),
+        'mb_per_sec': round(total / MB / elapsed, 1),
+        'server_cpu_seconds': round(cpu, 2),
+        'server_peak_rss': peak,
+    }
+    if record_dir is not None:
+        result['recorded_mb'] = round(sum(
+            os.path.getsize(os.path.join(record_dir, name))
+            for name in os.listdir(record_dir)
+        ) / MB, 1)
+    return result
+
+
+def _read(args, directory):
+    # Room for the whole recording: this measures the format, not drops.
+    recorder = Recorder(directory, max_buffered=GB).start()
+    keystroke = b'x'
+    output = os.urandom(args.frame_size)
+    start = time.perf_counter()
+    recording = recorder.open('session')
+    for _ in range(args.frames // 2):
+        recording.input(0, keystroke)
+        recording.output(0, output)
+    recording.close()
+    recorder.close()
+    written = time.perf_counter() - start
+
+    path = os.path.join(directory, 'session.rec')
+    size = os.path.getsize(path)
+    with RecordingReader(path) as reader:
+        start = time.perf_counter()
+        frames = sum(1 for _ in reader.frames())
+        replayed = time.perf_counter() - start
+        last = _last_time(reader)
+
+        targets = [
+            random.uniform(0, last) for _ in range(args.seeks)
+        ]
+        indexed = []
+        for target in targets:
+            start = time.perf_counter()
+            next(reader.frames(start=target))
+            indexed.append(time.perf_counter() - start)
+        # Without the index, the only way in is from the start.
+        reader._times = reader._offsets = []
+        scanned = []
+        for target in targets[:max(1, args.seeks // 10)]:
+            start = time.perf_counter()
+            next(reader.frames(start=target))
+            scanned.append(time.perf_counter() - start)
+
+    return {
+        'frames': frames,
+        'mb': round(size / MB, 1),
+        'frame_overhead_bytes': FRAME.size,
+        'write_mb_per_sec': round(size / MB / written, 1),
+        'replay_mb_per_sec': round(size / MB / replayed, 1),
+        'replay_frames_per_sec': round(frames / replayed),
+        'seek_indexed_p50_us': round(summarize(indexed)['p50'] * 1e6, 1),
+        'seek_scan_p50_ms': round(summarize(scanned)['p50'] * 1e3, 1),
+    }
+
+
+def _last_time(reader):
+    last = 0.0
+    for frame in reader.frames(start=reader._times[-1] / 1e6):
+        last = frame.time
+    return last
@@ -0,0 +1,191 @@
+"""
+Remote port forwarding through the server.
+
+``--clients`` client connections each ask the server to listen on
+``--forwards`` ports, and echo back whatever arrives on the
+``forwarded-tcpip`` channels. Measured:
+
+- connection setup: ``--connections`` TCP connections to the forwarded
+  ports, spread over all of them, ``--concurrency`` at a time, each
+  sending one message and waiting for its echo;
+- throughput of ``--mb`` MB streamed through one forward, and through
+  every client's first forward at once.
+"""
+
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import (
+    connect,
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def _echo(channel):
+    with channel:
+        while True:
+            try:
+                data = channel.recv(CHUNK_SIZE)
+                if not data:
+                    return
+                channel.sendall(data)
+            except OSError:
+                return
+
+
+def _handler(channel, origin, server):
+    # Called on the client transport's thread, which must not block.
+    threading.Thread(target=_echo, args=(channel,), daemon=True).start()
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--forwards', type=int, default=10)
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--mb', type=float, default=32)
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--allow-listen', f'{HOST}:*'
+    )
+    clients = []
+    try:
+        start = time.perf_counter()
+        ports = []
+        for _ in range(args.clients):
+            client = connect(HOST, port, pkey)
+            clients.append(client)
+            transport = client.get_transport()
+            transport.sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+            )
+            ports.append([
+                transport.request_port_forward(HOST, 0, _handler)
+                for _ in range(args.forwards)
+            ])
+        forwards_elapsed = time.perf_counter() - start
+
+        results = {'engine': args.engine}
+        results['forwards'] = {
+            'listeners': args.clients * args.forwards,
+            'listeners_per_sec': round(
+                args.clients * args.forwards / forwards_elapsed, 1
+            ),
+        }
+        flat = [p for client_ports in ports for p in client_ports]
+        results['setup'] = _setup(flat, args)
+        results['throughput'] = _throughput(
+            [client_ports[0] for client_ports in ports], args
+        )
+
+        # Cancelling a forward stops its listener.
+        transport = clients[0].get_transport()
+        transport.cancel_port_forward(HOST, ports[0][0])
+        time.sleep(0.1)
+        try:
+            socket.create_connection((HOST, ports[0][0]), timeout=1).close()
+            results['cancel_closes_listener'] = False
+        except OSError:
+            results['cancel_closes_listener'] = True
+        return results
+    finally:
+        for client in clients:
+            client.close()
+        stop_server(proc)
+
+
+def _connect(port):
+    sock = socket.create_connection((HOST, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def _setup(ports, args):
+    message = b'ping'
+
+    def one(port):
+        start = time.perf_counter()
+        with _connect(port) as sock:
+            sock.sendall(message)
+            received = 0
+            while received < len(message):
+                data = sock.recv(64)
+                if not data:
+                    raise EOFError('forward closed')
+                received += len(data)
+        return time.perf_counter() - start
+
+    targets = [random.choice(ports) for _ in range(args.connections)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = list(executor.map(one, targets))
+    wall = time.perf_counter() - start
+    return {
+        'connections': len(samples),
+        'connections_per_sec': round(len(samples) / wall, 1),
+        'first_echo': summarize(samples),
+    }
+
+
+def _stream(port, total):
+    payload = memoryview(bytes(CHUNK_SIZE))
+    with _connect(port) as sock:
+
+        def send():
+            remaining = total
+            while remaining > 0:
+                size = min(remaining, CHUNK_SIZE)
+                sock.sendall(payload[:size])
+                remaining -= size
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        received = 0
+        while received < total:
+            data = sock.recv(CHUNK_SIZE)
+            if not data:
+                raise EOFError('forward closed')
+            received += len(data)
+        sender.join()
+
+
+def _throughput(ports, args):
+    total = int(args.mb * MB)
+    start = time.perf_counter()
+    _stream(ports[0], total)
+    single = time.perf_counter() - start
+
+    threads = [
+        threading.Thread(target=_stream, args=(port, total), daemon=True)
+        for port in ports
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return {
+        'single_mb_per_sec': round(total / MB / single, 1),
+        'forwards': len(ports),
+        'total_mb_per_sec': round(total * len(ports) / MB / wall, 1),
+    }
@@ -0,0 +1,256 @@
+"""
+Dropped connections and handshake spikes when a server is restarted.
+
+``--clients`` threads connect and authenticate over and over, and
+``--sessions`` long-lived sessions echo a line every ``--interval``
+seconds, reconnecting if their connection drops. After ``--before``
+seconds the server is, in turn:
+
+- ``restart``: stopped with ``SIGTERM`` and started again;
+- ``upgrade``: sent ``SIGUSR2``, so that a new process takes over the
+  listening socket while the old one drains, see `.handoff`;
+- ``reload``: sent ``SIGHUP`` to re-read its host keys.
+
+Reported for each, over ``--after`` seconds more: failed connection
+attempts, dropped sessions, the longest time in which no handshake
+completed, handshake latency before the event and in the ``--window``
+seconds after it, and the handshakes completed in that window against a
+window of the same length before.
+"""
+
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+import paramiko
+
+from . import (
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize,
+)
+
+
+HOST = '127.0.0.1'
+USERNAME = 'user'
+# Pause after a failed connection attempt, so that a closed port is not
+# retried in a busy loop.
+RETRY_DELAY = 0.05
+STOP_TIMEOUT = 10.0
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.1)
+    parser.add_argument('--before', type=float, default=3.0)
+    parser.add_argument('--after', type=float, default=5.0)
+    parser.add_argument('--window', type=float, default=1.0)
+
+
+def run(args):
+    # Connections reset by a stopped server would each log a traceback.
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    pkey = load_client_key()
+    results = {'engine': args.engine, 'workers': args.workers}
+    for mode in ('restart', 'upgrade', 'reload'):
+        results[mode] = _run(args, pkey, mode)
+    return results
+
+
+def _server_args(args):
+    if args.workers:
+        # A supervisor only hands over a socket its workers share.
+        return (
+            '--engine', args.engine,
+            '--workers', str(args.workers),
+            '--shared-socket',
+        )
+    return ('--engine', args.engine)
+
+
+def _run(args, pkey, mode):
+    port = free_port(HOST)
+    server_args = _server_args(args)
+    proc = start_server(HOST, port, *server_args)
+    # Processes started by an upgrade, which outlive ``proc``.
+    started = []
+    stop = threading.Event()
+    handshakes = []
+    failures = []
+    drops = []
+    threads = [
+        threading.Thread(
+            target=_client,
+            args=(port, pkey, stop, handshakes, failures),
+            daemon=True
+        )
+        for _ in range(args.clients)
+    ] + [
+        threading.Thread(
+            target=_session,
+            args=(port, pkey, stop, args.interval, drops, failures),
+            daemon=True
+        )
+        for _ in range(args.sessions)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(args.before)
+        event = time.monotonic()
+        if mode == 'restart':
+            stop_server(proc)
+            proc = start_server(HOST, port, *server_args)
+        elif mode == 'upgrade':
+            children = set(_children(proc.pid))
+            proc.send_signal(signal.SIGUSR2)
+            started.append(_new_child(proc.pid, children))
+        else:
+            proc.send_signal(signal.SIGHUP)
+        time.sleep(args.after)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(STOP_TIMEOUT)
+        stop_server(proc)
+        for pid in started:
+            _stop_pid(pid)
+    return _report(args, event, handshakes, failures, drops)
+
+
+def _handshake(port, pkey):
+    sock = socket.create_connection((HOST, port), timeout=10)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    transport = paramiko.Transport(sock)
+    try:
+        transport.start_client(timeout=10)
+        transport.auth_publickey(USERNAME, pkey)
+    except BaseException:
+        transport.close()
+        raise
+    return transport
+
+
+def _client(port, pkey, stop, handshakes, failures):
+    while not stop.is_set():
+        start = time.monotonic()
+        try:
+            transport = _handshake(port, pkey)
+        except (OSError, EOFError, paramiko.SSHException):
+            failures.append(start)
+            time.sleep(RETRY_DELAY)
+            continue
+        handshakes.append((start, time.monotonic()))
+        transport.close()
+
+
+def _session(port, pkey, stop, interval, drops, failures):
+    transport = None
+    while not stop.is_set():
+        try:
+            if transport is None:
+                transport = _handshake(port, pkey)
+                channel = transport.open_session(timeout=10)
+                # The banner the server greets each session with.
+                channel.recv(1024)
+            channel.sendall(b'ping\n')
+            if not channel.recv(1024):
+                raise EOFError()
+        except (OSError, EOFError, paramiko.SSHException):
+            if transport is not None:
+                # It was open: the server dropped it.
+                drops.append(time.monotonic())
+                transport.close()
+                transport = None
+            else:
+                failures.append(time.monotonic())
+            time.sleep(RETRY_DELAY)
+            continue
+        stop.wait(interval)
+    if transport is not None:
+        transport.close()
+
+
+def _children(pid):
+    """Processes whose parent is ``pid`` (Linux only)."""
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(name))
+    return children
+
+
+def _new_child(pid, known, timeout=STOP_TIMEOUT):
+    """The first child of ``pid`` not in ``known``, waiting for one."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for child in _children(pid):
+            if child not in known:
+                return child
+        time.sleep(0.01)
+    raise RuntimeError(f'Process {pid} started no new server')
+
+
+def _stop_pid(pid):
+    """Stop a process that is not a child of this one."""
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.monotonic() + STOP_TIMEOUT
+    while os.path.exists(f'/proc/{pid}'):
+        if time.monotonic() > deadline:
+            os.kill(pid, signal.SIGKILL)
+            break
+        time.sleep(0.05)
+
+
+def _report(args, event, handshakes, failures, drops):
+    handshakes.sort(key=lambda handshake: handshake[1])
+    done = [end for _, end in handshakes]
+    gaps = [later - earlier for earlier, later in zip(done, done[1:])]
+    before = [
+        end - start for start, end in handshakes if end < event
+    ]
+    after = [
+        end - start for start, end in handshakes
+        if event <= start < event + args.window
+    ]
+    before_stats = summarize(before)
+    after_stats = summarize(after)
+    return {
+        'handshakes': len(handshakes),
+        'failed': len(failures),
+        'dropped_sessions': len(drops),
+        'accept_gap_max_ms': round(max(gaps, default=0) * 1e3, 1),
+        'handshake_before_p50_ms': _ms(before_stats['p50']),
+        'handshake_before_p99_ms': _ms(before_stats['p99']),
+        'handshake_after_p50_ms': _ms(after_stats['p50']),
+        'handshake_after_p99_ms': _ms(after_stats['p99']),
+        'handshake_after_max_ms': _ms(after_stats['max']),
+        'window_handshakes_before': sum(
+            1 for end in done if event - args.window <= end < event
+        ),
+        'window_handshakes_after': sum(
+            1 for end in done if event <= end < event + args.window
+        ),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1e3, 1)
@@ -0,0 +1,189 @@
+"""
+End-to-end session benchmark (the default scenario).
+
+Starts a server on localhost and drives it with ``--clients`` concurrent
+paramiko clients, using the keys under ``keys/``:
+
+* handshake: ``--connections`` connect/authenticate/open-channel cycles,
+  reporting handshakes per second and latency percentiles for the whole
+  handshake, for key exchange, for authentication and for channel open;
+* echo: each client sends ``--messages`` small messages one at a time and
+  waits for the echo, reporting round-trip percentiles;
+* bulk: each client streams ``--bulk-mb`` MB through its session while
+  reading the echo back, reporting aggregate throughput in MB/s.
+"""
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from . import (
+    free_port,
+    load_client_key,
+    start_server,
+    stop_server,
+    summarize
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+CHUNK_SIZE = 32 * 1024
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--bulk-mb', type=float, default=8)
+    parser.add_argument(
+        '--server-args',
+        default='',
+        help='extra arguments for python3 -m ssh.server'
+    )
+
+
+class Session:
+    """A client connection opened step by step so each phase is timed."""
+
+    def __init__(self, port, pkey, username='user'):
+        start = time.perf_counter()
+        sock = socket.create_connection((HOST, port), timeout=30)
+        self.transport = paramiko.Transport(sock)
+        self.transport.start_client(timeout=30)
+        kex_done = time.perf_counter()
+        self.transport.auth_publickey(username, pkey)
+        auth_done = time.perf_counter()
+        self.channel = self.transport.open_session(timeout=30)
+        opened = time.perf_counter()
+
+        self.kex = kex_done - start
+        self.auth = auth_done - kex_done
+        self.channel_open = opened - auth_done
+        self.handshake = opened - start
+
+    def read_line(self):
+        """Read the server's welcome line."""
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = self.channel.recv(1024)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read_exactly(self, size):
+        received = 0
+        while received < size:
+            chunk = self.channel.recv(min(CHUNK_SIZE, size - received))
+            if not chunk:
+                raise EOFError('channel closed')
+            received += len(chunk)
+
+    def close(self):
+        self.transport.close()
+
+
+def _handshakes(port, pkey, args):
+    def cycle(_):
+        session = Session(port, pkey)
+        session.read_line()
+        session.close()
+        return session
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        sessions = list(pool.map(cycle, range(args.connections)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'handshakes_per_sec': round(len(sessions) / elapsed, 1),
+        'handshake': summarize([s.handshake for s in sessions]),
+        'kex': summarize([s.kex for s in sessions]),
+        'auth': summarize([s.auth for s in sessions]),
+        'channel_open': summarize([s.channel_open for s in sessions]),
+    }
+
+
+def _echo(port, pkey, args):
+    payload = b'x' * args.message_size
+
+    def client(_):
+        session = Session(port, pkey)
+        session.read_line()
+        rtts = []
+        for _ in range(args.messages):
+            start = time.perf_counter()
+            session.channel.sendall(payload)
+            session.read_exactly(len(payload))
+            rtts.append(time.perf_counter() - start)
+        session.close()
+        return rtts
+
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        rtts = [rtt for result in pool.map(client, range(args.clients))
+                for rtt in result]
+    return summarize(rtts)
+
+
+def _bulk(port, pkey, args):
+    total = int(args.bulk_mb * MB)
+    chunk = b'x' * CHUNK_SIZE
+
+    def client(_):
+        session = Session(port, pkey)
+        session.read_line()
+
+        def send():
+            remaining = total
+            while remaining > 0:
+                session.channel.sendall(chunk[:remaining])
+                remaining -= len(chunk)
+
+        sender = threading.Thread(target=send, daemon=True)
+        start = time.perf_counter()
+        sender.start()
+        session.read_exactly(total)
+        elapsed = time.perf_counter() - start
+        sender.join()
+        session.close()
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        per_client = list(pool.map(client, range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'bytes_per_client': total,
+        'mb_per_sec': round(total * args.clients / MB / elapsed, 2),
+        'client_mb_per_sec': summarize(
+            [total / MB / seconds for seconds in per_client]
+        ),
+    }
+
+
+def run(args):
+    pkey = load_client_key()
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--backlog', '1024',
+        *args.server_args.split()
+    )
+    try:
+        return {
+            'engine': args.engine,
+            'clients': args.clients,
+            'handshake': _handshakes(port, pkey, args),
+            'echo_rtt': _echo(port, pkey, args),
+            'bulk': _bulk(port, pkey, args),
+        }
+    finally:
+        stop_server(proc)
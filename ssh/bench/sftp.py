@@ -0,0 +1,144 @@
+"""
+SFTP transfers of a large file.
+
+A ``--gb`` GB file is written to a temporary directory, which a server
+started with ``--sftp-root`` serves. The file is downloaded and uploaded
+with paramiko's `.SFTPClient`, which keeps many reads in flight, and with
+OpenSSH's ``sftp`` client if it is installed. Reported: MB/s for each
+client and direction, and the server's anonymous memory, which should
+not grow with the file size as reads go straight to the file.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from . import (
+    CLIENT_KEY_PATH,
+    connect,
+    free_port,
+    load_client_key,
+    rss_bytes,
+    start_server,
+    stop_server
+)
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+def add_arguments(parser):
+    parser.add_argument('--gb', type=float, default=1)
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument(
+        '--requests',
+        type=int,
+        default=64,
+        help='outstanding requests for the OpenSSH client'
+    )
+    parser.add_argument(
+        '--no-openssh',
+        action='store_true',
+        help='skip the OpenSSH sftp client'
+    )
+
+
+def _write_file(path, size):
+    block = os.urandom(MB)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(remaining, MB)])
+            remaining -= MB
+
+
+def run(args):
+    pkey = load_client_key()
+    size = int(args.gb * GB)
+    with tempfile.TemporaryDirectory() as root, \
+            tempfile.TemporaryDirectory() as local:
+        _write_file(os.path.join(root, 'data.bin'), size)
+        port = free_port(HOST)
+        proc = start_server(
+            HOST, port,
+            '--engine', args.engine,
+            '--sftp-root', root
+        )
+        try:
+            results = {'engine': args.engine, 'bytes': size}
+            results['paramiko'] = _paramiko(port, pkey, size, local)
+            sftp = shutil.which('sftp')
+            if sftp and not args.no_openssh:
+                results['openssh'] = _openssh(
+                    sftp, port, size, local, args.requests
+                )
+            results['server_anon_rss_mb'] = round(
+                rss_bytes(proc.pid, 'RssAnon') / MB, 1
+            )
+            return results
+        finally:
+            stop_server(proc)
+
+
+def _rate(size, elapsed):
+    return round(size / MB / elapsed, 1)
+
+
+def _paramiko(port, pkey, size, local):
+    client = connect(HOST, port, pkey)
+    try:
+        sftp = client.open_sftp()
+        target = os.path.join(local, 'paramiko.bin')
+        start = time.perf_counter()
+        sftp.get('/data.bin', target)
+        download = time.perf_counter() - start
+        start = time.perf_counter()
+        sftp.put(target, '/paramiko-upload.bin', confirm=False)
+        upload = time.perf_counter() - start
+        sftp.remove('/paramiko-upload.bin')
+        os.remove(target)
+    finally:
+        client.close()
+    return {
+        'download_mb_per_sec': _rate(size, download),
+        'upload_mb_per_sec': _rate(size, upload),
+    }
+
+
+def _openssh(sftp, port, size, local, requests):
+    target = os.path.join(local, 'openssh.bin')
+    command = [
+        sftp, '-q', '-b', '-',
+        '-P', str(port),
+        '-R', str(requests),
+        '-i', os.path.abspath(CLIENT_KEY_PATH),
+        '-o', 'BatchMode=yes',
+        '-o', 'StrictHostKeyChecking=no',
+        '-o', 'UserKnownHostsFile=/dev/null',
+        '-o', 'LogLevel=ERROR',
+        f'user@{HOST}',
+    ]
+
+    def transfer(batch):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            input=batch.encode(),
+            check=True,
+            stdout=subprocess.DEVNULL
+        )
+        return time.perf_counter() - start
+
+    download = transfer(f'get /data.bin {target}\n')
+    upload = transfer(
+        f'put {target} /openssh-upload.bin\nrm /openssh-upload.bin\n'
+    )
+    os.remove(target)
+    return {
+        'download_mb_per_sec': _rate(size, download),
+        'upload_mb_per_sec': _rate(size, upload),
+    }
@@ -0,0 +1,117 @@
+"""
+Cold start of short-lived client processes.
+
+Every sample is a fresh Python process; ``--runs`` of each are reported:
+
+- ``python``: an interpreter that imports nothing, for reference;
+- ``import_ssh`` and ``import_client``: importing the package and
+  `.client`, run in an empty directory whose files afterwards are listed
+  as ``created_files`` (there should be none);
+- ``first_connection``: importing `.client`, creating an `.SSHClient`,
+  which loads its keys, connecting and authenticating, and reading the
+  server's welcome line, each phase timed inside the process.
+
+``wall`` is the time to run the whole process, start-up and exit
+included.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import free_port, start_server, stop_server, summarize
+
+
+HOST = '127.0.0.1'
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+PHASES = ('import', 'client', 'connect', 'first_reply')
+
+_CONNECT = '''
+import json, sys, time
+start = time.perf_counter()
+from ssh.client import SSHClient
+imported = time.perf_counter()
+client = SSHClient(sys.argv[1], int(sys.argv[2]))
+created = time.perf_counter()
+# Leave known_hosts as it is, whatever port the server is on.
+from paramiko import WarningPolicy
+client.ssh.set_missing_host_key_policy(WarningPolicy())
+client.connect()
+connected = time.perf_counter()
+channel = client.open_session()
+while not channel.recv(1024).endswith(b'\\n'):
+    pass
+done = time.perf_counter()
+print(json.dumps([
+    imported - start, created - imported, connected - created,
+    done - connected
+]))
+'''
+
+
+def add_arguments(parser):
+    parser.add_argument('--engine', default='thread')
+    parser.add_argument('--runs', type=int, default=20)
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, code in (
+            ('python', 'pass'),
+            ('import_ssh', 'import ssh'),
+            ('import_client', 'import ssh.client'),
+        ):
+            samples = [
+                _timed([sys.executable, '-c', code], directory, env)[0]
+                for _ in range(args.runs)
+            ]
+            results[name] = {'wall': _ms(samples)}
+        results['created_files'] = sorted(os.listdir(directory))
+
+    port = free_port(HOST)
+    proc = start_server(HOST, port, '--engine', args.engine)
+    try:
+        walls = []
+        phases = {phase: [] for phase in PHASES}
+        for _ in range(args.runs):
+            wall, output = _timed(
+                [sys.executable, '-c', _CONNECT, HOST, str(port)],
+                None,
+                env
+            )
+            walls.append(wall)
+            timings = json.loads(output.splitlines()[-1])
+            for phase, seconds in zip(PHASES, timings):
+                phases[phase].append(seconds)
+    finally:
+        stop_server(proc)
+    results['first_connection'] = {'wall': _ms(walls)}
+    for phase, samples in phases.items():
+        results['first_connection'][phase] = _ms(samples)
+    return results
+
+
+def _timed(command, cwd, env):
+    start = time.perf_counter()
+    output = subprocess.run(
+        command,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True
+    ).stdout
+    return time.perf_counter() - start, output
+
+
+def _ms(samples):
+    stats = summarize(samples)
+    return {
+        'p50_ms': round(stats['p50'] * 1000, 1),
+        'p90_ms': round(stats['p90'] * 1000, 1),
+    }
@@ -0,0 +1,108 @@
+"""
+Bulk throughput through one echo session.
+
+For each ``--chunk-sizes`` value a server is started with that chunk size
+and the given ``--window-size`` and ``--max-packet-size``, and a client
+streams ``--gb`` GB through a session while reading the echo back on
+another thread. The client offers the same window and packet size.
+Reported per chunk size: MB/s in each direction combined, the elapsed
+time and the server's peak RSS.
+"""
+
+import socket
+import threading
+import time
+
+import paramiko
+
+from . import free_port, load_client_key, rss_bytes, start_server, stop_server
+
+
+HOST = '127.0.0.1'
+MB = 1024 * 1024
+GB = 1024 * MB
+BUFFER_SIZE = MB
+
+
+def add_arguments(parser):
+    parser.add_argument('--gb', type=float, default=2)
+    parser.add_argument(
+        '--chunk-sizes',
+        type=int,
+        nargs='+',
+        default=[32 * 1024, 64 * 1024, 256 * 1024, MB]
+    )
+    parser.add_argument('--window-size', type=int, default=8 * MB)
+    parser.add_argument('--max-packet-size', type=int, default=32 * 1024)
+    parser.add_argument('--engine', default='thread')
+
+
+def run(args):
+    pkey = load_client_key()
+    results = {
+        'engine': args.engine,
+        'bytes': int(args.gb * GB),
+        'window_size': args.window_size,
+        'max_packet_size': args.max_packet_size,
+    }
+    for chunk_size in args.chunk_sizes:
+        results[f'chunk_{chunk_size}'] = _stream(chunk_size, args, pkey)
+    return results
+
+
+def _stream(chunk_size, args, pkey):
+    port = free_port(HOST)
+    proc = start_server(
+        HOST, port,
+        '--engine', args.engine,
+        '--chunk-size', str(chunk_size),
+        '--window-size', str(args.window_size),
+        '--max-packet-size', str(args.max_packet_size)
+    )
+    try:
+        transport = paramiko.Transport(
+            socket.create_connection((HOST, port), timeout=30),
+            default_window_size=args.window_size,
+            default_max_packet_size=args.max_packet_size
+        )
+        transport.start_client(timeout=30)
+        transport.auth_publickey('user', pkey)
+        channel = transport.open_session(timeout=30)
+        while not channel.recv(1024).endswith(b'\n'):
+            pass
+
+        total = int(args.gb * GB)
+        payload = memoryview(bytes(BUFFER_SIZE))
+
+        def send():
+            remaining = total
+            while remaining > 0:
+                size = min(remaining, BUFFER_SIZE)
+                channel.sendall(payload[:size])
+                remaining -= size
+
+        peak = 0
+        received = 0
+        next_sample = 0
+        sender = threading.Thread(target=send, daemon=True)
+        start = time.perf_counter()
+        sender.start()
+        while received < total:
+            data = channel.recv(BUFFER_SIZE)
+            if not data:
+                raise EOFError('channel closed')
+            received += len(data)
+            if received >= next_sample:
+                peak = max(peak, rss_bytes(proc.pid))
+                next_sample += 64 * MB
+        elapsed = time.perf_counter() - start
+        sender.join()
+        transport.close()
+    finally:
+        stop_server(proc)
+
+    return {
+        'seconds': round(elapsed, 2),
+        'mb_per_sec': round(total / MB / elapsed, 1),
+        'server_peak_rss': peak,
+    }
@@ -0,0 +1,690 @@
+"""
+OpenSSH certificates.
+
+A certificate binds a public key to a key ID, principals (user or host
+names), a validity window, critical options and extensions, and is
+signed by a certificate authority (CA) key; see ``PROTOCOL.certkeys`` in
+OpenSSH. A server that trusts a CA accepts every user certificate it
+signed, and a client that trusts a CA for a domain accepts every host
+certificate it signed, so neither side needs a list of the other's keys.
+
+- `UserCertificates` checks user certificates for the server against
+  the CA keys in a ``TrustedUserCAKeys`` style file and the
+  ``cert-authority`` lines of ``authorized_keys``. A certificate's
+  signature is verified the first time it is seen and the result cached
+  until the certificate expires, so later logins with it cost a few
+  dictionary lookups however many users the CA has signed for.
+- `check_host_certificate` checks a server's host certificate against
+  the ``@cert-authority`` lines of ``known_hosts``, for `.HostKeyPolicy`,
+  and clients ask for host certificates with `certificate_transport`.
+- `CertifiedHostKey` lets the server offer a host certificate.
+- `sign_certificate` issues certificates, also from the command line::
+
+    python3 -m ssh.certificates --ca ca_key --id alice --principals alice \\
+        --valid-for 3600 id_ed25519.pub
+
+Certificates must name the user or host they are used for: unlike
+OpenSSH, one without principals is refused for hosts too. CA signatures
+made with SHA-1 (``ssh-rsa``) are refused, as by OpenSSH's default
+``CASignatureAlgorithms``.
+"""
+
+import argparse
+import base64
+import ipaddress
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .authorized_keys import AuthorizedKey, AuthorizedKeysFile
+
+
+logger = logging.getLogger('ssh')
+
+CERT_SUFFIX = '-cert-v01@openssh.com'
+USER = 1
+HOST = 2
+FOREVER = 2 ** 64 - 1
+MAX_CACHED = 65536
+CHECK_INTERVAL = 1.0
+
+# Extensions of user certificates, and the `.AuthorizedKey.allows`
+# feature each grants.
+EXTENSIONS = {
+    'permit-X11-forwarding': 'X11-forwarding',
+    'permit-agent-forwarding': 'agent-forwarding',
+    'permit-port-forwarding': 'port-forwarding',
+    'permit-pty': 'pty',
+    'permit-user-rc': 'user-rc',
+}
+# Critical options of user certificates this server enforces; others are
+# refused, as the format requires.
+CRITICAL_OPTIONS = frozenset(('force-command', 'source-address'))
+
+# The number of fields the public key takes up in a certificate.
+KEY_FIELDS = {
+    'ssh-ed25519': 1,
+    'ssh-rsa': 2,
+    'ssh-dss': 4,
+    'ecdsa-sha2-nistp256': 2,
+    'ecdsa-sha2-nistp384': 2,
+    'ecdsa-sha2-nistp521': 2,
+    'sk-ssh-ed25519@openssh.com': 2,
+    'sk-ecdsa-sha2-nistp256@openssh.com': 3,
+}
+
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+
+
+def is_certificate(key):
+    """Whether the paramiko ``key`` came with a certificate."""
+    blob = key.public_blob
+    return blob is not None and blob.key_type.endswith(CERT_SUFFIX)
+
+
+def _plain_type(cert_type):
+    """The key type certified by a ``cert_type`` certificate."""
+    key_type = cert_type[:-len(CERT_SUFFIX)]
+    if key_type.startswith('sk-'):
+        key_type += '@openssh.com'
+    return key_type
+
+
+class _Reader:
+
+    __slots__ = ('data', 'offset')
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def uint32(self):
+        return self._unpack(_UINT32)
+
+    def uint64(self):
+        return self._unpack(_UINT64)
+
+    def string(self):
+        length = self.uint32()
+        end = self.offset + length
+        if end > len(self.data):
+            raise ValueError('truncated certificate')
+        value = self.data[self.offset:end]
+        self.offset = end
+        return value
+
+    def text(self):
+        return self.string().decode()
+
+    def done(self):
+        return self.offset == len(self.data)
+
+    def _unpack(self, packer):
+        if self.offset + packer.size > len(self.data):
+            raise ValueError('truncated certificate')
+        (value,) = packer.unpack_from(self.data, self.offset)
+        self.offset += packer.size
+        return value
+
+
+def _string(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return _UINT32.pack(len(data)) + data
+
+
+def _parse_options(data):
+    """Critical options or extensions, as a `dict` of name to value."""
+    reader = _Reader(data)
+    options = {}
+    while not reader.done():
+        name = reader.text()
+        value = reader.string()
+        if name in options:
+            raise ValueError(f'option {name!r} given twice')
+        # A value is itself a string, or nothing for flags.
+        options[name] = _Reader(value).text() if value else ''
+    return options
+
+
+def _pack_options(options):
+    data = b''
+    for name in sorted(options):
+        value = options[name]
+        data += _string(name) + _string(_string(value) if value else b'')
+    return data
+
+
+class Certificate:
+
+    __slots__ = (
+        'cert_type',
+        'nonce',
+        'public_key',
+        'serial',
+        'type',
+        'key_id',
+        'principals',
+        'valid_after',
+        'valid_before',
+        'critical_options',
+        'extensions',
+        'ca_key',
+        'signature',
+        'signed',
+    )
+
+    def __init__(self, blob):
+        """
+        Parse a certificate.
+
+        :param bytes blob: the certificate, as sent on the wire
+        :raises ValueError: if ``blob`` is not a certificate
+        """
+        reader = _Reader(blob)
+        self.cert_type = reader.text()
+        if not self.cert_type.endswith(CERT_SUFFIX):
+            raise ValueError(f'{self.cert_type!r} is not a certificate')
+        key_type = _plain_type(self.cert_type)
+        fields = KEY_FIELDS.get(key_type)
+        if fields is None:
+            raise ValueError(f'unknown certificate type {self.cert_type!r}')
+        self.nonce = reader.string()
+        start = reader.offset
+        for _ in range(fields):
+            reader.string()
+        self.public_key = _string(key_type) + blob[start:reader.offset]
+        self.serial = reader.uint64()
+        self.type = reader.uint32()
+        self.key_id = reader.text()
+        principals = _Reader(reader.string())
+        names = []
+        while not principals.done():
+            names.append(principals.text())
+        self.principals = tuple(names)
+        self.valid_after = reader.uint64()
+        self.valid_before = reader.uint64()
+        self.critical_options = _parse_options(reader.string())
+        self.extensions = _parse_options(reader.string())
+        reader.string()  # reserved
+        self.ca_key = reader.string()
+        self.signed = blob[:reader.offset]
+        self.signature = reader.string()
+        if not reader.done():
+            raise ValueError('trailing data after the certificate')
+
+    def __repr__(self):
+        return (
+            f'<Certificate {self.key_id!r} serial {self.serial} '
+            f'for {", ".join(self.principals)}>'
+        )
+
+    @property
+    def ca_fingerprint(self):
+        """The CA key's fingerprint, as `.AuthorizedKey.fingerprint`."""
+        return AuthorizedKey('', self.ca_key).fingerprint
+
+    def verify(self):
+        """Whether the CA's signature over the certificate is good."""
+        ca_key = _ca_key(self.ca_key)
+        if ca_key is None:
+            return False
+        from paramiko.message import Message
+
+        signature = Message(self.signature)
+        if signature.get_text() == 'ssh-rsa':
+            return False
+        signature.rewind()
+        return ca_key.verify_ssh_sig(self.signed, signature)
+
+    def problem(self, cert_type, principals, now=None):
+        """
+        Why the certificate may not be used now as a ``cert_type``
+        certificate for any of ``principals``, or ``None`` if it may.
+        """
+        if self.type != cert_type:
+            return 'wrong certificate type'
+        now = time.time() if now is None else now
+        if now < self.valid_after:
+            return 'not yet valid'
+        if now >= self.valid_before:
+            return 'expired'
+        if not any(name in self.principals for name in principals):
+            return f'not issued for {", ".join(principals)}'
+        return None
+
+
+_ca_keys = {}
+_ca_lock = threading.Lock()
+
+
+def _ca_key(blob):
+    """The paramiko key for a CA key blob, or ``None``; CAs are few."""
+    with _ca_lock:
+        if blob in _ca_keys:
+            return _ca_keys[blob]
+    from paramiko import PKey
+
+    try:
+        key_type = _Reader(blob).text()
+        key = None
+        if not key_type.endswith(CERT_SUFFIX):
+            key = PKey.from_type_string(key_type, blob)
+    except Exception as exc:
+        logger.debug('Unusable CA key: %r', exc)
+        key = None
+    with _ca_lock:
+        if len(_ca_keys) >= MAX_CACHED:
+            _ca_keys.clear()
+        _ca_keys[blob] = key
+    return key
+
+
+class CertificateCache:
+    """
+    Certificates whose CA signature is good, by blob, kept until they
+    expire. Bad ones are not kept: checking one again costs what it
+    would for a plain key.
+    """
+
+    def __init__(self, max_size=MAX_CACHED):
+        """:param int max_size: certificates to keep at most"""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._certificates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._certificates)
+
+    def verified(self, blob, now=None):
+        """
+        The `Certificate` in ``blob`` if it is well formed and its CA
+        signature is good, else ``None``.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            certificate = self._certificates.get(blob)
+            if certificate is not None:
+                if now < certificate.valid_before:
+                    self._certificates.move_to_end(blob)
+                    self.hits += 1
+                    return certificate
+                del self._certificates[blob]
+            self.misses += 1
+        try:
+            certificate = Certificate(blob)
+        except (ValueError, UnicodeDecodeError) as exc:
+            logger.info('Malformed certificate: %s', exc)
+            return None
+        if not certificate.verify():
+            logger.info(
+                'Bad CA signature on certificate %r', certificate.key_id
+            )
+            return None
+        if now < certificate.valid_before:
+            with self._lock:
+                self._certificates[blob] = certificate
+                if len(self._certificates) > self.max_size:
+                    self._certificates.popitem(last=False)
+        return certificate
+
+
+class UserCertificates:
+
+    def __init__(
+        self,
+        authorized_keys=None,
+        trusted_ca_path=None,
+        check_interval=CHECK_INTERVAL,
+        max_cached=MAX_CACHED
+    ):
+        """
+        :param .AuthorizedKeys authorized_keys:
+            its ``cert-authority`` lines are trusted for the users they
+            apply to, limited to their ``principals=`` option if any
+        :param str trusted_ca_path:
+            a file of CA public keys trusted for every user, one per line,
+            like OpenSSH's ``TrustedUserCAKeys``
+        :param float check_interval:
+            minimum seconds between checks of that file for changes
+        :param int max_cached: verified certificates to keep at most
+        """
+        self.authorized_keys = authorized_keys
+        self.trusted_cas = None
+        if trusted_ca_path:
+            self.trusted_cas = AuthorizedKeysFile(
+                trusted_ca_path, check_interval
+            )
+        self.cache = CertificateCache(max_cached)
+
+    def lookup(self, username, key, address=None):
+        """
+        Check the certificate a client offered for ``username``.
+
+        :param .PKey key: the client's key, with its certificate
+        :param str address: the client's IP address
+        :return: an `.AuthorizedKey` carrying the certificate's
+            restrictions, or ``None`` if it is not accepted
+        """
+        certificate = self.cache.verified(key.public_blob.key_blob)
+        if certificate is None:
+            return None
+        authority = self._authority(username, certificate)
+        if authority is None:
+            logger.info(
+                "Certificate %r for '%s' is signed by an untrusted CA %s",
+                certificate.key_id,
+                username,
+                certificate.ca_fingerprint
+            )
+            return None
+        principals = (username,)
+        if 'principals' in authority.options:
+            principals = authority.options['principals'].split(',')
+        problem = certificate.problem(USER, principals) or _options_problem(
+            certificate, authority, address
+        )
+        if problem is not None:
+            logger.info(
+                "Certificate %r (serial %d) refused for '%s': %s",
+                certificate.key_id,
+                certificate.serial,
+                username,
+                problem
+            )
+            return None
+        return _authorized_key(certificate, authority)
+
+    def _authority(self, username, certificate):
+        """The line trusting the certificate's CA for ``username``."""
+        key_type = _Reader(certificate.ca_key).text()
+        if self.trusted_cas is not None:
+            entry = self.trusted_cas.lookup(key_type, certificate.ca_key)
+            if entry is not None:
+                return entry
+        if self.authorized_keys is not None:
+            entry = self.authorized_keys.lookup_blob(
+                username, key_type, certificate.ca_key
+            )
+            if entry is not None and 'cert-authority' in entry.options:
+                return entry
+        return None
+
+
+def _options_problem(certificate, authority, address):
+    options = certificate.critical_options
+    unknown = set(options) - CRITICAL_OPTIONS
+    if unknown:
+        return f'unsupported critical options {", ".join(sorted(unknown))}'
+    source = options.get('source-address')
+    if source is not None and not _source_allowed(source, address):
+        return f'not allowed from {address}'
+    command = options.get('force-command')
+    forced = authority.options.get('command')
+    if None not in (command, forced) and command != forced:
+        return 'force-command differs from the command= option'
+    return None
+
+
+def _source_allowed(source, address):
+    if address is None:
+        return False
+    try:
+        address = ipaddress.ip_address(address)
+        return any(
+            address in ipaddress.ip_network(network, strict=False)
+            for network in source.split(',')
+        )
+    except ValueError:
+        return False
+
+
+def _authorized_key(certificate, authority):
+    """
+    What the certificate allows, as an `.AuthorizedKey`: features only
+    with their extension, and the forced command if any.
+    """
+    options = {
+        name: value for name, value in authority.options.items()
+        if name not in ('cert-authority', 'principals')
+    }
+    options['restrict'] = True
+    for extension in certificate.extensions:
+        feature = EXTENSIONS.get(extension)
+        if feature is not None:
+            options[feature] = True
+    command = certificate.critical_options.get('force-command')
+    if command is not None:
+        options['command'] = command
+    return AuthorizedKey(
+        certificate.cert_type,
+        certificate.public_key,
+        certificate.key_id,
+        options
+    )
+
+
+host_certificates = CertificateCache()
+
+
+def check_host_certificate(key, hostname, authorities, now=None):
+    """
+    Check the host certificate of a server.
+
+    :param .PKey key: the server's key, with its certificate
+    :param str hostname: the server, as `.host_name` gives it
+    :param authorities:
+        the `.KnownHost` ``@cert-authority`` entries for ``hostname``
+    :return: why the certificate is refused, or ``None`` if it is good
+    """
+    certificate = host_certificates.verified(key.public_blob.key_blob, now)
+    if certificate is None:
+        return 'malformed or badly signed'
+    ca_type = _Reader(certificate.ca_key).text()
+    if not any(
+        entry.key_type == ca_type and entry.blob == certificate.ca_key
+        for entry in authorities
+    ):
+        return f'signed by an untrusted CA {certificate.ca_fingerprint}'
+    if certificate.critical_options:
+        return 'host certificates take no critical options'
+    # Principals are host names, without the port.
+    name = hostname
+    if name.startswith('[') and ']:' in name:
+        name = name[1:name.index(']:')]
+    return certificate.problem(HOST, (name,), now)
+
+
+_transport_class = None
+
+
+def certificate_transport():
+    """
+    A `.Transport` subclass for clients that asks for host certificates
+    before plain host keys. paramiko offers certificate types after every
+    plain type, so servers that have both never send the certificate.
+    """
+    global _transport_class
+    if _transport_class is None:
+        from paramiko import Transport
+
+        class CertificateTransport(Transport):
+
+            @property
+            def preferred_keys(self):
+                keys = super().preferred_keys
+                return tuple(
+                    sorted(keys, key=lambda name: not name.endswith(
+                        CERT_SUFFIX
+                    ))
+                )
+
+        _transport_class = CertificateTransport
+    return _transport_class
+
+
+class CertifiedHostKey:
+    """
+    A host key with its certificate, for `.Transport.add_server_key`:
+    clients asking for the certificate get it, signed by the key.
+    """
+
+    def __init__(self, key, blob):
+        """
+        :param .PKey key: the private host key
+        :param bytes blob: its certificate
+        """
+        self.key = key
+        self.blob = blob
+        self.name = _Reader(blob).text()
+
+    @classmethod
+    def from_file(cls, key, path):
+        """Pair ``key`` with the certificate in ``path``, a ``.pub``."""
+        with open(path) as f:
+            fields = f.read().split()
+        return cls(key, base64.b64decode(fields[1]))
+
+    def get_name(self):
+        return self.name
+
+    def asbytes(self):
+        return self.blob
+
+    def sign_ssh_data(self, data, algorithm=None):
+        if algorithm is not None and algorithm.endswith(CERT_SUFFIX):
+            algorithm = algorithm[:-len(CERT_SUFFIX)]
+        return self.key.sign_ssh_data(data, algorithm)
+
+    def add_to(self, transport):
+        """Offer the certificate on server ``transport``."""
+        transport.add_server_key(self)
+        if self.name == 'ssh-rsa' + CERT_SUFFIX:
+            # As add_server_key does for plain RSA keys.
+            for name in ('rsa-sha2-256', 'rsa-sha2-512'):
+                transport.server_key_dict[name + CERT_SUFFIX] = self
+
+
+def sign_certificate(
+    ca_key,
+    public_key,
+    key_id,
+    principals,
+    cert_type=USER,
+    valid_after=0,
+    valid_before=FOREVER,
+    critical_options=None,
+    extensions=None,
+    serial=0
+):
+    """
+    Issue a certificate for ``public_key``, signed with ``ca_key``.
+
+    :param .PKey ca_key: the CA's private key
+    :param .PKey public_key: the key to certify
+    :param str key_id: identifies the certificate in logs
+    :param principals: user or host names it is valid for
+    :param int cert_type: `USER` or `HOST`
+    :param int valid_after: seconds since the epoch
+    :param int valid_before: seconds since the epoch
+    :param dict critical_options: name to value, e.g. ``force-command``
+    :param extensions:
+        names of extensions, e.g. ``permit-pty``; for user certificates
+        all of `EXTENSIONS` by default, as with ``ssh-keygen``
+    :return: the certificate `bytes`
+    """
+    if extensions is None:
+        extensions = EXTENSIONS if cert_type == USER else ()
+    key_blob = public_key.asbytes()
+    key_type = _Reader(key_blob).text()
+    data = (
+        _string(key_type.replace('@openssh.com', '') + CERT_SUFFIX)
+        + _string(os.urandom(32))
+        + key_blob[4 + len(key_type):]
+        + _UINT64.pack(serial)
+        + _UINT32.pack(cert_type)
+        + _string(key_id)
+        + _string(b''.join(_string(name) for name in principals))
+        + _UINT64.pack(valid_after)
+        + _UINT64.pack(valid_before)
+        + _string(_pack_options(critical_options or {}))
+        + _string(_pack_options(dict.fromkeys(extensions, '')))
+        + _string(b'')
+        + _string(ca_key.asbytes())
+    )
+    algorithm = 'rsa-sha2-512' if ca_key.get_name() == 'ssh-rsa' else None
+    signature = ca_key.sign_ssh_data(data, algorithm)
+    return data + _string(signature.asbytes())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        'python3 -m ssh.certificates',
+        description='Sign public keys with a CA key, like ssh-keygen -s'
+    )
+    parser.add_argument('public_keys', nargs='+', metavar='PUBLIC_KEY')
+    parser.add_argument('--ca', required=True, help='CA private key')
+    parser.add_argument('--id', required=True, help='key ID')
+    parser.add_argument(
+        '--principals',
+        required=True,
+        help='comma-separated user or host names'
+    )
+    parser.add_argument(
+        '--host',
+        action='store_true',
+        help='issue host certificates'
+    )
+    parser.add_argument(
+        '--valid-for',
+        type=int,
+        help='seconds the certificates are valid for (default: forever)'
+    )
+    parser.add_argument('--serial', type=int, default=0)
+    parser.add_argument(
+        '--force-command',
+        help='the only command user certificates may run'
+    )
+    parser.add_argument(
+        '--source-address',
+        help='comma-separated networks user certificates may be used from'
+    )
+    args = parser.parse_args()
+
+    from paramiko import PKey
+
+    ca_key = PKey.from_path(args.ca)
+    critical_options = {}
+    if args.force_command:
+        critical_options['force-command'] = args.force_command
+    if args.source_address:
+        critical_options['source-address'] = args.source_address
+    now = int(time.time())
+    for path in args.public_keys:
+        with open(path) as f:
+            key_type, key_base64 = f.read().split()[:2]
+        blob = sign_certificate(
+            ca_key,
+            PKey.from_type_string(key_type, base64.b64decode(key_base64)),
+            args.id,
+            args.principals.split(','),
+            cert_type=HOST if args.host else USER,
+            valid_after=now - 60 if args.valid_for else 0,
+            valid_before=now + args.valid_for if args.valid_for else FOREVER,
+            critical_options=critical_options,
+            serial=args.serial
+        )
+        cert_path = path[:-len('.pub')] if path.endswith('.pub') else path
+        cert_path += '-cert.pub'
+        with open(cert_path, 'w') as f:
+            f.write(
+                f'{_Reader(blob).text()} {base64.b64encode(blob).decode()} '
+                f'{args.id}\n'
+            )
+        print(cert_path)
@@ -0,0 +1,278 @@
+"""
+Channel dispatch.
+
+A `ChannelDispatcher` serves every channel a client opens on one
+transport from a single `.EventLoop`, each with its own handler. Handlers
+read at most one chunk per readiness event, so channels on a connection
+take turns and a busy one cannot starve the others.
+
+The default handler, `EchoHandler`, sends a welcome line and echoes
+channel data back. `.SSHServer.channel_handler` chooses the handler for
+each channel.
+
+When the server offers subsystems such as SFTP, or runs commands, a
+session channel may turn into one of them. Clients make their shell,
+exec or subsystem request as soon as the channel is open, so the echo
+handler holds its welcome line back for at most
+`.SSHServer.request_wait` seconds, or until the client makes a request
+or sends data, so that an SFTP or command stream does not start with it.
+A subsystem request hands the channel over to the subsystem's own
+thread, and other requests to the handler `.SSHServer.request_handler`
+returns, if any, even after the welcome was sent.
+
+With a `.Recording` on the session, the dispatcher records channels
+opening and closing, and each handler the data it reads and sends.
+"""
+
+import socket
+
+
+RETRY_DELAY = 0.01
+
+
+class EchoHandler:
+    """Send a welcome line, then echo everything the client sends."""
+
+    def __init__(self, dispatcher, channel):
+        """
+        :param .ChannelDispatcher dispatcher: the dispatcher serving this
+        :param .Channel channel: the channel to serve
+        """
+        self.dispatcher = dispatcher
+        self.channel = channel
+        self.server = dispatcher.server
+        self.loop = dispatcher.loop
+        self.pending = None
+        self.closed = False
+        self.welcomed = False
+        # The request last acted on.
+        self.request = None
+
+    def start(self):
+        self.channel.setblocking(False)
+        if self.server.waits_for_requests:
+            self.loop.register(self.channel, self.on_readable)
+            self.on_request()
+            if not self.closed:
+                self.loop.call_later(self.server.request_wait, self._welcome)
+        else:
+            self._welcome()
+
+    def on_request(self):
+        """
+        Called on the loop thread after the client made a shell, exec or
+        subsystem request on the channel.
+        """
+        if self.closed:
+            return
+        request = self.dispatcher.request(self.channel)
+        if request is None or request is self.request:
+            return
+        self.request = request
+        kind, argument = request
+        if kind == 'subsystem':
+            self._start_subsystem(argument)
+            return
+        handler = self.server.request_handler(
+            self.dispatcher, self.channel, kind, argument
+        )
+        if handler is None:
+            self._welcome()
+        else:
+            self.closed = True
+            self.pending = None
+            self.loop.unregister(self.channel)
+            self.dispatcher.replace(self, handler)
+
+    def _welcome(self):
+        if self.welcomed or self.closed:
+            return
+        self.welcomed = True
+        welcome = f'Connected to SSH server on {self.server.addr}\n'.encode()
+        recording = self.dispatcher.session.recording
+        if recording is not None:
+            recording.output(self.channel.get_id(), welcome)
+        self.send(welcome)
+
+    def _start_subsystem(self, name):
+        """Stop serving the channel and run subsystem ``name`` on it."""
+        channel = self.channel
+        self.closed = True
+        self.pending = None
+        self.loop.unregister(channel)
+        self.dispatcher.discard(self)
+        channel.setblocking(True)
+        transport = channel.get_transport()
+        handler_class, args, kwargs = transport._get_subsystem_handler(name)
+        handler_class(
+            channel, name, transport.server_object, *args, **kwargs
+        ).start()
+
+    def on_readable(self, channel, mask):
+        # A request arrives before the data that follows it.
+        self.on_request()
+        if self.closed:
+            return
+        self._welcome()
+        try:
+            data = channel.recv(self.server.chunk_size)
+        except socket.timeout:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close()
+            return
+        self.dispatcher.session.touch()
+        self.server.metrics.inc('bytes_in', len(data))
+        recording = self.dispatcher.session.recording
+        if recording is not None:
+            recording.echo(channel.get_id(), data)
+        self.send(data)
+
+    def send(self, data):
+        """
+        Send as much of ``data`` as the channel window allows. Whatever is
+        left is retried shortly, and reads from the channel are paused
+        until it has been flushed.
+        """
+        if self.closed:
+            return
+        channel = self.channel
+        view = memoryview(data)
+        while view:
+            try:
+                sent = channel.send(view)
+            except socket.timeout:
+                break
+            except OSError:
+                sent = 0
+            if sent == 0:
+                self.close()
+                return
+            self.server.metrics.inc('bytes_out', sent)
+            view = view[sent:]
+
+        if view:
+            self.pending = view
+            self.loop.unregister(channel)
+            self.loop.call_later(RETRY_DELAY, self._flush)
+        elif not self.loop.is_registered(channel):
+            self.loop.register(channel, self.on_readable)
+
+    def _flush(self):
+        pending, self.pending = self.pending, None
+        if pending is not None:
+            self.send(pending)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.pending = None
+        self.loop.unregister(self.channel)
+        self.channel.close()
+        self.dispatcher.discard(self)
+
+
+class ChannelDispatcher:
+
+    def __init__(self, server, session, loop, on_close=None):
+        """
+        :param .SSHServer server: the server the channels belong to
+        :param .Session session: the session whose channels are served
+        :param .EventLoop loop: the loop to serve them from
+        :param on_close:
+            called with no arguments on the loop thread once the transport
+            has closed and every channel has been closed
+        """
+        self.server = server
+        self.session = session
+        self.loop = loop
+        self.on_close = on_close
+        self.handlers = {}
+        self.closed = False
+
+    def __len__(self):
+        return len(self.handlers)
+
+    def attach(self, transport):
+        """
+        Dispatch every channel the client opens on ``transport`` from now
+        on, including any already waiting to be accepted. Call on the loop
+        thread, or before the loop runs.
+        """
+        call_soon = self.loop.call_soon
+        transport.on_channel = lambda channel: call_soon(self.add, channel)
+        transport.on_request = (
+            lambda channel: call_soon(self.request_made, channel)
+        )
+        transport.on_close = lambda: call_soon(self.close)
+        # Requests made before the callback was set.
+        for channel in list(self.handlers):
+            self.request_made(channel)
+        while True:
+            channel = transport.accept(0)
+            if channel is None:
+                break
+            self.add(channel)
+        if not transport.is_active():
+            call_soon(self.close)
+
+    def add(self, channel):
+        """Start serving ``channel`` with a new handler."""
+        if self.closed:
+            channel.close()
+            return
+        handler = self.server.channel_handler(self, channel)
+        self.handlers[channel] = handler
+        self.server.metrics.gauge('active_channels', 1)
+        recording = self.session.recording
+        if recording is not None:
+            recording.event(
+                'open',
+                channel.get_id(),
+                handler=type(handler).__name__
+            )
+        handler.start()
+
+    def request(self, channel):
+        """
+        The ``(kind, argument)`` of the shell, exec or subsystem request on
+        ``channel``, or ``None``, see `.SSHServerInterface.channel_request`.
+        """
+        interface = self.session.transport.server_object
+        return interface.channel_request(channel.get_id())
+
+    def request_made(self, channel):
+        """Tell ``channel``'s handler, if it cares, about a new request."""
+        handler = self.handlers.get(channel)
+        on_request = getattr(handler, 'on_request', None)
+        if on_request is not None:
+            on_request()
+
+    def replace(self, handler, new_handler):
+        """Serve ``handler``'s channel with ``new_handler`` from now on."""
+        self.handlers[handler.channel] = new_handler
+        new_handler.start()
+
+    def discard(self, handler):
+        """Forget a handler whose channel has closed or been handed over."""
+        if self.handlers.pop(handler.channel, None) is not None:
+            self.server.metrics.gauge('active_channels', -1)
+            recording = self.session.recording
+            if recording is not None:
+                recording.event('close', handler.channel.get_id())
+            interface = self.session.transport.server_object
+            interface.requests.pop(handler.channel.get_id(), None)
+
+    def close(self):
+        """Close every channel and the transport. Safe to call again."""
+        if self.closed:
+            return
+        self.closed = True
+        for handler in list(self.handlers.values()):
+            handler.close()
+        self.session.close()
+        if self.on_close is not None:
+            self.on_close()
@@ -1,45 +1,218 @@
-"""SSH Client."""
+"""
+SSH Client.
+
+paramiko is imported when the first `SSHClient` is created, and keys are
+loaded once per process through `.keys`, so short-lived client processes
+start quickly. The command line also imports paramiko without the
+``invoke`` package, see `_import_paramiko_without_invoke`.
+
+With ``keepalive_interval`` the connection is probed like OpenSSH's
+``ServerAliveInterval``, and closed once the server has been silent for
+``keepalive_count_max`` intervals, see `.Keepalive`. With
+``idle_timeout`` it is closed once no channel has been open for that
+long. Both run on the process-wide timer wheel, not a thread per client.
+
+Servers are checked against ``keys/client/known_hosts`` with a
+`.HostKeyPolicy`: by default an unknown server's key is trusted and
+recorded on first use, and a server whose key changed is refused. A
+server with a host certificate from a ``@cert-authority`` listed for it
+needs no entry of its own. The client authenticates with the
+certificate ``keys/client/id_ecdsa-cert.pub`` if there is one.
+"""
 
 import argparse
+import importlib
+import logging
 import os
+import socket
+import sys
+import time
 
-import paramiko
-from paramiko import SSHClient as Client
-from paramiko.ssh_exception import NoValidConnectionsError
+from .keys import known_hosts, private_key
+from .known_hosts import ACCEPT_NEW, POLICIES, HostKeyPolicy, host_name
+from .log import configure_logging
+from .pipeline import CHUNK_SIZE, WINDOW, LineFramer, pipelined
+from .profiles import DEFAULT_PROFILE, PROFILES, get_profile
 
 
+logger = logging.getLogger('ssh')
+
 KEY_DIR = 'keys/client'
+# Idle connections are checked this many times per ``idle_timeout``.
+IDLE_CHECKS = 4
+
+
+def _import_paramiko_without_invoke():
+    """
+    Import paramiko without ``invoke``, which it imports up front but only
+    needs to run ``Match exec`` lines of ssh_config files. That is about
+    half of paramiko's import time. paramiko then takes ``invoke`` to be
+    missing for the rest of the process, so only a process that uses
+    paramiko for nothing else should call this, as the command line does.
+    """
+    if 'paramiko' in sys.modules or 'invoke' in sys.modules:
+        return
+    sys.modules['invoke'] = None
+    try:
+        importlib.import_module('paramiko')
+    finally:
+        if sys.modules.get('invoke', 0) is None:
+            del sys.modules['invoke']
+
+
+def _read_line(channel):
+    """
+    Read the server's welcome line, a byte at a time so that none of the
+    replies after it are taken.
+    """
+    line = bytearray()
+    while not line.endswith(b'\n'):
+        data = channel.recv(1)
+        if not data:
+            raise EOFError('Channel closed before the welcome line')
+        line += data
+    return bytes(line)
+
 
 class SSHClient:
 
-    def __init__(self, remote, port, username='user'):
+    def __init__(
+        self,
+        remote,
+        port,
+        username='user',
+        profile=None,
+        keepalive_interval=None,
+        keepalive_count_max=None,
+        idle_timeout=None,
+        known_hosts_path=None,
+        host_key_policy=ACCEPT_NEW
+    ):
+        """
+        :param profile:
+            a `.SecurityProfile`, or the name of one, for the algorithms
+            offered to the server
+        :param float keepalive_interval:
+            send a keepalive after this many seconds without sending
+            anything, or ``None`` for no keepalives
+        :param int keepalive_count_max:
+            close the connection once the server has been silent for this
+            many keepalive intervals; defaults to 3
+        :param float idle_timeout:
+            close the connection after this many seconds without an open
+            channel, or ``None`` to keep it open
+        :param str known_hosts_path:
+            host keys file, defaults to ``keys/client/known_hosts``
+        :param str host_key_policy:
+            ``"yes"``, ``"accept-new"`` or ``"no"``, see `.HostKeyPolicy`
+        """
         self.remote = remote
         self.port = port
         self.username = username
+        self.profile = get_profile(profile)
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count_max = keepalive_count_max
+        self.idle_timeout = idle_timeout
+        self._idle_since = None
+        from paramiko import SSHClient as Client
+
         self.ssh = Client()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self.transport = None
-        
-        key_path = os.path.join(KEY_DIR, 'id_ecdsa')
-        with open(key_path, 'r') as f:
-            key = f.read()
-        print(key)
-        self.private_key = paramiko.ECDSAKey.from_private_key_file(key_path)
-        self.ssh.load_host_keys(os.path.join(KEY_DIR, 'known_hosts'))
+
+        self.private_key = private_key(os.path.join(KEY_DIR, 'id_ecdsa'))
+        # Checked as load_system_host_keys would, against the store every
+        # client in the process shares. New keys are added by the policy,
+        # never by save_host_keys rewriting the file.
+        self.known_hosts = known_hosts(
+            known_hosts_path or os.path.join(KEY_DIR, 'known_hosts')
+        )
+        self.ssh._system_host_keys = self.known_hosts
+        self.ssh.set_missing_host_key_policy(
+            HostKeyPolicy(self.known_hosts, host_key_policy)
+        )
+
+    def connect(self):
+        """Connect and authenticate to the SSH server."""
+        self.ssh.connect(
+            hostname=self.remote,
+            port=self.port, 
+            username=self.username,
+            pkey=self.private_key,
+            transport_factory=self._transport
+        )
+        self.transport = self.ssh.get_transport()
+        if self.keepalive_interval or self.idle_timeout:
+            from .keepalive import COUNT_MAX, Keepalive, shared_wheel
+
+            wheel = shared_wheel()
+        if self.keepalive_interval:
+            Keepalive(
+                self.keepalive_interval,
+                self.keepalive_count_max or COUNT_MAX,
+                wheel=wheel
+            ).watch(self.transport, self._server_dead, self.transport)
+        if self.idle_timeout:
+            self._idle_since = None
+            wheel.schedule(
+                self.idle_timeout / IDLE_CHECKS,
+                self._idle_check,
+                wheel,
+                self.transport
+            )
+
+    def _server_dead(self, transport):
+        logger.info(
+            'No reply from %s:%d, closing the connection',
+            self.remote,
+            self.port
+        )
+        transport.close()
+
+    def _idle_check(self, wheel, transport):
+        if not transport.is_active():
+            return
+        now = time.monotonic()
+        if transport._channels.values():
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = now
+        elif now - self._idle_since >= self.idle_timeout:
+            logger.info(
+                'Closing the connection to %s:%d, idle for %.0f seconds',
+                self.remote,
+                self.port,
+                now - self._idle_since
+            )
+            transport.close()
+            return
+        wheel.schedule(
+            self.idle_timeout / IDLE_CHECKS,
+            self._idle_check,
+            wheel,
+            transport
+        )
+
+    def _transport(self, sock, **kwargs):
+        # Without this the key exchange can stall on delayed ACKs.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport_class = None
+        if self.known_hosts.authorities(host_name(self.remote, self.port)):
+            from .certificates import certificate_transport
+
+            transport_class = certificate_transport()
+        return self.profile.transport(
+            sock, transport_class=transport_class, **kwargs
+        )
 
     def start(self):
         """Connect to the SSH server."""
+        from paramiko.ssh_exception import NoValidConnectionsError
+
         try:
-            self.ssh.connect(
-                hostname=self.remote,
-                port=self.port, 
-                username=self.username,
-                pkey=self.private_key
-            )
+            self.connect()
         except NoValidConnectionsError:
             print('Failed to connect')
             return
-        self.transport = self.ssh.get_transport() 
         channel = self.transport.open_session()
 
         recv = channel.recv(1024)
@@ -51,8 +224,46 @@ class SSHClient:
             print(recv.decode('utf-8'))
 
     def open_session(self):
-        """Open a new session on the transport."""
-        transport.open_session()
+        """
+        Open a new session on the transport. For many short sessions use
+        `.ConnectionPool`, which shares transports between jobs.
+        """
+        return self.transport.open_session()
+
+    def pipeline(self, payloads, framer=None, window=WINDOW):
+        """
+        Send each payload on a new session with up to ``window`` awaiting
+        a reply, and yield the replies in order; see `.pipelined`.
+
+        :param payloads: an iterable of `bytes`
+        :param framer: a `.LineFramer` (the default) or `.LengthFramer`
+        """
+        framer = framer or LineFramer()
+        payloads = iter(payloads)
+        first = next(payloads, None)
+        if first is None:
+            return
+        if self.transport is None:
+            self.connect()
+        channel = self.open_session()
+        try:
+            # A server that also runs commands or subsystems holds its
+            # welcome line back for a moment, in case the session becomes
+            # one of them, or until the session's first data; it comes
+            # before the first reply either way.
+            channel.sendall(framer.encode(first))
+            _read_line(channel)
+            decoder = framer.decoder()
+            replies = []
+            while not replies:
+                data = channel.recv(CHUNK_SIZE)
+                if not data:
+                    raise EOFError('Channel closed before the first reply')
+                replies = decoder.feed(data)
+            yield from replies
+            yield from pipelined(channel, payloads, framer, window)
+        finally:
+            channel.close()
 
             
 if __name__ == '__main__':
@@ -70,6 +281,64 @@ if __name__ == '__main__':
         type=int,
         default=2222
     )
+    parser.add_argument(
+        '--profile',
+        choices=sorted(PROFILES),
+        default=DEFAULT_PROFILE,
+        help='ciphers, key exchanges, MACs and host key types to offer'
+    )
+    parser.add_argument(
+        '--keepalive-interval',
+        type=float,
+        help='probe the server after this many seconds without sending'
+    )
+    parser.add_argument(
+        '--keepalive-count-max',
+        type=int,
+        help='give up on a server silent for this many intervals'
+    )
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        help='close the connection after this long without a channel'
+    )
+    parser.add_argument(
+        '--strict-host-key-checking',
+        choices=POLICIES,
+        default=ACCEPT_NEW,
+        help='refuse, trust on first use, or accept unknown servers'
+    )
+    parser.add_argument(
+        '-b',
+        '--batch',
+        metavar='FILE',
+        help='send each line of FILE (- for stdin) pipelined, print replies'
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=WINDOW,
+        help='lines in flight at once with --batch'
+    )
     args = parser.parse_args()
-    client = SSHClient(args.address, args.port)
-    client.start()
+    configure_logging()
+    _import_paramiko_without_invoke()
+    client = SSHClient(
+        args.address,
+        args.port,
+        profile=args.profile,
+        keepalive_interval=args.keepalive_interval,
+        keepalive_count_max=args.keepalive_count_max,
+        idle_timeout=args.idle_timeout,
+        host_key_policy=args.strict_host_key_checking
+    )
+    if args.batch:
+        source = (
+            sys.stdin.buffer if args.batch == '-' else open(args.batch, 'rb')
+        )
+        with source:
+            lines = (line.rstrip(b'\n') for line in source)
+            for reply in client.pipeline(lines, window=args.window):
+                sys.stdout.buffer.write(reply + b'\n')
+    else:
+        client.start()
@@ -0,0 +1,521 @@
+"""
+Exec and shell requests.
+
+With ``--exec``, ``ssh user@host cmd`` runs ``cmd`` with ``/bin/sh -c``
+and a shell request runs ``--shell``, as the server's own user. A
+`ProcessPool` bounds the processes running at once, overall and per SSH
+user; requests beyond the limits wait their turn, up to ``max_queued``
+of them. Processes are spawned and reaped on the pool's worker threads,
+so an event loop never waits for ``fork`` or ``wait``.
+
+A `ProcessHandler` streams the process's stdout and stderr into the
+channel as data arrives, and channel data into its stdin, on the
+connection's `.EventLoop`. As with `.RelayHandler`, a full SSH window
+pauses reads from the pipes and a full stdin pipe pauses reads from the
+channel. Once the process has exited and its output has been sent, its
+exit status is sent and the channel closed. If the channel or the
+connection closes first, the process group is sent ``SIGTERM``, and
+``SIGKILL`` after ``KILL_GRACE`` seconds.
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .loop import EVENT_READ, EVENT_WRITE
+
+
+SHELL = '/bin/sh'
+MAX_PROCESSES = 64
+MAX_QUEUED = 1024
+SPAWN_WORKERS = 4
+CHUNK_SIZE = 64 * 1024
+RETRY_DELAY = 0.01
+KILL_GRACE = 2.0
+# Longest wait between checks for a closed channel after the client's EOF.
+CLOSE_CHECK = 1.0
+# How often to poll for exit without `os.pidfd_open`.
+EXIT_POLL = 0.01
+
+
+class _Ticket:
+
+    __slots__ = ('user', 'start')
+
+    def __init__(self, user, start):
+        self.user = user
+        self.start = start
+
+
+class ProcessPool:
+    """
+    Run at most ``max_processes`` processes, and ``max_per_user`` for
+    one SSH user, queueing requests beyond that.
+    """
+
+    def __init__(
+        self,
+        max_processes=MAX_PROCESSES,
+        max_per_user=None,
+        max_queued=MAX_QUEUED,
+        spawn_workers=SPAWN_WORKERS,
+        metrics=None
+    ):
+        self.max_processes = max_processes
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self.metrics = metrics
+        self.running = 0
+        self._per_user = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=spawn_workers,
+            thread_name_prefix='ssh-spawn'
+        )
+
+    def submit(self, user, start):
+        """
+        Call ``start()`` on a worker thread once ``user`` may run another
+        process. Every started process must be passed to `reap`, or its
+        slot given back with `release`.
+
+        :return: a ticket for `cancel`, or ``None`` if the queue is full
+        """
+        ticket = _Ticket(user, start)
+        with self._lock:
+            # `release` starts every waiting request that may run, so one
+            # that may run now is not jumping ahead of any.
+            if self._allowed(user):
+                self._take(user)
+            elif len(self._queue) >= self.max_queued:
+                self._count('execs_rejected')
+                return None
+            else:
+                self._queue.append(ticket)
+                return ticket
+        self._executor.submit(start)
+        return ticket
+
+    def cancel(self, ticket):
+        """
+        Forget a ticket that has not started yet.
+
+        :return: ``True`` if it was still waiting
+        """
+        with self._lock:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                return False
+        return True
+
+    def release(self, user):
+        """Give back ``user``'s slot and start whoever may run next."""
+        with self._lock:
+            self.running -= 1
+            count = self._per_user[user] - 1
+            if count:
+                self._per_user[user] = count
+            else:
+                del self._per_user[user]
+            if self.metrics is not None:
+                self.metrics.gauge('active_processes', -1)
+            ready = []
+            for ticket in list(self._queue):
+                if not self._allowed(ticket.user):
+                    if self.running >= self.max_processes:
+                        break
+                    continue
+                self._queue.remove(ticket)
+                self._take(ticket.user)
+                ready.append(ticket)
+        for ticket in ready:
+            self._executor.submit(ticket.start)
+
+    def reap(self, proc, user):
+        """
+        Stop ``proc``'s process group if it is still running, wait for it
+        on a worker thread and release its slot.
+        """
+        self._executor.submit(self._reap, proc, user)
+
+    def _reap(self, proc, user):
+        try:
+            if proc.poll() is None:
+                _signal_group(proc, signal.SIGTERM)
+                try:
+                    proc.wait(KILL_GRACE)
+                except subprocess.TimeoutExpired:
+                    _signal_group(proc, signal.SIGKILL)
+                    proc.wait()
+        finally:
+            self.release(user)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _allowed(self, user):
+        return self.running < self.max_processes and (
+            self.max_per_user is None
+            or self._per_user.get(user, 0) < self.max_per_user
+        )
+
+    def _take(self, user):
+        self.running += 1
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+        if self.metrics is not None:
+            self.metrics.gauge('active_processes', 1)
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.inc(name)
+
+
+def _signal_group(proc, signum):
+    try:
+        os.killpg(proc.pid, signum)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def exit_code(returncode):
+    """The SSH exit status for a `subprocess` return code."""
+    return 128 - returncode if returncode < 0 else returncode
+
+
+class ProcessHandler:
+    """Run a command or shell for a channel and stream its I/O."""
+
+    def __init__(self, dispatcher, channel, pool, command=None, shell=SHELL):
+        """
+        :param .ChannelDispatcher dispatcher: the dispatcher serving this
+        :param .Channel channel: the channel the request was made on
+        :param .ProcessPool pool: the pool to run the process through
+        :param str command:
+            the command to run with ``/bin/sh -c``, or ``None`` for a shell
+        :param str shell: the program to run for a shell request
+        """
+        self.dispatcher = dispatcher
+        self.channel = channel
+        self.pool = pool
+        self.command = command
+        self.shell = shell
+        self.server = dispatcher.server
+        self.loop = dispatcher.loop
+        self.transport = channel.get_transport()
+        self.user = self.transport.get_username() or ''
+        self.buffer = bytearray(CHUNK_SIZE)
+        self.ticket = None
+        self.proc = None
+        self.pidfd = None
+        self.returncode = None
+        # Output read but not yet sent: ``(send method, view)``.
+        self.to_channel = None
+        # Channel data not yet written to stdin.
+        self.to_stdin = None
+        self.open_outputs = 0
+        self.channel_eof = False
+        self.closed = False
+        self.requested_at = time.monotonic()
+
+    def start(self):
+        self.channel.setblocking(False)
+        self.ticket = self.pool.submit(self.user, self._spawn)
+        if self.ticket is None:
+            self._refuse('Too many processes, try again later\n')
+
+    def _spawn(self):
+        """Run on a pool worker: start the process."""
+        try:
+            proc = subprocess.Popen(
+                self._argv(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=self._environment(),
+                start_new_session=True
+            )
+        except OSError as exc:
+            self.pool.release(self.user)
+            self.loop.call_soon(self._refuse, f'{exc}\n')
+            return
+        self.loop.call_soon(self._started, proc)
+
+    def _argv(self):
+        forced = self._forced_command()
+        if forced is not None:
+            return [SHELL, '-c', forced]
+        if self.command is None:
+            return [self.shell]
+        return [SHELL, '-c', self.command]
+
+    def _forced_command(self):
+        entry = getattr(self.transport.server_object, 'authorized_key', None)
+        return entry.options.get('command') if entry is not None else None
+
+    def _environment(self):
+        env = {
+            'PATH': os.environ.get('PATH', os.defpath),
+            'USER': self.user,
+            'LOGNAME': self.user,
+            'SHELL': self.shell,
+        }
+        for name in ('HOME', 'LANG', 'TZ'):
+            if name in os.environ:
+                env[name] = os.environ[name]
+        peer = self.transport.getpeername()
+        local = self.transport.sock.getsockname()
+        env['SSH_CLIENT'] = f'{peer[0]} {peer[1]} {local[1]}'
+        if self.command is not None and self._forced_command() is not None:
+            env['SSH_ORIGINAL_COMMAND'] = self.command
+        return env
+
+    def _refuse(self, message):
+        if self.closed:
+            return
+        try:
+            self.channel.send_stderr(message.encode())
+            self.channel.send_exit_status(1)
+        except OSError:
+            pass
+        self.close()
+
+    def _started(self, proc):
+        self.proc = proc
+        if self.closed:
+            self.pool.reap(proc, self.user)
+            return
+        self.server.metrics.inc('execs')
+        self.server.metrics.observe(
+            'exec_start', time.monotonic() - self.requested_at
+        )
+        recording = self.dispatcher.session.recording
+        if recording is not None:
+            recording.event(
+                'process',
+                self.channel.get_id(),
+                argv=proc.args,
+                pid=proc.pid
+            )
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            os.set_blocking(pipe.fileno(), False)
+        self.open_outputs = 2
+        self.loop.register(proc.stdout, self._on_output)
+        self.loop.register(proc.stderr, self._on_output)
+        self.loop.register(self.channel, self._on_channel)
+        try:
+            self.pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            self.loop.call_later(EXIT_POLL, self._poll_exit)
+        else:
+            self.loop.register(self.pidfd, self._on_exit)
+
+    def _on_output(self, pipe, mask):
+        try:
+            size = os.readv(pipe.fileno(), [self.buffer])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            size = 0
+        if not size:
+            self.loop.unregister(pipe)
+            pipe.close()
+            self.open_outputs -= 1
+            self._finish_if_done()
+            return
+        self.dispatcher.session.touch()
+        data = memoryview(self.buffer)[:size]
+        recording = self.dispatcher.session.recording
+        if pipe is self.proc.stdout:
+            send = self.channel.send
+            if recording is not None:
+                recording.output(self.channel.get_id(), data)
+        else:
+            send = self.channel.send_stderr
+            if recording is not None:
+                recording.stderr(self.channel.get_id(), data)
+        self._send(send, data)
+
+    def _send(self, send, view):
+        """
+        Send ``view`` with ``send``. Whatever the SSH window does not take
+        is retried shortly, with reads from both pipes paused meanwhile,
+        as they share one buffer.
+        """
+        while view:
+            try:
+                sent = send(view)
+            except socket.timeout:
+                break
+            except OSError:
+                sent = 0
+            if sent == 0:
+                self.close()
+                return
+            self.server.metrics.inc('bytes_out', sent)
+            view = view[sent:]
+        if view:
+            self.to_channel = (send, view)
+            self._pause_outputs(True)
+            self.loop.call_later(RETRY_DELAY, self._flush_channel)
+        elif self.to_channel is not None:
+            self.to_channel = None
+            self._pause_outputs(False)
+
+    def _flush_channel(self):
+        if self.closed or self.to_channel is None:
+            return
+        self._send(*self.to_channel)
+        self._finish_if_done()
+
+    def _pause_outputs(self, paused):
+        for pipe in (self.proc.stdout, self.proc.stderr):
+            if pipe.closed:
+                continue
+            if paused:
+                self.loop.unregister(pipe)
+            elif not self.loop.is_registered(pipe):
+                self.loop.register(pipe, self._on_output)
+
+    def _on_channel(self, channel, mask):
+        try:
+            data = channel.recv(CHUNK_SIZE)
+        except socket.timeout:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            if channel.closed:
+                self.close()
+                return
+            self.channel_eof = True
+            self.loop.unregister(channel)
+            if self.to_stdin is None:
+                self._close_stdin()
+            self.loop.call_later(RETRY_DELAY, self._check_closed, RETRY_DELAY)
+            return
+        self.dispatcher.session.touch()
+        self.server.metrics.inc('bytes_in', len(data))
+        recording = self.dispatcher.session.recording
+        if recording is not None:
+            recording.input(channel.get_id(), data)
+        self._write_stdin(memoryview(data))
+
+    def _write_stdin(self, view):
+        stdin = self.proc.stdin
+        try:
+            written = os.write(stdin.fileno(), view)
+        except (BlockingIOError, InterruptedError):
+            written = 0
+        except OSError:
+            # The process closed its stdin; drop what the client sends.
+            written = len(view)
+        if written < len(view):
+            self.to_stdin = view[written:]
+            self.loop.unregister(self.channel)
+            if not self.loop.is_registered(stdin):
+                self.loop.register(stdin, self._on_stdin, EVENT_WRITE)
+            return
+        self.to_stdin = None
+        self.loop.unregister(stdin)
+        if self.channel_eof:
+            self._close_stdin()
+        elif not self.loop.is_registered(self.channel):
+            self.loop.register(self.channel, self._on_channel, EVENT_READ)
+
+    def _on_stdin(self, stdin, mask):
+        pending, self.to_stdin = self.to_stdin, None
+        if pending is not None:
+            self._write_stdin(pending)
+
+    def _close_stdin(self):
+        stdin = self.proc.stdin
+        if not stdin.closed:
+            self.loop.unregister(stdin)
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _check_closed(self, delay):
+        """
+        Stop the process if the client closed the channel. Clients often
+        close right after EOF, so checks start soon and back off.
+        """
+        if self.closed or self.returncode is not None:
+            return
+        if self.channel.closed:
+            self.close()
+        else:
+            delay = min(delay * 2, CLOSE_CHECK)
+            self.loop.call_later(delay, self._check_closed, delay)
+
+    def _on_exit(self, pidfd, mask):
+        self.loop.unregister(pidfd)
+        os.close(pidfd)
+        self.pidfd = None
+        self._exited(self.proc.wait())
+
+    def _poll_exit(self):
+        if self.closed:
+            return
+        returncode = self.proc.poll()
+        if returncode is None:
+            self.loop.call_later(EXIT_POLL, self._poll_exit)
+        else:
+            self._exited(returncode)
+
+    def _exited(self, returncode):
+        self.returncode = returncode
+        self.pool.release(self.user)
+        self._finish_if_done()
+
+    def _finish_if_done(self):
+        """Send the exit status once the process is done and flushed."""
+        if (
+            self.closed
+            or self.returncode is None
+            or self.open_outputs
+            or self.to_channel is not None
+        ):
+            return
+        status = exit_code(self.returncode)
+        recording = self.dispatcher.session.recording
+        if recording is not None:
+            recording.event('exit', self.channel.get_id(), status=status)
+        try:
+            self.channel.send_exit_status(status)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.to_channel = self.to_stdin = None
+        self.loop.unregister(self.channel)
+        if self.ticket is not None and self.proc is None:
+            self.pool.cancel(self.ticket)
+        proc = self.proc
+        if proc is not None:
+            for pipe in (proc.stdin, proc.stdout, proc.stderr):
+                self.loop.unregister(pipe)
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+            if self.pidfd is not None:
+                self.loop.unregister(self.pidfd)
+                os.close(self.pidfd)
+                self.pidfd = None
+            if self.returncode is None:
+                self.pool.reap(proc, self.user)
+        self.channel.close()
+        self.dispatcher.discard(self)
@@ -3,15 +3,25 @@ from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives import serialization
 
 
-def create_ecdsa() -> (bytes, bytes):
+CURVES = {
+    'nistp256': ec.SECP256R1,
+    'nistp384': ec.SECP384R1,
+    'nistp521': ec.SECP521R1,
+}
+
+
+def create_ecdsa(curve='nistp521') -> (bytes, bytes):
     """
     Generate an ECDSA key.
 
-    :return: a tuple containing the public and private key bytes.
+    :param str curve: ``"nistp256"``, ``"nistp384"`` or ``"nistp521"``
+    :return:
+        a tuple containing the private and public key bytes, in OpenSSH
+        format.
     :rtype: tuple
     """
-    private_key = ec.generate_private_key(ec.SECP521R1())
-    private_key_bytes = private_key.private_bytes()
+    private_key = ec.generate_private_key(CURVES[curve]())
+    private_key_bytes = private_key.private_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PrivateFormat.OpenSSH,
         encryption_algorithm=serialization.NoEncryption()
@@ -23,13 +33,3 @@ def create_ecdsa() -> (bytes, bytes):
         format=serialization.PublicFormat.OpenSSH
     )
     return (private_key_bytes, public_key_bytes)
-
-
-# with open('id_ecdsa_521.pub', 'wb') as f:
-#    f.write(public_key_bytes)
-
-# with open('id_ecdsa_521', 'wb') as f:
-#    f.write(private_key_bytes)
-
-
-
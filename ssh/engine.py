@@ -0,0 +1,154 @@
+"""
+Event-loop server engine.
+
+The default engine in `.SSHServer` runs one thread per accepted socket.
+`EventEngine` instead accepts connections and serves channel I/O from a
+single `.EventLoop`, and pushes the blocking parts of a session (key
+exchange, authentication and the wait for the first channel) onto a
+bounded pool of worker threads. The channels of every connection are
+dispatched from that one loop, see `.ChannelDispatcher`.
+
+Packets are still read, decrypted and written by paramiko: every
+connection keeps its own `paramiko.Transport` thread, so the engine
+saves the per-session handler threads but not those. A worker is held
+for the whole handshake, up to `.SSHServer.channel_wait` seconds for a
+client that is slow or idle before opening a channel, so ``pool_size``
+such clients exhaust the pool and later connections queue behind them.
+``--channel-wait`` shortens the hold, and ``--max-handshakes`` refuses
+connections beyond that many unauthenticated ones.
+
+Select it with ``python3 -m ssh.server --engine event``.
+
+`EventEngine.drain` stops accepting and stops the loop once the open
+sessions have ended, for `.SSHServer.drain`.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .channels import ChannelDispatcher
+from .log import connection_logger
+from .loop import EventLoop
+
+
+logger = logging.getLogger('ssh')
+
+POOL_SIZE = 32
+MAX_PENDING = 1024
+
+
+class EventEngine:
+
+    def __init__(self, server, pool_size=POOL_SIZE, max_pending=MAX_PENDING):
+        """
+        :param .SSHServer server: the server whose sessions are served
+        :param int pool_size: number of threads running handshakes
+        :param int max_pending:
+            maximum number of accepted connections waiting for a worker;
+            connections beyond this are closed immediately
+        """
+        self.server = server
+        self.loop = EventLoop()
+        self.pool = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix='ssh-handshake'
+        )
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._dispatchers = set()
+        self._listen_socket = None
+        self.draining = False
+
+    def serve(self, listen_socket):
+        """
+        Serve connections from ``listen_socket`` until interrupted or
+        drained.
+        """
+        listen_socket.setblocking(False)
+        self._listen_socket = listen_socket
+        self.loop.register(listen_socket, self._on_accept)
+        try:
+            self.loop.run()
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            for dispatcher in list(self._dispatchers):
+                dispatcher.close()
+
+    def drain(self, timeout=None):
+        """
+        Stop accepting connections, and stop serving once every session
+        has ended or after ``timeout`` seconds. Safe to call from any
+        thread.
+        """
+        self.loop.call_soon(self._drain, timeout)
+
+    def _drain(self, timeout):
+        self.draining = True
+        if self._listen_socket is not None:
+            self.loop.unregister(self._listen_socket)
+            self._listen_socket.close()
+        if timeout is not None:
+            self.loop.call_later(timeout, self.loop.stop)
+        self._check_drained()
+
+    def _check_drained(self):
+        if self.draining and not len(self.server.sessions):
+            self.loop.stop()
+
+    def _on_accept(self, listen_socket, mask):
+        while True:
+            try:
+                client_socket, addr = listen_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                logger.info('Accept failed: %r', exc)
+                return
+            accepted_at = time.monotonic()
+            client_socket.setblocking(True)
+            log = connection_logger(addr)
+            log.info('Connection from %r', addr)
+            self.server.count('connections')
+            session = self.server.admit(client_socket, addr)
+            if session is None:
+                continue
+            if not self._pending.acquire(blocking=False):
+                log.info('Handshake queue full, dropping %r', addr)
+                self.server.finish(session)
+                continue
+            self.pool.submit(self._handshake, session, accepted_at)
+
+    def _handshake(self, session, accepted_at):
+        """Run on a worker thread: negotiate, then hand off to the loop."""
+        self.server.metrics.observe('accept', time.monotonic() - accepted_at)
+        try:
+            channels = self.server.negotiate(session)
+        except Exception as exc:
+            connection_logger(session.addr).info('%r', exc)
+            channels = None
+        finally:
+            self._pending.release()
+
+        if channels is None:
+            self.server.finish(session)
+            self._check_drained()
+            return
+        self.loop.call_soon(self._attach, channels, session)
+
+    def _attach(self, channels, session):
+        dispatcher = ChannelDispatcher(
+            self.server,
+            session,
+            self.loop,
+            lambda: self._closed(dispatcher)
+        )
+        self._dispatchers.add(dispatcher)
+        for channel in channels:
+            dispatcher.add(channel)
+        dispatcher.attach(session.transport)
+
+    def _closed(self, dispatcher):
+        self._dispatchers.discard(dispatcher)
+        self.server.finish(dispatcher.session)
+        self._check_drained()
@@ -0,0 +1,362 @@
+"""
+Run the same payload or command on many hosts at once.
+
+`fan_out` connects to every host with at most ``concurrency`` hosts in
+flight, sends the payload (or runs the command) on a new channel and
+passes output to ``on_output(host, data)`` as it arrives. Each host gets
+``timeout`` seconds per attempt and ``retries`` further attempts if it
+fails to connect, authenticate or open a channel. Once the payload or
+command has been sent, a failure is reported instead of retried, so that
+nothing runs twice. A `Result` is returned for every host, in the order
+given.
+
+From the command line::
+
+    python3 -m ssh.fanout -H hosts.txt --payload 'hello' --concurrency 64
+
+prints each host's output line by line, prefixed with the host, and a
+summary at the end (``--json`` prints the results as JSON instead).
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from paramiko.ssh_exception import SSHException
+
+from .log import configure_logging
+from .pool import ConnectionPool
+
+
+PORT = 2222
+CONCURRENCY = 32
+TIMEOUT = 30.0
+RETRIES = 1
+RETRY_DELAY = 0.5
+CHUNK_SIZE = 32 * 1024
+
+
+class Result:
+
+    __slots__ = (
+        'host',
+        'port',
+        'status',
+        'attempts',
+        'elapsed',
+        'bytes',
+        'exit_status',
+        'error',
+        'output',
+    )
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        # ``ok``, ``timeout`` or ``error``.
+        self.status = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.bytes = 0
+        self.exit_status = None
+        self.error = None
+        # The output, if it was collected.
+        self.output = None
+
+    def __repr__(self):
+        return f'<Result {self.host}:{self.port} {self.status}>'
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    def as_dict(self):
+        result = {
+            name: getattr(self, name) for name in self.__slots__
+            if name != 'output'
+        }
+        if self.output is not None:
+            result['output'] = self.output.decode('utf-8', 'replace')
+        return result
+
+
+def parse_host(host, default_port=PORT):
+    """Split ``"host"``, ``"host:port"`` or ``"[v6]:port"`` into a tuple."""
+    if isinstance(host, tuple):
+        return host
+    if host.startswith('['):
+        address, _, port = host[1:].partition(']:')
+        return address.rstrip(']'), int(port) if port else default_port
+    address, sep, port = host.rpartition(':')
+    if sep and ':' not in address:
+        return address, int(port)
+    return host, default_port
+
+
+def fan_out(
+    hosts,
+    payload=b'',
+    command=None,
+    username='user',
+    concurrency=CONCURRENCY,
+    timeout=TIMEOUT,
+    retries=RETRIES,
+    on_output=None,
+    on_result=None,
+    collect=False,
+    pool=None
+):
+    """
+    Run ``payload`` or ``command`` on every host in ``hosts``.
+
+    :param hosts: ``"host[:port]"`` strings or ``(host, port)`` tuples
+    :param bytes payload:
+        data written to each channel, followed by EOF; without
+        ``command`` the output is whatever the server sends back
+    :param str command: run this command on each host instead of a shell
+    :param int concurrency: hosts in flight at once
+    :param float timeout: seconds allowed for each attempt on a host
+    :param int retries:
+        further attempts after failing to connect, authenticate or open a
+        channel
+    :param on_output:
+        called as ``on_output(host, data)`` for every chunk of output, from
+        worker threads, as soon as it arrives
+    :param on_result: called with each `Result` as its host finishes
+    :param bool collect: also keep each host's output in `Result.output`
+    :param .ConnectionPool pool:
+        the pool to connect through; by default a pool is created and
+        closed for this call
+    :return: a `list` of `Result`, in the order of ``hosts``
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = ConnectionPool(timeout=timeout, max_transports=concurrency)
+    targets = [parse_host(host) for host in hosts]
+
+    def run_host(target):
+        result = _run_host(
+            pool, target, payload, command, username, timeout, retries,
+            on_output, collect
+        )
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    try:
+        with ThreadPoolExecutor(
+            max_workers=concurrency,
+            thread_name_prefix='ssh-fanout'
+        ) as executor:
+            return list(executor.map(run_host, targets))
+    finally:
+        if own_pool:
+            pool.close()
+
+
+def _run_host(
+    pool, target, payload, command, username, timeout, retries, on_output,
+    collect
+):
+    host, port = target
+    result = Result(host, port)
+    start = time.monotonic()
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(RETRY_DELAY * attempt)
+        result.attempts += 1
+        deadline = time.monotonic() + timeout
+        try:
+            channel = pool.open_session(host, port, username)
+        except (SSHException, EOFError, OSError) as exc:
+            _failed(result, exc, timeout)
+            continue
+        # Past this point the command may have run, or the payload been
+        # acted on, and output passed on: a failure is not retried.
+        output = [] if collect else None
+        try:
+            result.exit_status = _run_channel(
+                pool, channel, host, payload, command, deadline, result,
+                output, on_output
+            )
+        except (SSHException, EOFError, OSError) as exc:
+            _failed(result, exc, timeout)
+        else:
+            result.status = 'ok'
+            result.error = None
+            if collect:
+                result.output = b''.join(output)
+        break
+    result.elapsed = time.monotonic() - start
+    return result
+
+
+def _failed(result, exc, timeout):
+    if isinstance(exc, socket.timeout):
+        result.status = 'timeout'
+        result.error = f'timed out after {timeout}s'
+    else:
+        result.status = 'error'
+        result.error = repr(exc)
+
+
+def _run_channel(
+    pool, channel, host, payload, command, deadline, result, output,
+    on_output
+):
+    try:
+        channel.settimeout(max(0.0, deadline - time.monotonic()))
+        if command is not None:
+            channel.exec_command(command)
+        if payload:
+            channel.sendall(payload)
+        channel.shutdown_write()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout()
+            channel.settimeout(remaining)
+            data = channel.recv(CHUNK_SIZE)
+            if not data:
+                break
+            result.bytes += len(data)
+            if output is not None:
+                output.append(data)
+            if on_output is not None:
+                on_output(host, data)
+        if channel.exit_status_ready():
+            return channel.recv_exit_status()
+        return None
+    finally:
+        pool.release(channel)
+
+
+class _LinePrinter:
+    """Write each host's output to a stream line by line, prefixed."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.partial = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, host, data):
+        with self.lock:
+            lines = (self.partial.pop(host, b'') + data).split(b'\n')
+            if lines[-1]:
+                self.partial[host] = lines[-1]
+            self._write(host, lines[:-1])
+
+    def flush(self, host):
+        with self.lock:
+            self._write(host, [self.partial.pop(host, b'')])
+
+    def _write(self, host, lines):
+        for line in lines:
+            if line:
+                self.stream.write(
+                    f"{host}: {line.decode('utf-8', 'replace')}\n"
+                )
+        self.stream.flush()
+
+
+def _read_hosts(path):
+    with open(path) as f:
+        return [
+            line.strip() for line in f
+            if line.strip() and not line.startswith('#')
+        ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        'python3 -m ssh.fanout',
+        description='Run a payload or command on many hosts'
+    )
+    parser.add_argument(
+        'hosts',
+        nargs='*',
+        help='host or host:port'
+    )
+    parser.add_argument(
+        '-H',
+        '--hosts-file',
+        help='file with one host or host:port per line'
+    )
+    parser.add_argument('-p', '--port', type=int, default=PORT)
+    parser.add_argument('-u', '--username', default='user')
+    parser.add_argument('--payload', default='', help='data to send')
+    parser.add_argument('--payload-file', help='send this file')
+    parser.add_argument('--command', help='command to run on each host')
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        type=int,
+        default=CONCURRENCY
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=TIMEOUT,
+        help='seconds per attempt on each host'
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=RETRIES,
+        help='further attempts on hosts that could not be reached'
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='print results as JSON instead of streaming output'
+    )
+    args = parser.parse_args()
+    configure_logging()
+
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        hosts.extend(_read_hosts(args.hosts_file))
+    if not hosts:
+        parser.error('no hosts given')
+    if args.payload_file:
+        with open(args.payload_file, 'rb') as f:
+            payload = f.read()
+    else:
+        payload = args.payload.encode()
+
+    printer = None if args.json else _LinePrinter(sys.stdout)
+    start = time.monotonic()
+    results = fan_out(
+        [parse_host(host, args.port) for host in hosts],
+        payload=payload,
+        command=args.command,
+        username=args.username,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        retries=args.retries,
+        on_output=printer,
+        on_result=printer and (lambda result: printer.flush(result.host)),
+        collect=args.json
+    )
+    elapsed = time.monotonic() - start
+
+    failed = [result for result in results if not result.ok]
+    if args.json:
+        print(json.dumps([result.as_dict() for result in results], indent=2))
+    else:
+        for result in failed:
+            print(
+                f'{result.host}:{result.port}: {result.status}: '
+                f'{result.error}',
+                file=sys.stderr
+            )
+        print(
+            f'{len(results) - len(failed)}/{len(results)} hosts ok '
+            f'in {elapsed:.2f}s',
+            file=sys.stderr
+        )
+    sys.exit(1 if failed else 0)
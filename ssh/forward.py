@@ -0,0 +1,434 @@
+"""
+Local port forwarding (``direct-tcpip`` channels).
+
+A client asks the server to connect to a destination for it, as with
+``ssh -L 8080:internal:80``. The destination must match the server's
+`ForwardAllowList` and any ``permitopen`` options on the client's key,
+and keys marked ``no-port-forwarding`` or ``restrict`` may not forward.
+
+A `RelayHandler` then moves bytes between the channel and the TCP socket
+on the connection's `.EventLoop`. Socket reads go into one reused buffer
+per tunnel. When the channel's SSH window is full, the handler stops
+reading the socket until the window opens again; when the socket's send
+buffer is full, it stops reading the channel, so the client's window is
+not replenished. Neither direction ever queues more than one chunk.
+
+Remote port forwarding (``tcpip-forward`` requests, as with ``ssh -R``)
+has the server listen for the client. The listening sockets of every
+connection are served by one `ListenerPool` with a single event loop
+thread. Each accepted connection gets a ``forwarded-tcpip`` channel
+opened back to the client on a small worker pool, and is then relayed by
+a `RelayHandler` on its own connection's loop like a local forward.
+"""
+
+import fnmatch
+import functools
+import logging
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from paramiko.ssh_exception import SSHException
+
+from .loop import EVENT_READ, EVENT_WRITE, EventLoop
+
+
+logger = logging.getLogger('ssh')
+
+CONNECT_TIMEOUT = 10.0
+CHUNK_SIZE = 64 * 1024
+RETRY_DELAY = 0.01
+LISTEN_BACKLOG = 128
+# Connections accepted per readiness event on one listener.
+ACCEPT_BATCH = 64
+OPEN_WORKERS = 8
+
+
+def _split_target(target):
+    host, sep, port = target.rpartition(':')
+    if not sep:
+        raise ValueError(f'Expected HOST:PORT, got {target!r}')
+    return host.strip('[]'), port
+
+
+class ForwardAllowList:
+    """
+    Destinations clients may forward to, as ``host:port`` patterns in
+    which either part may use ``*`` and ``?`` wildcards, e.g.
+    ``10.0.0.*:22`` or ``db.internal:*``.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = [_split_target(pattern) for pattern in patterns]
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def permits(self, host, port):
+        return _matches(self.patterns, host, port)
+
+
+def _matches(patterns, host, port):
+    port = str(port)
+    return any(
+        fnmatch.fnmatchcase(host, host_pattern)
+        and (port_pattern == '*' or port_pattern == port)
+        for host_pattern, port_pattern in patterns
+    )
+
+
+def key_permits(entry, host, port, option='permitopen'):
+    """
+    Check the options of the `.AuthorizedKey` that authenticated the
+    client: ``no-port-forwarding`` and ``restrict`` deny, and ``option``
+    limits the addresses: ``permitopen`` for local forwards, or
+    ``permitlisten`` for remote ones, whose entries may leave out the host
+    to mean ``localhost``.
+    """
+    if entry is None:
+        return True
+    if not entry.allows('port-forwarding'):
+        return False
+    permitted = entry.options.get(option)
+    if permitted is None:
+        return True
+    patterns = []
+    for target in permitted:
+        if option == 'permitlisten' and ':' not in target:
+            target = f'localhost:{target}'
+        try:
+            patterns.append(_split_target(target))
+        except ValueError:
+            continue
+    # Hosts are exact, or ``*`` for any; so are ports.
+    port = str(port)
+    return any(
+        host_pattern in ('*', host) and port_pattern in ('*', port)
+        for host_pattern, port_pattern in patterns
+    )
+
+
+def connect(host, port, timeout=CONNECT_TIMEOUT):
+    """Connect to a forwarding destination and return the socket."""
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(False)
+    return sock
+
+
+class RelayHandler:
+    """Relay a ``direct-tcpip`` channel to its connected socket."""
+
+    def __init__(self, dispatcher, channel, sock):
+        """
+        :param .ChannelDispatcher dispatcher: the dispatcher serving this
+        :param .Channel channel: the forwarding channel
+        :param socket.socket sock: the connected, non-blocking destination
+        """
+        self.dispatcher = dispatcher
+        self.channel = channel
+        self.sock = sock
+        self.server = dispatcher.server
+        self.loop = dispatcher.loop
+        self.buffer = bytearray(CHUNK_SIZE)
+        self.view = memoryview(self.buffer)
+        # Data read but not yet written, in each direction.
+        self.to_channel = None
+        self.to_socket = None
+        self.channel_eof = False
+        self.socket_eof = False
+        self.closed = False
+
+    def start(self):
+        self.channel.setblocking(False)
+        self.loop.register(self.channel, self.on_channel)
+        self.loop.register(self.sock, self.on_socket)
+
+    def on_channel(self, channel, mask):
+        """Channel readable: write what it has to the socket."""
+        try:
+            data = channel.recv(CHUNK_SIZE)
+        except socket.timeout:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.channel_eof = True
+            self.loop.unregister(channel)
+            self._shutdown_socket()
+            return
+        self.dispatcher.session.touch()
+        self.server.metrics.inc('bytes_in', len(data))
+        self._write_socket(memoryview(data))
+
+    def on_socket(self, sock, mask):
+        if mask & EVENT_WRITE:
+            pending, self.to_socket = self.to_socket, None
+            self._write_socket(pending)
+        if mask & EVENT_READ and not self.closed:
+            self._read_socket()
+
+    def _read_socket(self):
+        try:
+            size = self.sock.recv_into(self.buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            size = 0
+        if not size:
+            self.socket_eof = True
+            self._update_socket()
+            try:
+                self.channel.shutdown_write()
+            except OSError:
+                pass
+            self._close_if_done()
+            return
+        self.dispatcher.session.touch()
+        self._write_channel(self.view[:size])
+
+    def _write_socket(self, view):
+        """Send ``view`` to the socket; pause channel reads if it backs up."""
+        try:
+            sent = self.sock.send(view)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self.close()
+            return
+        if sent < len(view):
+            self.to_socket = view[sent:]
+            self.loop.unregister(self.channel)
+        elif not self.channel_eof and not self.loop.is_registered(
+            self.channel
+        ):
+            self.loop.register(self.channel, self.on_channel)
+        self._update_socket()
+
+    def _write_channel(self, view):
+        """
+        Send ``view`` on the channel. Whatever the SSH window does not
+        take is retried shortly, with socket reads paused meanwhile.
+        """
+        while view:
+            try:
+                sent = self.channel.send(view)
+            except socket.timeout:
+                break
+            except OSError:
+                sent = 0
+            if sent == 0:
+                self.close()
+                return
+            self.server.metrics.inc('bytes_out', sent)
+            view = view[sent:]
+        self.to_channel = view if view else None
+        if view:
+            self.loop.call_later(RETRY_DELAY, self._flush_channel)
+        self._update_socket()
+
+    def _flush_channel(self):
+        if self.closed or self.to_channel is None:
+            return
+        self._write_channel(self.to_channel)
+
+    def _update_socket(self):
+        """Register the socket for the events it currently needs."""
+        if self.closed:
+            return
+        events = 0
+        if self.to_channel is None and not self.socket_eof:
+            events |= EVENT_READ
+        if self.to_socket is not None:
+            events |= EVENT_WRITE
+        if not events:
+            self.loop.unregister(self.sock)
+        elif self.loop.is_registered(self.sock):
+            self.loop.modify(self.sock, self.on_socket, events)
+        else:
+            self.loop.register(self.sock, self.on_socket, events)
+
+    def _shutdown_socket(self):
+        if self.to_socket is not None:
+            return
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self._close_if_done()
+
+    def _close_if_done(self):
+        if self.channel_eof and self.socket_eof and self.to_channel is None:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.to_channel = self.to_socket = None
+        self.loop.unregister(self.channel)
+        self.loop.unregister(self.sock)
+        self.channel.close()
+        self.sock.close()
+        self.dispatcher.discard(self)
+
+
+def listen_address(address):
+    """
+    The local address to bind for a ``tcpip-forward`` request: ``""``,
+    ``"*"`` and ``"0.0.0.0"`` mean every IPv4 address, and ``"localhost"``
+    the loopback address.
+    """
+    if address in ('', '*', '0.0.0.0'):
+        return '0.0.0.0'
+    if address == 'localhost':
+        return '127.0.0.1'
+    return address
+
+
+class ListenerPool:
+    """
+    The listening sockets of remote forwards for every connection,
+    served from one event loop thread that is started on first use.
+
+    For every accepted connection a ``forwarded-tcpip`` channel is opened
+    on the owning transport, from a pool of ``open_workers`` threads as
+    that waits for the client, and passed with the socket to
+    ``on_connection(transport, channel, sock)``.
+    """
+
+    def __init__(
+        self,
+        on_connection,
+        metrics=None,
+        open_workers=OPEN_WORKERS,
+        backlog=LISTEN_BACKLOG
+    ):
+        self.on_connection = on_connection
+        self.metrics = metrics
+        self.open_workers = open_workers
+        self.backlog = backlog
+        self.loop = None
+        self._executor = None
+        # Listening sockets by ``(transport, address, port)``, where port
+        # is the bound port.
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._listeners)
+
+    def listen(self, transport, address, port):
+        """
+        Listen on ``(address, port)`` for ``transport``. Safe to call from
+        any thread.
+
+        :return: the bound port, which differs from ``port`` if it was 0
+        :raises OSError: if the address cannot be bound
+        """
+        bind_address = listen_address(address)
+        sock = socket.create_server(
+            (bind_address, port),
+            family=socket.AF_INET6 if ':' in bind_address else socket.AF_INET,
+            backlog=self.backlog
+        )
+        sock.setblocking(False)
+        port = sock.getsockname()[1]
+        key = (transport, address, port)
+        with self._lock:
+            if self.loop is None:
+                self.loop = EventLoop()
+                self.loop.start_thread('ssh-listeners')
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.open_workers,
+                    thread_name_prefix='ssh-forward'
+                )
+            self._listeners[key] = sock
+        self._gauge(1)
+        self.loop.call_soon(
+            self.loop.register,
+            sock,
+            functools.partial(self._on_accept, key)
+        )
+        return port
+
+    def cancel(self, transport, address, port):
+        """
+        Stop listening on ``(address, port)`` for ``transport``.
+
+        :return: ``True`` if there was such a listener
+        """
+        with self._lock:
+            sock = self._listeners.pop((transport, address, port), None)
+        if sock is None:
+            return False
+        self._gauge(-1)
+        self.loop.call_soon(self._close, sock)
+        return True
+
+    def close_transport(self, transport):
+        """Stop every listener of ``transport``, e.g. once it has closed."""
+        with self._lock:
+            keys = [key for key in self._listeners if key[0] is transport]
+            socks = [self._listeners.pop(key) for key in keys]
+        for sock in socks:
+            self._gauge(-1)
+            self.loop.call_soon(self._close, sock)
+
+    def close(self):
+        """Stop every listener and the loop thread."""
+        with self._lock:
+            socks = list(self._listeners.values())
+            self._listeners.clear()
+        if self.loop is None:
+            return
+        for sock in socks:
+            self._gauge(-1)
+            self.loop.call_soon(self._close, sock)
+        self.loop.call_soon(self.loop.stop)
+        self._executor.shutdown(wait=False)
+
+    def _close(self, sock):
+        self.loop.unregister(sock)
+        sock.close()
+
+    def _on_accept(self, key, listener, mask):
+        transport = key[0]
+        for _ in range(ACCEPT_BATCH):
+            try:
+                sock, origin = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                logger.exception('Error accepting forwarded connection')
+                return
+            if not transport.is_active():
+                sock.close()
+                continue
+            self._executor.submit(self._open, key, sock, origin)
+
+    def _open(self, key, sock, origin):
+        """Run on a worker: open the channel and hand it over."""
+        transport, address, port = key
+        try:
+            channel = transport.open_channel(
+                'forwarded-tcpip',
+                dest_addr=(address, port),
+                src_addr=origin[:2],
+                timeout=CONNECT_TIMEOUT
+            )
+        except (SSHException, EOFError, OSError) as exc:
+            logger.info(
+                'Forwarded connection from %r refused: %r', origin, exc
+            )
+            sock.close()
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(False)
+        if self.metrics is not None:
+            self.metrics.inc('forwarded_connections')
+        self.on_connection(transport, channel, sock)
+
+    def _gauge(self, delta):
+        if self.metrics is not None:
+            self.metrics.gauge('forward_listeners', delta)
@@ -0,0 +1,147 @@
+"""
+Zero-downtime upgrades and reloads of a running server.
+
+`upgrade` starts a new server process with the same command line and
+hands it the listening socket. The socket is passed down, not bound
+again, so connections that arrive while the processes change over wait
+in its backlog whichever process accepts them: none is refused. Once the
+new process reports that it is ready the old one stops accepting and
+drains, serving its open sessions until they end, see `.SSHServer.drain`.
+If the new process fails to start it is killed and the old one carries
+on as before.
+
+The new process picks up the socket with `inherited` and reports with
+`notify_ready` once it serves connections.
+
+`handle_signals` maps signals onto a `.SSHServer` or `.Supervisor`:
+
+- ``SIGHUP``: re-read the host keys and the ``--config`` file, see
+  `.SSHServer.reload`;
+- ``SIGUSR2``: upgrade to a new process, e.g. after deploying new code;
+- ``SIGQUIT``: drain and exit.
+"""
+
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+
+logger = logging.getLogger('ssh')
+
+LISTEN_FD = 'SSH_LISTEN_FD'
+READY_FD = 'SSH_READY_FD'
+UPGRADE_TIMEOUT = 30.0
+
+
+def inherited():
+    """
+    The listening socket and readiness pipe passed down by `upgrade`.
+
+    They are removed from the environment, so that processes started
+    later do not see them.
+
+    :return: ``(socket, fd)``, or ``(None, None)`` if there are none
+    """
+    listen_fd = os.environ.pop(LISTEN_FD, None)
+    ready_fd = os.environ.pop(READY_FD, None)
+    if listen_fd is None:
+        return None, None
+    sock = socket.socket(fileno=int(listen_fd))
+    return sock, None if ready_fd is None else int(ready_fd)
+
+
+def notify_ready(ready_fd):
+    """Tell the process that started this one it can stop accepting."""
+    if ready_fd is None:
+        return
+    try:
+        os.write(ready_fd, b'1')
+    except OSError:
+        pass
+    finally:
+        os.close(ready_fd)
+
+
+def upgrade(sock, argv=None, timeout=UPGRADE_TIMEOUT):
+    """
+    Start a new server process serving ``sock``, and wait until it is
+    ready.
+
+    :param socket.socket sock: the listening socket to hand over
+    :param list argv:
+        the new process's command line; by default this process's own
+    :param float timeout: seconds the new process has to get ready
+    :return: the new process's `subprocess.Popen`, or ``None`` if it
+        failed to start, in which case it has been killed
+    """
+    if argv is None:
+        argv = [sys.executable, *sys.orig_argv[1:]]
+    listen_fd = sock.fileno()
+    ready_r, ready_w = os.pipe()
+    env = dict(os.environ)
+    env[LISTEN_FD] = str(listen_fd)
+    env[READY_FD] = str(ready_w)
+    try:
+        process = subprocess.Popen(
+            argv,
+            env=env,
+            pass_fds=(listen_fd, ready_w)
+        )
+    finally:
+        os.close(ready_w)
+    try:
+        # A process that exits closes the pipe before writing to it.
+        readable, _, _ = select.select([ready_r], [], [], timeout)
+        ready = bool(readable) and os.read(ready_r, 1) == b'1'
+    finally:
+        os.close(ready_r)
+    if not ready:
+        logger.error(
+            'New server process %d did not start, still serving',
+            process.pid
+        )
+        process.kill()
+        process.wait()
+        return None
+    logger.info(
+        'Handed the listening socket to process %d', process.pid
+    )
+    return process
+
+
+def handle_signals(server, upgrades=True):
+    """
+    Reload, upgrade or drain ``server`` on ``SIGHUP``, ``SIGUSR2`` and
+    ``SIGQUIT``. Each runs on a thread of its own, so the signal does
+    not stall the thread it interrupts.
+
+    :param server: a `.SSHServer` or `.Supervisor`
+    :param bool upgrades:
+        whether ``SIGUSR2`` upgrades; if ``False`` it is ignored, as in
+        the workers of a `.Supervisor`
+    """
+    actions = {
+        signal.SIGHUP: server.reload,
+        signal.SIGQUIT: server.drain,
+    }
+    if upgrades:
+        actions[signal.SIGUSR2] = server.upgrade
+    else:
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    for signum, action in actions.items():
+        signal.signal(signum, _handler(action))
+
+
+def _handler(action):
+    def handle(signum, frame):
+        threading.Thread(
+            target=action,
+            name=f'ssh-{signal.Signals(signum).name.lower()}',
+            daemon=True
+        ).start()
+    return handle
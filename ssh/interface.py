@@ -3,7 +3,7 @@
 """
 
 import logging
-import os
+import time
 
 from paramiko.server import ServerInterface
 from paramiko.common import (
@@ -12,14 +12,28 @@ from paramiko.common import (
 )
 from paramiko import (
     OPEN_SUCCEEDED,
-    OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+    OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED,
+    OPEN_FAILED_CONNECT_FAILED
 )
 
+from .authorized_keys import AUTHORIZED_KEYS_PATH, AuthorizedKeys
+from .certificates import is_certificate
+from . import forward
+from .log import connection_logger
+
 
 logger = logging.getLogger('ssh')
-AUTHORIZED_KEYS_PATH = 'keys/server/authorized_keys'
+
+_default_authorized_keys = None
 
 
+def default_authorized_keys():
+    """The shared `.AuthorizedKeys` store for ``AUTHORIZED_KEYS_PATH``."""
+    global _default_authorized_keys
+    if _default_authorized_keys is None:
+        _default_authorized_keys = AuthorizedKeys(AUTHORIZED_KEYS_PATH)
+    return _default_authorized_keys
+
 
 class SSHServerInterface(ServerInterface):
     """
@@ -29,6 +43,73 @@ class SSHServerInterface(ServerInterface):
     shouldn't do too much work in them. (Nothing that blocks or sleeps).
     """
 
+    def __init__(
+        self,
+        addr=None,
+        authorized_keys=None,
+        certificates=None,
+        metrics=None,
+        forward_allow=None,
+        listen_allow=None,
+        listeners=None,
+        transport=None,
+        allow_exec=False,
+        session=None,
+        admission=None,
+        max_auth_tries=None
+    ):
+        """
+        :param tuple addr: the client's ``(ip, port)``, used for ``from=``
+        :param .AuthorizedKeys authorized_keys:
+            the key store to authenticate against; defaults to the shared
+            store for ``AUTHORIZED_KEYS_PATH``
+        :param .UserCertificates certificates:
+            checks user certificates; without it they are refused
+        :param .Metrics metrics: where to record auth timings and counters
+        :param .ForwardAllowList forward_allow:
+            destinations ``direct-tcpip`` channels may connect to; by
+            default port forwarding is refused
+        :param .ForwardAllowList listen_allow:
+            addresses remote forwards may listen on; by default remote
+            forwarding is refused
+        :param .ListenerPool listeners: where remote forwards listen
+        :param .Transport transport: the transport this interface serves
+        :param bool allow_exec: accept exec requests
+        :param .Session session: the session this interface serves
+        :param .AdmissionControl admission:
+            told about failed attempts, and given back ``session``'s
+            handshake slot once the client has authenticated
+        :param int max_auth_tries:
+            failed authentication attempts after which the connection is
+            closed, or ``None``
+        """
+        self.addr = addr
+        self.forward_allow = forward_allow
+        self.listen_allow = listen_allow
+        self.listeners = listeners
+        self.transport = transport
+        self.allow_exec = allow_exec
+        self.session = session
+        self.admission = admission
+        self.max_auth_tries = max_auth_tries
+        self.auth_failures = 0
+        # Connected destination sockets by channel ID, until the channel's
+        # handler takes them with `pop_forward`.
+        self.forwards = {}
+        # The shell, exec or subsystem request made on each channel, by ID.
+        self.requests = {}
+        self.log = connection_logger(addr)
+        self.authorized_keys = authorized_keys or default_authorized_keys()
+        self.certificates = certificates
+        self.metrics = metrics
+        # The `.AuthorizedKey` entry that authenticated the client, and the
+        # `time.monotonic` time it was accepted.
+        self.authorized_key = None
+        self.authenticated_at = None
+        # The entry for the key last offered, whose signature paramiko
+        # checks next, if there is one.
+        self.accepted_key = None
+
     def check_channel_request(self, kind, chanid):
         """
         Determine if a channel request of a given type will be granted, and 
@@ -43,10 +124,38 @@ class SSHServerInterface(ServerInterface):
         :return: an `int` success or failure code (listed above)
         """
         if kind == 'session':
-            logger.info('Session channel request accepted')
+            self.log.info('Session channel request accepted')
+            if self.metrics is not None:
+                self.metrics.inc('channel_opens')
             return OPEN_SUCCEEDED
         return OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
 
+    def check_channel_shell_request(self, channel):
+        """
+        Accept shell requests; a session channel is served the same way
+        whether or not the client asks for a shell.
+        """
+        self._channel_request(channel, 'shell')
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        """
+        Accept exec requests if the server runs commands; the channel's
+        handler starts the command, see `.ProcessHandler`.
+        """
+        if not self.allow_exec:
+            return False
+        command = command.decode('utf-8', 'surrogateescape')
+        self.log.info('Exec request: %r', command)
+        self._channel_request(channel, 'exec', command)
+        return True
+
+    def check_channel_pty_request(
+        self, channel, term, width, height, pixelwidth, pixelheight, modes
+    ):
+        """Accept pty requests unless the client's key has ``no-pty``."""
+        return self.authorized_key is None or self.authorized_key.allows('pty')
+
 
     def get_allowed_auths(self, username):
         """
@@ -141,24 +250,77 @@ class SSHServerInterface(ServerInterface):
             authentication
         :rtype: int
         """
-        if not os.path.exists(AUTHORIZED_KEYS_PATH):
-            logger.info('Authorized keys file not found.')
+        start = time.monotonic()
+        self.accepted_key = None
+        result = self._check_auth_publickey(username, key)
+        if self.metrics is not None:
+            self.metrics.observe(
+                'check_auth_publickey', time.monotonic() - start
+            )
+        return result
+
+    def authenticated(self):
+        """
+        Called once the client has authenticated, after paramiko has
+        verified its signature: the key last accepted by
+        `check_auth_publickey` is the one it signed with. Gives back the
+        session's handshake slot.
+        """
+        self.authenticated_at = time.monotonic()
+        self.authorized_key = self.accepted_key
+        if self.admission is not None and self.session is not None:
+            self.admission.release(self.session)
+
+    def auth_failed(self):
+        """
+        Called for each authentication attempt paramiko rejects, after
+        any signature check; keys offered without a signature are not
+        attempts.
+        """
+        self.auth_failures += 1
+        if self.admission is not None and self.addr is not None:
+            self.admission.auth_failed(self.addr[0])
+        if (
+            self.max_auth_tries is not None
+            and self.auth_failures >= self.max_auth_tries
+            and self.transport is not None
+        ):
+            self.log.info('Too many authentication failures for %r', self.addr)
+            self._count('auth_tries_exceeded')
+            self.transport.close()
+
+    def _check_auth_publickey(self, username, key):
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(
+                "Authenticating '%s' with %s key %s",
+                username,
+                key.get_name(),
+                key.fingerprint
+            )
+        if is_certificate(key):
+            entry = None
+            if self.certificates is not None:
+                entry = self.certificates.lookup(
+                    username, key, self.addr[0] if self.addr else None
+                )
+        else:
+            entry = self.authorized_keys.lookup(username, key)
+            if entry is not None and 'cert-authority' in entry.options:
+                # A CA key vouches for the certificates it signs only.
+                entry = None
+        if entry is None:
+            return AUTH_FAILED
+        if not entry.allows_address(self.addr[0] if self.addr else None):
+            self.log.info(
+                "Key for '%s' not allowed from %r",
+                username,
+                self.addr
+            )
             return AUTH_FAILED
 
-        logger.info(
-            "Authenticating '%s' with key: %s",
-            username,
-            key.get_base64()
-        )
-        with open(AUTHORIZED_KEYS_PATH, 'r') as f:
-            authorized_keys = f.read().splitlines()
-        key_base64 = key.get_base64()
-        for auth_key in authorized_keys:
-            if key_base64 in auth_key:
-                logger.info("Authorized key found for '%s'", username)
-                return AUTH_SUCCESSFUL
-
-        return AUTH_FAILED
+        self.log.info("Authorized key found for '%s'", username)
+        self.accepted_key = entry
+        return AUTH_SUCCESSFUL
 
     def check_auth_interactive(self, username, submethods):
         """Begin an interactive challenge, if supported."""
@@ -189,7 +351,30 @@ class SSHServerInterface(ServerInterface):
             the port number (`int`) that was opened for listening, 
             or ``False`` to reject
         """
-        return False
+        bind_address = forward.listen_address(address)
+        if not (
+            self.listen_allow
+            and self.listeners is not None
+            and self.transport is not None
+            and self.listen_allow.permits(bind_address, port)
+            and forward.key_permits(
+                self.authorized_key, address, port, 'permitlisten'
+            )
+        ):
+            self.log.info('Listening on %r:%d denied', address, port)
+            self._count('remote_forwards_denied')
+            return False
+        try:
+            port = self.listeners.listen(self.transport, address, port)
+        except OSError as exc:
+            self.log.info(
+                'Listening on %r:%d failed: %r', address, port, exc
+            )
+            self._count('remote_forwards_failed')
+            return False
+        self.log.info('Listening on %r:%d', address, port)
+        self._count('remote_forwards')
+        return port
 
     def cancel_port_forward_request(self, address, port):
         """
@@ -200,7 +385,8 @@ class SSHServerInterface(ServerInterface):
         :param str address: the forwarded address
         :param int port: the forwarded port
         """
-        pass
+        if self.listeners is not None:
+            self.listeners.cancel(self.transport, address, port)
 
     def check_global_request(self, kind, msg):
         """
@@ -232,131 +418,177 @@ class SSHServerInterface(ServerInterface):
         """
         return False
 
-        # ...Channel requests...
-
-        def check_channel_subsystem_request(self, channel, name):
-            """
-            Determine if a requested subsystem will be provided to the 
-            client on the given channel. If this method returns ``True``, 
-            all future I/O through this channel will be assumed to be 
-            connected to the requested subsystem. An example of a subsystem 
-            is ``sftp``.
-
-            The default implementation checks for a subsystem handler assigned
-            via `.Transport.set_subsystem_handler`. If one has been set, 
-            the handler is invoked and this method returns ``True``. 
-            Otherwise it returns ``False``.
-
-            .. note:: Because the default implementation uses the `.Transport` 
-                to identify valid subsystems, you probably won't need to 
-                override this method.
-
-            :param .Channel channel: the `.Channel` the pty request 
-                arrived on.
-            :param str name: name of the requested subsystem.
-            :return:
-                ``True`` if this channel is not hooked up to the requested
-                subsystem; ``False`` if that subsystem can't or won't be 
-                provided.
-            """
-            transport = channel.get_transport()
-            handler_class, args, kwargs = transport._get_subsystem_handler(name)
-            if handler_class is None:
-                return False
-            handler = handler_class(channel, name, self, *args, **kwargs)
-            handler.start()
-            return True
-
-        def check_channel_forward_agent_request(self, channel):
-            """
-            Determine if the client will be provided with a forward agent
-            session. If this method returns ``True``, the server will
-            allow SSH Agent forwarding.
-
-            The default implementation always returns ``False``.
-
-            :param .Channel channel: the `.Channel` the request arrived on.
-            :return: 
-                ``True`` if the AgentForward was loaded; ``False`` if not
-
-            If ``True`` is returned, the server should create an 
-            :class:`AgentServerProxy` to access the agent.
-            """
+    # ...Channel requests...
+
+    def check_channel_subsystem_request(self, channel, name):
+        """
+        Determine if a requested subsystem will be provided to the 
+        client on the given channel. If this method returns ``True``, 
+        all future I/O through this channel will be assumed to be 
+        connected to the requested subsystem. An example of a subsystem 
+        is ``sftp``.
+
+        The default implementation checks for a subsystem handler assigned
+        via `.Transport.set_subsystem_handler`. If one has been set, 
+        the handler is invoked and this method returns ``True``. 
+        Otherwise it returns ``False``.
+
+        .. note:: Because the default implementation uses the `.Transport` 
+            to identify valid subsystems, you probably won't need to 
+            override this method.
+
+        :param .Channel channel: the `.Channel` the pty request 
+            arrived on.
+        :param str name: name of the requested subsystem.
+        :return:
+            ``True`` if this channel is not hooked up to the requested
+            subsystem; ``False`` if that subsystem can't or won't be 
+            provided.
+        """
+        transport = channel.get_transport()
+        handler_class, args, kwargs = transport._get_subsystem_handler(name)
+        if handler_class is None:
             return False
+        # The channel's handler starts the subsystem once it has stopped
+        # serving the channel itself, see `.EchoHandler.on_request`.
+        self._channel_request(channel, 'subsystem', name)
+        return True
 
-        def check_channel_direct_tcpip_request(self, chanid, origin, destination):
-            """
-            Determine if a local port forwarding channel will be granted, 
-            and return ``OPEN_SUCCEEDED`` or an error code. This method is 
-            called in server mode when the client requests a channel, after
-            authentication is complete.
-
-            The ``chanid`` parameter is a small number that uniquely
-            identifies the channel within a `.Transport`. A `.Channel` object
-            is not created unless this method returns ``OPEN_SUCCEEDED`` --
-            once a `.Channel` object is created, you can call 
-            `.Channel.get_id` to retrieve the channel ID.
-
-            The origin and destination parameters are (ip_address, port) 
-            tuples that correspond to both ends of the TCP connection in the 
-            forwarding tunnel.
-
-            The return value should either be ``OPEN_SUCCEEDED`` (for ``0``)
-            to allow the channel request, or one of the following error 
-            codes to reject it:
-
-                - ``OPEN_FAILED_ADMINSTRATIVELY_PROHIBITED``
-                - ``OPEN_FAILED_CONNECT_FAILED``
-                - ``OPEN_FAILED_UNKNOWN_CHANNEL_TYPE``
-                - ``OPEN_FAILED_RESOURCE_SHORTAGE``
-
-            The default implementation always returns
-            ``OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED``.
-
-            :param int chanid: ID of the channel
-            :param tuple origin:
-                2-tuple containing the IP address and port of the 
-                originator (client side)
-            :param tuple destination:
-                2-tuple containing the IP address and port of the 
-                destination (server side)
-            :return: an `int` success or failure code (listed above)
-            """
-            return OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+    def check_channel_forward_agent_request(self, channel):
+        """
+        Determine if the client will be provided with a forward agent
+        session. If this method returns ``True``, the server will
+        allow SSH Agent forwarding.
 
-        def check_channel_env_request(self, channel, name, value):
-            """
-            Check whether a given environment variable can be specified 
-            for the given channel. This method should return ``True`` 
-            if the server is willing to set the specified environment
-            variable. Note that some environment variables (e.g., PATH)
-            can be exceedingly dangerous, so blindly allowing the client 
-            to set the environment is almost certainly not a good idea.
-
-            The default implementation always returns ``False``.
-
-            :param channel: the `.Channel` the env request arrived on
-            :param str name: name
-            :param str value: Channel value
-            :returns: a boolean
-            """
-            return False
+        The default implementation always returns ``False``.
 
-        def get_banner(self):
-            """
-            A pre-login banner to display to the user. The message may 
-            span multiple lines separated by crlf pairs. The language 
-            should be in rfc3066 style, for example: en-US.
+        :param .Channel channel: the `.Channel` the request arrived on.
+        :return: 
+            ``True`` if the AgentForward was loaded; ``False`` if not
 
-            The default implementation always returns ``(None, None)``.
+        If ``True`` is returned, the server should create an 
+        :class:`AgentServerProxy` to access the agent.
+        """
+        return False
 
-            :returns: A tuple containing the banner and language code.
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        """
+        Determine if a local port forwarding channel will be granted, 
+        and return ``OPEN_SUCCEEDED`` or an error code. This method is 
+        called in server mode when the client requests a channel, after
+        authentication is complete.
 
-            .. versionadded:: 2.3
-            """
-            return ('SSH Server', 'en-US')
+        The ``chanid`` parameter is a small number that uniquely
+        identifies the channel within a `.Transport`. A `.Channel` object
+        is not created unless this method returns ``OPEN_SUCCEEDED`` --
+        once a `.Channel` object is created, you can call 
+        `.Channel.get_id` to retrieve the channel ID.
 
+        The origin and destination parameters are (ip_address, port) 
+        tuples that correspond to both ends of the TCP connection in the 
+        forwarding tunnel.
 
+        The return value should either be ``OPEN_SUCCEEDED`` (for ``0``)
+        to allow the channel request, or one of the following error 
+        codes to reject it:
 
+            - ``OPEN_FAILED_ADMINSTRATIVELY_PROHIBITED``
+            - ``OPEN_FAILED_CONNECT_FAILED``
+            - ``OPEN_FAILED_UNKNOWN_CHANNEL_TYPE``
+            - ``OPEN_FAILED_RESOURCE_SHORTAGE``
 
+        The default implementation always returns
+        ``OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED``.
 
+        :param int chanid: ID of the channel
+        :param tuple origin:
+            2-tuple containing the IP address and port of the 
+            originator (client side)
+        :param tuple destination:
+            2-tuple containing the IP address and port of the 
+            destination (server side)
+        :return: an `int` success or failure code (listed above)
+        """
+        host, port = destination
+        if not (
+            self.forward_allow
+            and self.forward_allow.permits(host, port)
+            and forward.key_permits(self.authorized_key, host, port)
+        ):
+            self.log.info('Forwarding to %s:%d denied', host, port)
+            self._count('forwards_denied')
+            return OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        # This blocks the transport thread, but only this connection's.
+        try:
+            self.forwards[chanid] = forward.connect(host, port)
+        except OSError as exc:
+            self.log.info('Forwarding to %s:%d failed: %r', host, port, exc)
+            self._count('forwards_failed')
+            return OPEN_FAILED_CONNECT_FAILED
+        self.log.info('Forwarding to %s:%d', host, port)
+        self._count('forwards')
+        return OPEN_SUCCEEDED
+
+    def pop_forward(self, chanid):
+        """
+        Return and forget the destination socket connected for the
+        ``direct-tcpip`` channel ``chanid``, or ``None``.
+        """
+        return self.forwards.pop(chanid, None)
+
+    def channel_request(self, chanid):
+        """
+        Return the ``(kind, argument)`` of the shell, exec or subsystem
+        request made on channel ``chanid``, or ``None``.
+        """
+        return self.requests.get(chanid)
+
+    def _channel_request(self, channel, kind, argument=None):
+        # The transport reports the request once it has been answered.
+        self.requests[channel.get_id()] = (kind, argument)
+        recording = self.session.recording if self.session else None
+        if recording is not None:
+            recording.event(
+                'request', channel.get_id(), kind=kind, argument=argument
+            )
+
+    def close_forwards(self):
+        """Close destination sockets no channel handler has taken."""
+        while self.forwards:
+            self.forwards.popitem()[1].close()
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.inc(name)
+
+    def check_channel_env_request(self, channel, name, value):
+        """
+        Check whether a given environment variable can be specified 
+        for the given channel. This method should return ``True`` 
+        if the server is willing to set the specified environment
+        variable. Note that some environment variables (e.g., PATH)
+        can be exceedingly dangerous, so blindly allowing the client 
+        to set the environment is almost certainly not a good idea.
+
+        The default implementation always returns ``False``.
+
+        :param channel: the `.Channel` the env request arrived on
+        :param str name: name
+        :param str value: Channel value
+        :returns: a boolean
+        """
+        return False
+
+    def get_banner(self):
+        """
+        A pre-login banner to display to the user. The message may 
+        span multiple lines separated by crlf pairs. The language 
+        should be in rfc3066 style, for example: en-US.
+
+        The default implementation always returns ``(None, None)``.
+
+        :returns: A tuple containing the banner and language code.
+
+        .. versionadded:: 2.3
+        """
+        return ('SSH Server', 'en-US')
@@ -0,0 +1,192 @@
+"""
+SSH-level keepalives and dead-peer detection.
+
+`Keepalive` watches transports the way OpenSSH's ``ClientAliveInterval``
+and ``ServerAliveInterval`` do. When a transport has sent nothing for
+``interval`` seconds it sends a ``keepalive@openssh.com`` global request,
+which every SSH implementation answers. A peer that has sent nothing for
+``interval * count_max`` seconds is dead: its transport is closed, which
+ends any thread blocked on it, instead of holding a socket and a thread
+until TCP gives up, possibly never.
+
+Probes are sent from each transport's own thread, so a peer that stopped
+reading cannot block anyone else. Checking for silence takes one timer per
+transport on a shared `.TimerWheel`. The timer re-arms itself for the
+time left, and receiving a packet only stores a timestamp. 50,000 watched
+transports therefore cost about the same per tick as 50.
+"""
+
+import threading
+import time
+
+from paramiko.common import (
+    MSG_REQUEST_FAILURE,
+    MSG_REQUEST_SUCCESS,
+    cMSG_GLOBAL_REQUEST,
+)
+from paramiko.message import Message
+
+from .timers import TimerWheel
+
+
+COUNT_MAX = 3
+KEEPALIVE_REQUEST = 'keepalive@openssh.com'
+
+_wheel = None
+_wheel_lock = threading.Lock()
+
+
+def shared_wheel():
+    """The process-wide `.TimerWheel` for clients, started on first use."""
+    global _wheel
+    with _wheel_lock:
+        if _wheel is None:
+            _wheel = TimerWheel().start(name='ssh-client-timers')
+        return _wheel
+
+
+class Watch:
+
+    __slots__ = (
+        'transport',
+        'callback',
+        'args',
+        'received',
+        'outstanding',
+        'timer',
+        'cancelled',
+    )
+
+    def __init__(self, transport, callback, args):
+        self.transport = transport
+        self.callback = callback
+        self.args = args
+        self.received = time.monotonic()
+        # Probes sent whose reply has not arrived.
+        self.outstanding = 0
+        self.timer = None
+        self.cancelled = False
+
+
+class Keepalive:
+    """Probe idle transports and close those whose peer went silent."""
+
+    def __init__(
+        self,
+        interval,
+        count_max=COUNT_MAX,
+        wheel=None,
+        metrics=None
+    ):
+        """
+        :param float interval:
+            seconds without sending before a transport sends a probe
+        :param int count_max:
+            probe intervals a peer may stay silent before it is dead
+        :param .TimerWheel wheel:
+            the wheel to run checks on; defaults to `shared_wheel`
+        :param .Metrics metrics: counts ``keepalives`` and ``dead_peers``
+        """
+        self.interval = interval
+        self.count_max = count_max
+        self.timeout = interval * count_max
+        self.wheel = wheel or shared_wheel()
+        self.metrics = metrics
+        self.watched = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.watched
+
+    def watch(self, transport, callback=None, *args):
+        """
+        Start probing ``transport``, which must have finished key exchange.
+        If its peer goes silent, ``callback(*args)`` is called on the wheel
+        thread to close it, or the transport is closed if there is no
+        callback.
+
+        :return: a `Watch` to pass to `cancel`
+        """
+        watch = Watch(transport, callback, args)
+        packetizer = transport.packetizer
+        read_message = packetizer.read_message
+
+        def read():
+            message = read_message()
+            watch.received = time.monotonic()
+            return message
+
+        packetizer.read_message = read
+        handlers = transport._handler_table
+        for ptype in (MSG_REQUEST_SUCCESS, MSG_REQUEST_FAILURE):
+            handlers[ptype] = _reply_handler(watch, handlers[ptype])
+        packetizer.set_keepalive(self.interval, lambda: self._probe(watch))
+        with self._lock:
+            self.watched += 1
+        watch.timer = self.wheel.schedule(self.timeout, self._check, watch)
+        return watch
+
+    def cancel(self, watch):
+        """Stop watching; safe to call more than once, or with ``None``."""
+        with self._lock:
+            if watch is None or watch.cancelled:
+                return
+            watch.cancelled = True
+            self.watched -= 1
+        self.wheel.cancel(watch.timer)
+        watch.transport.packetizer.set_keepalive(0, None)
+
+    def _probe(self, watch):
+        """Send a probe; called on the transport's thread."""
+        transport = watch.transport
+        event = transport.completion_event
+        if not transport.clear_to_send.is_set() or (
+            event is not None and not event.is_set()
+        ):
+            # Mid key exchange, or another global request is waiting for
+            # its reply, which must not be taken for the probe's.
+            return
+        m = Message()
+        m.add_byte(cMSG_GLOBAL_REQUEST)
+        m.add_string(KEEPALIVE_REQUEST)
+        m.add_boolean(True)
+        watch.outstanding += 1
+        transport._send_user_message(m)
+        if self.metrics is not None:
+            self.metrics.inc('keepalives')
+
+    def _check(self, watch):
+        if watch.cancelled:
+            return
+        if not watch.transport.is_active():
+            self.cancel(watch)
+            return
+        silent = time.monotonic() - watch.received
+        if silent < self.timeout:
+            watch.timer = self.wheel.schedule(
+                self.timeout - silent,
+                self._check,
+                watch
+            )
+            return
+        self.cancel(watch)
+        if self.metrics is not None:
+            self.metrics.inc('dead_peers')
+        if watch.callback is None:
+            watch.transport.close()
+        else:
+            watch.callback(*watch.args)
+
+
+def _reply_handler(watch, handler):
+    """Consume replies to probes and pass any other reply to ``handler``."""
+
+    def handle(m):
+        if watch.outstanding:
+            # Replies come in the order requests were sent, and a probe is
+            # only sent while no other request waits.
+            watch.outstanding -= 1
+            return
+        handler(m)
+
+    return handle
@@ -0,0 +1,73 @@
+"""
+Private keys and ``known_hosts`` files, loaded once per process.
+
+`private_key` and `known_hosts` cache what they parse by path, so every
+`.SSHClient` and `.ConnectionPool` in a process shares one key object and
+one `.KnownHosts` per file instead of reading it for each client or
+connection. A file is parsed again only when it changes. paramiko is
+imported on first use.
+"""
+
+import os
+import threading
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def private_key(path):
+    """
+    The private key in ``path``, of any type paramiko supports, with the
+    certificate in ``path-cert.pub`` if there is one.
+    """
+    return _load(path, _read_private_key, path + '-cert.pub')
+
+
+def known_hosts(path):
+    """
+    The `.KnownHosts` store for ``path``, which need not exist. The store
+    is shared, and re-reads the file itself when it changes: keys added
+    to it are seen by every user of the file.
+    """
+    from .known_hosts import KnownHosts
+
+    path = os.path.abspath(path)
+    key = (KnownHosts, path)
+    with _lock:
+        store = _cache.get(key)
+        if store is None:
+            # New keys are written later, from a timer: a relative path
+            # would be resolved against whatever the directory is then.
+            store = _cache[key] = KnownHosts(path)
+        return store
+
+
+def _load(path, read, *related):
+    """
+    ``read(path)``, again only once ``path`` or one of the ``related``
+    files, which need not exist, has changed.
+    """
+    version = [_version(path)]
+    for related_path in related:
+        try:
+            version.append(_version(related_path))
+        except FileNotFoundError:
+            version.append(None)
+    key = (read, os.path.abspath(path))
+    with _lock:
+        cached = _cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = _cache[key] = (version, read(path))
+        return cached[1]
+
+
+def _version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_private_key(path):
+    from paramiko import PKey
+
+    return PKey.from_path(path)
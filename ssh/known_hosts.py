@@ -0,0 +1,493 @@
+"""
+Indexed ``known_hosts`` store for clients.
+
+`KnownHosts` parses a file once into a dictionary keyed by host name, so
+checking a server's key is a dictionary access however many hosts are
+listed. Hashed names (``|1|salt|hash``) cannot be indexed by name; they
+are grouped by salt, and the hosts looked up against them are
+remembered, so each host costs one HMAC per salt the first time only.
+Lines with wildcard or negated patterns are matched one by one, as are
+the rare lines mixing them with plain names. ``@revoked`` keys are
+refused for every host, and ``@cert-authority`` lines are kept apart
+from host keys.
+
+The file is re-read only when its inode, mtime or size changes, checked
+at most once per ``check_interval`` seconds. Keys added with
+`KnownHosts.add` are seen at once by every client sharing the store, and
+appended to the file together, one write per ``flush_delay`` seconds
+and once more at exit, instead of the whole file being rewritten for
+each new host.
+
+`HostKeyPolicy` checks servers against a store for paramiko's
+`SSHClient`, like OpenSSH's ``StrictHostKeyChecking``, and host
+certificates against its ``@cert-authority`` lines, see `.certificates`.
+"""
+
+import atexit
+import base64
+import binascii
+import fnmatch
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger('ssh')
+
+CHECK_INTERVAL = 1.0
+FLUSH_DELAY = 1.0
+MAX_LOOKUPS = 65536
+HASH_MAGIC = '|1|'
+
+# Values of ``StrictHostKeyChecking`` that `HostKeyPolicy` understands.
+STRICT = 'yes'
+ACCEPT_NEW = 'accept-new'
+OFF = 'no'
+POLICIES = (STRICT, ACCEPT_NEW, OFF)
+
+
+class KnownHost:
+
+    __slots__ = ('hosts', 'key_type', 'blob', 'marker', '_key')
+
+    def __init__(self, hosts, key_type, blob, marker=None):
+        self.hosts = hosts
+        self.key_type = key_type
+        self.blob = blob
+        self.marker = marker
+        self._key = None
+
+    def __repr__(self):
+        return f'<KnownHost {self.hosts} {self.key_type}>'
+
+    @property
+    def key(self):
+        """
+        The paramiko `PKey`, built on first use: most entries in a large
+        file are never looked at.
+        """
+        if self._key is None:
+            from paramiko import PKey
+
+            self._key = PKey.from_type_string(self.key_type, self.blob)
+        return self._key
+
+    def to_line(self):
+        line = f'{self.hosts} {self.key_type} '
+        line += base64.b64encode(self.blob).decode()
+        if self.marker is not None:
+            line = f'{self.marker} {line}'
+        return line + '\n'
+
+
+def parse_line(line):
+    """
+    Parse one ``known_hosts`` line.
+
+    :return: a `KnownHost`, or ``None`` for blank, comment and malformed
+        lines
+    """
+    fields = line.split()
+    if not fields or fields[0].startswith('#'):
+        return None
+    marker = None
+    if fields[0].startswith('@'):
+        marker = fields.pop(0)
+    if len(fields) < 3:
+        return None
+    try:
+        blob = base64.b64decode(fields[2], validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return KnownHost(fields[0], fields[1], blob, marker)
+
+
+def host_name(hostname, port=22):
+    """The name a host is listed under: ``[host]:port`` off port 22."""
+    if port == 22:
+        return hostname
+    return f'[{hostname}]:{port}'
+
+
+def hash_host(hostname, salt=None):
+    """``hostname`` hashed as with OpenSSH's ``HashKnownHosts``."""
+    if salt is None:
+        salt = os.urandom(hashlib.sha1().digest_size)
+    digest = hmac.digest(salt, hostname.encode(), 'sha1')
+    return '|1|{}|{}'.format(
+        base64.b64encode(salt).decode(), base64.b64encode(digest).decode()
+    )
+
+
+def _parse_hashed(field):
+    """The ``(salt, digest)`` of a hashed host field, or ``None``."""
+    parts = field[len(HASH_MAGIC):].split('|')
+    if len(parts) != 2:
+        return None
+    try:
+        return tuple(base64.b64decode(part, validate=True) for part in parts)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _matches(patterns, hostname):
+    """
+    Match ``hostname`` against a comma-separated pattern list; a negated
+    match excludes the line.
+    """
+    matched = False
+    for pattern in patterns.split(','):
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        # Only * and ? are wildcards: [host]:port is literal.
+        pattern = pattern.lower().replace('[', '[[]')
+        if fnmatch.fnmatchcase(hostname, pattern):
+            if negate:
+                return False
+            matched = True
+    return matched
+
+
+class _Index:
+
+    __slots__ = (
+        'names',
+        'hashed',
+        'patterns',
+        'revoked',
+        'authorities',
+        'lookups',
+        'count',
+    )
+
+    def __init__(self):
+        # Host name -> entries listing it by name.
+        self.names = {}
+        # Salt -> digest -> entries.
+        self.hashed = {}
+        # Entries matched line by line.
+        self.patterns = []
+        self.revoked = set()
+        self.authorities = []
+        # Host name -> entries found for it, hashed and patterns included.
+        self.lookups = {}
+        self.count = 0
+
+    def add(self, entry):
+        self.count += 1
+        if entry.marker == '@revoked':
+            self.revoked.add((entry.key_type, entry.blob))
+            return
+        if entry.marker == '@cert-authority':
+            self.authorities.append(entry)
+            return
+        if entry.marker is not None:
+            return
+        hosts = entry.hosts
+        if hosts.startswith(HASH_MAGIC):
+            hashed = _parse_hashed(hosts)
+            if hashed is not None:
+                salt, digest = hashed
+                self.hashed.setdefault(salt, {}).setdefault(
+                    digest, []
+                ).append(entry)
+        elif any(char in hosts for char in '*?!'):
+            self.patterns.append(entry)
+        else:
+            for name in hosts.lower().split(','):
+                self.names.setdefault(name, []).append(entry)
+
+    def lookup(self, hostname):
+        entries = self.lookups.get(hostname)
+        if entries is not None:
+            return entries
+        entries = list(self.names.get(hostname, ()))
+        if self.hashed:
+            name = hostname.encode()
+            for salt, digests in self.hashed.items():
+                found = digests.get(hmac.digest(salt, name, 'sha1'))
+                if found is not None:
+                    entries.extend(found)
+        for entry in self.patterns:
+            if _matches(entry.hosts, hostname):
+                entries.append(entry)
+        if len(self.lookups) >= MAX_LOOKUPS:
+            self.lookups.clear()
+        self.lookups[hostname] = entries
+        return entries
+
+
+class _KeysByType(dict):
+    """A host's keys by type, as paramiko's `HostKeys.lookup` returns."""
+
+    def keys(self):
+        # paramiko's `SSHClient.connect` indexes this.
+        return list(super().keys())
+
+
+class KnownHosts:
+
+    def __init__(
+        self,
+        path,
+        check_interval=CHECK_INTERVAL,
+        flush_delay=FLUSH_DELAY,
+        hash_hosts=False
+    ):
+        """
+        :param str path: the ``known_hosts`` file; it need not exist
+        :param float check_interval:
+            minimum seconds between checks of the file for changes
+        :param float flush_delay:
+            seconds a new key may wait to be appended with others
+        :param bool hash_hosts: write new host names hashed
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self.flush_delay = flush_delay
+        self.hash_hosts = hash_hosts
+        self._index = _Index()
+        self._signature = None
+        self._checked = float('-inf')
+        self._pending = []
+        self._flush_timer = None
+        self._lock = threading.RLock()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        self.refresh()
+        return self._index.count
+
+    def lookup(self, hostname):
+        """
+        The `KnownHost` entries listing ``hostname``, as `host_name`
+        gives it, by name, hash or pattern. Revoked keys are included.
+        """
+        self.refresh()
+        hostname = hostname.lower()
+        index = self._index
+        entries = index.lookups.get(hostname)
+        if entries is None:
+            with self._lock:
+                entries = index.lookup(hostname)
+        return entries
+
+    def get(self, hostname):
+        """
+        ``hostname``'s keys by type, or ``None`` if none are known. This
+        lets `KnownHosts` stand in for paramiko's `HostKeys`.
+        """
+        entries = self.lookup(hostname)
+        revoked = self._index.revoked
+        keys = _KeysByType()
+        for entry in entries:
+            if (entry.key_type, entry.blob) in revoked:
+                continue
+            try:
+                keys.setdefault(entry.key_type, entry.key)
+            except Exception as exc:
+                logger.debug(
+                    'Skipping %s key for %s in %s: %r',
+                    entry.key_type,
+                    hostname,
+                    self.path,
+                    exc
+                )
+        return keys or None
+
+    def revoked(self, key):
+        """Whether the paramiko ``key`` is listed as ``@revoked``."""
+        self.refresh()
+        return (key.get_name(), key.asbytes()) in self._index.revoked
+
+    def authorities(self, hostname):
+        """The ``@cert-authority`` entries whose patterns match."""
+        self.refresh()
+        hostname = hostname.lower()
+        return [
+            entry for entry in self._index.authorities
+            if _matches(entry.hosts, hostname)
+        ]
+
+    def add(self, hostname, key):
+        """
+        Trust ``key`` for ``hostname`` from now on. It is appended to the
+        file with other new keys within ``flush_delay`` seconds.
+        """
+        blob = key.asbytes()
+        with self._lock:
+            self.refresh()
+            hostname = hostname.lower()
+            for entry in self._index.lookup(hostname):
+                if entry.key_type == key.get_name() and entry.blob == blob:
+                    return
+            written = hash_host(hostname) if self.hash_hosts else hostname
+            entry = KnownHost(written, key.get_name(), blob)
+            entry._key = key
+            self._pending.append((hostname, entry))
+            self._apply(self._index, hostname, entry)
+            if self._flush_timer is None:
+                from .keepalive import shared_wheel
+
+                self._flush_timer = shared_wheel().schedule(
+                    self.flush_delay, self.flush
+                )
+
+    def _apply(self, index, hostname, entry):
+        # Indexed by the name even if written hashed; the name is known.
+        index.count += 1
+        index.names.setdefault(hostname, []).append(entry)
+        index.lookups.pop(hostname, None)
+
+    def flush(self):
+        """Append the keys added since the last flush to the file."""
+        with self._lock:
+            self._flush_timer = None
+            if not self._pending:
+                return
+            data = ''.join(entry.to_line() for _, entry in self._pending)
+            data = data.encode()
+            try:
+                before = self._stat()
+                fd = os.open(
+                    self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600
+                )
+                try:
+                    size = os.fstat(fd).st_size
+                    if size and os.pread(fd, 1, size - 1) != b'\n':
+                        data = b'\n' + data
+                    # One write, so lines from other processes appending
+                    # at the same time are not interleaved with ours.
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+            except OSError as exc:
+                logger.info(
+                    'Failed to add %d host keys to %s: %r',
+                    len(self._pending),
+                    self.path,
+                    exc
+                )
+                return
+            logger.debug(
+                'Added %d host keys to %s', len(self._pending), self.path
+            )
+            self._pending = []
+            after = self._stat()
+            # Our own append is already in the index; skip re-reading the
+            # file unless someone else changed it too.
+            if (
+                after is not None
+                and self._signature == before
+                and after[3] == (before[3] if before else 0) + len(data)
+            ):
+                self._signature = after
+
+    def refresh(self, force=False):
+        """Re-read the file if it has changed on disk."""
+        if not force and self._fresh():
+            return
+        with self._lock:
+            if not force and self._fresh():
+                return
+            signature = self._stat()
+            if signature == self._signature and not force:
+                self._checked = time.monotonic()
+                return
+            index = self._load() if signature is not None else _Index()
+            # Keys not written yet are not in the file.
+            for hostname, entry in self._pending:
+                self._apply(index, hostname, entry)
+            self._index = index
+            self._signature = signature
+            self._checked = time.monotonic()
+            if signature is not None:
+                logger.info(
+                    'Loaded %d known hosts from %s', index.count, self.path
+                )
+
+    def _fresh(self):
+        return time.monotonic() - self._checked < self.check_interval
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        index = _Index()
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    entry = parse_line(line)
+                    if entry is not None:
+                        index.add(entry)
+        except (OSError, UnicodeDecodeError) as exc:
+            logger.info('Failed to read %s: %r', self.path, exc)
+        return index
+
+
+class HostKeyPolicy:
+    """
+    What to do about servers whose key is not in a `KnownHosts`, for
+    paramiko's `SSHClient.set_missing_host_key_policy`. paramiko itself
+    refuses a server whose key differs from a known one.
+
+    - ``"yes"``: refuse unknown servers;
+    - ``"accept-new"``: trust an unknown server's key and add it to the
+      store, as on first use;
+    - ``"no"``: accept unknown servers without adding them.
+
+    A ``@revoked`` key is refused whatever the policy. A server with a
+    host certificate signed by a ``@cert-authority`` for it is accepted
+    whatever the policy, and not added; if the certificate is bad, the
+    server is refused.
+    """
+
+    def __init__(self, known_hosts, policy=ACCEPT_NEW):
+        """
+        :param .KnownHosts known_hosts: the store to check and add to
+        :param str policy: one of `POLICIES`
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown host key policy {policy!r}')
+        self.known_hosts = known_hosts
+        self.policy = policy
+
+    def missing_host_key(self, client, hostname, key):
+        from paramiko.ssh_exception import SSHException
+
+        if self.known_hosts.revoked(key):
+            raise SSHException(
+                f'{key.get_name()} host key for {hostname} is revoked'
+            )
+        if key.public_blob is not None:
+            from .certificates import check_host_certificate, is_certificate
+
+            authorities = self.known_hosts.authorities(hostname)
+            if authorities and is_certificate(key):
+                problem = check_host_certificate(key, hostname, authorities)
+                if problem is not None:
+                    raise SSHException(
+                        f'Host certificate for {hostname} refused: {problem}'
+                    )
+                logger.debug('Host certificate for %s accepted', hostname)
+                return
+        if self.policy == STRICT:
+            raise SSHException(
+                f'No {key.get_name()} host key is known for {hostname}'
+            )
+        if self.policy == ACCEPT_NEW:
+            self.known_hosts.add(hostname, key)
+            logger.info(
+                'Added %s host key for %s to %s',
+                key.get_name(),
+                hostname,
+                self.known_hosts.path
+            )
@@ -0,0 +1,232 @@
+"""
+Logging pipeline for the ``ssh`` logger.
+
+Records are put on a bounded in-memory queue by a `DropQueueHandler` and
+written to stdout and a log file by a background `QueueListener` thread,
+so a session thread never blocks on log I/O. If the queue is full the
+record is dropped and counted instead of waiting.
+
+Per-connection records carry structured fields (``peer=...``) through a
+`ConnectionLogger` and are rate limited per message by `RateLimitFilter`,
+so a connection storm cannot flood the log.
+
+The level defaults to ``$SSH_LOG_LEVEL`` (``INFO`` if unset) and the file
+to ``$SSH_LOG_FILE`` (``ssh.log`` in the working directory if unset, none
+if empty). Setting ``$SSH_LOG_QUEUE=0`` attaches the handlers
+synchronously instead.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+logger = logging.getLogger('ssh')
+
+LOG_PATH = 'ssh.log'
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+QUEUE_SIZE = 10000
+RATE = 50.0
+BURST = 200
+MAX_BUCKETS = 1024
+
+
+class FieldsFormatter(logging.Formatter):
+    """Append a record's structured ``fields`` as ``key=value`` pairs."""
+
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            pairs = ' '.join(f'{key}={value}' for key, value in fields.items())
+            message = f'{message} [{pairs}]'
+        return message
+
+
+class DropQueueHandler(QueueHandler):
+    """A `QueueHandler` that drops records instead of blocking when full."""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BlockingSentinelListener(QueueListener):
+    """
+    A `QueueListener` whose stop waits for room in a full queue instead of
+    raising `queue.Full`.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token-bucket rate limit for records that have structured ``fields``.
+
+    Each distinct message format gets its own bucket refilled at ``rate``
+    records per second up to ``burst``. Records without ``fields`` always
+    pass. The next record let through after some were suppressed reports
+    how many were.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if getattr(record, 'fields', None) is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(
+                record.msg, (self.burst, now, 0)
+            )
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._buckets.clear()
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[record.msg] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[record.msg] = (tokens - 1, now, 0)
+        if suppressed:
+            record.fields = dict(record.fields, suppressed=suppressed)
+        return True
+
+
+class ConnectionLogger(logging.LoggerAdapter):
+    """
+    Attach per-connection fields, such as the peer address, to records.
+
+    >>> log = ConnectionLogger(logger, peer=addr)
+    >>> log.info('Authenticated %r', username)
+    """
+
+    def __init__(self, logger, **fields):
+        super().__init__(logger, fields)
+
+    def process(self, msg, kwargs):
+        extra = kwargs.setdefault('extra', {})
+        extra['fields'] = dict(self.extra, **extra.get('fields', {}))
+        return msg, kwargs
+
+
+def connection_logger(addr, **fields):
+    """Return a `ConnectionLogger` for a client at ``addr``."""
+    if addr:
+        fields['peer'] = f'{addr[0]}:{addr[1]}'
+    return ConnectionLogger(logger, **fields)
+
+
+_configured = False
+_listener = None
+_queue_handler = None
+# The arguments `configure_logging` attached the handlers with.
+_arguments = None
+
+
+def configure_logging(
+    level=None,
+    path=None,
+    stream=None,
+    queued=None,
+    rate=RATE,
+    burst=BURST
+):
+    """
+    Attach handlers to the ``ssh`` logger. Calling it again only changes
+    the level.
+
+    :param level: a level name or number; defaults to ``$SSH_LOG_LEVEL``
+    :param str path:
+        log file, or ``''`` for none; defaults to ``$SSH_LOG_FILE``, or
+        `LOG_PATH` if unset
+    :param stream: stream for console output; defaults to stdout
+    :param bool queued:
+        write from a background thread; defaults to ``$SSH_LOG_QUEUE``
+        (on unless set to ``0``)
+    :param float rate: per-message rate limit for per-connection records
+    :param int burst: burst size for the rate limit
+    """
+    global _configured, _listener, _queue_handler, _arguments
+
+    if level is None:
+        level = os.environ.get('SSH_LOG_LEVEL', 'INFO')
+    if isinstance(level, str):
+        level = level.upper()
+    logger.setLevel(level)
+    if _configured:
+        return
+    _configured = True
+    _arguments = (path, stream, queued, rate, burst)
+
+    if path is None:
+        path = os.environ.get('SSH_LOG_FILE', LOG_PATH)
+    if queued is None:
+        queued = os.environ.get('SSH_LOG_QUEUE', '1') != '0'
+
+    formatter = FieldsFormatter(FORMAT)
+    handlers = [logging.StreamHandler(stream or sys.stdout)]
+    if path:
+        handlers.append(logging.FileHandler(path, delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    rate_limit = RateLimitFilter(rate, burst)
+    if not queued:
+        logger.addFilter(rate_limit)
+        for handler in handlers:
+            logger.addHandler(handler)
+        return
+
+    _queue_handler = DropQueueHandler(queue.Queue(QUEUE_SIZE))
+    _queue_handler.addFilter(rate_limit)
+    logger.addHandler(_queue_handler)
+    _listener = BlockingSentinelListener(_queue_handler.queue, *handlers)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def configure_after_fork():
+    """
+    Set the queued pipeline up again in a forked child. The child inherits
+    the queue handler but not the listener thread that drains the queue,
+    so its records would fill the queue and then be dropped.
+    """
+    global _configured, _listener, _queue_handler
+
+    if _listener is None:
+        return
+    logger.removeHandler(_queue_handler)
+    _configured = False
+    _listener = None
+    _queue_handler = None
+    configure_logging(logger.level, *_arguments)
+
+
+def dropped_records():
+    """Number of records dropped because the queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,147 @@
+"""
+Selector-based event loop.
+
+One thread multiplexes readiness events for any number of file objects
+(sockets, paramiko channels, pipes). Other threads hand work to the loop
+with `EventLoop.call_soon`, which wakes it up through a self-pipe.
+"""
+
+import heapq
+import logging
+import os
+import selectors
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger('ssh')
+
+EVENT_READ = selectors.EVENT_READ
+EVENT_WRITE = selectors.EVENT_WRITE
+
+
+class EventLoop:
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+        self._ready = deque()
+        self._timers = []
+        self._timer_seq = 0
+        self._running = False
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self.selector.register(self._wake_r, EVENT_READ, self._on_wakeup)
+
+    def register(self, fileobj, callback, events=EVENT_READ):
+        """
+        Call ``callback(fileobj, mask)`` whenever ``fileobj`` is ready.
+
+        Must be called from the loop thread (use `call_soon` otherwise).
+        """
+        self.selector.register(fileobj, events, callback)
+
+    def modify(self, fileobj, callback, events=EVENT_READ):
+        """Change the events or callback registered for ``fileobj``."""
+        self.selector.modify(fileobj, events, callback)
+
+    def unregister(self, fileobj):
+        """Stop watching ``fileobj``. Unknown file objects are ignored."""
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def is_registered(self, fileobj):
+        try:
+            self.selector.get_key(fileobj)
+        except (KeyError, ValueError):
+            return False
+        return True
+
+    def call_soon(self, callback, *args):
+        """
+        Schedule ``callback(*args)`` on the loop thread. Safe to call from
+        any thread.
+        """
+        self._ready.append((callback, args))
+        if threading.current_thread() is not self.thread:
+            self._wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Schedule ``callback(*args)`` to run after ``delay`` seconds. Must be
+        called from the loop thread.
+        """
+        self._timer_seq += 1
+        heapq.heappush(
+            self._timers,
+            (time.monotonic() + delay, self._timer_seq, callback, args)
+        )
+
+    def run(self):
+        """Run the loop in the calling thread until `stop` is called."""
+        self.thread = threading.current_thread()
+        self._running = True
+        try:
+            while self._running:
+                self._run_once()
+        finally:
+            self.thread = None
+
+    def start_thread(self, name='ssh-loop'):
+        """Run the loop in a new daemon thread and return the thread."""
+        thread = threading.Thread(target=self.run, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Ask the loop to return from `run`. Safe to call from any thread."""
+        self._running = False
+        self._wakeup()
+
+    def close(self):
+        self.selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _run_once(self):
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, self._timers[0][0] - time.monotonic())
+        else:
+            timeout = None
+
+        for key, mask in self.selector.select(timeout):
+            self._invoke(key.data, key.fileobj, mask)
+
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            self._invoke(callback, *args)
+
+        for _ in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            self._invoke(callback, *args)
+
+    def _invoke(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('Unhandled error in event loop callback')
+
+    def _wakeup(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _on_wakeup(self, fd, mask):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
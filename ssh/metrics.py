@@ -0,0 +1,253 @@
+"""
+Session metrics.
+
+`Metrics` holds counters, gauges and per-phase latency histograms for a
+server. Recording is a dictionary update and a bucket increment under an
+uncontended lock, cheap enough to leave on under full load.
+
+The phases of a server session are:
+
+* ``accept``: from ``accept()`` returning to a thread picking the
+  connection up;
+* ``banner``: from then until the client's SSH banner has been read;
+* ``kex``: key exchange;
+* ``auth``: from the end of key exchange until a key is accepted;
+* ``check_auth_publickey``: time spent in that callback;
+* ``channel_wait``: from authentication until the first channel opens
+  (the ``transport.accept`` wait);
+* ``session``: from the first channel opening until the connection
+  closes;
+* ``exec_start``: from an exec or shell request until its process has
+  started, including any wait for a free process slot.
+
+`Metrics.snapshot` returns everything as a plain `dict` (the in-process
+stats API), `merge` combines snapshots from several processes, and
+`render_prometheus` formats a snapshot in the Prometheus text format.
+`MetricsServer` serves it over HTTP on a local port.
+"""
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PREFIX = 'ssh'
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0
+)
+PHASES = (
+    'accept',
+    'banner',
+    'kex',
+    'auth',
+    'check_auth_publickey',
+    'channel_wait',
+    'session',
+    'exec_start',
+)
+COUNTERS = (
+    'connections',
+    'handshakes',
+    'auth_failures',
+    'channel_opens',
+    'bytes_in',
+    'bytes_out',
+    'closed',
+    'rejected',
+    'timeouts',
+    'forwards',
+    'forwards_denied',
+    'forwards_failed',
+    'remote_forwards',
+    'remote_forwards_denied',
+    'remote_forwards_failed',
+    'forwarded_connections',
+    'execs',
+    'execs_rejected',
+    'rejected_rate',
+    'rejected_auth_failures',
+    'rejected_handshakes',
+    'auth_tries_exceeded',
+    'keepalives',
+    'dead_peers',
+    'recorded_bytes',
+    'recording_dropped_bytes',
+)
+GAUGES = (
+    'active_sessions',
+    'active_channels',
+    'forward_listeners',
+    'active_processes',
+    'handshakes_in_flight',
+)
+
+
+class Histogram:
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class Metrics:
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.gauges = dict.fromkeys(GAUGES, 0)
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        """Add ``value`` to counter ``name``."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, delta):
+        """Move gauge ``name`` by ``delta``."""
+        with self._lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def observe(self, phase, seconds):
+        """Record that ``phase`` took ``seconds``."""
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase):
+        """Time the body of a ``with`` block as ``phase``."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.monotonic() - start)
+
+    def snapshot(self):
+        """Return all metrics as a JSON-serialisable `dict`."""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'phases': {
+                    name: histogram.snapshot()
+                    for name, histogram in self.phases.items()
+                },
+            }
+
+
+def merge(snapshots):
+    """Sum a sequence of `Metrics.snapshot` results into one snapshot."""
+    total = {'counters': {}, 'gauges': {}, 'phases': {}}
+    for snapshot in snapshots:
+        for kind in ('counters', 'gauges'):
+            for name, value in snapshot.get(kind, {}).items():
+                total[kind][name] = total[kind].get(name, 0) + value
+        for name, histogram in snapshot.get('phases', {}).items():
+            merged = total['phases'].setdefault(name, {
+                'counts': [0] * len(histogram['counts']),
+                'sum': 0.0,
+                'count': 0,
+            })
+            merged['counts'] = [
+                a + b for a, b in zip(merged['counts'], histogram['counts'])
+            ]
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+    return total
+
+
+def render_prometheus(snapshot):
+    """Format a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        metric = f'{PREFIX}_{name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    for name, value in sorted(snapshot['gauges'].items()):
+        metric = f'{PREFIX}_{name}'
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric} {value}')
+
+    metric = f'{PREFIX}_phase_seconds'
+    lines.append(f'# TYPE {metric} histogram')
+    for phase, histogram in snapshot['phases'].items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram['counts']):
+            cumulative += count
+            lines.append(
+                f'{metric}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{metric}_sum{{phase="{phase}"}} {histogram["sum"]}')
+        lines.append(f'{metric}_count{{phase="{phase}"}} {histogram["count"]}')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Serve ``/metrics`` (Prometheus text) and ``/stats`` (JSON) for a
+    callable returning a snapshot.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, snapshot, host='127.0.0.1', port=9022):
+        """
+        :param snapshot: a callable returning a `Metrics.snapshot` `dict`
+        """
+        self.snapshot = snapshot
+        super().__init__((host, port), _MetricsHandler)
+
+    def start(self):
+        """Serve from a daemon thread and return the thread."""
+        thread = threading.Thread(
+            target=self.serve_forever,
+            name='ssh-metrics',
+            daemon=True
+        )
+        thread.start()
+        return thread
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = render_prometheus(self.server.snapshot()).encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/stats':
+            body = json.dumps(self.server.snapshot()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,195 @@
+"""
+Pipelined requests over one channel.
+
+`pipelined` writes payloads from any iterable on a background thread
+while replies are read on the calling thread, so up to ``window``
+requests are in flight at once instead of one per round trip. Replies
+are split out of the byte stream by a framer, which copes with replies
+arriving in pieces or several to a read, and are yielded in order
+(`send_all` passes them to a callback instead)::
+
+    for reply in pipelined(channel, payloads, LengthFramer()):
+        ...
+
+`LineFramer` sends and splits newline-terminated messages, and
+`LengthFramer` prefixes each message with its length as a 4-byte big
+endian integer, which suits binary payloads.
+"""
+
+import socket
+import struct
+import threading
+import time
+
+
+WINDOW = 64
+CHUNK_SIZE = 64 * 1024
+POLL_INTERVAL = 0.1
+
+
+class LineFramer:
+    """Newline-terminated messages; replies exclude the newline."""
+
+    def encode(self, payload):
+        return payload if payload.endswith(b'\n') else payload + b'\n'
+
+    def decoder(self):
+        return _LineDecoder()
+
+
+class _LineDecoder:
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes and return the messages now complete."""
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            messages.append(bytes(buffer[start:end]))
+            start = end + 1
+        del buffer[:start]
+        return messages
+
+
+class LengthFramer:
+    """Messages prefixed with their length as a 4-byte big endian int."""
+
+    header = struct.Struct('>I')
+
+    def encode(self, payload):
+        return self.header.pack(len(payload)) + payload
+
+    def decoder(self):
+        return _LengthDecoder(self.header)
+
+
+class _LengthDecoder:
+
+    def __init__(self, header):
+        self.header = header
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes and return the messages now complete."""
+        buffer = self.buffer
+        buffer += data
+        size = self.header.size
+        messages = []
+        start = 0
+        while len(buffer) - start >= size:
+            (length,) = self.header.unpack_from(buffer, start)
+            end = start + size + length
+            if len(buffer) < end:
+                break
+            messages.append(bytes(buffer[start + size:end]))
+            start = end
+        del buffer[:start]
+        return messages
+
+
+def pipelined(
+    channel,
+    payloads,
+    framer=None,
+    window=WINDOW,
+    chunk_size=CHUNK_SIZE
+):
+    """
+    Send every payload in ``payloads`` on ``channel`` with up to
+    ``window`` awaiting a reply, and yield the replies in order.
+
+    The channel's timeout, if any, applies to the wait for each read.
+
+    :param .Channel channel: an open channel that answers each message
+    :param payloads: an iterable of `bytes`; it may be a generator
+    :param framer: a `LineFramer` (the default) or `LengthFramer`
+    :param int window: requests allowed in flight at once
+    :param int chunk_size: largest read from the channel
+    :raises EOFError: if the channel closes before every reply arrived
+    """
+    framer = framer or LineFramer()
+    decoder = framer.decoder()
+    credits = threading.Semaphore(window)
+    state = {'sent': 0, 'done': False, 'error': None}
+    stop = threading.Event()
+
+    def send():
+        try:
+            for payload in payloads:
+                credits.acquire()
+                if stop.is_set():
+                    return
+                view = memoryview(framer.encode(payload))
+                while view:
+                    try:
+                        sent = channel.send(view)
+                    except socket.timeout:
+                        if stop.is_set():
+                            return
+                        continue
+                    if not sent:
+                        raise EOFError('Channel closed')
+                    view = view[sent:]
+                state['sent'] += 1
+        except Exception as exc:
+            state['error'] = exc
+        finally:
+            state['done'] = True
+
+    timeout = channel.gettimeout()
+    # Wake up now and then to notice that the sender has finished.
+    channel.settimeout(POLL_INTERVAL)
+    sender = threading.Thread(
+        target=send,
+        name='ssh-pipeline',
+        daemon=True
+    )
+    sender.start()
+    received = 0
+    last_read = time.monotonic()
+    try:
+        while not (state['done'] and received >= state['sent']):
+            try:
+                data = channel.recv(chunk_size)
+            except socket.timeout:
+                if (
+                    timeout is not None
+                    and time.monotonic() - last_read > timeout
+                ):
+                    raise
+                continue
+            if not data:
+                raise EOFError(
+                    f'Channel closed after {received} of '
+                    f"{state['sent']} replies"
+                )
+            last_read = time.monotonic()
+            for reply in decoder.feed(data):
+                received += 1
+                credits.release()
+                yield reply
+        if state['error'] is not None:
+            raise state['error']
+    finally:
+        stop.set()
+        credits.release()
+        channel.settimeout(timeout)
+
+
+def send_all(channel, payloads, on_reply, framer=None, window=WINDOW):
+    """
+    Like `pipelined`, but pass each reply to ``on_reply`` and return the
+    number of replies.
+    """
+    count = 0
+    for reply in pipelined(channel, payloads, framer, window):
+        on_reply(reply)
+        count += 1
+    return count
@@ -0,0 +1,421 @@
+"""
+Pool of authenticated client transports.
+
+`ConnectionPool` keeps transports open per ``(host, port, username)`` and
+opens new channels on them, so a job pays for a channel open instead of
+a TCP connection, key exchange and authentication::
+
+    pool = ConnectionPool()
+    with pool.session('localhost', 2222) as channel:
+        channel.sendall(b'data')
+
+A transport carries at most ``max_channels`` channels at once, and at
+most ``max_host_channels`` are open to one host at a time; callers wait
+for a free slot beyond that. Transports idle for ``health_interval``
+seconds are checked with a keepalive round trip before they are reused.
+Transports idle for ``idle_timeout`` are closed, and the least recently
+used idle transports are closed when more than ``max_transports`` are
+open. With ``keepalive_interval``, transports whose server stops
+answering are closed by a `.Keepalive`, so jobs blocked on them end.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import paramiko
+from paramiko.common import (
+    MSG_REQUEST_FAILURE,
+    MSG_REQUEST_SUCCESS,
+    cMSG_GLOBAL_REQUEST,
+)
+from paramiko.message import Message
+from paramiko.ssh_exception import SSHException
+
+from .certificates import certificate_transport
+from .client import KEY_DIR
+from .keepalive import COUNT_MAX, KEEPALIVE_REQUEST, Keepalive
+from .keys import known_hosts, private_key
+from .known_hosts import ACCEPT_NEW, HostKeyPolicy, host_name
+
+
+logger = logging.getLogger('ssh')
+
+MAX_CHANNELS = 10
+MAX_TRANSPORTS = 64
+IDLE_TIMEOUT = 300.0
+HEALTH_INTERVAL = 30.0
+TIMEOUT = 30.0
+
+
+class _Probe:
+    """
+    Keepalive round trips on one transport. Replies to them are taken off
+    the transport before paramiko sees them, as `.Keepalive` does with
+    its own, so that the ``completion_event`` of a concurrent
+    `.Transport.global_request` is left alone and never gets one.
+    """
+
+    __slots__ = ('transport', 'sent', 'answered', 'replied')
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.sent = 0
+        self.answered = 0
+        self.replied = threading.Condition()
+        handlers = transport._handler_table
+        for ptype in (MSG_REQUEST_SUCCESS, MSG_REQUEST_FAILURE):
+            handlers[ptype] = self._reply_handler(handlers[ptype])
+
+    def ping(self, timeout=TIMEOUT):
+        """
+        Send a ``keepalive@openssh.com`` global request and wait up to
+        ``timeout`` seconds for its reply.
+
+        :return: ``True`` if the peer answered and the transport is still
+            open
+        """
+        transport = self.transport
+        if not transport.is_active():
+            return False
+        event = transport.completion_event
+        if event is not None and not event.is_set():
+            # Another global request waits for its reply, which comes
+            # first and would be taken for this one's. It answers for the
+            # peer just as well.
+            return event.wait(timeout) and transport.is_active()
+        m = Message()
+        m.add_byte(cMSG_GLOBAL_REQUEST)
+        m.add_string(KEEPALIVE_REQUEST)
+        m.add_boolean(True)
+        with self.replied:
+            self.sent += 1
+            sent = self.sent
+        # Not under the lock: sending waits out a rekey, which the
+        # transport thread may not finish while a reply handler waits.
+        transport._send_user_message(m)
+        with self.replied:
+            answered = self.replied.wait_for(
+                lambda: self.answered >= sent or not transport.is_active(),
+                timeout
+            )
+        return answered and transport.is_active()
+
+    def _reply_handler(self, handler):
+        def handle(m):
+            with self.replied:
+                if self.answered < self.sent:
+                    # Replies come in the order requests were sent.
+                    self.answered += 1
+                    self.replied.notify_all()
+                    return
+            handler(m)
+
+        return handle
+
+
+class _Connection:
+
+    __slots__ = (
+        'key',
+        'client',
+        'transport',
+        'probe',
+        'channels',
+        'last_used',
+    )
+
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.transport = client.get_transport()
+        self.probe = _Probe(self.transport)
+        self.channels = 0
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+
+    def __init__(
+        self,
+        pkey=None,
+        max_channels=MAX_CHANNELS,
+        max_host_channels=None,
+        max_transports=MAX_TRANSPORTS,
+        idle_timeout=IDLE_TIMEOUT,
+        health_interval=HEALTH_INTERVAL,
+        timeout=TIMEOUT,
+        known_hosts=None,
+        host_key_policy=ACCEPT_NEW,
+        keepalive_interval=None,
+        keepalive_count_max=COUNT_MAX
+    ):
+        """
+        :param .PKey pkey:
+            the key to authenticate with; defaults to
+            ``keys/client/id_ecdsa``
+        :param int max_channels: concurrent channels per transport
+        :param int max_host_channels:
+            concurrent channels per ``(host, port, username)``, or ``None``
+        :param int max_transports:
+            open transports to keep; the least recently used idle ones are
+            closed beyond this
+        :param float idle_timeout: close transports unused for this long
+        :param float health_interval:
+            check transports unused for this long before reusing them
+        :param float timeout: connect, channel open and wait timeout
+        :param str known_hosts: host keys file, defaults to the client's
+        :param str host_key_policy:
+            ``"yes"``, ``"accept-new"`` or ``"no"``, see `.HostKeyPolicy`
+        :param float keepalive_interval:
+            probe transports that sent nothing for this many seconds, or
+            ``None`` for no keepalives
+        :param int keepalive_count_max:
+            close transports whose server stayed silent for this many
+            keepalive intervals
+        """
+        if pkey is None:
+            pkey = private_key(os.path.join(KEY_DIR, 'id_ecdsa'))
+        self.pkey = pkey
+        self.max_channels = max_channels
+        self.max_host_channels = max_host_channels
+        self.max_transports = max_transports
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.known_hosts = known_hosts or os.path.join(KEY_DIR, 'known_hosts')
+        self.host_key_policy = host_key_policy
+        self.keepalive = None
+        if keepalive_interval:
+            self.keepalive = Keepalive(keepalive_interval, keepalive_count_max)
+        self.stats = dict.fromkeys(
+            ('handshakes', 'reused', 'health_checks', 'evicted'), 0
+        )
+        # Every open connection, least recently used first.
+        self._connections = OrderedDict()
+        # Open channels, and reserved slots, per key.
+        self._host_channels = {}
+        self._channels = {}
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._connections)
+
+    def open_session(self, host, port=22, username='user'):
+        """
+        Open a session channel to ``host``, on a pooled transport if one
+        has room. Pass the channel to `release` when done with it.
+
+        :raises TimeoutError:
+            if no channel slot for the host frees up within ``timeout``
+        """
+        key = (host, port, username)
+        for attempt in range(2):
+            conn = self._acquire(key)
+            try:
+                channel = conn.transport.open_session(timeout=self.timeout)
+            except (SSHException, EOFError, OSError):
+                self._discard(conn)
+                if attempt:
+                    raise
+                continue
+            with self._cond:
+                self._channels[channel] = conn
+            return channel
+
+    def release(self, channel):
+        """Close a channel from `open_session` and free its slot."""
+        channel.close()
+        with self._cond:
+            conn = self._channels.pop(channel, None)
+            if conn is None:
+                return
+            conn.channels -= 1
+            self._host_channels[conn.key] -= 1
+            conn.last_used = time.monotonic()
+            self._connections.move_to_end(conn)
+            self._cond.notify_all()
+        if not conn.transport.is_active():
+            self._discard(conn)
+
+    @contextmanager
+    def session(self, host, port=22, username='user'):
+        """`open_session` as a context manager that releases the channel."""
+        channel = self.open_session(host, port, username)
+        try:
+            yield channel
+        finally:
+            self.release(channel)
+
+    def close(self):
+        """Close every pooled transport."""
+        with self._cond:
+            connections = list(self._connections)
+            self._connections.clear()
+            self._channels.clear()
+            self._host_channels.clear()
+            self._cond.notify_all()
+        _close(connections)
+
+    def _acquire(self, key):
+        """
+        Reserve a channel slot for ``key`` on a healthy connection,
+        connecting if no open connection has room.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                conn, idle = self._reserve(key, deadline)
+            _close(idle)
+            if conn is None:
+                break
+            if time.monotonic() - conn.last_used < self.health_interval:
+                self._count('reused')
+                return conn
+            self._count('health_checks')
+            if conn.probe.ping(self.timeout):
+                conn.last_used = time.monotonic()
+                self._count('reused')
+                return conn
+            logger.info('Pooled transport to %r failed health check', key)
+            self._discard(conn)
+
+        try:
+            conn = self._connect(key)
+        except Exception:
+            with self._cond:
+                self._host_channels[key] -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.stats['handshakes'] += 1
+            conn.channels = 1
+            self._connections[conn] = None
+            idle = self._evict()
+        _close(idle)
+        return conn
+
+    def _reserve(self, key, deadline):
+        """
+        Take a channel slot for ``key``: on an open connection with room,
+        which is returned, or for a new connection, and ``None`` is
+        returned. Called with the lock held.
+
+        :return: ``(connection, idle)``, where ``idle`` lists the expired
+            connections for the caller to close once it releases the lock
+        """
+        while (
+            self.max_host_channels is not None
+            and self._host_channels.get(key, 0) >= self.max_host_channels
+        ):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'No free channel slot for {key!r}')
+            self._cond.wait(remaining)
+
+        idle = self._expire()
+        self._host_channels[key] = self._host_channels.get(key, 0) + 1
+        for conn in reversed(self._connections):
+            if (
+                conn.key == key
+                and conn.channels < self.max_channels
+                and conn.transport.is_active()
+            ):
+                conn.channels += 1
+                self._connections.move_to_end(conn)
+                return conn, idle
+        return None, idle
+
+    def _connect(self, key):
+        host, port, username = key
+        client = paramiko.SSHClient()
+        # As with load_system_host_keys, save_host_keys never rewrites
+        # the file; the policy appends new keys to the shared store.
+        store = known_hosts(self.known_hosts)
+        client._system_host_keys = store
+        client.set_missing_host_key_policy(
+            HostKeyPolicy(store, self.host_key_policy)
+        )
+        transport_factory = None
+        if store.authorities(host_name(host, port)):
+            transport_factory = certificate_transport()
+        client.connect(
+            hostname=host,
+            port=port,
+            username=username,
+            pkey=self.pkey,
+            timeout=self.timeout,
+            banner_timeout=self.timeout,
+            auth_timeout=self.timeout,
+            allow_agent=False,
+            look_for_keys=False,
+            transport_factory=transport_factory
+        )
+        client.get_transport().sock.setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+        if self.keepalive is not None:
+            self.keepalive.watch(client.get_transport())
+        return _Connection(key, client)
+
+    def _discard(self, conn):
+        """Close ``conn`` and drop it and its channel slots from the pool."""
+        with self._cond:
+            if self._connections.pop(conn, False) is not False:
+                self._host_channels[conn.key] -= conn.channels
+                for channel in [
+                    c for c, owner in self._channels.items() if owner is conn
+                ]:
+                    del self._channels[channel]
+                self._cond.notify_all()
+        conn.client.close()
+
+    def _count(self, name):
+        with self._cond:
+            self.stats[name] += 1
+
+    def _expire(self):
+        """
+        Drop connections idle longer than ``idle_timeout`` from the pool.
+        Called with the lock held; closing them is left to the caller, so
+        that their teardown does not hold up other threads.
+
+        :return: the dropped connections
+        """
+        now = time.monotonic()
+        idle = []
+        for conn in list(self._connections):
+            if now - conn.last_used < self.idle_timeout:
+                break
+            if conn.channels == 0:
+                idle.append(self._drop_idle(conn))
+        return idle
+
+    def _evict(self):
+        """
+        Drop least recently used idle connections over the limit, as
+        `_expire` does.
+        """
+        excess = len(self._connections) - self.max_transports
+        idle = []
+        for conn in list(self._connections):
+            if excess <= 0:
+                break
+            if conn.channels == 0:
+                idle.append(self._drop_idle(conn))
+                excess -= 1
+        return idle
+
+    def _drop_idle(self, conn):
+        del self._connections[conn]
+        self.stats['evicted'] += 1
+        return conn
+
+
+def _close(connections):
+    for conn in connections:
+        conn.client.close()
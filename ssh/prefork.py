@@ -0,0 +1,287 @@
+"""
+Multi-process (prefork) server mode.
+
+`Supervisor` starts N worker processes, each running its own `.SSHServer`
+so key exchange and ciphers are spread across cores instead of sharing
+one GIL. Workers either bind the same address with ``SO_REUSEPORT`` (the
+kernel balances new connections between them) or inherit one listening
+socket created by the supervisor.
+
+The supervisor restarts workers that exit unexpectedly and combines the
+`.SSHServer.metrics` each worker reports, see `Supervisor.snapshot`.
+`Supervisor.reload` and `Supervisor.drain` reload and drain every
+worker. `Supervisor.upgrade` hands the shared socket to a new supervisor,
+see `.handoff`; with ``SO_REUSEPORT`` there is no one socket to hand
+over.
+
+Start it with ``python3 -m ssh.server --workers N``.
+"""
+
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+
+from . import handoff, logger
+from .log import configure_after_fork, shutdown_logging
+from .metrics import merge
+
+
+REPORT_INTERVAL = 1.0
+RESTART_DELAY = 1.0
+
+
+def _context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _worker_main(index, host, port, reuse_port, sock, stats_queue, kwargs):
+    """Entry point of a worker process."""
+    from .server import SSHServer
+
+    configure_after_fork()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # Not the supervisor's handlers, inherited with fork.
+    for signum in (signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR2):
+        signal.signal(signum, signal.SIG_IGN)
+    server = SSHServer(host, port, reuse_port=reuse_port, sock=sock, **kwargs)
+    handoff.handle_signals(server, upgrades=False)
+
+    def report():
+        while True:
+            time.sleep(REPORT_INTERVAL)
+            stats_queue.put((index, os.getpid(), server.snapshot()))
+
+    threading.Thread(target=report, name='ssh-stats', daemon=True).start()
+    logger.info('Worker %d started with pid %d', index, os.getpid())
+    try:
+        server.start()
+    finally:
+        stats_queue.put((index, os.getpid(), server.snapshot()))
+        # multiprocessing ends the process without running atexit.
+        shutdown_logging()
+
+
+class Supervisor:
+
+    def __init__(
+        self,
+        host,
+        port,
+        workers,
+        reuse_port=True,
+        sock=None,
+        **kwargs
+    ):
+        """
+        :param int workers: number of worker processes
+        :param bool reuse_port:
+            bind each worker with ``SO_REUSEPORT``; if ``False`` (or the
+            platform lacks it) workers share one inherited socket
+        :param socket.socket sock:
+            an already listening socket for the workers to share, e.g.
+            one passed down by `.handoff.upgrade`
+        :param kwargs: passed on to each worker's `.SSHServer`
+        """
+        self.addr = (host, port)
+        self.workers = workers
+        self.reuse_port = (
+            sock is None and reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        )
+        self.kwargs = kwargs
+        self.socket = sock
+        self.metrics_server = None
+        self.draining = False
+        self.processes = {}
+        self.restarts = 0
+        self._ctx = _context()
+        self._stats_queue = self._ctx.Queue()
+        self._live_stats = {}
+        # Counters and histograms of workers that have exited.
+        self._retired = merge([])
+        self._stopping = False
+        self._upgrade_lock = threading.Lock()
+
+    def start(self, on_ready=None):
+        """
+        Start the workers and supervise them until interrupted, or until
+        they have drained.
+
+        :param on_ready:
+            called once every worker has started and reported its stats
+        """
+        if not self.reuse_port and self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(self.addr)
+            self.socket.listen(self.kwargs.get('backlog', 128))
+
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(
+            'Supervising %d workers on %r (%s)',
+            self.workers,
+            self.addr,
+            'SO_REUSEPORT' if self.reuse_port else 'shared socket'
+        )
+
+        try:
+            while not self.draining or any(
+                process.is_alive() for process, _ in self.processes.values()
+            ):
+                self._collect(timeout=REPORT_INTERVAL)
+                if on_ready is not None and (
+                    len(self._live_stats) >= self.workers
+                ):
+                    on_ready()
+                    on_ready = None
+                self._reap()
+        except KeyboardInterrupt:
+            logger.info('Stopping workers')
+        finally:
+            self.stop()
+
+    def reload(self):
+        """Reload every worker, see `.SSHServer.reload`."""
+        self._signal_workers(signal.SIGHUP)
+        return True
+
+    def drain(self):
+        """
+        Drain every worker, see `.SSHServer.drain`, and stop restarting
+        them: `start` returns once they have all exited.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        self._stopping = True
+        logger.info('Draining workers')
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        self._signal_workers(signal.SIGQUIT)
+
+    def upgrade(self, argv=None):
+        """
+        Hand the shared socket to a new supervisor, see
+        `.handoff.upgrade`, and `drain` once it is ready.
+
+        :return: ``True`` if the new supervisor took over
+        """
+        if self.socket is None:
+            logger.warning(
+                'Cannot upgrade: workers bound with SO_REUSEPORT have no '
+                'shared socket to hand over, see --shared-socket'
+            )
+            return False
+        if not self._upgrade_lock.acquire(blocking=False):
+            logger.warning('Upgrade already in progress')
+            return False
+        try:
+            if self.draining or handoff.upgrade(self.socket, argv) is None:
+                return False
+            self.drain()
+            return True
+        finally:
+            self._upgrade_lock.release()
+
+    def _signal_workers(self, signum):
+        for process, _ in list(self.processes.values()):
+            if process.is_alive():
+                try:
+                    os.kill(process.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def stop(self):
+        self._stopping = True
+        for process, _ in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.processes.values():
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+        self._collect(timeout=0)
+        if self.socket is not None:
+            self.socket.close()
+        logger.info(
+            'Combined worker counters: %r',
+            self.snapshot()['counters']
+        )
+
+    def snapshot(self):
+        """
+        Combined metrics of all workers, including the counters of workers
+        that have exited since the supervisor started.
+        """
+        live = [stats for _, stats in self._live_stats.values()]
+        total = merge(live + [self._retired])
+        total['gauges']['workers'] = sum(
+            1 for process, _ in self.processes.values() if process.is_alive()
+        )
+        total['counters']['restarts'] = self.restarts
+        return total
+
+    def _spawn(self, index):
+        host, port = self.addr
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                index,
+                host,
+                port,
+                self.reuse_port,
+                self.socket,
+                self._stats_queue,
+                self.kwargs
+            ),
+            name=f'ssh-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = (process, time.monotonic())
+
+    def _collect(self, timeout):
+        """Drain stats reports from the workers."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                index, pid, stats = self._stats_queue.get(
+                    timeout=max(0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                return
+            process, _ = self.processes.get(index, (None, None))
+            if process is not None and process.pid == pid:
+                self._live_stats[index] = (pid, stats)
+
+    def _reap(self):
+        """Restart workers that have exited."""
+        if self._stopping:
+            return
+        for index, (process, started) in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            logger.warning(
+                'Worker %d (pid %d) exited with code %r',
+                index,
+                process.pid,
+                process.exitcode
+            )
+            pid, stats = self._live_stats.pop(index, (None, {}))
+            if pid == process.pid:
+                stats.pop('gauges', None)
+                self._retired = merge([self._retired, stats])
+            if time.monotonic() - started < RESTART_DELAY:
+                # Crashing on startup; don't spin.
+                time.sleep(RESTART_DELAY)
+            self.restarts += 1
+            self._spawn(index)
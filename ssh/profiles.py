@@ -0,0 +1,184 @@
+"""
+Algorithm profiles.
+
+A `SecurityProfile` orders and limits the ciphers, key exchanges, MACs
+and host key types a `.Transport` offers. The same profile is applied to
+the server's transports and to clients, see `SecurityProfile.transport`.
+paramiko picks, for each kind, the first of the client's algorithms the
+server also offers.
+
+``default`` leaves paramiko's own lists alone. ``modern`` offers only
+AEAD and CTR ciphers, elliptic-curve key exchange, encrypt-then-MAC SHA-2
+MACs and no SHA-1 or RSA/SHA-1 signatures. ``compatible`` keeps the
+``modern`` order but still accepts CBC ciphers, SHA-1 and non-ETM MACs
+and the finite-field groups, for older clients.
+
+``fast`` is ordered by what ``python3 -m ssh.bench algorithms`` measures.
+On x86-64 with AES-NI, AES-GCM moves about 1.6 times the data of AES-CTR
+with HMAC-SHA2-256, as it needs no separate MAC. Elliptic-curve key
+exchanges take a few milliseconds where the finite-field groups take 50
+or more, and RSA host keys add a millisecond or two over Ed25519 and
+ECDSA. Among the curves, curve25519 and nistp256 cost the same.
+"""
+
+
+class SecurityProfile:
+    """
+    Algorithms to offer, most preferred first; ``None`` keeps paramiko's
+    list.
+    """
+
+    __slots__ = ('name', 'ciphers', 'kex', 'macs', 'key_types')
+
+    def __init__(
+        self,
+        name,
+        ciphers=None,
+        kex=None,
+        macs=None,
+        key_types=None
+    ):
+        """
+        :param str name: the profile's name
+        :param ciphers: cipher names, e.g. ``"aes128-gcm@openssh.com"``
+        :param kex: key exchange names, e.g. ``"curve25519-sha256@libssh.org"``
+        :param macs: MAC names, e.g. ``"hmac-sha2-256-etm@openssh.com"``
+        :param key_types: host key types, e.g. ``"ssh-ed25519"``
+        """
+        self.name = name
+        self.ciphers = _tuple(ciphers)
+        self.kex = _tuple(kex)
+        self.macs = _tuple(macs)
+        self.key_types = _tuple(key_types)
+
+    def __repr__(self):
+        return f'<SecurityProfile {self.name}>'
+
+    def apply(self, transport):
+        """
+        Offer this profile's algorithms on ``transport``, which must not
+        have started negotiating. Algorithms this paramiko does not
+        support are left out.
+        """
+        options = transport.get_security_options()
+        for attribute, option, supported in (
+            ('ciphers', 'ciphers', transport._cipher_info),
+            ('kex', 'kex', transport._kex_info),
+            ('macs', 'digests', transport._mac_info),
+            ('key_types', 'key_types', transport._key_info),
+        ):
+            names = getattr(self, attribute)
+            if names is None:
+                continue
+            names = tuple(name for name in names if name in supported)
+            if not names:
+                raise ValueError(
+                    f'Profile {self.name!r} has no supported {attribute}'
+                )
+            setattr(options, option, names)
+        return transport
+
+    def transport(self, sock, transport_class=None, **kwargs):
+        """
+        Create a `.Transport` on ``sock`` offering this profile; pass as
+        ``transport_factory`` to `paramiko.SSHClient.connect`.
+
+        :param transport_class: a `.Transport` subclass to create instead
+        """
+        if transport_class is None:
+            from paramiko import Transport as transport_class
+
+        return self.apply(transport_class(sock, **kwargs))
+
+
+def _tuple(names):
+    if names is None:
+        return None
+    if isinstance(names, str):
+        names = names.split(',')
+    return tuple(names)
+
+
+_MODERN_KEX = (
+    'curve25519-sha256@libssh.org',
+    'ecdh-sha2-nistp256',
+    'ecdh-sha2-nistp384',
+    'ecdh-sha2-nistp521',
+)
+_MODERN_MACS = (
+    'hmac-sha2-256-etm@openssh.com',
+    'hmac-sha2-512-etm@openssh.com',
+)
+_MODERN_KEYS = (
+    'ssh-ed25519',
+    'ecdsa-sha2-nistp256',
+    'ecdsa-sha2-nistp384',
+    'ecdsa-sha2-nistp521',
+    'rsa-sha2-512',
+    'rsa-sha2-256',
+)
+
+PROFILES = {
+    'default': SecurityProfile('default'),
+    'modern': SecurityProfile(
+        'modern',
+        ciphers=(
+            'aes256-gcm@openssh.com',
+            'aes128-gcm@openssh.com',
+            'aes256-ctr',
+            'aes192-ctr',
+            'aes128-ctr',
+        ),
+        kex=_MODERN_KEX,
+        macs=_MODERN_MACS,
+        key_types=_MODERN_KEYS,
+    ),
+    'fast': SecurityProfile(
+        'fast',
+        ciphers=(
+            'aes128-gcm@openssh.com',
+            'aes256-gcm@openssh.com',
+            'aes128-ctr',
+            'aes256-ctr',
+        ),
+        kex=('curve25519-sha256@libssh.org', 'ecdh-sha2-nistp256'),
+        macs=('hmac-sha2-256-etm@openssh.com', 'hmac-sha2-256'),
+        key_types=('ssh-ed25519', 'ecdsa-sha2-nistp256', 'rsa-sha2-256'),
+    ),
+    'compatible': SecurityProfile(
+        'compatible',
+        ciphers=(
+            'aes256-gcm@openssh.com',
+            'aes128-gcm@openssh.com',
+            'aes256-ctr',
+            'aes192-ctr',
+            'aes128-ctr',
+            'aes256-cbc',
+            'aes192-cbc',
+            'aes128-cbc',
+        ),
+        kex=_MODERN_KEX + (
+            'diffie-hellman-group16-sha512',
+            'diffie-hellman-group-exchange-sha256',
+            'diffie-hellman-group14-sha256',
+        ),
+        macs=_MODERN_MACS + ('hmac-sha2-256', 'hmac-sha2-512', 'hmac-sha1'),
+        key_types=_MODERN_KEYS,
+    ),
+}
+DEFAULT_PROFILE = 'default'
+
+
+def get_profile(profile):
+    """
+    The `SecurityProfile` named ``profile``, or ``profile`` itself if it
+    already is one; ``None`` gives the default.
+    """
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if isinstance(profile, SecurityProfile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(f'Unknown profile {profile!r}') from None
@@ -0,0 +1,612 @@
+"""
+Session recording.
+
+With ``--record-dir DIR`` the server records the channel I/O of every
+session to a file in ``DIR``, along with an audit trail of what happened:
+who logged in with which key, which channels were opened, the shell,
+exec and subsystem requests made on them, exit statuses and closes.
+
+Sessions never write to disk themselves. A `Recording` appends frames to
+an in-memory block and hands it to its `Recorder` once it holds
+``block_size`` bytes, or after ``flush_interval`` seconds for a quiet
+session. Large `bytes` data is kept by reference rather than copied,
+and data echoed back to the client is stored once. The recorder's one
+background thread writes everything handed to it since its last pass,
+with one ``writev`` per file. At most ``max_buffered`` bytes wait to be
+written. When the disk cannot keep up, blocks beyond that are dropped
+rather than slowing sessions down, and the next block written starts
+with a `LOST` frame saying how many bytes are missing.
+
+A recording is two files named after the session. ``NAME.rec`` holds
+`MAGIC`, then frames, each a `FRAME` header followed by its data:
+
+- ``time``: microseconds since the session started, ``uint64``;
+- ``kind``: `INPUT`, `OUTPUT`, `STDERR`, `ECHO`, `EVENT` or `LOST`,
+  ``uint8``;
+- ``channel``: the server's channel ID, or `NO_CHANNEL`, ``uint32``;
+- ``length``: the number of data bytes that follow, ``uint32``.
+
+An `ECHO` frame has no data: it is output that repeats the `INPUT` frame
+just before it. An `EVENT` frame holds a JSON object whose ``event`` is
+``start``, ``open``, ``request``, ``process``, ``exit``, ``close`` (also
+when a channel is handed to a subsystem) or ``end``. ``NAME.idx`` holds
+an `INDEX` entry, a frame's time and offset in ``NAME.rec``, for about
+every ``INDEX_INTERVAL`` bytes, so `RecordingReader` finds any point in
+a long session by bisecting the index and reading on from there. Both
+files are only appended to, so a recording cut short by a crash reads up
+to its last complete frame.
+
+Data on SFTP and forwarded channels is not recorded. Replay a recording,
+or print its audit trail, with::
+
+    python3 -m ssh.recording FILE [--start SECONDS] [--speed N] [--events]
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger('ssh')
+
+MAGIC = b'SSHREC1\n'
+FRAME = struct.Struct('<QBII')
+INDEX = struct.Struct('<QQ')
+LOST_BYTES = struct.Struct('<Q')
+# Frame kinds.
+INPUT = 1
+OUTPUT = 2
+STDERR = 3
+EVENT = 4
+LOST = 5
+ECHO = 6
+KINDS = {
+    INPUT: 'input',
+    OUTPUT: 'output',
+    STDERR: 'stderr',
+    EVENT: 'event',
+    LOST: 'lost',
+    ECHO: 'echo',
+}
+NO_CHANNEL = 0xFFFFFFFF
+BLOCK_SIZE = 1024 * 1024
+INDEX_INTERVAL = 64 * 1024
+# Data smaller than this is copied into the block instead of referenced.
+COPY_SIZE = 4096
+MAX_BUFFERED = 64 * 1024 * 1024
+FLUSH_INTERVAL = 1.0
+# Buffers passed to one ``writev`` call, below any system's ``IOV_MAX``.
+MAX_IOV = 512
+
+
+class Recording:
+    """
+    The recording of one session. Its methods may be called from any
+    thread; each adds a frame to the block being filled.
+    """
+
+    __slots__ = (
+        'recorder',
+        'name',
+        'started',
+        'pieces',
+        'size',
+        'marks',
+        'lost',
+        'closed',
+        'lock',
+        # Only used by the recorder's thread.
+        'fd',
+        'index_fd',
+        'offset',
+    )
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.started = time.monotonic()
+        # The block being filled: header and data buffers, and their size.
+        self.pieces = []
+        self.size = 0
+        # ``(time, offset in the block)`` of frames seeks may start at.
+        self.marks = []
+        # Bytes dropped since the last block that was written.
+        self.lost = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.fd = None
+        self.index_fd = None
+        self.offset = 0
+
+    def __repr__(self):
+        return f'<Recording {self.name}>'
+
+    def input(self, channel, data):
+        """Record ``data`` received from the client on ``channel``."""
+        self._frame(INPUT, channel, data)
+
+    def output(self, channel, data):
+        """Record ``data`` sent to the client on ``channel``."""
+        self._frame(OUTPUT, channel, data)
+
+    def stderr(self, channel, data):
+        """Record extended (stderr) data sent on ``channel``."""
+        self._frame(STDERR, channel, data)
+
+    def echo(self, channel, data):
+        """
+        Record ``data`` received on ``channel`` and sent straight back,
+        storing it once.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            now = self._begin()
+            self._append(now, INPUT, channel, data)
+            self._append(now, ECHO, channel, b'')
+            if self.size >= self.recorder.block_size:
+                self._hand_off()
+
+    def event(self, event, channel=NO_CHANNEL, **fields):
+        """Record an audit event with JSON-serializable ``fields``."""
+        fields = {'event': event, **fields}
+        self._frame(EVENT, channel, json.dumps(fields).encode())
+
+    def flush(self):
+        """Hand buffered frames to the recorder to be written."""
+        with self.lock:
+            if self.pieces:
+                self._hand_off()
+
+    def close(self):
+        """Record the end of the session; safe to call again."""
+        with self.lock:
+            if self.closed:
+                return
+            now = self._begin()
+            self._append(now, EVENT, NO_CHANNEL, b'{"event": "end"}')
+            self.closed = True
+            self._hand_off(final=True)
+
+    def _frame(self, kind, channel, data):
+        with self.lock:
+            if self.closed:
+                return
+            self._append(self._begin(), kind, channel, data)
+            if self.size >= self.recorder.block_size:
+                self._hand_off()
+
+    def _begin(self):
+        """
+        Start the next frame, starting a block or marking it for the
+        index as needed, and return its time.
+        """
+        now = int((time.monotonic() - self.started) * 1e6)
+        if not self.pieces:
+            self.recorder._dirty(self)
+            self.pieces.append(bytearray())
+            self.marks.append((now, 0))
+            if self.lost:
+                self._append(
+                    now, LOST, NO_CHANNEL, LOST_BYTES.pack(self.lost)
+                )
+        elif self.size - self.marks[-1][1] >= INDEX_INTERVAL:
+            self.marks.append((now, self.size))
+        return now
+
+    def _append(self, now, kind, channel, data):
+        pieces = self.pieces
+        header = FRAME.pack(now, kind, channel, len(data))
+        if len(data) < COPY_SIZE or not isinstance(data, bytes):
+            if type(pieces[-1]) is not bytearray:
+                pieces.append(bytearray())
+            tail = pieces[-1]
+            tail += header
+            tail += data
+        else:
+            pieces += (header, data)
+        self.size += FRAME.size + len(data)
+
+    def _hand_off(self, final=False, keep=False):
+        pieces, size, marks = self.pieces, self.size, self.marks
+        self.pieces = []
+        self.size = 0
+        self.marks = []
+        if self.recorder._submit(self, pieces, size, marks, final, keep):
+            self.lost = 0
+        else:
+            self.lost += size
+
+
+class Recorder:
+    """Write `Recording` files from one background thread."""
+
+    def __init__(
+        self,
+        directory,
+        block_size=BLOCK_SIZE,
+        max_buffered=MAX_BUFFERED,
+        flush_interval=FLUSH_INTERVAL,
+        metrics=None
+    ):
+        """
+        :param str directory: where recordings are written; created if
+            needed
+        :param int block_size:
+            bytes a session buffers before handing them over to be written
+        :param int max_buffered:
+            bytes waiting to be written beyond which blocks are dropped
+        :param float flush_interval:
+            seconds after which a partly filled buffer is written anyway
+        :param .Metrics metrics:
+            counts ``recorded_bytes`` and ``recording_dropped_bytes``
+        """
+        self.directory = directory
+        self.block_size = block_size
+        self.max_buffered = max_buffered
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.buffered = 0
+        # ``(recording, pieces, size, marks, final)`` blocks to write, and
+        # recordings with frames not handed over yet.
+        self._queue = []
+        self._dirty_recordings = set()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run,
+            name='ssh-recorder',
+            daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def open(self, name, **fields):
+        """
+        Start recording to ``NAME.rec`` and ``NAME.idx``, with a ``start``
+        event holding ``fields`` and the wall-clock time.
+
+        :return: a `Recording`
+        """
+        recording = Recording(self, name)
+        recording.event('start', time=time.time(), **fields)
+        with recording.lock:
+            recording._hand_off(keep=True)
+        return recording
+
+    def close(self):
+        """Write everything recorded so far and stop the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _dirty(self, recording):
+        with self._cond:
+            self._dirty_recordings.add(recording)
+
+    def _submit(self, recording, pieces, size, marks, final, keep=False):
+        """
+        Queue a block to be written; ``False`` if it was dropped. The
+        ``final`` block of a recording, which closes its files, and one to
+        ``keep``, its ``start`` event, are never dropped.
+        """
+        with self._cond:
+            self._dirty_recordings.discard(recording)
+            dropped = (
+                self.buffered + size > self.max_buffered
+                and not (final or keep)
+            )
+            if not dropped:
+                self.buffered += size
+                self._queue.append((recording, pieces, size, marks, final))
+                self._cond.notify()
+        if dropped and self.metrics is not None:
+            self.metrics.inc('recording_dropped_bytes', size)
+        return not dropped
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    timeout = next_flush - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                queue, self._queue = self._queue, []
+                stopping = self._stopping
+                now = time.monotonic()
+                if stopping or now >= next_flush:
+                    next_flush = now + self.flush_interval
+                    dirty = list(self._dirty_recordings)
+                else:
+                    dirty = ()
+            for recording in dirty:
+                recording.flush()
+            if queue:
+                written = self._write(queue)
+                with self._cond:
+                    self.buffered -= written
+            elif stopping and not dirty:
+                return
+
+    def _write(self, queue):
+        """Write queued blocks, grouped by recording, in order."""
+        blocks = {}
+        for recording, *entry in queue:
+            blocks.setdefault(recording, []).append(entry)
+        written = 0
+        for recording, entries in blocks.items():
+            size = sum(entry[1] for entry in entries)
+            written += size
+            if recording.fd != -1:
+                try:
+                    self._append(recording, entries)
+                except OSError as exc:
+                    logger.warning(
+                        'Recording %s failed: %r', recording.name, exc
+                    )
+                    self._close_files(recording)
+                    # Drop whatever else it records.
+                    recording.fd = -1
+            if self.metrics is not None:
+                self.metrics.inc(
+                    'recording_dropped_bytes' if recording.fd == -1
+                    else 'recorded_bytes',
+                    size
+                )
+            if entries[-1][3]:
+                self._close_files(recording)
+        return written
+
+    def _append(self, recording, entries):
+        if recording.fd is None:
+            path = os.path.join(self.directory, recording.name)
+            flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND
+            recording.fd = os.open(f'{path}.rec', flags, 0o600)
+            recording.index_fd = os.open(f'{path}.idx', flags, 0o600)
+            _write_all(recording.fd, [MAGIC])
+            recording.offset = len(MAGIC)
+        index = []
+        buffers = []
+        offset = recording.offset
+        for pieces, size, marks, _ in entries:
+            index += (
+                INDEX.pack(frame_time, offset + at)
+                for frame_time, at in marks
+            )
+            buffers += pieces
+            offset += size
+        _write_all(recording.fd, buffers)
+        _write_all(recording.index_fd, [b''.join(index)])
+        recording.offset = offset
+
+    def _close_files(self, recording):
+        for fd in (recording.fd, recording.index_fd):
+            if fd is not None and fd != -1:
+                os.close(fd)
+        recording.index_fd = None
+        if recording.fd != -1:
+            recording.fd = None
+
+
+def _write_all(fd, buffers):
+    """``writev`` every byte of ``buffers`` to ``fd``."""
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    while views:
+        written = os.writev(fd, views[:MAX_IOV])
+        while written:
+            if written >= len(views[0]):
+                written -= len(views.pop(0))
+            else:
+                views[0] = views[0][written:]
+                written = 0
+
+
+class Frame:
+
+    __slots__ = ('time', 'kind', 'channel', 'data')
+
+    def __init__(self, time, kind, channel, data):
+        self.time = time
+        self.kind = kind
+        self.channel = channel
+        self.data = data
+
+    def __repr__(self):
+        return (
+            f'<Frame {self.time:.6f} {KINDS.get(self.kind, self.kind)} '
+            f'{self.channel} {len(self.data)}>'
+        )
+
+    def event(self):
+        """The fields of an `EVENT` frame."""
+        return json.loads(self.data)
+
+
+class RecordingReader:
+    """
+    Read a recording, from the start or from any point in it.
+
+    >>> with RecordingReader('recordings/NAME.rec') as reader:
+    ...     for frame in reader.frames(start=3600):
+    ...         ...
+    """
+
+    def __init__(self, path):
+        """
+        :param str path:
+            the ``.rec`` file; ``.idx`` next to it is used if present
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f'{path} is not a session recording')
+        self._times = []
+        self._offsets = []
+        index_path = f'{os.path.splitext(path)[0]}.idx'
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            end = len(data) - len(data) % INDEX.size
+            for frame_time, offset in INDEX.iter_unpack(data[:end]):
+                if offset < len(self._map):
+                    self._times.append(frame_time)
+                    self._offsets.append(offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def seek(self, start):
+        """The offset of a frame at or before ``start`` seconds."""
+        at = bisect.bisect_right(self._times, int(start * 1e6)) - 1
+        return self._offsets[at] if at >= 0 else len(MAGIC)
+
+    def frames(self, start=0.0, end=None, kinds=None, channel=None):
+        """
+        Iterate over the `Frame` objects from ``start`` to ``end`` seconds
+        into the session, their data as `bytes`. `ECHO` frames come as
+        `OUTPUT` frames holding the data they repeat.
+
+        :param kinds: only frames of these kinds
+        :param int channel: only frames of this channel
+        """
+        data = self._map
+        size = len(data)
+        start_us = int(start * 1e6)
+        end_us = None if end is None else int(end * 1e6)
+        offset = self.seek(start) if start else len(MAGIC)
+        # Where the data of the last frame with data is.
+        echoed = (offset, 0)
+        while offset + FRAME.size <= size:
+            frame_time, kind, frame_channel, length = FRAME.unpack_from(
+                data, offset
+            )
+            at = offset + FRAME.size
+            offset = at + length
+            if offset > size:
+                # Cut short by a crash.
+                return
+            if end_us is not None and frame_time > end_us:
+                return
+            if kind == ECHO:
+                kind = OUTPUT
+                at, length = echoed
+            else:
+                echoed = (at, length)
+            if (
+                frame_time >= start_us
+                and (kinds is None or kind in kinds)
+                and (channel is None or frame_channel == channel)
+            ):
+                yield Frame(
+                    frame_time / 1e6,
+                    kind,
+                    frame_channel,
+                    data[at:at + length]
+                )
+
+    def events(self):
+        """Iterate over the audit events as ``(time, channel, fields)``."""
+        for frame in self.frames(kinds=(EVENT, LOST)):
+            if frame.kind == LOST:
+                (lost,) = LOST_BYTES.unpack(frame.data)
+                yield frame.time, frame.channel, {'event': 'lost',
+                                                  'bytes': lost}
+            else:
+                yield frame.time, frame.channel, frame.event()
+
+
+def replay(reader, out, start=0.0, end=None, speed=None, channel=None):
+    """
+    Write the output of a session to the binary stream ``out``, at
+    ``speed`` times the original pace, or as fast as possible.
+    """
+    began = time.monotonic()
+    for frame in reader.frames(start, end, (OUTPUT, STDERR), channel):
+        if speed:
+            delay = (frame.time - start) / speed - (time.monotonic() - began)
+            if delay > 0:
+                out.flush()
+                time.sleep(delay)
+        out.write(frame.data)
+    out.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        'python3 -m ssh.recording',
+        description='Replay a session recording'
+    )
+    parser.add_argument('path', help='a .rec file')
+    parser.add_argument(
+        '--start',
+        type=float,
+        default=0.0,
+        help='seconds into the session to start at'
+    )
+    parser.add_argument(
+        '--end',
+        type=float,
+        help='seconds into the session to stop at'
+    )
+    parser.add_argument(
+        '--speed',
+        type=float,
+        help='replay at N times the original pace (default: at once)'
+    )
+    parser.add_argument(
+        '--channel',
+        type=int,
+        help='only this channel'
+    )
+    parser.add_argument(
+        '--events',
+        action='store_true',
+        help='print the audit events instead of the output'
+    )
+    args = parser.parse_args()
+
+    try:
+        reader = RecordingReader(args.path)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    with reader:
+        if args.events:
+            for event_time, event_channel, fields in reader.events():
+                channel = '-' if event_channel == NO_CHANNEL else event_channel
+                print(f'{event_time:12.6f} {channel:>5} {json.dumps(fields)}')
+        else:
+            try:
+                replay(
+                    reader,
+                    sys.stdout.buffer,
+                    args.start,
+                    args.end,
+                    args.speed,
+                    args.channel
+                )
+            except (BrokenPipeError, KeyboardInterrupt):
+                pass
@@ -0,0 +1,31 @@
+"""RSA key."""
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+PUBLIC_EXPONENT = 65537
+
+
+def create_rsa(bits=3072) -> (bytes, bytes):
+    """
+    Generate an RSA key.
+
+    :param int bits: the modulus size
+    :return:
+        a tuple containing the private and public key bytes, in OpenSSH
+        format.
+    :rtype: tuple
+    """
+    private_key = rsa.generate_private_key(PUBLIC_EXPONENT, bits)
+    private_bytes = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.OpenSSH,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+    public_key = private_key.public_key()
+    public_bytes = public_key.public_bytes(
+        encoding=serialization.Encoding.OpenSSH,
+        format=serialization.PublicFormat.OpenSSH
+    )
+    return (private_bytes, public_bytes)
@@ -3,94 +3,965 @@ Class for an SSH server instance.
 
 Run a SSH server on a specified address with:
 
-``python3 -m ssh.server [-h] [-a ADDRESS] [-p PORT]``
+``python3 -m ssh.server [-h] [-a ADDRESS] [-p PORT] [-e {thread,event}]
+[-w WORKERS]``
+
+The ``thread`` engine (the default) serves each connection on its own
+thread. The ``event`` engine serves the channels of all connections from
+one event loop and runs handshakes on a bounded worker pool, see
+`.engine.EventEngine`; each connection still has its own paramiko
+transport thread.
+
+With ``--workers N`` the server forks N worker processes that share the
+listening address, see `.prefork.Supervisor`.
+
+A client may open any number of channels on one connection; they are all
+served from one event loop per connection, see `.ChannelDispatcher`.
+Channel data is echoed back in chunks of up to ``--chunk-size`` bytes;
+``--window-size`` and ``--max-packet-size`` set the SSH flow-control
+window and largest data packet offered for each channel.
+
+Local port forwarding (``ssh -L``) is refused unless destinations are
+allowed with ``--allow-forward HOST:PORT``, and remote forwarding
+(``ssh -R``) unless listening addresses are allowed with
+``--allow-listen HOST:PORT``, see `.forward`.
+
+``--sftp-root DIR`` serves a directory over SFTP, see `.sftp`, and
+``--exec`` runs commands for exec and shell requests, see `.commands`.
+``--record-dir DIR`` records the I/O and an audit trail of every session
+to files in ``DIR``, see `.recording`.
+
+Live sessions are tracked in a `.SessionRegistry`, which limits them with
+``--max-sessions`` and ``--max-sessions-per-ip`` and closes them after
+``--login-timeout`` or ``--idle-timeout`` seconds, or once a client has
+been silent for ``--keepalive-count-max`` intervals of
+``--keepalive-interval``, see `.Keepalive`. Before key exchange,
+`.AdmissionControl` refuses connections from IPs over ``--rate-per-ip``
+or ``--max-auth-failures-per-ip``, and beyond ``--max-handshakes`` not
+yet authenticated; ``--max-auth-tries`` closes a connection after that
+many failed attempts.
+
+``--profile`` limits the ciphers, key exchanges, MACs and host key types
+offered, see `.profiles`. The Ed25519 host key in ``keys/server`` is
+required; ECDSA and RSA host keys there are offered too if present, and
+so is the host certificate of each key, e.g. ``id_ed25519-cert.pub``.
+User certificates signed by a CA in ``--trusted-user-ca-keys`` or a
+``cert-authority`` line of ``authorized_keys`` are accepted without the
+user's key being listed, see `.certificates`.
+
+``--config FILE`` reads settings from a JSON object of `SSHServer`
+keyword arguments, which take precedence over the command line. On
+``SIGHUP`` the server re-reads its host keys and that file and applies
+the `RELOADABLE` settings to new connections. ``SIGUSR2`` hands the
+listening socket to a new server process and drains this one, and
+``SIGQUIT`` drains it and exits, see `.handoff`.
 
 """
 
 import argparse
-from logging import getLogger
+import errno
+import inspect
+import json
 import os
 import socket
 import threading
+import time
 
 import paramiko
-from paramiko import RSAKey
+from paramiko import Channel, RSAKey, SFTPServer
+from paramiko.auth_handler import AuthHandler
+from paramiko.common import AUTH_FAILED, MSG_CHANNEL_REQUEST
 from paramiko.transport import Transport
 
+from .admission import (
+    FAILURE_WINDOW,
+    MAX_AUTH_TRIES,
+    MAX_TRACKED,
+    AdmissionControl
+)
+from .authorized_keys import AUTHORIZED_KEYS_PATH, AuthorizedKeys
+from .certificates import CertifiedHostKey, UserCertificates
+from .channels import ChannelDispatcher, EchoHandler
+from .commands import MAX_PROCESSES, SHELL, ProcessHandler, ProcessPool
+from .engine import EventEngine, POOL_SIZE
+from .forward import ForwardAllowList, ListenerPool, RelayHandler
+from . import handoff
 from .interface import SSHServerInterface
+from .keepalive import COUNT_MAX as KEEPALIVE_COUNT_MAX
+from .log import configure_logging, connection_logger
+from .loop import EventLoop
+from .metrics import Metrics, MetricsServer
+from .profiles import DEFAULT_PROFILE, PROFILES, get_profile
+from .recording import Recorder
+from .sessions import LOGIN_TIMEOUT, MAX_SESSIONS, SessionRegistry
+from .sftp import SFTPCache, SFTPRoot
 from . import logger
 
-MAX_CONNECTIONS = 5
+LISTEN_BACKLOG = 128
+CHUNK_SIZE = 256 * 1024
+WINDOW_SIZE = 8 * 1024 * 1024
+MAX_PACKET_SIZE = 32 * 1024
+# Seconds a session channel that may become an SFTP or command channel
+# waits for the client's request before its welcome line is sent.
+REQUEST_WAIT = 0.5
+# Seconds a logged-in connection may take to open its first channel.
+CHANNEL_WAIT = 20.0
 KEY_DIR = 'keys/server'
+# Host key files in KEY_DIR, and their key classes. Only the first is
+# required.
+HOST_KEY_FILES = (
+    ('id_ed25519', paramiko.Ed25519Key),
+    ('id_ecdsa', paramiko.ECDSAKey),
+    ('id_rsa', RSAKey),
+)
+ENGINES = ('thread', 'event')
+# Seconds between checks for `SSHServer.drain` while accepting.
+ACCEPT_INTERVAL = 1.0
+DRAIN_POLL = 0.1
+# Settings `SSHServer.reload` applies to a running server.
+RELOADABLE = frozenset((
+    'authorized_keys_path',
+    'user_authorized_keys',
+    'trusted_user_ca_keys',
+    'max_sessions',
+    'max_sessions_per_ip',
+    'idle_timeout',
+    'login_timeout',
+    'channel_wait',
+    'chunk_size',
+    'window_size',
+    'max_packet_size',
+    'request_wait',
+    'forward_allow',
+    'listen_allow',
+    'rate_per_ip',
+    'burst_per_ip',
+    'max_handshakes',
+    'max_auth_tries',
+    'max_auth_failures_per_ip',
+    'auth_failure_window',
+    'profile',
+    'drain_timeout',
+))
+
+
+def _handle_request(channel, m):
+    """
+    Handle a channel request like paramiko does, then report a shell,
+    exec or subsystem request to `_Transport.on_request`. Reporting it
+    only after the reply has been sent keeps a handler that finishes
+    quickly from closing the channel before the request is answered.
+    """
+    requests = getattr(channel.transport.server_object, 'requests', {})
+    before = requests.get(channel.get_id())
+    Channel._handle_request(channel, m)
+    on_request = channel.transport.on_request
+    if on_request is not None and requests.get(channel.get_id()) is not before:
+        on_request(channel)
+
+
+class _AuthHandler(AuthHandler):
+    """
+    An `.AuthHandler` that reports each rejected authentication attempt
+    to `_Transport.on_auth_failed` once paramiko has decided it, after
+    checking any signature. Keys offered without a signature, and the
+    ``none`` method clients start with, are not attempts.
+    """
+
+    def _send_auth_result(self, username, method, result):
+        super()._send_auth_result(username, method, result)
+        on_auth_failed = self.transport.on_auth_failed
+        if (
+            result == AUTH_FAILED
+            and method != 'none'
+            and on_auth_failed is not None
+        ):
+            on_auth_failed()
+
+
+class _Transport(paramiko.Transport):
+    """
+    A `.Transport` that records when the client's banner was read, and
+    reports authentication, new channels and its own end to callbacks
+    instead of waiting in `accept`.
+    """
+
+    banner_at = None
+    # Called with each channel the client opens, on the transport thread.
+    on_channel = None
+    # Called with a channel after a shell, exec or subsystem request on
+    # it has been answered, on the transport thread.
+    on_request = None
+    # Called once, on the transport thread, when the transport stops.
+    on_close = None
+    # Called once, on the transport thread, when the client has
+    # authenticated and before any channel is opened.
+    on_auth = None
+    # Called on the transport thread for each rejected authentication
+    # attempt, see `_AuthHandler`.
+    on_auth_failed = None
+
+    _channel_handler_table = {
+        **Transport._channel_handler_table,
+        MSG_CHANNEL_REQUEST: _handle_request,
+    }
+
+    def _check_banner(self):
+        super()._check_banner()
+        self.banner_at = time.monotonic()
+
+    def _parse_newkeys(self, m):
+        if self.server_mode and self.auth_handler is None:
+            self.auth_handler = _AuthHandler(self)
+        super()._parse_newkeys(m)
+
+    def _auth_trigger(self):
+        super()._auth_trigger()
+        if self.on_auth is not None:
+            self.on_auth()
+
+    def _parse_channel_open(self, m):
+        super()._parse_channel_open(m)
+        self._dispatch_channel()
+
+    def queue_channel(self, channel):
+        """
+        Serve a channel the server opened, such as a ``forwarded-tcpip``
+        channel, like one the client opened.
+        """
+        self._queue_incoming_channel(channel)
+        self._dispatch_channel()
+
+    def _dispatch_channel(self):
+        if self.on_channel is not None:
+            channel = self.accept(0)
+            if channel is not None:
+                self.on_channel(channel)
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+
+def read_config(path):
+    """
+    The `SSHServer` keyword arguments in the JSON file ``path``.
+
+    :raises ValueError: if it holds anything else
+    """
+    with open(path) as f:
+        settings = json.load(f)
+    if not isinstance(settings, dict):
+        raise ValueError(f'{path}: expected a JSON object')
+    known = inspect.signature(SSHServer).parameters.keys() - {
+        'sock', 'reuse_port', 'config'
+    }
+    unknown = sorted(settings.keys() - known)
+    if unknown:
+        raise ValueError(f'{path}: unknown settings {", ".join(unknown)}')
+    return settings
+
+
+def _load_host_keys():
+    """
+    The host keys in `KEY_DIR`, and a `.CertifiedHostKey` for each that
+    has a certificate.
+    """
+    host_keys = []
+    host_certificates = []
+    for index, (name, key_class) in enumerate(HOST_KEY_FILES):
+        path = os.path.join(KEY_DIR, name)
+        if index and not os.path.exists(path):
+            continue
+        host_keys.append(key_class.from_private_key_file(path))
+        if os.path.exists(path + '-cert.pub'):
+            host_certificates.append(CertifiedHostKey.from_file(
+                host_keys[-1], path + '-cert.pub'
+            ))
+    return host_keys, host_certificates
 
 
 class SSHServer():
 
-    def __init__(self, host='0.0.0.0', port=2222):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    def __init__(
+        self,
+        host='0.0.0.0',
+        port=2222,
+        engine='thread',
+        pool_size=POOL_SIZE,
+        backlog=LISTEN_BACKLOG,
+        reuse_port=False,
+        sock=None,
+        authorized_keys_path=AUTHORIZED_KEYS_PATH,
+        user_authorized_keys=None,
+        trusted_user_ca_keys=None,
+        max_sessions=MAX_SESSIONS,
+        max_sessions_per_ip=None,
+        idle_timeout=None,
+        login_timeout=LOGIN_TIMEOUT,
+        channel_wait=CHANNEL_WAIT,
+        keepalive_interval=None,
+        keepalive_count_max=KEEPALIVE_COUNT_MAX,
+        chunk_size=CHUNK_SIZE,
+        window_size=WINDOW_SIZE,
+        max_packet_size=MAX_PACKET_SIZE,
+        forward_allow=(),
+        listen_allow=(),
+        sftp_root=None,
+        allow_exec=False,
+        shell=SHELL,
+        request_wait=REQUEST_WAIT,
+        max_processes=MAX_PROCESSES,
+        max_processes_per_user=None,
+        record_dir=None,
+        rate_per_ip=None,
+        burst_per_ip=None,
+        max_handshakes=None,
+        max_auth_tries=MAX_AUTH_TRIES,
+        max_auth_failures_per_ip=None,
+        auth_failure_window=FAILURE_WINDOW,
+        max_tracked_ips=MAX_TRACKED,
+        profile=DEFAULT_PROFILE,
+        drain_timeout=None,
+        config=None
+    ):
+        """
+        :param int backlog: listen backlog
+        :param bool reuse_port:
+            set ``SO_REUSEPORT`` so several processes can bind the same
+            address and let the kernel balance connections between them
+        :param socket.socket sock:
+            an already listening socket to serve instead of binding
+            ``(host, port)``, e.g. one inherited from a supervisor or
+            passed down by `.handoff.upgrade`
+        :param str authorized_keys_path: global ``authorized_keys`` file
+        :param str user_authorized_keys:
+            per-user ``authorized_keys`` path template; ``%u`` is replaced
+            by the username
+        :param str trusted_user_ca_keys:
+            file of CA public keys whose user certificates are accepted
+            for every user, see `.UserCertificates`
+        :param int max_sessions:
+            concurrent sessions; connections beyond this are closed
+        :param int max_sessions_per_ip: concurrent sessions per client IP
+        :param float idle_timeout:
+            close sessions without channel traffic for this many seconds
+        :param float login_timeout:
+            close connections that have not authenticated and opened a
+            channel within this many seconds
+        :param float channel_wait:
+            seconds a connection is given to authenticate and open its
+            first channel before it is closed; the handshake, and with the
+            event engine its worker thread, is held meanwhile
+        :param float keepalive_interval:
+            send a keepalive to clients that were sent nothing for this
+            many seconds, see `.Keepalive`
+        :param int keepalive_count_max:
+            close sessions whose client stayed silent for this many
+            keepalive intervals
+        :param int chunk_size: largest read from a channel, in bytes
+        :param int window_size: SSH channel window offered to clients
+        :param int max_packet_size:
+            largest SSH data packet clients may send on a channel
+        :param forward_allow:
+            ``host:port`` patterns clients may open ``direct-tcpip``
+            channels to, see `.ForwardAllowList`; empty disables forwarding
+        :param listen_allow:
+            ``host:port`` patterns remote forwards may listen on; empty
+            disables remote forwarding
+        :param str sftp_root:
+            serve this directory over the ``sftp`` subsystem; no SFTP by
+            default
+        :param bool allow_exec:
+            run commands for exec requests, and ``shell`` for shell
+            requests, as the server's user; see `.commands`
+        :param str shell: the program shell requests run
+        :param float request_wait:
+            with ``sftp_root`` or ``allow_exec``, seconds a session channel
+            waits for a shell, exec or subsystem request before its echo
+            session sends the welcome line
+        :param int max_processes: processes running at once
+        :param int max_processes_per_user:
+            processes running at once for one SSH user
+        :param str record_dir:
+            record every session to a file in this directory, see
+            `.Recorder`
+        :param float rate_per_ip:
+            new connections per second from one client IP, see
+            `.AdmissionControl`
+        :param int burst_per_ip:
+            connections one client IP may open at once under
+            ``rate_per_ip``
+        :param int max_handshakes:
+            connections accepted but not yet authenticated at once
+        :param int max_auth_tries:
+            failed authentication attempts before a connection is closed
+        :param int max_auth_failures_per_ip:
+            failed attempts from one client IP, within
+            ``auth_failure_window`` seconds, before its new connections
+            are refused
+        :param float auth_failure_window: see ``max_auth_failures_per_ip``
+        :param int max_tracked_ips:
+            client IPs to keep rate and failure state for
+        :param profile:
+            a `.SecurityProfile`, or the name of one in `.PROFILES`, for
+            the algorithms offered to clients
+        :param float drain_timeout:
+            seconds `drain` waits for open sessions before closing them;
+            by default it waits until they end
+        :param str config:
+            JSON file of keyword arguments that `reload` re-reads; its
+            `RELOADABLE` settings are applied here too, over the ones
+            given
+        """
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown engine {engine!r}')
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.listening = False
+        else:
+            self.listening = True
+        self.socket = sock
         self.addr = (host, port)
-        self.sessions = {}
+        self.engine = engine
+        self.draining = False
+        self.drain_timeout = drain_timeout
+        self.config = config
+        self._engine = None
+        self._upgrade_lock = threading.Lock()
+        self.pool_size = pool_size
+        self.backlog = backlog
+        self.chunk_size = chunk_size
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.forward_allow = ForwardAllowList(forward_allow)
+        self.listen_allow = ForwardAllowList(listen_allow)
+        self.metrics = Metrics()
+        # The `.MetricsServer` serving `snapshot`, closed on `drain`.
+        self.metrics_server = None
+        self.listeners = ListenerPool(self._forwarded, self.metrics)
+        # Subsystem name -> ``(handler class, args, kwargs)``, registered on
+        # every transport, see `.Transport.set_subsystem_handler`.
+        self.subsystems = {}
+        self.sftp_cache = None
+        if sftp_root is not None:
+            self.sftp_cache = SFTPCache()
+            self.subsystems['sftp'] = (
+                SFTPServer,
+                (SFTPRoot,),
+                {'root': sftp_root, 'cache': self.sftp_cache}
+            )
+        self.shell = shell
+        self.request_wait = request_wait
+        self.processes = None
+        if allow_exec:
+            self.processes = ProcessPool(
+                max_processes,
+                max_processes_per_user,
+                metrics=self.metrics
+            )
+        self.recorder = None
+        if record_dir is not None:
+            self.recorder = Recorder(record_dir, metrics=self.metrics)
+        self.max_auth_tries = max_auth_tries
+        self.channel_wait = channel_wait
+        self.admission = AdmissionControl(
+            rate_per_ip,
+            burst_per_ip,
+            max_handshakes,
+            max_auth_failures_per_ip,
+            auth_failure_window,
+            max_tracked_ips,
+            metrics=self.metrics
+        )
+        self.sessions = SessionRegistry(
+            max_sessions,
+            max_sessions_per_ip,
+            idle_timeout=idle_timeout,
+            login_timeout=login_timeout,
+            keepalive_interval=keepalive_interval,
+            keepalive_count_max=keepalive_count_max,
+            metrics=self.metrics
+        )
+        self.key_files = {
+            'authorized_keys_path': authorized_keys_path,
+            'user_authorized_keys': user_authorized_keys,
+            'trusted_user_ca_keys': trusted_user_ca_keys,
+        }
+        self._load_authorized_keys()
+
+        self.profile = get_profile(profile)
+        self.host_keys, self.host_certificates = _load_host_keys()
+        self.host_key = self.host_keys[0]
+        self._settings = {}
+        if config is not None:
+            self._settings = read_config(config)
+            self._apply(self._settings)
+
+    def _load_authorized_keys(self):
+        self.authorized_keys = AuthorizedKeys(
+            self.key_files['authorized_keys_path'],
+            user_path=self.key_files['user_authorized_keys']
+        )
+        self.certificates = UserCertificates(
+            self.authorized_keys,
+            self.key_files['trusted_user_ca_keys']
+        )
+
+    def reload(self):
+        """
+        Re-read the host keys and certificates, and the ``config`` file,
+        and apply its `RELOADABLE` settings. Connections accepted from
+        now on use them; open sessions keep what they negotiated. If a
+        file cannot be read, everything is kept as it was.
 
-        self.host_key = paramiko.Ed25519Key.from_private_key_file(
-            os.path.join(KEY_DIR, 'id_ed25519')
+        :return: ``True`` if the server was reloaded
+        """
+        try:
+            host_keys, host_certificates = _load_host_keys()
+            settings = read_config(self.config) if self.config else {}
+        except (OSError, ValueError, paramiko.SSHException) as exc:
+            logger.error('Reload failed, nothing changed: %s', exc)
+            return False
+        # Compared with the settings in effect, which for the others are
+        # still those this process started with.
+        fixed = sorted(
+            name for name in (settings.keys() | self._settings.keys())
+            - RELOADABLE
+            if settings.get(name) != self._settings.get(name)
+        )
+        if fixed:
+            logger.warning(
+                'Not reloaded, upgrade (SIGUSR2) to apply: %s',
+                ', '.join(fixed)
+            )
+        self.host_keys = host_keys
+        self.host_certificates = host_certificates
+        self.host_key = host_keys[0]
+        self._apply(settings)
+        self._settings = {
+            name: value for name, value in self._settings.items()
+            if name not in RELOADABLE
+        }
+        self._settings.update(
+            (name, value) for name, value in settings.items()
+            if name in RELOADABLE
         )
+        logger.info(
+            'Reloaded %d host keys and %d settings',
+            len(host_keys),
+            len(settings.keys() & RELOADABLE)
+        )
+        return True
+
+    def _apply(self, settings):
+        """Apply the `RELOADABLE` settings among ``settings``."""
+        sessions = self.sessions
+        admission = self.admission
+        for name, value in settings.items():
+            if name not in RELOADABLE:
+                continue
+            if name in self.key_files:
+                self.key_files[name] = value
+            elif name == 'max_sessions_per_ip':
+                sessions.max_per_ip = value
+            elif name in ('max_sessions', 'idle_timeout', 'login_timeout'):
+                setattr(sessions, name, value)
+            elif name == 'rate_per_ip':
+                admission.rate = value
+            elif name == 'max_handshakes':
+                admission.max_handshakes = value
+            elif name == 'max_auth_failures_per_ip':
+                admission.max_ip_failures = value
+            elif name == 'auth_failure_window':
+                admission.failure_window = value
+            elif name in ('forward_allow', 'listen_allow'):
+                setattr(self, name, ForwardAllowList(value))
+            elif name == 'profile':
+                self.profile = get_profile(value)
+            elif name != 'burst_per_ip':
+                setattr(self, name, value)
+        if 'rate_per_ip' in settings or 'burst_per_ip' in settings:
+            burst = settings.get('burst_per_ip')
+            admission.burst = (
+                burst if burst is not None else max(1, admission.rate or 1)
+            )
+        if settings.keys() & self.key_files.keys():
+            self._load_authorized_keys()
 
-    def start(self):
+    def start(self, on_ready=None):
         """
-        Start the SSH server.
+        Start the SSH server. Returns once it has drained, see `drain`.
+
+        :param on_ready: called once connections are being accepted
         """
-        self.socket.bind(self.addr)
-        self.socket.listen(MAX_CONNECTIONS)
-        
+        if not self.listening:
+            self.socket.bind(self.addr)
+            self.socket.listen(self.backlog)
+            self.listening = True
+        self.sessions.start()
+        if self.recorder is not None:
+            self.recorder.start()
+
+        if self.engine == 'event':
+            self._engine = EventEngine(self, pool_size=self.pool_size)
+            if self.draining:
+                self._engine.drain(self.drain_timeout)
+            if on_ready is not None:
+                on_ready()
+            try:
+                self._engine.serve(self.socket)
+            except KeyboardInterrupt:
+                logger.info('Exiting server')
+            finally:
+                self._close_recorder()
+            return
+
+        if on_ready is not None:
+            on_ready()
+        # A timeout, not a blocking accept, so that `drain` is noticed.
+        # The socket may be shared with a process using another engine.
+        self.socket.settimeout(ACCEPT_INTERVAL)
         try:
-            while True:
-                client_socket, addr = self.socket.accept()
-                logger.info('Connection from %r', addr)
-                session_t = threading.Thread(
+            while not self.draining:
+                try:
+                    client_socket, addr = self.socket.accept()
+                except socket.timeout:
+                    continue
+                accepted_at = time.monotonic()
+                connection_logger(addr).info('Connection from %r', addr)
+                self.count('connections')
+                session = self.admit(client_socket, addr)
+                if session is None:
+                    continue
+                threading.Thread(
                     target=self.handle_client,
-                    args=(client_socket, addr),
+                    args=(session, accepted_at),
                     daemon=True
-                )
-                self.sessions[addr] = session_t
-                session_t.start()
+                ).start()
+            self.socket.close()
+            self._wait_drained()
         except KeyboardInterrupt:
             logger.info('Exiting server')
+        finally:
+            self.sessions.close_all()
+            self._close_recorder()
 
-    def handle_client(self, client_socket, addr):
+    def drain(self):
+        """
+        Stop accepting connections and let open sessions end: `start`
+        returns once none are left, or after ``drain_timeout`` seconds,
+        closing those still open. Safe to call from any thread.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        logger.info(
+            'Draining: no longer accepting, %d sessions open',
+            len(self.sessions)
+        )
+        if self.metrics_server is not None:
+            # Free the port for the process taking over.
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        if self._engine is not None:
+            self._engine.drain(self.drain_timeout)
+
+    def _wait_drained(self):
+        deadline = None
+        if self.drain_timeout is not None:
+            deadline = time.monotonic() + self.drain_timeout
+        while len(self.sessions) and (
+            deadline is None or time.monotonic() < deadline
+        ):
+            time.sleep(DRAIN_POLL)
+        if len(self.sessions):
+            logger.info(
+                'Drain timeout, closing %d sessions', len(self.sessions)
+            )
+
+    def upgrade(self, argv=None):
+        """
+        Hand the listening socket to a new server process, see
+        `.handoff.upgrade`, and `drain` once it is ready. Blocks until
+        then.
+
+        :param list argv:
+            the new process's command line; by default this process's
+        :return: ``True`` if the new process took over
+        """
+        if not self._upgrade_lock.acquire(blocking=False):
+            logger.warning('Upgrade already in progress')
+            return False
+        try:
+            if self.draining or handoff.upgrade(self.socket, argv) is None:
+                return False
+            self.drain()
+            return True
+        finally:
+            self._upgrade_lock.release()
+
+    def _close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def admit(self, client_socket, addr):
+        """
+        Register an accepted connection with `sessions` and `admission`,
+        closing it if a limit has been reached.
+
+        :return: the new `.Session`, or ``None``
+        """
+        session = self.sessions.admit(addr, client_socket)
+        if session is None:
+            connection_logger(addr).info(
+                'Session limit reached, dropping %r', addr
+            )
+            client_socket.close()
+            return None
+        reason = self.admission.admit(session)
+        if reason is not None:
+            connection_logger(addr).info(
+                'Admission refused (%s), dropping %r', reason, addr
+            )
+            self.sessions.remove(session)
+            client_socket.close()
+            return None
+        # Small replies (channel confirmations, echoes) must not wait for
+        # the client's delayed ACK.
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return session
+
+    def count(self, name, value=1):
+        """Add ``value`` to the ``name`` counter in `metrics`."""
+        self.metrics.inc(name, value)
+
+    def snapshot(self):
+        """Return a snapshot of `metrics`, see `.Metrics.snapshot`."""
+        return self.metrics.snapshot()
+
+    def negotiate(self, session):
+        """
+        Run key exchange and authentication on an accepted session and
+        wait for the client to open a channel.
+
+        This blocks for up to 20 seconds, so the event engine calls it from
+        a worker thread. With port forwarding enabled, a client that
+        authenticated but opened no channel is kept, as ``ssh -N -L`` only
+        opens channels when something connects to its end of the tunnel,
+        and ``ssh -N -R`` never does.
+
+        :return: a `list` holding the first `.Channel`, if any, or ``None``
+            if the client failed to authenticate or did not open a channel
+            in time
+        """
+        addr = session.addr
+        log = connection_logger(addr)
+        metrics = self.metrics
+        start = time.monotonic()
+        transport = session.transport = _Transport(
+            session.client_socket,
+            default_window_size=self.window_size,
+            default_max_packet_size=self.max_packet_size
+        )
+        self.profile.apply(transport)
+        for host_key in self.host_keys:
+            transport.add_server_key(host_key)
+        for host_certificate in self.host_certificates:
+            host_certificate.add_to(transport)
+        for name, (handler_class, args, kwargs) in self.subsystems.items():
+            transport.set_subsystem_handler(
+                name, handler_class, *args, **kwargs
+            )
+
+        server_interface = SSHServerInterface(
+            addr,
+            self.authorized_keys,
+            certificates=self.certificates,
+            metrics=metrics,
+            forward_allow=self.forward_allow,
+            listen_allow=self.listen_allow,
+            listeners=self.listeners,
+            transport=transport,
+            allow_exec=self.processes is not None,
+            session=session,
+            admission=self.admission,
+            max_auth_tries=self.max_auth_tries
+        )
+        transport.on_auth = (
+            lambda: self._authenticated(session, server_interface)
+        )
+        transport.on_auth_failed = server_interface.auth_failed
+        transport.start_server(server=server_interface)
+        kex_done = time.monotonic()
+        banner_at = transport.banner_at or start
+        metrics.observe('banner', banner_at - start)
+        metrics.observe('kex', kex_done - banner_at)
+
+        channel = transport.accept(self.channel_wait)
+        if not transport.is_authenticated():
+            log.info('Failed to authenticate %r', addr)
+            self.count('auth_failures')
+            return None
+        elif channel is None and not (self.forward_allow or self.listen_allow):
+            log.info('No channel request received')
+            return None
+        auth_at = server_interface.authenticated_at or kex_done
+        metrics.observe('auth', auth_at - kex_done)
+        if channel is not None:
+            metrics.observe('channel_wait', time.monotonic() - auth_at)
+        self.count('handshakes')
+        self.sessions.logged_in(session)
+        metrics.gauge('active_sessions', 1)
+        return [] if channel is None else [channel]
+
+    def _authenticated(self, session, interface):
+        interface.authenticated()
+        if self.recorder is not None:
+            self._record(session, interface)
+
+    def _record(self, session, interface):
+        """Start recording a session whose client has authenticated."""
+        fields = {
+            'peer': f'{session.addr[0]}:{session.addr[1]}',
+            'user': session.transport.get_username(),
+        }
+        entry = interface.authorized_key
+        if entry is not None:
+            fields['key_type'] = entry.key_type
+            fields['fingerprint'] = entry.fingerprint
+            fields['comment'] = entry.comment
+        name = '{}-{}-{}'.format(
+            time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()),
+            os.getpid(),
+            session.id
+        )
+        session.recording = self.recorder.open(name, **fields)
+
+    def handle_client(self, session, accepted_at=None):
         """
         Handle an individual SSH client.
         """
+        addr = session.addr
+        log = connection_logger(addr)
+        metrics = self.metrics
+        if accepted_at is not None:
+            metrics.observe('accept', time.monotonic() - accepted_at)
         try:
-            transport = paramiko.Transport(client_socket)
-            transport.add_server_key(self.host_key)
-            
-            server_interface = SSHServerInterface()
-            transport.start_server(server=server_interface)
-
-            channel = transport.accept(20)
-            if not transport.is_authenticated():
-                logger.info('Failed to authenticate %r', addr)
-                return
-            elif channel is None:
-                logger.info('No channel request received')
+            channels = self.negotiate(session)
+            if channels is None:
                 return
 
-            channel.send(f'Connected to SSH server on {self.addr}\n')
-            
-            # Channel loop
-            while True:
-                data = channel.recv(1024)
-                # print(data.decode('utf-8'))
-                print(data.decode('utf-8'))
-                # channel.send(bytes(f'Echo: {data.decode()}'))
-                channel.send(data)
+            loop = EventLoop()
+            dispatcher = ChannelDispatcher(self, session, loop, loop.stop)
+            for channel in channels:
+                dispatcher.add(channel)
+            dispatcher.attach(session.transport)
+            try:
+                loop.run()
+            finally:
+                dispatcher.close()
+                loop.close()
 
         except Exception as exc:
-            logger.info('%r', exc)
+            log.info('%r', exc)
         finally:
-            logger.info(f'Closing connection with {addr}')
-            client_socket.close()
+            self.finish(session)
+
+    def channel_handler(self, dispatcher, channel):
+        """
+        Return the handler that serves a newly opened ``channel``: a
+        `.RelayHandler` for ``direct-tcpip`` channels, an `.EchoHandler`
+        otherwise, which also documents the interface.
+        """
+        interface = channel.get_transport().server_object
+        sock = interface.pop_forward(channel.get_id())
+        if sock is not None:
+            return RelayHandler(dispatcher, channel, sock)
+        return EchoHandler(dispatcher, channel)
+
+    @property
+    def waits_for_requests(self):
+        """
+        Whether a session channel may become something other than an echo
+        session, so its handler must wait for the client's request.
+        """
+        return bool(self.subsystems) or self.processes is not None
+
+    def request_handler(self, dispatcher, channel, kind, argument):
+        """
+        Return the handler that takes over ``channel`` after a ``kind``
+        request (``"shell"`` or ``"exec"``, with the command as
+        ``argument``), or ``None`` to keep echoing.
+        """
+        if self.processes is None or kind not in ('shell', 'exec'):
+            return None
+        command = argument if kind == 'exec' else None
+        return ProcessHandler(
+            dispatcher, channel, self.processes, command, self.shell
+        )
+
+    def _forwarded(self, transport, channel, sock):
+        """
+        Serve a connection accepted by a remote forward's listener,
+        relayed over ``channel``; called from a `.ListenerPool` worker.
+        """
+        transport.server_object.forwards[channel.get_id()] = sock
+        transport.queue_channel(channel)
+
+    def finish(self, session):
+        """Close ``session`` and remove it from `sessions`."""
+        self.admission.release(session)
+        transport = session.transport
+        if transport is not None:
+            self.listeners.close_transport(transport)
+            if transport.server_object is not None:
+                transport.server_object.close_forwards()
+        if session.authenticated_at is not None:
+            self.metrics.gauge('active_sessions', -1)
+            self.metrics.observe(
+                'session',
+                time.monotonic() - session.authenticated_at
+            )
+        connection_logger(session.addr).info(
+            'Closing connection with %r', session.addr
+        )
+        self.count('closed')
+        self.sessions.remove(session)
+        session.close()
+        if session.recording is not None:
+            session.recording.close()
+
+
+def _serve_metrics(server, port, wait=False):
+    """
+    Serve ``server``'s metrics on ``port``. After an upgrade the old
+    process holds the port until it drains, so with ``wait`` keep trying
+    in the background until then.
+    """
+    def serve():
+        while True:
+            try:
+                metrics_server = MetricsServer(server.snapshot, port=port)
+            except OSError as exc:
+                if not wait or exc.errno != errno.EADDRINUSE:
+                    raise
+                time.sleep(ACCEPT_INTERVAL)
+                continue
+            server.metrics_server = metrics_server
+            metrics_server.start()
+            return
+
+    if wait:
+        threading.Thread(target=serve, name='ssh-metrics', daemon=True).start()
+    else:
+        serve()
 
 
 if __name__ == '__main__':
@@ -109,9 +980,300 @@ if __name__ == '__main__':
         type=int,
         default=2222
     )
-    
+    parser.add_argument(
+        '-e',
+        '--engine',
+        choices=ENGINES,
+        default='thread',
+        help='thread per connection, or channels served from one event '
+             'loop (each connection keeps its transport thread)'
+    )
+    parser.add_argument(
+        '--profile',
+        choices=sorted(PROFILES),
+        default=DEFAULT_PROFILE,
+        help='ciphers, key exchanges, MACs and host key types to offer'
+    )
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=POOL_SIZE,
+        help='handshake worker threads for the event engine'
+    )
+    parser.add_argument(
+        '--backlog',
+        type=int,
+        default=LISTEN_BACKLOG,
+        help='listen backlog'
+    )
+    parser.add_argument(
+        '--max-sessions',
+        type=int,
+        default=MAX_SESSIONS,
+        help='concurrent sessions per process'
+    )
+    parser.add_argument(
+        '--max-sessions-per-ip',
+        type=int,
+        help='concurrent sessions per client IP address per process'
+    )
+    parser.add_argument(
+        '--rate-per-ip',
+        type=float,
+        help='new connections per second from one client IP address'
+    )
+    parser.add_argument(
+        '--burst-per-ip',
+        type=int,
+        help='connections one client IP may open at once under '
+             '--rate-per-ip (default: the rate)'
+    )
+    parser.add_argument(
+        '--max-handshakes',
+        type=int,
+        help='connections being accepted but not yet authenticated at once'
+    )
+    parser.add_argument(
+        '--max-auth-tries',
+        type=int,
+        default=MAX_AUTH_TRIES,
+        help='failed authentication attempts before a connection is closed'
+    )
+    parser.add_argument(
+        '--max-auth-failures-per-ip',
+        type=int,
+        help='failed authentication attempts from one client IP within '
+             '--auth-failure-window before it is refused'
+    )
+    parser.add_argument(
+        '--auth-failure-window',
+        type=float,
+        default=FAILURE_WINDOW,
+        help='seconds over which --max-auth-failures-per-ip is counted'
+    )
+    parser.add_argument(
+        '--max-tracked-ips',
+        type=int,
+        default=MAX_TRACKED,
+        help='client IP addresses to keep rate and failure state for'
+    )
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        help='close sessions idle for this many seconds'
+    )
+    parser.add_argument(
+        '--login-timeout',
+        type=float,
+        default=LOGIN_TIMEOUT,
+        help='close connections not logged in after this many seconds'
+    )
+    parser.add_argument(
+        '--channel-wait',
+        type=float,
+        default=CHANNEL_WAIT,
+        help='seconds a connection has to log in and open a channel; '
+             'each one holds a handshake worker meanwhile'
+    )
+    parser.add_argument(
+        '--keepalive-interval',
+        type=float,
+        help='probe clients that were sent nothing for this many seconds'
+    )
+    parser.add_argument(
+        '--keepalive-count-max',
+        type=int,
+        default=KEEPALIVE_COUNT_MAX,
+        help='close sessions silent for this many keepalive intervals'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=CHUNK_SIZE,
+        help='largest read from a channel, in bytes'
+    )
+    parser.add_argument(
+        '--window-size',
+        type=int,
+        default=WINDOW_SIZE,
+        help='SSH channel window size, in bytes'
+    )
+    parser.add_argument(
+        '--max-packet-size',
+        type=int,
+        default=MAX_PACKET_SIZE,
+        help='largest SSH channel data packet accepted, in bytes'
+    )
+    parser.add_argument(
+        '--allow-forward',
+        metavar='HOST:PORT',
+        action='append',
+        default=[],
+        help='allow local port forwarding to HOST:PORT (wildcards allowed, '
+             'may be repeated)'
+    )
+    parser.add_argument(
+        '--allow-listen',
+        metavar='HOST:PORT',
+        action='append',
+        default=[],
+        help='allow remote port forwards to listen on HOST:PORT (0.0.0.0 '
+             'for all addresses, wildcards allowed, may be repeated)'
+    )
+    parser.add_argument(
+        '--sftp-root',
+        metavar='DIR',
+        help='serve DIR over the sftp subsystem'
+    )
+    parser.add_argument(
+        '--exec',
+        action='store_true',
+        help='run commands for exec and shell requests, as this user'
+    )
+    parser.add_argument(
+        '--shell',
+        default=SHELL,
+        help='program run for shell requests with --exec'
+    )
+    parser.add_argument(
+        '--request-wait',
+        type=float,
+        default=REQUEST_WAIT,
+        help='with --sftp-root or --exec, seconds a session waits for a '
+             'shell, exec or subsystem request before sending its welcome'
+    )
+    parser.add_argument(
+        '--max-processes',
+        type=int,
+        default=MAX_PROCESSES,
+        help='commands running at once; more wait for a free slot'
+    )
+    parser.add_argument(
+        '--max-processes-per-user',
+        type=int,
+        help='commands running at once for one SSH user'
+    )
+    parser.add_argument(
+        '--record-dir',
+        metavar='DIR',
+        help='record the I/O and an audit trail of every session to DIR'
+    )
+    parser.add_argument(
+        '--authorized-keys',
+        default=AUTHORIZED_KEYS_PATH,
+        help='global authorized_keys file'
+    )
+    parser.add_argument(
+        '--user-authorized-keys',
+        metavar='TEMPLATE',
+        help='per-user authorized_keys path, %%u is the username'
+    )
+    parser.add_argument(
+        '--trusted-user-ca-keys',
+        metavar='FILE',
+        help='accept user certificates signed by the CA keys in FILE'
+    )
+    parser.add_argument(
+        '--drain-timeout',
+        type=float,
+        help='seconds sessions may run on after SIGQUIT or an upgrade '
+             '(default: until they end)'
+    )
+    parser.add_argument(
+        '--config',
+        metavar='FILE',
+        help='JSON object of SSHServer settings, re-read on SIGHUP'
+    )
+    parser.add_argument(
+        '--log-level',
+        help='level of the ssh logger (default $SSH_LOG_LEVEL or INFO)'
+    )
+    parser.add_argument(
+        '--log-file',
+        help='log file, empty for none (default $SSH_LOG_FILE or ssh.log)'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='serve /metrics and /stats on this port on 127.0.0.1'
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=0,
+        help='number of worker processes (0 serves from this process)'
+    )
+    parser.add_argument(
+        '--shared-socket',
+        action='store_true',
+        help='workers inherit one listening socket instead of SO_REUSEPORT'
+    )
+
     args = parser.parse_args()
+    configure_logging(args.log_level, args.log_file)
     host = args.address
     port = args.port
-    server = SSHServer(host, port)
-    server.start()
+    server_kwargs = dict(
+        engine=args.engine,
+        pool_size=args.pool_size,
+        backlog=args.backlog,
+        authorized_keys_path=args.authorized_keys,
+        user_authorized_keys=args.user_authorized_keys,
+        trusted_user_ca_keys=args.trusted_user_ca_keys,
+        max_sessions=args.max_sessions,
+        max_sessions_per_ip=args.max_sessions_per_ip,
+        idle_timeout=args.idle_timeout,
+        login_timeout=args.login_timeout,
+        channel_wait=args.channel_wait,
+        keepalive_interval=args.keepalive_interval,
+        keepalive_count_max=args.keepalive_count_max,
+        chunk_size=args.chunk_size,
+        window_size=args.window_size,
+        max_packet_size=args.max_packet_size,
+        forward_allow=args.allow_forward,
+        listen_allow=args.allow_listen,
+        sftp_root=args.sftp_root,
+        allow_exec=args.exec,
+        shell=args.shell,
+        request_wait=args.request_wait,
+        max_processes=args.max_processes,
+        max_processes_per_user=args.max_processes_per_user,
+        record_dir=args.record_dir,
+        rate_per_ip=args.rate_per_ip,
+        burst_per_ip=args.burst_per_ip,
+        max_handshakes=args.max_handshakes,
+        max_auth_tries=args.max_auth_tries,
+        max_auth_failures_per_ip=args.max_auth_failures_per_ip,
+        auth_failure_window=args.auth_failure_window,
+        max_tracked_ips=args.max_tracked_ips,
+        profile=args.profile,
+        drain_timeout=args.drain_timeout,
+        config=args.config
+    )
+    if args.config:
+        try:
+            settings = read_config(args.config)
+        except (OSError, ValueError) as exc:
+            parser.error(str(exc))
+        host = settings.pop('host', host)
+        port = settings.pop('port', port)
+        server_kwargs.update(settings)
+    # Set if this process was started by an upgrade.
+    sock, ready_fd = handoff.inherited()
+    if args.workers > 0:
+        from .prefork import Supervisor
+        server = Supervisor(
+            host,
+            port,
+            args.workers,
+            reuse_port=not args.shared_socket,
+            sock=sock,
+            **server_kwargs
+        )
+    else:
+        server = SSHServer(host, port, sock=sock, **server_kwargs)
+    handoff.handle_signals(server)
+    if args.metrics_port:
+        _serve_metrics(server, args.metrics_port, wait=sock is not None)
+    server.start(on_ready=lambda: handoff.notify_ready(ready_fd))
@@ -0,0 +1,252 @@
+"""
+Registry of live server sessions.
+
+`SessionRegistry` tracks every accepted connection until it closes, so
+finished sessions are dropped instead of accumulating. It enforces limits
+on the total and per-IP number of concurrent sessions when a connection
+is admitted, and closes sessions that do not finish logging in within
+``login_timeout`` (half-open) or that see no channel traffic for
+``idle_timeout``. A session counts as logged in once it has
+authenticated and opened its first channel. From then on, with
+``keepalive_interval``, a `.Keepalive` probes it and reaps it once the
+client has been silent for ``keepalive_count_max`` intervals.
+
+Timeouts are driven by one `.TimerWheel`. Recording activity only stores
+a timestamp; the idle timer checks it when it fires and re-arms itself
+for the remaining time, so busy sessions never touch the wheel.
+"""
+
+import itertools
+import threading
+import time
+
+from .keepalive import COUNT_MAX, Keepalive
+from .log import connection_logger
+from .timers import TimerWheel
+
+
+MAX_SESSIONS = 10000
+LOGIN_TIMEOUT = 60.0
+
+
+class Session:
+
+    __slots__ = (
+        'id',
+        'addr',
+        'client_socket',
+        'transport',
+        'started',
+        'last_activity',
+        'authenticated_at',
+        'closed',
+        'timer',
+        'keepalive',
+        'recording',
+        'handshaking',
+    )
+
+    def __init__(self, session_id, addr, client_socket):
+        self.id = session_id
+        self.addr = addr
+        self.client_socket = client_socket
+        self.transport = None
+        self.started = self.last_activity = time.monotonic()
+        self.authenticated_at = None
+        self.closed = False
+        self.timer = None
+        self.keepalive = None
+        # The session's `.Recording`, with ``--record-dir``.
+        self.recording = None
+        # Whether it holds a slot in `.AdmissionControl`.
+        self.handshaking = False
+
+    def __repr__(self):
+        return f'<Session {self.id} {self.addr!r}>'
+
+    def touch(self):
+        """Record channel activity."""
+        self.last_activity = time.monotonic()
+
+    def close(self):
+        """Close the transport, or the bare socket if there is none yet."""
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+        try:
+            self.client_socket.close()
+        except OSError:
+            pass
+
+
+class SessionRegistry:
+
+    def __init__(
+        self,
+        max_sessions=MAX_SESSIONS,
+        max_per_ip=None,
+        idle_timeout=None,
+        login_timeout=LOGIN_TIMEOUT,
+        keepalive_interval=None,
+        keepalive_count_max=COUNT_MAX,
+        wheel=None,
+        metrics=None
+    ):
+        """
+        :param int max_sessions: concurrent sessions allowed, or ``None``
+        :param int max_per_ip:
+            concurrent sessions allowed from one IP address, or ``None``
+        :param float idle_timeout:
+            close authenticated sessions idle for this many seconds, or
+            ``None`` to never close idle sessions
+        :param float login_timeout:
+            close sessions not authenticated after this many seconds
+        :param float keepalive_interval:
+            probe logged-in sessions that sent nothing for this many
+            seconds, or ``None`` for no keepalives
+        :param int keepalive_count_max:
+            intervals a client may stay silent before it is reaped
+        :param .TimerWheel wheel: the wheel to schedule timeouts on
+        :param .Metrics metrics:
+            counts ``rejected`` connections and reaped ``timeouts``
+        """
+        self.max_sessions = max_sessions
+        self.max_per_ip = max_per_ip
+        self.idle_timeout = idle_timeout
+        self.login_timeout = login_timeout
+        self.wheel = wheel or TimerWheel()
+        self.metrics = metrics
+        self.keepalive = None
+        if keepalive_interval:
+            self.keepalive = Keepalive(
+                keepalive_interval,
+                keepalive_count_max,
+                wheel=self.wheel,
+                metrics=metrics
+            )
+        self.sessions = {}
+        self.per_ip = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self):
+        """Start the timer wheel thread."""
+        self.wheel.start()
+        return self
+
+    def admit(self, addr, client_socket):
+        """
+        Register a newly accepted connection.
+
+        :return: a new `Session`, or ``None`` if a limit would be exceeded
+        """
+        ip = addr[0]
+        session = None
+        with self._lock:
+            if (
+                self.max_sessions is None
+                or len(self.sessions) < self.max_sessions
+            ) and (
+                self.max_per_ip is None
+                or self.per_ip.get(ip, 0) < self.max_per_ip
+            ):
+                session = Session(next(self._ids), addr, client_socket)
+                self.sessions[session.id] = session
+                self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+        if session is None:
+            if self.metrics is not None:
+                self.metrics.inc('rejected')
+            return None
+        if self.login_timeout:
+            session.timer = self.wheel.schedule(
+                self.login_timeout,
+                self._login_expired,
+                session
+            )
+        return session
+
+    def logged_in(self, session):
+        """
+        Mark ``session`` as logged in: stop the login timer and start the
+        idle timer and keepalives, if any.
+        """
+        session.touch()
+        session.authenticated_at = session.last_activity
+        self.wheel.cancel(session.timer)
+        session.timer = None
+        if self.idle_timeout:
+            session.timer = self.wheel.schedule(
+                self.idle_timeout,
+                self._idle_check,
+                session
+            )
+        if self.keepalive is not None and session.transport is not None:
+            session.keepalive = self.keepalive.watch(
+                session.transport,
+                self._peer_dead,
+                session
+            )
+
+    def remove(self, session):
+        """Forget a finished session. Safe to call more than once."""
+        self.wheel.cancel(session.timer)
+        session.timer = None
+        if self.keepalive is not None:
+            self.keepalive.cancel(session.keepalive)
+        ip = session.addr[0]
+        with self._lock:
+            if self.sessions.pop(session.id, None) is None:
+                return
+            count = self.per_ip[ip] - 1
+            if count:
+                self.per_ip[ip] = count
+            else:
+                del self.per_ip[ip]
+
+    def close_all(self):
+        for session in list(self.sessions.values()):
+            session.close()
+
+    def _login_expired(self, session):
+        if session.authenticated_at is not None or session.closed:
+            return
+        connection_logger(session.addr).info(
+            'Login timeout for %r', session.addr
+        )
+        self._reap(session)
+
+    def _idle_check(self, session):
+        # A reload may have turned the idle timeout off.
+        if session.closed or not self.idle_timeout:
+            return
+        idle = time.monotonic() - session.last_activity
+        if idle < self.idle_timeout:
+            session.timer = self.wheel.schedule(
+                self.idle_timeout - idle,
+                self._idle_check,
+                session
+            )
+            return
+        connection_logger(session.addr).info(
+            'Idle timeout for %r', session.addr
+        )
+        self._reap(session)
+
+    def _peer_dead(self, session):
+        if session.closed:
+            return
+        connection_logger(session.addr).info(
+            'Keepalive timeout for %r', session.addr
+        )
+        self._reap(session)
+
+    def _reap(self, session):
+        if self.metrics is not None:
+            self.metrics.inc('timeouts')
+        try:
+            session.close()
+        finally:
+            self.remove(session)
@@ -0,0 +1,383 @@
+"""
+SFTP subsystem.
+
+`SFTPRoot` serves the files under one directory over paramiko's
+`.SFTPServer`, which runs each SFTP channel on its own thread. Clients
+keep many read and write requests outstanding on a handle, and each is
+answered as soon as it is read, with no per-handle seek or lock.
+
+Files opened read-only share one descriptor, read with ``pread``. The
+descriptors are kept in an `SFTPCache` while the file is unchanged, so
+reopening a file costs no ``open``, and ``stat`` results are cached for
+``stat_ttl`` seconds. Changes made through the server drop the affected
+entries. Writes go straight to the file with ``pwrite``. Files are not
+memory-mapped: touching a mapping past the end of a file that something
+else truncated raises ``SIGBUS``, which would kill the whole server.
+"""
+
+import errno
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+
+from paramiko import (
+    SFTP_OK,
+    SFTP_PERMISSION_DENIED,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface
+)
+
+
+STAT_TTL = 1.0
+MAX_STATS = 10000
+# Unused descriptors kept open for later opens of the same file.
+MAX_IDLE_FILES = 64
+
+
+class _SharedFile:
+
+    __slots__ = ('key', 'fd', 'refs')
+
+    def __init__(self, key, fd):
+        self.key = key
+        self.fd = fd
+        self.refs = 0
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SFTPCache:
+    """
+    ``stat`` results and read-only file descriptors shared by every SFTP
+    session of a server.
+    """
+
+    def __init__(
+        self,
+        stat_ttl=STAT_TTL,
+        max_stats=MAX_STATS,
+        max_idle_files=MAX_IDLE_FILES
+    ):
+        self.stat_ttl = stat_ttl
+        self.max_stats = max_stats
+        self.max_idle_files = max_idle_files
+        # ``(path, follow_symlinks)`` -> ``(stat_result, expires)``.
+        self._stats = OrderedDict()
+        # Descriptors by ``(path, device, inode, size, mtime)``; ``_idle``
+        # holds those no handle uses, least recently used first.
+        self._files = {}
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stat(self, path, follow_symlinks=True):
+        """`os.stat` (or `os.lstat`) of ``path``, cached for ``stat_ttl``."""
+        key = (path, follow_symlinks)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        st = os.stat(path, follow_symlinks=follow_symlinks)
+        with self._lock:
+            self._stats[key] = (st, now + self.stat_ttl)
+            self._stats.move_to_end(key)
+            while len(self._stats) > self.max_stats:
+                self._stats.popitem(last=False)
+        return st
+
+    def invalidate(self, path=None):
+        """Forget cached ``stat`` results for ``path``, or for every path."""
+        with self._lock:
+            if path is None:
+                self._stats.clear()
+                return
+            self._stats.pop((path, True), None)
+            self._stats.pop((path, False), None)
+
+    def open(self, path):
+        """
+        Return a shared read-only descriptor of ``path``. Pass it to
+        `release` when done with it.
+        """
+        st = self.stat(path)
+        key = (path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            shared = self._files.get(key)
+            if shared is not None:
+                self._idle.pop(key, None)
+                shared.refs += 1
+                return shared
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        try:
+            shared = _SharedFile(key, fd)
+        except Exception:
+            os.close(fd)
+            raise
+        with self._lock:
+            existing = self._files.get(key)
+            if existing is not None:
+                self._idle.pop(key, None)
+                existing.refs += 1
+                unused, shared = shared, existing
+            else:
+                unused = None
+                shared.refs = 1
+                self._files[key] = shared
+        if unused is not None:
+            unused.close()
+        return shared
+
+    def release(self, shared):
+        closing = []
+        with self._lock:
+            shared.refs -= 1
+            if shared.refs:
+                return
+            self._idle[shared.key] = shared
+            while len(self._idle) > self.max_idle_files:
+                key, old = self._idle.popitem(last=False)
+                del self._files[key]
+                closing.append(old)
+        for old in closing:
+            old.close()
+
+    def close(self):
+        """Close every idle descriptor."""
+        with self._lock:
+            closing = list(self._idle.values())
+            for key in self._idle:
+                del self._files[key]
+            self._idle.clear()
+        for old in closing:
+            old.close()
+
+
+class SFTPFileHandle(SFTPHandle):
+    """An open file: a shared descriptor if read-only, else its own."""
+
+    def __init__(self, root, path, flags, fd=None, shared=None):
+        super().__init__(flags)
+        self.root = root
+        self.path = path
+        self.fd = shared.fd if shared is not None else fd
+        self.shared = shared
+        self.append = bool(flags & os.O_APPEND)
+
+    def read(self, offset, length):
+        try:
+            return os.pread(self.fd, length, offset)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def write(self, offset, data):
+        if self.shared is not None:
+            return SFTP_PERMISSION_DENIED
+        try:
+            view = memoryview(data)
+            while view:
+                if self.append:
+                    written = os.write(self.fd, view)
+                else:
+                    written = os.pwrite(self.fd, view, offset)
+                offset += written
+                view = view[written:]
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.fd))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return self.root.chattr(self.root.virtual(self.path), attr)
+
+    def close(self):
+        if self.shared is not None:
+            self.root.cache.release(self.shared)
+            self.shared = None
+        elif self.fd is not None:
+            os.close(self.fd)
+            self.root.cache.invalidate(self.path)
+        self.fd = None
+
+
+class SFTPRoot(SFTPServerInterface):
+    """
+    Serve the directory ``root`` as ``/``. Paths that resolve outside of
+    it, through ``..`` or symlinks, are refused.
+    """
+
+    def __init__(self, server, root, cache=None):
+        """
+        :param .ServerInterface server: the SSH server interface
+        :param str root: directory to serve
+        :param .SFTPCache cache: shared caches; a private one by default
+        """
+        super().__init__(server)
+        self.root = os.path.realpath(root)
+        self.cache = cache or SFTPCache()
+
+    def local(self, path):
+        """The local path for the SFTP ``path``, which must be inside."""
+        local = os.path.realpath(
+            os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+        )
+        if not self._inside(local):
+            raise PermissionError(
+                errno.EACCES, 'Outside of the served root', path
+            )
+        return local
+
+    def virtual(self, local):
+        """The SFTP path of ``local``, a path inside the root."""
+        relative = os.path.relpath(local, self.root)
+        if relative == os.curdir:
+            return '/'
+        return '/' + relative.replace(os.sep, '/')
+
+    def canonicalize(self, path):
+        return posixpath.normpath(posixpath.join('/', path or '/'))
+
+    def open(self, path, flags, attr):
+        try:
+            local = self.local(path)
+            if flags & (os.O_WRONLY | os.O_RDWR) == 0:
+                return SFTPFileHandle(
+                    self, local, flags, shared=self.cache.open(local)
+                )
+            mode = getattr(attr, 'st_mode', None) or 0o666
+            fd = os.open(local, flags | getattr(os, 'O_CLOEXEC', 0), mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.cache.invalidate(local)
+        if flags & os.O_CREAT and attr is not None:
+            SFTPServer.set_file_attr(local, attr)
+        return SFTPFileHandle(self, local, flags, fd=fd)
+
+    def list_folder(self, path):
+        try:
+            local = self.local(path)
+            entries = []
+            with os.scandir(local) as it:
+                for entry in it:
+                    entries.append(SFTPAttributes.from_stat(
+                        entry.stat(follow_symlinks=False),
+                        entry.name
+                    ))
+            return entries
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(self.cache.stat(self.local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            local = self._local_link(path)
+            return SFTPAttributes.from_stat(self.cache.stat(local, False))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def remove(self, path):
+        return self._change(os.remove, self._local_link, path)
+
+    def rename(self, oldpath, newpath):
+        try:
+            old = self._local_link(oldpath)
+            new = self._local_link(newpath)
+            if os.path.exists(new):
+                return SFTPServer.convert_errno(errno.EEXIST)
+            os.rename(old, new)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.cache.invalidate()
+        return SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._local_link(oldpath), self._local_link(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.cache.invalidate()
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            local = self.local(path)
+            os.mkdir(local)
+            if attr is not None:
+                SFTPServer.set_file_attr(local, attr)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.cache.invalidate(local)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        return self._change(os.rmdir, self.local, path)
+
+    def chattr(self, path, attr):
+        try:
+            local = self.local(path)
+            SFTPServer.set_file_attr(local, attr)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.cache.invalidate(local)
+        return SFTP_OK
+
+    def symlink(self, target_path, path):
+        return self._change(
+            lambda local: os.symlink(target_path, local),
+            self._local_link,
+            path
+        )
+
+    def readlink(self, path):
+        try:
+            target = os.readlink(self._local_link(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if os.path.isabs(target):
+            if not self._inside(target):
+                return SFTP_PERMISSION_DENIED
+            target = self.virtual(target)
+        return target
+
+    def _inside(self, local):
+        # The root itself ends in a separator only when it is ``/``.
+        return local == self.root or local.startswith(
+            os.path.join(self.root, '')
+        )
+
+    def _local_link(self, path):
+        """Like `local`, but without following a final symlink."""
+        path = self.canonicalize(path)
+        parent, name = posixpath.split(path)
+        if not name:
+            return self.local(parent)
+        return os.path.join(self.local(parent), name)
+
+    def _change(self, operation, resolve, path):
+        try:
+            local = resolve(path)
+            operation(local)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        self.cache.invalidate(local)
+        return SFTP_OK
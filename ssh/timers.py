@@ -0,0 +1,128 @@
+"""
+Hashed timer wheel.
+
+`TimerWheel` keeps timers in a ring of slots, one slot per ``tick``
+seconds. Scheduling and cancelling are O(1), and each tick only looks at
+the timers in one slot, so tens of thousands of per-session timers cost
+about the same to run as a handful. Timers fire on the wheel's own
+thread with a resolution of one tick; callbacks should be short.
+"""
+
+import logging
+import math
+import threading
+import time
+
+
+logger = logging.getLogger('ssh')
+
+TICK = 0.1
+SLOTS = 512
+
+
+class Timer:
+
+    __slots__ = ('callback', 'args', 'rounds', 'slot', 'cancelled')
+
+    def __init__(self, callback, args, rounds, slot):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds
+        self.slot = slot
+        self.cancelled = False
+
+
+class TimerWheel:
+
+    def __init__(self, tick=TICK, slots=SLOTS):
+        """
+        :param float tick: seconds per slot, the timer resolution
+        :param int slots: number of slots in the ring
+        """
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self._cursor = 0
+        self._last = time.monotonic()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call ``callback(*args)`` on the wheel thread after ``delay`` seconds.
+
+        :return: a `Timer` that can be passed to `cancel`
+        """
+        ticks = max(1, math.ceil(delay / self.tick))
+        size = len(self.slots)
+        with self._lock:
+            slot = (self._cursor + ticks) % size
+            timer = Timer(callback, args, (ticks - 1) // size, slot)
+            self.slots[slot].add(timer)
+            self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        """Cancel ``timer`` if it has not fired yet."""
+        if timer is None or timer.cancelled:
+            return
+        with self._lock:
+            timer.cancelled = True
+            slot = self.slots[timer.slot]
+            if timer in slot:
+                slot.remove(timer)
+                self._count -= 1
+
+    def advance(self, now=None):
+        """
+        Move the wheel forward to ``now`` and run every timer that became
+        due. Called by the wheel thread; exposed for driving it manually.
+        """
+        if now is None:
+            now = time.monotonic()
+        ticks = int((now - self._last) / self.tick)
+        if ticks <= 0:
+            return
+        self._last += ticks * self.tick
+
+        for _ in range(ticks):
+            due = []
+            with self._lock:
+                self._cursor = (self._cursor + 1) % len(self.slots)
+                slot = self.slots[self._cursor]
+                for timer in list(slot):
+                    if timer.rounds > 0:
+                        timer.rounds -= 1
+                        continue
+                    slot.remove(timer)
+                    timer.cancelled = True
+                    due.append(timer)
+                self._count -= len(due)
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logger.exception('Unhandled error in timer callback')
+
+    def start(self, name='ssh-timers'):
+        """Drive the wheel from a daemon thread."""
+        if self._thread is None:
+            self._last = time.monotonic()
+            self._thread = threading.Thread(
+                target=self._run,
+                name=name,
+                daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.tick):
+            self.advance()
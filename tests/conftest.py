@@ -0,0 +1,56 @@
+import os
+
+import paramiko
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from ssh.bench import free_port, start_server, stop_server
+
+
+HOST = '127.0.0.1'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def keys(tmp_path, monkeypatch):
+    """
+    A working directory with a fresh ``keys/`` tree: a server host key,
+    and a client key listed in the server's ``authorized_keys``.
+    """
+    server_dir = tmp_path / 'keys' / 'server'
+    client_dir = tmp_path / 'keys' / 'client'
+    server_dir.mkdir(parents=True)
+    client_dir.mkdir(parents=True)
+    host_key = ed25519.Ed25519PrivateKey.generate()
+    (server_dir / 'id_ed25519').write_bytes(host_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.OpenSSH,
+        serialization.NoEncryption()
+    ))
+    client_key = paramiko.ECDSAKey.generate()
+    client_key.write_private_key_file(str(client_dir / 'id_ecdsa'))
+    (server_dir / 'authorized_keys').write_text(
+        f'{client_key.get_name()} {client_key.get_base64()} client\n'
+    )
+    (client_dir / 'known_hosts').touch()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def server(keys):
+    """Start ``python3 -m ssh.server`` with extra arguments; the port."""
+    procs = []
+
+    def start(*args):
+        port = free_port(HOST)
+        procs.append(start_server(
+            HOST, port, *args,
+            env={'PYTHONPATH': ROOT, 'SSH_LOG_FILE': ''}
+        ))
+        return port
+
+    yield start
+    for proc in procs:
+        stop_server(proc)
@@ -0,0 +1,289 @@
+import functools
+import queue
+import time
+from types import SimpleNamespace
+
+import paramiko
+import pytest
+from paramiko.common import (
+    MSG_SERVICE_ACCEPT,
+    MSG_USERAUTH_BANNER,
+    MSG_USERAUTH_FAILURE,
+    MSG_USERAUTH_PK_OK,
+    MSG_USERAUTH_SUCCESS,
+    cMSG_SERVICE_REQUEST,
+    cMSG_USERAUTH_REQUEST,
+)
+from paramiko.message import Message
+from paramiko.ssh_exception import SSHException
+
+from conftest import HOST
+from ssh import admission
+from ssh.admission import AdmissionControl
+from ssh.metrics import Metrics
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, 'time', clock)
+    return clock
+
+
+def _session(ip='192.0.2.1'):
+    return SimpleNamespace(addr=(ip, 50000), handshaking=False)
+
+
+def _admit(control, ip='192.0.2.1'):
+    session = _session(ip)
+    reason = control.admit(session)
+    control.release(session)
+    return reason
+
+
+def test_unlimited(clock):
+    control = AdmissionControl()
+    assert [_admit(control) for _ in range(100)] == [None] * 100
+    assert len(control) == 0
+
+
+def test_burst_then_rate(clock):
+    control = AdmissionControl(rate=2, burst=3)
+    assert [_admit(control) for _ in range(4)] == [None, None, None, 'rate']
+    clock.now += 0.25
+    assert _admit(control) == 'rate'
+    clock.now += 0.25
+    assert _admit(control) is None
+    assert _admit(control) == 'rate'
+    # The bucket holds no more than ``burst`` however long it was idle.
+    clock.now += 3600
+    assert [_admit(control) for _ in range(4)] == [None, None, None, 'rate']
+
+
+def test_burst_defaults_to_rate():
+    assert AdmissionControl(rate=5).burst == 5
+    assert AdmissionControl(rate=0.5).burst == 1
+    assert AdmissionControl().burst == 1
+
+
+def test_buckets_are_per_ip(clock):
+    control = AdmissionControl(rate=1, burst=1)
+    assert _admit(control, '192.0.2.1') is None
+    assert _admit(control, '192.0.2.1') == 'rate'
+    assert _admit(control, '192.0.2.2') is None
+    assert len(control) == 2
+
+
+def test_refused_connections_take_no_token(clock):
+    control = AdmissionControl(rate=1, burst=1, max_handshakes=1)
+    busy = _session('192.0.2.9')
+    assert control.admit(busy) is None
+    assert _admit(control) == 'handshakes'
+    control.release(busy)
+    assert _admit(control) is None
+
+
+def test_handshake_slots(clock):
+    control = AdmissionControl(max_handshakes=2)
+    sessions = [_session() for _ in range(3)]
+    assert [control.admit(s) for s in sessions] == [None, None, 'handshakes']
+    assert not sessions[2].handshaking
+    control.release(sessions[0])
+    control.release(sessions[0])
+    assert control.handshakes == 1
+    assert control.admit(sessions[2]) is None
+    assert control.handshakes == 2
+
+
+def test_auth_failures(clock):
+    control = AdmissionControl(max_ip_failures=3, failure_window=60)
+    for _ in range(3):
+        assert _admit(control) is None
+        control.auth_failed('192.0.2.1')
+    assert _admit(control) == 'auth_failures'
+    assert _admit(control, '192.0.2.2') is None
+    # One failure's allowance comes back every window / max_ip_failures.
+    clock.now += 19
+    assert _admit(control) == 'auth_failures'
+    clock.now += 1
+    assert _admit(control) is None
+    control.auth_failed('192.0.2.1')
+    assert _admit(control) == 'auth_failures'
+
+
+def test_auth_failures_ignored_without_limit(clock):
+    control = AdmissionControl(rate=1)
+    for _ in range(10):
+        control.auth_failed('192.0.2.1')
+    assert _admit(control) is None
+
+
+def test_tracked_addresses_are_bounded(clock):
+    control = AdmissionControl(rate=1, burst=1, max_tracked=2)
+    assert _admit(control, '192.0.2.1') is None
+    assert _admit(control, '192.0.2.2') is None
+    assert _admit(control, '192.0.2.3') is None
+    assert len(control) == 2
+    # The least recently used address was evicted and starts afresh.
+    assert _admit(control, '192.0.2.1') is None
+    assert _admit(control, '192.0.2.3') == 'rate'
+
+
+def test_metrics(clock):
+    metrics = Metrics()
+    control = AdmissionControl(rate=1, burst=1, metrics=metrics)
+    session = _session()
+    assert control.admit(session) is None
+    assert metrics.gauges['handshakes_in_flight'] == 1
+    assert _admit(control) == 'rate'
+    assert metrics.counters['rejected_rate'] == 1
+    control.release(session)
+    assert metrics.gauges['handshakes_in_flight'] == 0
+
+
+class _Replies:
+    """
+    Stands in for a client transport's auth handler, so that tests can
+    send hand-made authentication requests and read the server's
+    replies.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self._handler_table = {
+            ptype: functools.partial(self.queue.put, ptype)
+            for ptype in (
+                MSG_SERVICE_ACCEPT,
+                MSG_USERAUTH_BANNER,
+                MSG_USERAUTH_FAILURE,
+                MSG_USERAUTH_PK_OK,
+                MSG_USERAUTH_SUCCESS,
+            )
+        }
+
+    def get(self):
+        """The type of the next reply that is not a banner."""
+        while True:
+            ptype = self.queue.get(timeout=10)
+            if ptype != MSG_USERAUTH_BANNER:
+                return ptype
+
+    def is_authenticated(self):
+        return False
+
+    def abort(self):
+        pass
+
+
+def _start_client(port):
+    transport = paramiko.Transport((HOST, port))
+    transport.start_client(timeout=10)
+    return transport
+
+
+def _connect(port):
+    """
+    Connect once a handshake slot is free: the server may not yet have
+    noticed earlier connections, even its own readiness check, close.
+    """
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            return _start_client(port)
+        except (EOFError, OSError, SSHException):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+
+
+def _raw_auth(port):
+    transport = _connect(port)
+    replies = transport.auth_handler = _Replies()
+    m = Message()
+    m.add_byte(cMSG_SERVICE_REQUEST)
+    m.add_string('ssh-userauth')
+    transport._send_message(m)
+    assert replies.get() == MSG_SERVICE_ACCEPT
+    return transport, replies
+
+
+def _publickey(transport, replies, key, signature=None):
+    """Send a publickey request; the type of the server's reply."""
+    m = Message()
+    m.add_byte(cMSG_USERAUTH_REQUEST)
+    m.add_string('user')
+    m.add_string('ssh-connection')
+    m.add_string('publickey')
+    m.add_boolean(signature is not None)
+    m.add_string(key.get_name())
+    m.add_string(key.asbytes())
+    if signature is not None:
+        m.add_string(signature)
+    transport._send_message(m)
+    return replies.get()
+
+
+def _refused(port):
+    try:
+        _start_client(port).close()
+    except (EOFError, OSError, SSHException):
+        return True
+    return False
+
+
+def _client_key():
+    return paramiko.ECDSAKey.from_private_key_file('keys/client/id_ecdsa')
+
+
+def test_unsigned_or_forged_auth_keeps_handshake_slot(server):
+    port = server('--max-handshakes', '1')
+    key = _client_key()
+    transport, replies = _raw_auth(port)
+    try:
+        assert _publickey(transport, replies, key) == MSG_USERAUTH_PK_OK
+        assert _refused(port)
+        forged = key.sign_ssh_data(b'not the session data').asbytes()
+        assert _publickey(
+            transport, replies, key, forged
+        ) == MSG_USERAUTH_FAILURE
+        assert _refused(port)
+    finally:
+        transport.close()
+    # A real login gives the slot back, just after its success reply.
+    transport = _connect(port)
+    try:
+        transport.auth_publickey('user', key)
+        _connect(port).close()
+    finally:
+        transport.close()
+
+
+def test_forged_signatures_count_as_failures(server):
+    port = server('--max-auth-tries', '2')
+    key = _client_key()
+    transport, replies = _raw_auth(port)
+    try:
+        for _ in range(5):
+            assert _publickey(transport, replies, key) == MSG_USERAUTH_PK_OK
+        forged = key.sign_ssh_data(b'not the session data').asbytes()
+        assert _publickey(
+            transport, replies, key, forged
+        ) == MSG_USERAUTH_FAILURE
+        assert transport.is_active()
+        assert _publickey(
+            transport, replies, key, forged
+        ) == MSG_USERAUTH_FAILURE
+        deadline = time.monotonic() + 10
+        while transport.is_active():
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        transport.close()
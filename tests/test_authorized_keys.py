@@ -0,0 +1,148 @@
+import base64
+import hashlib
+
+import paramiko
+import pytest
+
+from ssh.authorized_keys import (
+    AuthorizedKeys,
+    AuthorizedKeysFile,
+    parse_line,
+    parse_options,
+)
+
+
+KEY = paramiko.ECDSAKey.generate()
+OTHER = paramiko.ECDSAKey.generate()
+
+
+def _line(key, options='', comment='user@host'):
+    prefix = f'{options} ' if options else ''
+    return f'{prefix}{key.get_name()} {key.get_base64()} {comment}\n'
+
+
+def test_plain_line():
+    entry = parse_line(_line(KEY))
+    assert entry.key_type == KEY.get_name()
+    assert entry.blob == KEY.asbytes()
+    assert entry.comment == 'user@host'
+    assert entry.options == {}
+
+
+@pytest.mark.parametrize('line', [
+    '',
+    '   ',
+    '# ecdsa-sha2-nistp256 AAAA',
+    'ecdsa-sha2-nistp256',
+    'ecdsa-sha2-nistp256 not!base64',
+    'no-pty',
+    'no-pty,from="10.0.0.1" garbage AAAA',
+])
+def test_ignored_lines(line):
+    assert parse_line(line) is None
+
+
+def test_options():
+    options = parse_options(
+        'no-pty,from="10.0.0.0/8,!10.0.0.1",command="echo \\"a,b\\"",'
+        'permitopen="db:5432",permitopen="cache:6379",restrict'
+    )
+    assert options == {
+        'no-pty': True,
+        'from': '10.0.0.0/8,!10.0.0.1',
+        'command': 'echo "a,b"',
+        'permitopen': ['db:5432', 'cache:6379'],
+        'restrict': True,
+    }
+
+
+def test_options_with_spaces_in_quotes():
+    entry = parse_line(_line(KEY, 'command="ls -l /tmp",no-pty'))
+    assert entry.blob == KEY.asbytes()
+    assert entry.options == {'command': 'ls -l /tmp', 'no-pty': True}
+
+
+def test_cert_authority_is_an_option():
+    entry = parse_line(_line(KEY, 'cert-authority,principals="alice,bob"'))
+    assert entry.options == {
+        'cert-authority': True,
+        'principals': 'alice,bob',
+    }
+
+
+def test_allows():
+    assert parse_line(_line(KEY)).allows('pty')
+    assert not parse_line(_line(KEY, 'no-pty')).allows('pty')
+    restricted = parse_line(_line(KEY, 'restrict,pty'))
+    assert restricted.allows('pty')
+    assert not restricted.allows('port-forwarding')
+    assert not parse_line(_line(KEY, 'restrict,no-pty,pty')).allows('pty')
+
+
+@pytest.mark.parametrize('patterns, address, allowed', [
+    (None, '192.0.2.1', True),
+    (None, None, True),
+    ('192.0.2.1', '192.0.2.1', True),
+    ('192.0.2.1', '192.0.2.10', False),
+    ('192.0.2.*', '192.0.2.10', True),
+    ('192.0.2.?', '192.0.2.10', False),
+    ('10.0.0.0/8', '10.1.2.3', True),
+    ('10.0.0.0/8', '11.0.0.1', False),
+    ('10.0.0.0/8,!10.0.0.1', '10.0.0.1', False),
+    ('!10.0.0.1,10.0.0.0/8', '10.0.0.1', False),
+    ('10.0.0.0/8,!10.0.0.1', '10.0.0.2', True),
+    ('!10.0.0.1', '10.0.0.2', False),
+    ('2001:db8::/32', '2001:db8::1', True),
+    ('2001:db8::/32', '2001:db9::1', False),
+    ('10.0.0.0/8', '2001:db8::1', False),
+    ('not-a-network/8', '10.0.0.1', False),
+    ('10.0.0.0/8', None, False),
+])
+def test_from(patterns, address, allowed):
+    options = '' if patterns is None else f'from="{patterns}"'
+    entry = parse_line(_line(KEY, options))
+    assert entry.allows_address(address) is allowed
+
+
+def test_fingerprint():
+    entry = parse_line(_line(KEY))
+    digest = hashlib.sha256(KEY.asbytes()).digest()
+    assert entry.fingerprint == (
+        'SHA256:' + base64.b64encode(digest).decode().rstrip('=')
+    )
+
+
+def test_file_is_reread_when_changed(tmp_path):
+    path = tmp_path / 'authorized_keys'
+    path.write_text(_line(KEY))
+    keys = AuthorizedKeysFile(str(path), check_interval=0)
+    assert keys.lookup(KEY.get_name(), KEY.asbytes()) is not None
+    assert keys.lookup(OTHER.get_name(), OTHER.asbytes()) is None
+    path.write_text(_line(OTHER) + '# the first key was removed\n')
+    assert keys.lookup(KEY.get_name(), KEY.asbytes()) is None
+    assert keys.lookup(OTHER.get_name(), OTHER.asbytes()) is not None
+    path.unlink()
+    assert len(keys) == 0
+
+
+def test_user_files(tmp_path):
+    users = tmp_path / 'users'
+    users.mkdir()
+    (users / 'alice').write_text(_line(OTHER))
+    global_file = tmp_path / 'authorized_keys'
+    global_file.write_text(_line(KEY))
+    keys = AuthorizedKeys(
+        str(global_file), str(users / '%u'), check_interval=0
+    )
+    assert keys.lookup('alice', OTHER) is not None
+    assert keys.lookup('alice', KEY) is not None
+    assert keys.lookup('bob', OTHER) is None
+    assert keys.lookup('bob', KEY) is not None
+
+
+@pytest.mark.parametrize('username', ['', '.', '..', '../alice', 'a/b'])
+def test_unsafe_usernames_read_no_user_file(tmp_path, username):
+    (tmp_path / 'alice').write_text(_line(OTHER))
+    (tmp_path / 'users').mkdir()
+    keys = AuthorizedKeys(None, str(tmp_path / 'users' / '%u'))
+    assert keys.lookup(username, OTHER) is None
@@ -0,0 +1,290 @@
+import time
+
+import paramiko
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from paramiko.message import Message
+from paramiko.pkey import PublicBlob
+from paramiko.ssh_exception import SSHException
+
+from ssh.authorized_keys import AuthorizedKeys
+from ssh.certificates import (
+    HOST,
+    USER,
+    Certificate,
+    CertificateCache,
+    UserCertificates,
+    check_host_certificate,
+    sign_certificate,
+)
+from ssh.known_hosts import HostKeyPolicy, KnownHosts, parse_line
+
+
+CA = paramiko.ECDSAKey.generate()
+OTHER_CA = paramiko.ECDSAKey.generate()
+RSA_CA = paramiko.RSAKey.generate(2048)
+KEY = paramiko.ECDSAKey.generate()
+
+
+def _with_certificate(key, blob):
+    certified = paramiko.ECDSAKey(vals=(key.signing_key, key.verifying_key))
+    certified.public_blob = PublicBlob(Certificate(blob).cert_type, blob)
+    return certified
+
+
+def _string(data):
+    m = Message()
+    m.add_string(data)
+    return m.asbytes()
+
+
+def _resign(blob, signature):
+    return Certificate(blob).signed + _string(signature)
+
+
+def _sha1_signature(key, data):
+    m = Message()
+    m.add_string('ssh-rsa')
+    m.add_string(key.key.sign(data, padding.PKCS1v15(), hashes.SHA1()))
+    return m.asbytes()
+
+
+def test_parse():
+    blob = sign_certificate(
+        CA,
+        KEY,
+        'alice@example',
+        ['alice', 'admin'],
+        valid_after=100,
+        valid_before=200,
+        critical_options={'force-command': 'uptime'},
+        extensions=['permit-pty'],
+        serial=42
+    )
+    certificate = Certificate(blob)
+    assert certificate.cert_type == 'ecdsa-sha2-nistp256-cert-v01@openssh.com'
+    assert certificate.public_key == KEY.asbytes()
+    assert certificate.serial == 42
+    assert certificate.type == USER
+    assert certificate.key_id == 'alice@example'
+    assert certificate.principals == ('alice', 'admin')
+    assert (certificate.valid_after, certificate.valid_before) == (100, 200)
+    assert certificate.critical_options == {'force-command': 'uptime'}
+    assert certificate.extensions == {'permit-pty': ''}
+    assert certificate.ca_key == CA.asbytes()
+    assert certificate.verify()
+
+
+def test_malformed():
+    blob = sign_certificate(CA, KEY, 'id', ['alice'])
+    for data in (blob[:-1], blob + b'\0', blob[:40], KEY.asbytes()):
+        with pytest.raises(ValueError):
+            Certificate(data)
+    unknown = _string('ssh-foo-cert-v01@openssh.com') + blob[45:]
+    with pytest.raises(ValueError, match='unknown certificate type'):
+        Certificate(unknown)
+    assert CertificateCache().verified(blob[:-1]) is None
+
+
+def test_tampered_signature():
+    blob = bytearray(sign_certificate(CA, KEY, 'id', ['alice']))
+    index = bytes(blob).index(b'alice')
+    blob[index] = ord('b')
+    assert not Certificate(bytes(blob)).verify()
+    assert CertificateCache().verified(bytes(blob)) is None
+
+
+def test_signed_by_another_key():
+    blob = sign_certificate(CA, KEY, 'id', ['alice'])
+    signature = OTHER_CA.sign_ssh_data(Certificate(blob).signed)
+    assert not Certificate(_resign(blob, signature.asbytes())).verify()
+
+
+def test_rsa_sha2_signature():
+    assert Certificate(sign_certificate(RSA_CA, KEY, 'id', ['a'])).verify()
+
+
+def test_rsa_sha1_signature_refused():
+    blob = sign_certificate(RSA_CA, KEY, 'id', ['alice'])
+    sha1 = _resign(blob, _sha1_signature(RSA_CA, Certificate(blob).signed))
+    certificate = Certificate(sha1)
+    assert Message(certificate.signature).get_text() == 'ssh-rsa'
+    assert not certificate.verify()
+    assert CertificateCache().verified(sha1) is None
+
+
+@pytest.mark.parametrize('now, problem', [
+    (99, 'not yet valid'),
+    (100, None),
+    (199.5, None),
+    (200, 'expired'),
+])
+def test_validity_window(now, problem):
+    blob = sign_certificate(
+        CA, KEY, 'id', ['alice'], valid_after=100, valid_before=200
+    )
+    assert Certificate(blob).problem(USER, ['alice'], now) == problem
+
+
+def test_principals_and_type():
+    certificate = Certificate(sign_certificate(CA, KEY, 'id', ['alice']))
+    assert certificate.problem(USER, ['alice']) is None
+    assert certificate.problem(USER, ['bob', 'alice']) is None
+    assert certificate.problem(USER, ['bob']) == 'not issued for bob'
+    assert certificate.problem(HOST, ['alice']) == 'wrong certificate type'
+    nobody = Certificate(sign_certificate(CA, KEY, 'id', []))
+    assert nobody.problem(USER, ['alice']) is not None
+
+
+def test_cache_drops_expired():
+    cache = CertificateCache()
+    blob = sign_certificate(CA, KEY, 'id', ['alice'], valid_before=200)
+    assert cache.verified(blob, now=100) is not None
+    assert cache.verified(blob, now=150) is not None
+    assert (len(cache), cache.hits) == (1, 1)
+    assert cache.verified(blob, now=200) is not None
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def trusted(tmp_path):
+    path = tmp_path / 'trusted_user_ca_keys'
+    path.write_text(f'{CA.get_name()} {CA.get_base64()} ca\n')
+    return UserCertificates(trusted_ca_path=str(path))
+
+
+def _user(certificates, username='alice', address='192.0.2.1', **kwargs):
+    kwargs.setdefault('valid_before', int(time.time()) + 3600)
+    blob = sign_certificate(
+        kwargs.pop('ca', CA),
+        KEY,
+        'id',
+        kwargs.pop('principals', ['alice']),
+        **kwargs
+    )
+    return certificates.lookup(username, _with_certificate(KEY, blob), address)
+
+
+def test_user_certificate(trusted):
+    entry = _user(trusted, extensions=['permit-pty'])
+    assert entry.blob == KEY.asbytes()
+    assert entry.allows('pty')
+    assert not entry.allows('port-forwarding')
+    assert _user(trusted, username='bob') is None
+    assert _user(trusted, ca=OTHER_CA) is None
+    assert _user(trusted, cert_type=HOST) is None
+    assert _user(trusted, valid_before=int(time.time()) - 1) is None
+    assert _user(trusted, valid_after=int(time.time()) + 60) is None
+
+
+def test_unknown_critical_options_refused(trusted):
+    assert _user(trusted, critical_options={'verify-required': ''}) is None
+    assert _user(
+        trusted,
+        critical_options={'force-command': 'uptime', 'no-such-option': 'x'}
+    ) is None
+
+
+def test_force_command(trusted):
+    entry = _user(trusted, critical_options={'force-command': 'uptime'})
+    assert entry.options['command'] == 'uptime'
+
+
+@pytest.mark.parametrize('address, accepted', [
+    ('192.0.2.1', True),
+    ('198.51.100.7', True),
+    ('203.0.113.1', False),
+    (None, False),
+])
+def test_source_address(trusted, address, accepted):
+    entry = _user(
+        trusted,
+        address=address,
+        critical_options={'source-address': '192.0.2.0/24,198.51.100.7'}
+    )
+    assert (entry is not None) is accepted
+
+
+def test_cert_authority_line(tmp_path):
+    path = tmp_path / 'authorized_keys'
+    path.write_text(
+        f'cert-authority,principals="ops",command="id" '
+        f'{CA.get_name()} {CA.get_base64()}\n'
+        f'{OTHER_CA.get_name()} {OTHER_CA.get_base64()}\n'
+    )
+    certificates = UserCertificates(AuthorizedKeys(str(path)))
+    # The principals= option, not the user name, must be certified.
+    assert _user(certificates) is None
+    entry = _user(certificates, principals=['ops'])
+    assert entry.options['command'] == 'id'
+    assert _user(
+        certificates,
+        principals=['ops'],
+        critical_options={'force-command': 'uptime'}
+    ) is None
+    # A key without cert-authority vouches for no certificates.
+    assert _user(certificates, principals=['ops'], ca=OTHER_CA) is None
+
+
+def _authorities(*lines):
+    return [parse_line(line) for line in lines]
+
+
+def _host(principals=('www.example.com',), ca=CA, **kwargs):
+    blob = sign_certificate(
+        ca, KEY, 'host', list(principals), cert_type=HOST, **kwargs
+    )
+    return _with_certificate(KEY, blob)
+
+
+def test_host_certificate():
+    authorities = _authorities(
+        f'@cert-authority *.example.com {CA.get_name()} {CA.get_base64()}'
+    )
+    assert check_host_certificate(
+        _host(), 'www.example.com', authorities
+    ) is None
+    assert check_host_certificate(
+        _host(), '[www.example.com]:2222', authorities
+    ) is None
+    assert check_host_certificate(
+        _host(), 'mail.example.com', authorities
+    ) == 'not issued for mail.example.com'
+    assert 'untrusted CA' in check_host_certificate(
+        _host(ca=OTHER_CA), 'www.example.com', authorities
+    )
+    assert check_host_certificate(
+        _host(critical_options={'force-command': 'id'}),
+        'www.example.com',
+        authorities
+    ) == 'host certificates take no critical options'
+    assert check_host_certificate(
+        _host(valid_after=100, valid_before=200),
+        'www.example.com',
+        authorities,
+        now=200
+    ) == 'expired'
+    user = _with_certificate(
+        KEY, sign_certificate(CA, KEY, 'id', ['www.example.com'])
+    )
+    assert check_host_certificate(
+        user, 'www.example.com', authorities
+    ) == 'wrong certificate type'
+
+
+def test_host_key_policy(tmp_path):
+    path = tmp_path / 'known_hosts'
+    path.write_text(
+        f'@cert-authority *.example.com {CA.get_name()} {CA.get_base64()}\n'
+    )
+    known = KnownHosts(str(path), check_interval=0)
+    policy = HostKeyPolicy(known, 'yes')
+    policy.missing_host_key(None, 'www.example.com', _host())
+    assert known.get('www.example.com') is None
+    with pytest.raises(SSHException, match='refused'):
+        policy.missing_host_key(
+            None, 'www.example.com', _host(ca=RSA_CA)
+        )
+    with pytest.raises(SSHException, match='not issued'):
+        policy.missing_host_key(None, 'mail.example.com', _host())
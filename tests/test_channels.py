@@ -0,0 +1,77 @@
+import time
+
+import paramiko
+
+from conftest import HOST
+
+
+WELCOME = b'Connected to SSH server on'
+
+
+def _connect(port):
+    key = paramiko.ECDSAKey.from_private_key_file('keys/client/id_ecdsa')
+    transport = paramiko.Transport((HOST, port))
+    transport.connect(username='user', pkey=key)
+    return transport
+
+
+def _read(channel):
+    data = b''
+    while True:
+        chunk = channel.recv(1024)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def test_welcome_without_request(server):
+    transport = _connect(server('--exec', '--sftp-root', '.'))
+    try:
+        channel = transport.open_session(timeout=10)
+        channel.settimeout(10)
+        assert channel.recv(1024).startswith(WELCOME)
+        channel.sendall(b'ping')
+        assert channel.recv(1024) == b'ping'
+    finally:
+        transport.close()
+
+
+def test_requests_get_a_clean_channel(server, keys):
+    (keys / 'file').write_bytes(b'data')
+    transport = _connect(server('--exec', '--sftp-root', '.'))
+    try:
+        sftp = paramiko.SFTPClient.from_transport(transport)
+        with sftp.open('/file') as f:
+            assert f.read() == b'data'
+        sftp.close()
+        channel = transport.open_session(timeout=10)
+        channel.settimeout(10)
+        channel.exec_command('echo hi')
+        assert _read(channel) == b'hi\n'
+        assert channel.recv_exit_status() == 0
+    finally:
+        transport.close()
+
+
+def test_request_after_welcome_takes_over(server):
+    transport = _connect(server('--exec', '--request-wait', '0.05'))
+    try:
+        channel = transport.open_session(timeout=10)
+        channel.settimeout(10)
+        assert channel.recv(1024).startswith(WELCOME)
+        channel.exec_command('echo late; exit 3')
+        assert _read(channel) == b'late\n'
+        assert channel.recv_exit_status() == 3
+    finally:
+        transport.close()
+
+
+def test_channel_wait(server):
+    transport = _connect(server('--channel-wait', '0.2'))
+    try:
+        deadline = time.monotonic() + 10
+        while transport.is_active():
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        transport.close()
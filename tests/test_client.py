@@ -0,0 +1,54 @@
+import builtins
+
+import pytest
+
+from ssh.client import SSHClient
+from ssh.pipeline import LengthFramer
+
+from conftest import HOST
+
+
+SERVER_ARGS = [
+    (),
+    ('--exec',),
+    ('--sftp-root', '.'),
+    ('--exec', '--sftp-root', '.'),
+]
+
+
+@pytest.mark.parametrize('args', SERVER_ARGS)
+def test_pipeline(server, args):
+    client = SSHClient(HOST, server(*args), host_key_policy='no')
+    try:
+        replies = list(client.pipeline([b'one', b'two', b'three']))
+        assert replies == [b'one', b'two', b'three']
+        replies = list(client.pipeline([b'\n\x00', b''], LengthFramer()))
+        assert replies == [b'\n\x00', b'']
+    finally:
+        client.ssh.close()
+
+
+class _Done(Exception):
+    pass
+
+
+@pytest.mark.parametrize('args', SERVER_ARGS)
+def test_start(server, args, monkeypatch, capsys):
+    client = SSHClient(HOST, server(*args), host_key_policy='no')
+    lines = iter(['hello', 'again'])
+
+    def input(prompt):
+        try:
+            return next(lines)
+        except StopIteration:
+            raise _Done() from None
+
+    monkeypatch.setattr(builtins, 'input', input)
+    try:
+        with pytest.raises(_Done):
+            client.start()
+    finally:
+        client.ssh.close()
+    out = capsys.readouterr().out.split('\n')
+    assert out[0].startswith('Connected to SSH server on')
+    assert [line for line in out[1:] if line] == ['hello', 'again']
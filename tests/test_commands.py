@@ -0,0 +1,266 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+
+import paramiko
+import pytest
+
+from conftest import HOST
+from ssh import commands
+from ssh.commands import ProcessHandler, ProcessPool, exit_code
+from ssh.metrics import Metrics
+
+
+class Starts:
+    """Records which of the pool's ``start`` callables have run."""
+
+    def __init__(self):
+        self.started = []
+        self._cond = threading.Condition()
+
+    def __call__(self, name):
+        def start():
+            with self._cond:
+                self.started.append(name)
+                self._cond.notify_all()
+        return start
+
+    def wait(self, *names):
+        """Wait until exactly ``names`` have started, in any order."""
+        deadline = time.monotonic() + 10
+        with self._cond:
+            while sorted(self.started) != sorted(names):
+                assert time.monotonic() < deadline, self.started
+                self._cond.wait(0.05)
+
+
+@pytest.fixture
+def pool():
+    pool = ProcessPool(
+        max_processes=2, max_per_user=None, max_queued=1, metrics=Metrics()
+    )
+    yield pool
+    pool.close()
+
+
+def test_global_limit_and_queue(pool):
+    starts = Starts()
+    assert pool.submit('alice', starts('a1')) is not None
+    assert pool.submit('bob', starts('b1')) is not None
+    queued = pool.submit('carol', starts('c1'))
+    assert queued is not None
+    assert pool.submit('dave', starts('d1')) is None
+    assert pool.metrics.counters['execs_rejected'] == 1
+    starts.wait('a1', 'b1')
+    assert pool.running == 2
+    pool.release('alice')
+    starts.wait('a1', 'b1', 'c1')
+    assert pool.running == 2
+    assert pool._per_user == {'bob': 1, 'carol': 1}
+    assert pool.metrics.gauges['active_processes'] == 2
+
+
+def test_cancel(pool):
+    starts = Starts()
+    pool.submit('alice', starts('a1'))
+    pool.submit('alice', starts('a2'))
+    ticket = pool.submit('alice', starts('a3'))
+    assert pool.cancel(ticket)
+    assert not pool.cancel(ticket)
+    pool.release('alice')
+    pool.release('alice')
+    starts.wait('a1', 'a2')
+    assert pool.running == 0
+
+
+def test_per_user_limit():
+    pool = ProcessPool(max_processes=3, max_per_user=1)
+    starts = Starts()
+    try:
+        pool.submit('alice', starts('a1'))
+        pool.submit('alice', starts('a2'))
+        # Another user is not held up behind alice's waiting request.
+        pool.submit('bob', starts('b1'))
+        pool.submit('bob', starts('b2'))
+        starts.wait('a1', 'b1')
+        pool.release('bob')
+        starts.wait('a1', 'b1', 'b2')
+        pool.release('alice')
+        starts.wait('a1', 'b1', 'b2', 'a2')
+        assert pool._per_user == {'alice': 1, 'bob': 1}
+    finally:
+        pool.close()
+
+
+def _reap(pool, script):
+    starts = Starts()
+    pool.submit('alice', starts('a1'))
+    starts.wait('a1')
+    proc = subprocess.Popen(
+        ['/bin/sh', '-c', script],
+        stdout=subprocess.PIPE,
+        start_new_session=True
+    )
+    # Wait for the shell to be ready for signals.
+    assert proc.stdout.readline() == b'ready\n'
+    pool.reap(proc, 'alice')
+    deadline = time.monotonic() + 10
+    while pool.running:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    proc.stdout.close()
+    return proc.returncode
+
+
+def test_reap_terminates(pool):
+    assert _reap(pool, 'echo ready; sleep 30') == -signal.SIGTERM
+
+
+def test_reap_kills_after_grace(pool, monkeypatch):
+    monkeypatch.setattr(commands, 'KILL_GRACE', 0.2)
+    script = 'trap "" TERM; echo ready; sleep 30'
+    assert _reap(pool, script) == -signal.SIGKILL
+
+
+def test_exit_code():
+    assert exit_code(0) == 0
+    assert exit_code(3) == 3
+    assert exit_code(-signal.SIGKILL) == 137
+
+
+class _Channel:
+
+    def __init__(self):
+        self.stderr = b''
+        self.status = None
+        self.closed = False
+
+    def setblocking(self, blocking):
+        pass
+
+    def get_transport(self):
+        return SimpleNamespace(get_username=lambda: 'alice')
+
+    def send_stderr(self, data):
+        self.stderr += data
+        return len(data)
+
+    def send_exit_status(self, status):
+        self.status = status
+
+    def close(self):
+        self.closed = True
+
+
+def test_refused_when_queue_is_full():
+    pool = SimpleNamespace(submit=lambda user, start: None)
+    discarded = []
+    dispatcher = SimpleNamespace(
+        server=None,
+        loop=SimpleNamespace(unregister=lambda fileobj: None),
+        discard=discarded.append
+    )
+    channel = _Channel()
+    handler = ProcessHandler(dispatcher, channel, pool, 'true')
+    handler.start()
+    assert channel.stderr == b'Too many processes, try again later\n'
+    assert channel.status == 1
+    assert channel.closed
+    assert discarded == [handler]
+
+
+def _connect(port):
+    key = paramiko.ECDSAKey.from_private_key_file('keys/client/id_ecdsa')
+    transport = paramiko.Transport((HOST, port))
+    transport.connect(username='user', pkey=key)
+    return transport
+
+
+def _exec(transport, command, stdin=b''):
+    """Run ``command``; its stdout, stderr and exit status."""
+    channel = transport.open_session(timeout=10)
+    channel.settimeout(10)
+    channel.exec_command(command)
+    channel.sendall(stdin)
+    channel.shutdown_write()
+    stdout = channel.makefile('rb').read()
+    stderr = channel.makefile_stderr('rb').read()
+    return stdout, stderr, channel.recv_exit_status()
+
+
+def test_exec(server):
+    transport = _connect(server('--exec'))
+    try:
+        assert _exec(transport, 'echo out; echo err >&2; exit 7') == (
+            b'out\n', b'err\n', 7
+        )
+        assert _exec(transport, 'tr a-z A-Z', b'abc' * 50000) == (
+            b'ABC' * 50000, b'', 0
+        )
+        assert _exec(transport, 'kill -9 $$')[2] == 137
+        assert _exec(transport, 'echo $USER') == (b'user\n', b'', 0)
+    finally:
+        transport.close()
+
+
+def test_forced_command(keys, server):
+    path = keys / 'keys' / 'server' / 'authorized_keys'
+    path.write_text(
+        'command="echo forced: $SSH_ORIGINAL_COMMAND" ' + path.read_text()
+    )
+    transport = _connect(server('--exec'))
+    try:
+        assert _exec(transport, 'echo asked') == (
+            b'forced: echo asked\n', b'', 0
+        )
+    finally:
+        transport.close()
+
+
+def test_processes_limited_per_user(server):
+    transport = _connect(server('--exec', '--max-processes-per-user', '1'))
+    try:
+        first = transport.open_session(timeout=10)
+        first.settimeout(10)
+        first.exec_command('echo started; read line; echo $line')
+        assert first.recv(1024) == b'started\n'
+        # The second command waits until the first has exited.
+        second = transport.open_session(timeout=10)
+        second.settimeout(10)
+        second.exec_command('echo second')
+        time.sleep(0.3)
+        assert not second.recv_ready()
+        first.sendall(b'done\n')
+        assert first.recv(1024) == b'done\n'
+        assert first.recv_exit_status() == 0
+        assert second.recv(1024) == b'second\n'
+        assert second.recv_exit_status() == 0
+    finally:
+        transport.close()
+
+
+def test_closed_channel_stops_process(server):
+    transport = _connect(server('--exec'))
+    try:
+        channel = transport.open_session(timeout=10)
+        channel.settimeout(10)
+        channel.exec_command('echo $$; exec sleep 30')
+        pid = int(channel.recv(1024))
+        channel.close()
+        deadline = time.monotonic() + 10
+        while _alive(pid):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        transport.close()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
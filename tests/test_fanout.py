@@ -0,0 +1,150 @@
+import socket
+
+import pytest
+
+from conftest import HOST
+from ssh import fanout
+from ssh.bench import free_port
+from ssh.fanout import fan_out, parse_host
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(fanout, 'RETRY_DELAY', 0)
+
+
+class _Channel:
+    """Replies with ``chunks``, then raises ``error`` or reports EOF."""
+
+    def __init__(self, chunks, error=None, exit_status=0):
+        self.chunks = list(chunks)
+        self.error = error
+        self.exit_status = exit_status
+        self.commands = []
+        self.sent = b''
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, command):
+        self.commands.append(command)
+
+    def sendall(self, data):
+        self.sent += data
+
+    def shutdown_write(self):
+        pass
+
+    def recv(self, size):
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.error is not None:
+            raise self.error
+        return b''
+
+    def exit_status_ready(self):
+        return self.exit_status is not None
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+
+class _Pool:
+    """Fails ``failures`` opens, then hands out ``channel``."""
+
+    def __init__(self, channel, failures=0):
+        self.channel = channel
+        self.failures = failures
+        self.opened = 0
+        self.released = []
+
+    def open_session(self, host, port, username):
+        self.opened += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError('refused')
+        return self.channel
+
+    def release(self, channel):
+        self.released.append(channel)
+
+
+def _run(pool, **kwargs):
+    output = []
+    kwargs.setdefault('retries', 2)
+    (result,) = fan_out(
+        ['example.com:22'],
+        pool=pool,
+        on_output=lambda host, data: output.append(data),
+        **kwargs
+    )
+    return result, output
+
+
+def test_connect_failures_are_retried():
+    channel = _Channel([b'out'])
+    pool = _Pool(channel, failures=2)
+    result, output = _run(pool, command='uptime', collect=True)
+    assert result.ok
+    assert (result.attempts, pool.opened) == (3, 3)
+    assert (result.output, result.exit_status, result.error) == (
+        b'out', 0, None
+    )
+    assert channel.commands == ['uptime']
+    assert output == [b'out']
+    assert pool.released == [channel]
+
+
+def test_gives_up_after_retries():
+    pool = _Pool(_Channel([]), failures=5)
+    result, _ = _run(pool, retries=1)
+    assert (result.status, result.attempts, pool.opened) == ('error', 2, 2)
+    assert 'refused' in result.error
+
+
+def test_failure_after_send_is_not_retried():
+    channel = _Channel([b'partial'], error=EOFError('lost'))
+    pool = _Pool(channel)
+    result, output = _run(pool, command='deploy', payload=b'data')
+    assert (result.status, result.attempts) == ('error', 1)
+    assert channel.commands == ['deploy']
+    assert channel.sent == b'data'
+    assert output == [b'partial']
+    assert result.bytes == len(b'partial')
+    assert pool.released == [channel]
+
+
+def test_timeout_after_send_is_not_retried():
+    channel = _Channel([], error=socket.timeout())
+    result, _ = _run(_Pool(channel), command='sleep 60', timeout=5)
+    assert (result.status, result.attempts) == ('timeout', 1)
+    assert result.error == 'timed out after 5s'
+
+
+@pytest.mark.parametrize('host, parsed', [
+    ('example.com', ('example.com', 2222)),
+    ('example.com:22', ('example.com', 22)),
+    ('192.0.2.1:2200', ('192.0.2.1', 2200)),
+    ('2001:db8::1', ('2001:db8::1', 2222)),
+    ('[2001:db8::1]:22', ('2001:db8::1', 22)),
+    ('[2001:db8::1]', ('2001:db8::1', 2222)),
+    (('example.com', 22), ('example.com', 22)),
+])
+def test_parse_host(host, parsed):
+    assert parse_host(host) == parsed
+
+
+def test_fan_out(server):
+    port = server('--exec')
+    closed = free_port(HOST)
+    results = fan_out(
+        [f'{HOST}:{port}', f'{HOST}:{closed}', (HOST, port)],
+        command='cat; exit 3',
+        payload=b'hello',
+        timeout=10,
+        collect=True
+    )
+    assert [result.status for result in results] == ['ok', 'error', 'ok']
+    assert [result.attempts for result in results] == [1, 2, 1]
+    for result in results[::2]:
+        assert (result.output, result.exit_status) == (b'hello', 3)
@@ -0,0 +1,236 @@
+import socket
+import socketserver
+import threading
+import time
+
+import paramiko
+import pytest
+from paramiko.common import (
+    OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED,
+    OPEN_FAILED_CONNECT_FAILED,
+)
+from paramiko.ssh_exception import ChannelException, SSHException
+
+from conftest import HOST
+from ssh.bench import free_port
+
+
+class _Echo(socketserver.BaseRequestHandler):
+    """Echo until EOF, then say goodbye and close."""
+
+    def handle(self):
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            self.request.sendall(data)
+        self.request.sendall(b'bye')
+
+
+@pytest.fixture
+def echo():
+    """The port of a local echo server."""
+    server = socketserver.ThreadingTCPServer((HOST, 0), _Echo)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def _options(keys, options):
+    """Prefix the client key's ``authorized_keys`` line with options."""
+    path = keys / 'keys' / 'server' / 'authorized_keys'
+    path.write_text(f'{options} {path.read_text()}')
+
+
+def _connect(port):
+    key = paramiko.ECDSAKey.from_private_key_file('keys/client/id_ecdsa')
+    transport = paramiko.Transport((HOST, port))
+    transport.connect(username='user', pkey=key)
+    return transport
+
+
+def _open(transport, port):
+    channel = transport.open_channel(
+        'direct-tcpip', (HOST, port), ('127.0.0.1', 40000), timeout=10
+    )
+    channel.settimeout(10)
+    return channel
+
+
+def _refusal(transport, port):
+    with pytest.raises(ChannelException) as info:
+        _open(transport, port)
+    return info.value.code
+
+
+def _read_all(channel):
+    data = bytearray()
+    while True:
+        chunk = channel.recv(65536)
+        if not chunk:
+            return bytes(data)
+        data += chunk
+
+
+def test_local_forward(server, echo):
+    transport = _connect(server('--allow-forward', f'{HOST}:{echo}'))
+    try:
+        channel = _open(transport, echo)
+        channel.sendall(b'ping')
+        assert channel.recv(1024) == b'ping'
+        # More than the SSH window and the socket buffers hold at once.
+        data = bytes(range(256)) * 40000
+        sender = threading.Thread(target=channel.sendall, args=(data,))
+        sender.start()
+        received = bytearray()
+        while len(received) < len(data):
+            received += channel.recv(65536)
+        sender.join()
+        assert received == data
+        # Half-close: the echo server sees EOF and can still answer.
+        channel.shutdown_write()
+        assert _read_all(channel) == b'bye'
+    finally:
+        transport.close()
+
+
+def test_denied_destinations(server, echo):
+    transport = _connect(server('--allow-forward', f'{HOST}:{echo}'))
+    try:
+        closed = free_port(HOST)
+        assert _refusal(transport, closed) == (
+            OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        )
+        with pytest.raises(ChannelException):
+            transport.open_channel(
+                'direct-tcpip', ('localhost', echo), ('127.0.0.1', 40000),
+                timeout=10
+            )
+        assert _open(transport, echo) is not None
+    finally:
+        transport.close()
+    transport = _connect(server())
+    try:
+        assert _refusal(transport, echo) == (
+            OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        )
+    finally:
+        transport.close()
+
+
+def test_connect_failed(server):
+    transport = _connect(server('--allow-forward', f'{HOST}:*'))
+    try:
+        assert _refusal(transport, free_port(HOST)) == (
+            OPEN_FAILED_CONNECT_FAILED
+        )
+    finally:
+        transport.close()
+
+
+def test_permitopen(keys, server, echo):
+    other = free_port(HOST)
+    _options(keys, f'permitopen="{HOST}:{echo}"')
+    transport = _connect(server('--allow-forward', f'{HOST}:*'))
+    try:
+        _open(transport, echo).close()
+        assert _refusal(transport, other) == (
+            OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        )
+    finally:
+        transport.close()
+
+
+@pytest.mark.parametrize('options', ['no-port-forwarding', 'restrict'])
+def test_key_may_not_forward(keys, server, echo, options):
+    _options(keys, options)
+    transport = _connect(server(
+        '--allow-forward', f'{HOST}:*', '--allow-listen', f'{HOST}:*'
+    ))
+    try:
+        assert _refusal(transport, echo) == (
+            OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        )
+        with pytest.raises(SSHException):
+            transport.request_port_forward(HOST, 0)
+    finally:
+        transport.close()
+
+
+def _wait_refused(port):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection((HOST, port), timeout=10).close()
+        except ConnectionRefusedError:
+            return
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_remote_forward(server):
+    transport = _connect(server('--allow-listen', f'{HOST}:*'))
+    try:
+        port = transport.request_port_forward(HOST, 0)
+        assert port
+        with socket.create_connection((HOST, port), timeout=10) as sock:
+            channel = transport.accept(10)
+            assert channel is not None
+            channel.settimeout(10)
+            sock.sendall(b'ping')
+            assert channel.recv(1024) == b'ping'
+            channel.sendall(b'pong')
+            assert sock.recv(1024) == b'pong'
+            # Half-close from the listening side.
+            sock.shutdown(socket.SHUT_WR)
+            assert channel.recv(1024) == b''
+            channel.sendall(b'bye')
+            channel.shutdown_write()
+            assert sock.recv(1024) == b'bye'
+            assert sock.recv(1024) == b''
+        transport.cancel_port_forward(HOST, port)
+        _wait_refused(port)
+    finally:
+        transport.close()
+
+
+def test_listeners_close_with_transport(server):
+    transport = _connect(server('--allow-listen', f'{HOST}:*'))
+    try:
+        port = transport.request_port_forward(HOST, 0)
+    finally:
+        transport.close()
+    _wait_refused(port)
+
+
+def test_denied_listen(server):
+    allowed = free_port(HOST)
+    transport = _connect(server('--allow-listen', f'{HOST}:{allowed}'))
+    try:
+        with pytest.raises(SSHException):
+            transport.request_port_forward(HOST, 0)
+        with pytest.raises(SSHException):
+            transport.request_port_forward('0.0.0.0', 0)
+    finally:
+        transport.close()
+    transport = _connect(server())
+    try:
+        with pytest.raises(SSHException):
+            transport.request_port_forward(HOST, 0)
+    finally:
+        transport.close()
+
+
+def test_permitlisten(keys, server):
+    allowed = free_port(HOST)
+    _options(keys, f'permitlisten="{HOST}:{allowed}"')
+    transport = _connect(server('--allow-listen', f'{HOST}:*'))
+    try:
+        with pytest.raises(SSHException):
+            transport.request_port_forward(HOST, 0)
+        assert transport.request_port_forward(HOST, allowed) == allowed
+    finally:
+        transport.close()
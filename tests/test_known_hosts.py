@@ -0,0 +1,210 @@
+import paramiko
+import pytest
+from paramiko.ssh_exception import SSHException
+
+from ssh.keys import known_hosts
+from ssh.known_hosts import (
+    HostKeyPolicy,
+    KnownHosts,
+    hash_host,
+    host_name,
+    parse_line,
+)
+
+
+KEY = paramiko.ECDSAKey.generate()
+OTHER = paramiko.ECDSAKey.generate()
+CA = paramiko.ECDSAKey.generate()
+
+
+def _line(hosts, key, marker=None):
+    line = f'{hosts} {key.get_name()} {key.get_base64()}\n'
+    return line if marker is None else f'{marker} {line}'
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / 'known_hosts'
+
+    def load(*lines):
+        path.write_text(''.join(lines))
+        return KnownHosts(str(path), check_interval=0)
+
+    return load
+
+
+def _blobs(store, hostname):
+    keys = store.get(hostname)
+    return None if keys is None else [k.asbytes() for k in keys.values()]
+
+
+@pytest.mark.parametrize('line', [
+    '',
+    '# example.com ecdsa-sha2-nistp256 AAAA',
+    'example.com ecdsa-sha2-nistp256',
+    'example.com ecdsa-sha2-nistp256 not!base64',
+    '@revoked ecdsa-sha2-nistp256 AAAA',
+])
+def test_ignored_lines(line):
+    assert parse_line(line) is None
+
+
+def test_parse_marker():
+    entry = parse_line(_line('*.example.com', CA, '@cert-authority'))
+    assert entry.marker == '@cert-authority'
+    assert entry.hosts == '*.example.com'
+    assert entry.blob == CA.asbytes()
+    assert entry.to_line() == _line('*.example.com', CA, '@cert-authority')
+
+
+def test_host_name():
+    assert host_name('example.com') == 'example.com'
+    assert host_name('example.com', 2222) == '[example.com]:2222'
+
+
+def test_names(store):
+    known = store(
+        _line('example.com,192.0.2.1', KEY),
+        _line('[example.com]:2222', OTHER),
+    )
+    assert _blobs(known, 'example.com') == [KEY.asbytes()]
+    assert _blobs(known, '192.0.2.1') == [KEY.asbytes()]
+    assert _blobs(known, 'EXAMPLE.com') == [KEY.asbytes()]
+    assert _blobs(known, '[example.com]:2222') == [OTHER.asbytes()]
+    assert known.get('www.example.com') is None
+    assert known.get('example') is None
+    assert len(known) == 2
+
+
+def test_hashed(store):
+    known = store(
+        _line(hash_host('example.com'), KEY),
+        _line(hash_host('[example.com]:2222'), OTHER),
+        _line('|1|bad|hash', OTHER),
+    )
+    assert _blobs(known, 'example.com') == [KEY.asbytes()]
+    assert _blobs(known, 'Example.COM') == [KEY.asbytes()]
+    assert _blobs(known, '[example.com]:2222') == [OTHER.asbytes()]
+    assert known.get('example.org') is None
+
+
+def test_hash_host_is_salted():
+    salt = b'\0' * 20
+    assert hash_host('example.com', salt) == hash_host('example.com', salt)
+    assert hash_host('example.com') != hash_host('example.com')
+
+
+@pytest.mark.parametrize('patterns, hostname, matched', [
+    ('*.example.com', 'www.example.com', True),
+    ('*.example.com', 'example.com', False),
+    ('*.EXAMPLE.com', 'www.example.com', True),
+    ('192.0.2.?', '192.0.2.7', True),
+    ('192.0.2.?', '192.0.2.17', False),
+    ('*.example.com,!bad.example.com', 'bad.example.com', False),
+    ('!bad.example.com,*.example.com', 'bad.example.com', False),
+    ('*.example.com,!bad.example.com', 'good.example.com', True),
+    ('!bad.example.com', 'good.example.com', False),
+    ('[*.example.com]:2222', '[www.example.com]:2222', True),
+    ('[*.example.com]:2222', '[www.example.com]:22', False),
+    ('[*.example.com]:2222', 'www.example.com', False),
+    ('*.example.com', '[www.example.com]:2222', False),
+])
+def test_patterns(store, patterns, hostname, matched):
+    known = store(_line(patterns, KEY))
+    assert (known.get(hostname) is not None) is matched
+
+
+def test_revoked(store):
+    known = store(
+        _line('example.com', KEY),
+        _line('example.com', OTHER),
+        _line('*', KEY, '@revoked'),
+    )
+    assert known.revoked(KEY)
+    assert not known.revoked(OTHER)
+    assert _blobs(known, 'example.com') == [OTHER.asbytes()]
+    for policy in ('yes', 'accept-new', 'no'):
+        with pytest.raises(SSHException, match='revoked'):
+            HostKeyPolicy(known, policy).missing_host_key(
+                None, 'example.com', KEY
+            )
+
+
+def test_authorities(store):
+    known = store(
+        _line('*.example.com,!bad.example.com', CA, '@cert-authority'),
+        _line('[*.example.com]:2222', OTHER, '@cert-authority'),
+    )
+    assert known.get('www.example.com') is None
+    assert [e.blob for e in known.authorities('www.example.com')] == [
+        CA.asbytes()
+    ]
+    assert known.authorities('bad.example.com') == []
+    assert known.authorities('example.org') == []
+    assert [
+        e.blob for e in known.authorities('[www.example.com]:2222')
+    ] == [OTHER.asbytes()]
+
+
+def test_plain_key_needs_policy_despite_authority(store):
+    # A host's plain key is not vouched for by a @cert-authority line.
+    known = store(_line('*.example.com', CA, '@cert-authority'))
+    with pytest.raises(SSHException, match='No ecdsa'):
+        HostKeyPolicy(known, 'yes').missing_host_key(
+            None, 'www.example.com', KEY
+        )
+
+
+def test_policies(store):
+    known = store()
+    with pytest.raises(ValueError):
+        HostKeyPolicy(known, 'ask')
+    with pytest.raises(SSHException):
+        HostKeyPolicy(known, 'yes').missing_host_key(None, 'a.example', KEY)
+    HostKeyPolicy(known, 'no').missing_host_key(None, 'a.example', KEY)
+    assert known.get('a.example') is None
+    HostKeyPolicy(known, 'accept-new').missing_host_key(
+        None, 'a.example', KEY
+    )
+    assert _blobs(known, 'a.example') == [KEY.asbytes()]
+
+
+def test_add_and_flush(tmp_path):
+    path = tmp_path / 'known_hosts'
+    path.write_text(_line('example.com', KEY).rstrip('\n'))
+    known = KnownHosts(str(path), check_interval=0, hash_hosts=True)
+    known.add('[New.example]:2222', OTHER)
+    known.add('[new.example]:2222', OTHER)
+    assert _blobs(known, '[new.example]:2222') == [OTHER.asbytes()]
+    known.flush()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[1].startswith('|1|')
+    reloaded = KnownHosts(str(path), check_interval=0)
+    assert _blobs(reloaded, '[new.example]:2222') == [OTHER.asbytes()]
+    assert _blobs(reloaded, 'example.com') == [KEY.asbytes()]
+
+
+def test_file_is_reread_when_changed(tmp_path):
+    path = tmp_path / 'known_hosts'
+    known = KnownHosts(str(path), check_interval=0)
+    assert known.get('example.com') is None
+    path.write_text(_line('example.com', KEY))
+    assert _blobs(known, 'example.com') == [KEY.asbytes()]
+    path.write_text(_line('*', KEY, '@revoked') + 'x' * 100 + '\n')
+    assert known.get('example.com') is None
+    assert known.revoked(KEY)
+
+
+def test_shared_store_keeps_its_directory(tmp_path, monkeypatch):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    monkeypatch.chdir(tmp_path / 'a')
+    known = known_hosts('known_hosts')
+    known.add('example.com', KEY)
+    monkeypatch.chdir(tmp_path / 'b')
+    known.flush()
+    assert (tmp_path / 'a' / 'known_hosts').read_text() == _line(
+        'example.com', KEY
+    )
+    assert not (tmp_path / 'b' / 'known_hosts').exists()
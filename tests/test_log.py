@@ -0,0 +1,28 @@
+import time
+
+import paramiko
+
+from conftest import HOST
+
+
+def _wait_for(path, text, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if path.exists() and text in path.read_text():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_worker_records_reach_the_log(server, keys):
+    path = keys / 'workers.log'
+    port = server('--workers', '2', '--log-file', str(path))
+    for index in range(2):
+        assert _wait_for(path, f'Worker {index} started')
+    key = paramiko.ECDSAKey.from_private_key_file('keys/client/id_ecdsa')
+    transport = paramiko.Transport((HOST, port))
+    try:
+        transport.connect(username='user', pkey=key)
+    finally:
+        transport.close()
+    assert _wait_for(path, "Authorized key found for 'user'")
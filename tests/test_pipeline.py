@@ -0,0 +1,149 @@
+import socket
+import threading
+
+import pytest
+
+from ssh.pipeline import LengthFramer, LineFramer, pipelined, send_all
+
+
+MESSAGES = [b'', b'a', b'hello world', bytes(range(256)) * 10]
+
+
+def _stream(framer, messages):
+    return b''.join(framer.encode(message) for message in messages)
+
+
+def _feed(decoder, stream, sizes):
+    """Feed ``stream`` in pieces of ``sizes``, cycled; every message."""
+    messages = []
+    at = 0
+    index = 0
+    while at < len(stream):
+        size = sizes[index % len(sizes)]
+        messages += decoder.feed(stream[at:at + size])
+        at += size
+        index += 1
+    return messages
+
+
+@pytest.mark.parametrize('sizes', [
+    [1],
+    [2, 3],
+    [4],
+    [5, 1, 7],
+    [4096],
+    [1 << 20],
+])
+def test_length_decoder(sizes):
+    framer = LengthFramer()
+    stream = _stream(framer, MESSAGES)
+    decoder = framer.decoder()
+    assert _feed(decoder, stream, sizes) == MESSAGES
+    assert decoder.buffer == b''
+
+
+def test_length_decoder_keeps_partial_messages():
+    framer = LengthFramer()
+    decoder = framer.decoder()
+    stream = _stream(framer, [b'first', b'second'])
+    # A whole message and the header of the next, then the rest.
+    assert decoder.feed(stream[:13]) == [b'first']
+    assert decoder.feed(stream[13:15]) == []
+    assert decoder.feed(stream[15:]) == [b'second']
+    assert decoder.feed(b'') == []
+    assert framer.encode(b'\n') == b'\0\0\0\1\n'
+
+
+@pytest.mark.parametrize('sizes', [[1], [2, 3], [5, 1, 7], [4096]])
+def test_line_decoder(sizes):
+    framer = LineFramer()
+    messages = [b'', b'a', b'hello world', b'\r', b'x' * 5000]
+    decoder = framer.decoder()
+    assert _feed(decoder, _stream(framer, messages), sizes) == messages
+    assert decoder.buffer == b''
+
+
+def test_line_decoder_keeps_partial_lines():
+    decoder = LineFramer().decoder()
+    assert decoder.feed(b'one\ntw') == [b'one']
+    assert decoder.feed(b'o') == []
+    assert decoder.feed(b'\nthree\n\n') == [b'two', b'three', b'']
+    assert LineFramer().encode(b'line\n') == b'line\n'
+    assert LineFramer().encode(b'line') == b'line\n'
+
+
+class _EchoChannel:
+    """
+    An in-memory channel that echoes what is sent to it, in pieces of
+    ``piece`` bytes, and tracks the requests awaiting replies.
+    """
+
+    def __init__(self, framer, piece):
+        self.decoder = framer.decoder()
+        self.piece = piece
+        self.pending = bytearray()
+        self.timeout = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cond = threading.Condition()
+
+    def gettimeout(self):
+        return self.timeout
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def send(self, data):
+        data = bytes(data[:self.piece])
+        with self.cond:
+            self.in_flight += len(self.decoder.feed(data))
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.pending += data
+            self.cond.notify_all()
+        return len(data)
+
+    def recv(self, size):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.pending, self.timeout):
+                raise socket.timeout()
+            data = bytes(self.pending[:min(size, self.piece)])
+            del self.pending[:len(data)]
+            return data
+
+    def replied(self, count=1):
+        with self.cond:
+            self.in_flight -= count
+
+
+@pytest.mark.parametrize('framer', [LineFramer(), LengthFramer()])
+@pytest.mark.parametrize('piece', [3, 1 << 16])
+def test_pipelined(framer, piece):
+    channel = _EchoChannel(framer, piece)
+    channel.settimeout(10)
+    payloads = [b'message %d' % i for i in range(200)]
+    replies = []
+    for reply in pipelined(channel, iter(payloads), framer, window=8):
+        replies.append(reply)
+        channel.replied()
+    assert replies == payloads
+    # A reply's credit is returned just before it is yielded, so one more
+    # request may be sent before the loop above counts it.
+    assert channel.max_in_flight <= 8 + 1
+    assert channel.gettimeout() == 10
+
+
+def test_send_all():
+    framer = LengthFramer()
+    channel = _EchoChannel(framer, 1 << 16)
+    replies = []
+    assert send_all(channel, [b'a', b'b'], replies.append, framer) == 2
+    assert replies == [b'a', b'b']
+
+
+def test_channel_closed_early():
+    class Closed(_EchoChannel):
+        def recv(self, size):
+            return b''
+
+    with pytest.raises(EOFError):
+        list(pipelined(Closed(LineFramer(), 10), [b'a']))
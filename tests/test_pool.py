@@ -0,0 +1,155 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import HOST
+from ssh.pool import ConnectionPool
+
+
+WELCOME = b'Connected to SSH server on'
+
+
+@pytest.fixture
+def pools(keys):
+    """Make `ConnectionPool` objects that are closed after the test."""
+    made = []
+
+    def make(**kwargs):
+        kwargs.setdefault('host_key_policy', 'no')
+        kwargs.setdefault('timeout', 10)
+        made.append(ConnectionPool(**kwargs))
+        return made[-1]
+
+    yield make
+    for pool in made:
+        pool.close()
+
+
+def _echo(channel, data=b'ping'):
+    channel.settimeout(10)
+    assert channel.recv(1024).startswith(WELCOME)
+    channel.sendall(data)
+    assert channel.recv(1024) == data
+
+
+def test_channels_share_transports(server, pools):
+    port = server()
+    pool = pools(max_channels=2)
+    channels = [pool.open_session(HOST, port) for _ in range(3)]
+    for channel in channels:
+        _echo(channel)
+    assert len(pool) == 2
+    assert pool.stats['handshakes'] == 2
+    assert len({channel.get_transport() for channel in channels}) == 2
+    for channel in channels:
+        pool.release(channel)
+    assert pool._host_channels == {(HOST, port, 'user'): 0}
+    with pool.session(HOST, port) as channel:
+        _echo(channel)
+    assert pool.stats == {
+        'handshakes': 2, 'reused': 2, 'health_checks': 0, 'evicted': 0
+    }
+
+
+def test_host_channel_limit(server, pools):
+    port = server()
+    pool = pools(max_host_channels=1, timeout=0.5)
+    first = pool.open_session(HOST, port)
+    with pytest.raises(TimeoutError):
+        pool.open_session(HOST, port)
+    pool.timeout = 10
+    opened = []
+    waiter = threading.Thread(
+        target=lambda: opened.append(pool.open_session(HOST, port))
+    )
+    waiter.start()
+    waiter.join(0.3)
+    assert waiter.is_alive()
+    pool.release(first)
+    waiter.join(10)
+    assert len(opened) == 1
+    _echo(opened[0])
+    assert pool.stats['handshakes'] == 1
+
+
+def test_health_check(server, pools):
+    port = server()
+    pool = pools(health_interval=0)
+    with pool.session(HOST, port) as channel:
+        transport = channel.get_transport()
+    with pool.session(HOST, port) as channel:
+        _echo(channel)
+        assert channel.get_transport() is transport
+    assert pool.stats['health_checks'] == 1
+    assert pool.stats['reused'] == 1
+    # A transport that fails its check is replaced.
+    conn = next(iter(pool._connections))
+    conn.probe = SimpleNamespace(ping=lambda timeout: False)
+    with pool.session(HOST, port) as channel:
+        _echo(channel)
+        assert channel.get_transport() is not transport
+    assert not transport.is_active()
+    assert pool.stats['handshakes'] == 2
+    assert len(pool) == 1
+
+
+def test_probe_leaves_global_requests_alone(server, pools):
+    port = server()
+    pool = pools()
+    with pool.session(HOST, port):
+        pass
+    conn = next(iter(pool._connections))
+    for _ in range(3):
+        assert conn.probe.ping(10)
+    # The probe's replies were not taken for this request's, nor this
+    # request's for a later probe's.
+    replies = []
+    request = threading.Thread(target=lambda: replies.append(
+        conn.transport.global_request('keepalive@openssh.com', wait=True)
+    ))
+    request.start()
+    assert conn.probe.ping(10)
+    request.join(10)
+    assert not request.is_alive()
+    assert conn.probe.ping(10)
+    assert conn.probe.answered == conn.probe.sent
+
+
+def test_closed_transport_is_replaced(server, pools):
+    port = server()
+    pool = pools()
+    with pool.session(HOST, port) as channel:
+        transport = channel.get_transport()
+    transport.close()
+    with pool.session(HOST, port) as channel:
+        _echo(channel)
+    assert pool.stats['handshakes'] == 2
+
+
+def test_idle_transports_expire(server, pools):
+    port = server()
+    pool = pools(idle_timeout=0)
+    with pool.session(HOST, port) as channel:
+        transport = channel.get_transport()
+    with pool.session(HOST, port) as channel:
+        _echo(channel)
+    assert not transport.is_active()
+    assert pool.stats['evicted'] == 1
+    assert len(pool) == 1
+
+
+def test_least_recently_used_evicted(server, pools):
+    port = server()
+    pool = pools(max_transports=1)
+    with pool.session(HOST, port) as channel:
+        transport = channel.get_transport()
+    busy = pool.open_session(HOST, port, 'other')
+    assert not transport.is_active()
+    assert pool.stats['evicted'] == 1
+    # Transports with open channels are kept over the limit.
+    with pool.session(HOST, port) as channel:
+        _echo(channel)
+        assert len(pool) == 2
+    _echo(busy)
+    pool.release(busy)
@@ -0,0 +1,201 @@
+import os
+
+import pytest
+
+from ssh import recording
+from ssh.metrics import Metrics
+from ssh.recording import (
+    EVENT,
+    FRAME,
+    INPUT,
+    LOST,
+    LOST_BYTES,
+    MAGIC,
+    OUTPUT,
+    Recorder,
+    RecordingReader,
+)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1700000000.0 + self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(recording, 'time', clock)
+    return clock
+
+
+def _frames(reader, **kwargs):
+    return [
+        (frame.time, frame.kind, frame.channel, bytes(frame.data))
+        for frame in reader.frames(**kwargs)
+    ]
+
+
+def _read(tmp_path, name='session', **kwargs):
+    with RecordingReader(str(tmp_path / f'{name}.rec')) as reader:
+        return _frames(reader, **kwargs)
+
+
+def test_block_hand_off(tmp_path, clock):
+    recorder = Recorder(str(tmp_path), block_size=100)
+    session = recorder.open('session', user='user')
+    # The start event is handed over at once.
+    assert len(recorder._queue) == 1
+    session.input(0, b'a' * 10)
+    assert len(recorder._queue) == 1
+    assert session.size == FRAME.size + 10
+    assert recorder._dirty_recordings == {session}
+    session.output(0, b'b' * 100)
+    assert len(recorder._queue) == 2
+    assert (session.pieces, session.size) == ([], 0)
+    assert recorder._dirty_recordings == set()
+    assert recorder.buffered == sum(entry[2] for entry in recorder._queue)
+    session.stderr(0, b'c')
+    session.flush()
+    assert len(recorder._queue) == 3
+    recorder.start()
+    session.close()
+    recorder.close()
+    assert recorder.buffered == 0
+    frames = _read(tmp_path)
+    assert [frame[1:] for frame in frames[1:]] == [
+        (INPUT, 0, b'a' * 10),
+        (OUTPUT, 0, b'b' * 100),
+        (recording.STDERR, 0, b'c'),
+        (EVENT, recording.NO_CHANNEL, b'{"event": "end"}'),
+    ]
+    with RecordingReader(str(tmp_path / 'session.rec')) as reader:
+        start = next(reader.events())[2]
+    assert start == {'event': 'start', 'time': 1700001000.0, 'user': 'user'}
+
+
+@pytest.mark.parametrize('data', [b'hello', b'x' * recording.COPY_SIZE])
+def test_echo_is_stored_once(tmp_path, clock, data):
+    recorder = Recorder(str(tmp_path)).start()
+    session = recorder.open('session')
+    session.echo(3, data)
+    session.close()
+    recorder.close()
+    assert (tmp_path / 'session.rec').read_bytes().count(data) == 1
+    assert [frame[1:] for frame in _read(tmp_path, kinds=(INPUT, OUTPUT))] == [
+        (INPUT, 3, data),
+        (OUTPUT, 3, data),
+    ]
+
+
+def test_lost_frames(tmp_path, clock):
+    metrics = Metrics()
+    recorder = Recorder(str(tmp_path), block_size=1, metrics=metrics)
+    session = recorder.open('session')
+    frame = FRAME.size + 10
+    recorder.max_buffered = recorder.buffered + frame
+    clock.now += 1
+    session.output(0, b'a' * 10)
+    clock.now += 1
+    session.output(0, b'b' * 10)
+    clock.now += 1
+    session.output(0, b'c' * 10)
+    # The second block is dropped, and the third, which starts with a
+    # LOST frame for it, too.
+    lost = frame + (FRAME.size + LOST_BYTES.size + frame)
+    assert session.lost == lost
+    assert metrics.counters['recording_dropped_bytes'] == lost
+    recorder.start()
+    clock.now += 1
+    session.close()
+    recorder.close()
+    frames = _read(tmp_path)
+    assert [frame[:2] for frame in frames] == [
+        (0.0, EVENT),
+        (1.0, OUTPUT),
+        (4.0, LOST),
+        (4.0, EVENT),
+    ]
+    assert frames[1][3] == b'a' * 10
+    assert LOST_BYTES.unpack(frames[2][3]) == (lost,)
+    with RecordingReader(str(tmp_path / 'session.rec')) as reader:
+        assert list(reader.events())[1] == (
+            4.0, recording.NO_CHANNEL, {'event': 'lost', 'bytes': lost}
+        )
+    assert [frame[:2] for frame in _read(tmp_path, start=2)] == [
+        (4.0, LOST),
+        (4.0, EVENT),
+    ]
+
+
+def _long_session(tmp_path, clock, seconds=10, block_size=None):
+    kwargs = {} if block_size is None else {'block_size': block_size}
+    recorder = Recorder(str(tmp_path), **kwargs).start()
+    session = recorder.open('session')
+    for second in range(1, seconds + 1):
+        clock.now += 1
+        session.output(second % 2, bytes([second]) * 40000)
+    clock.now += 1
+    session.close()
+    recorder.close()
+
+
+@pytest.mark.parametrize('block_size', [None, 50000])
+def test_seek(tmp_path, clock, block_size):
+    _long_session(tmp_path, clock, block_size=block_size)
+    with RecordingReader(str(tmp_path / 'session.rec')) as reader:
+        assert len(reader._times) > 3
+        assert reader.seek(-1) == len(MAGIC)
+        offsets = [reader.seek(second + 0.5) for second in range(11)]
+        assert offsets == sorted(offsets)
+        assert offsets[8] > offsets[3] > len(MAGIC)
+        for second, offset in enumerate(offsets):
+            assert FRAME.unpack_from(reader._map, offset)[0] <= (
+                (second + 0.5) * 1e6
+            )
+        frames = _frames(reader, start=5.5, kinds=(OUTPUT,))
+        assert [(frame[0], frame[3][:1]) for frame in frames] == [
+            (float(second), bytes([second])) for second in range(6, 11)
+        ]
+        assert [
+            frame[0] for frame in _frames(reader, start=3, end=5)
+        ] == [3.0, 4.0, 5.0]
+        assert [
+            frame[0] for frame in _frames(reader, start=3, channel=0)
+        ] == [4.0, 6.0, 8.0, 10.0]
+
+
+def test_cut_short(tmp_path, clock):
+    _long_session(tmp_path, clock)
+    path = tmp_path / 'session.rec'
+    index = tmp_path / 'session.idx'
+    complete = _read(tmp_path)
+    size = os.path.getsize(path)
+    # Lose the end event and half of the last output frame, and leave a
+    # partial entry and one past the end of the data in the index.
+    os.truncate(path, size - FRAME.size - 16 - 20000)
+    with open(index, 'ab') as f:
+        f.write(recording.INDEX.pack(11000000, size))
+        f.write(b'\0' * 5)
+    frames = _read(tmp_path)
+    assert frames == complete[:-2]
+    assert _read(tmp_path, start=9.5) == []
+    assert _read(tmp_path, start=8.5) == complete[-3:-2]
+    # Without its index the recording is read from the start.
+    index.unlink()
+    assert _read(tmp_path) == complete[:-2]
+    assert _read(tmp_path, start=8.5) == complete[-3:-2]
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'session.rec'
+    path.write_bytes(b'SSHREC0\n')
+    with pytest.raises(ValueError):
+        RecordingReader(str(path))
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from paramiko import SFTP_OK, SFTP_PERMISSION_DENIED
+
+from conftest import ROOT
+from ssh.sftp import SFTPRoot
+
+
+SIZE = 4 * 1024 * 1024
+CHUNK = 32 * 1024
+
+_READER = '''
+import os, sys, time
+from ssh.sftp import SFTPRoot
+root = SFTPRoot(None, sys.argv[1])
+deadline = time.monotonic() + float(sys.argv[2])
+while time.monotonic() < deadline:
+    handle = root.open('/data', os.O_RDONLY, None)
+    for offset in range(0, %d, %d):
+        data = handle.read(offset, %d)
+        if not isinstance(data, bytes):
+            sys.exit('read failed: %%r' %% data)
+    handle.close()
+''' % (SIZE, CHUNK, CHUNK)
+
+
+def test_read_while_truncated(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(b'x' * SIZE)
+    reader = subprocess.Popen(
+        [sys.executable, '-c', _READER, str(tmp_path), '2'],
+        env=dict(os.environ, PYTHONPATH=ROOT)
+    )
+    try:
+        while reader.poll() is None:
+            # As another session's upload would: O_TRUNC, then refill.
+            with open(path, 'wb') as f:
+                f.write(b'y' * (SIZE // 2))
+            time.sleep(0.001)
+            path.write_bytes(b'x' * SIZE)
+    finally:
+        reader.wait(10)
+    # Killed by SIGBUS if it read a truncated file through a mapping.
+    assert reader.returncode == 0
+
+
+@pytest.fixture
+def root(tmp_path):
+    """A served root, with ``secret`` outside of it."""
+    (tmp_path / 'secret').write_text('secret')
+    served = tmp_path / 'root'
+    (served / 'dir').mkdir(parents=True)
+    (served / 'file').write_text('file')
+    # A sibling whose name starts with the root's.
+    (tmp_path / 'root2').mkdir()
+    return SFTPRoot(None, str(served))
+
+
+@pytest.mark.parametrize('path, local', [
+    ('', ''),
+    ('/', ''),
+    ('..', ''),
+    ('/../..', ''),
+    ('dir/../file', 'file'),
+    ('/dir/../../../file', 'file'),
+    ('../root2', 'root2'),
+    ('//dir//.', 'dir'),
+])
+def test_dot_dot_stays_inside(root, path, local):
+    assert root.local(path) == os.path.join(root.root, local).rstrip('/')
+
+
+def test_symlink_escapes(root):
+    outside = os.path.dirname(root.root)
+    os.symlink(outside, os.path.join(root.root, 'up'))
+    os.symlink('../secret', os.path.join(root.root, 'secret'))
+    os.symlink(outside + '/root2', os.path.join(root.root, 'sibling'))
+    for path in ('/up', '/up/secret', '/secret', '/sibling', '/dir/../up'):
+        with pytest.raises(PermissionError):
+            root.local(path)
+        assert root.stat(path) == SFTP_PERMISSION_DENIED
+    assert root.open('/secret', os.O_RDONLY, None) == SFTP_PERMISSION_DENIED
+    assert root.open(
+        '/up/new', os.O_WRONLY | os.O_CREAT, None
+    ) == SFTP_PERMISSION_DENIED
+    assert root.list_folder('/up') == SFTP_PERMISSION_DENIED
+    assert root.mkdir('/up/new', None) == SFTP_PERMISSION_DENIED
+    assert root.rename('/file', '/up/file') == SFTP_PERMISSION_DENIED
+    assert root.posix_rename('/file', '/up/file') == SFTP_PERMISSION_DENIED
+    assert root.readlink('/sibling') == SFTP_PERMISSION_DENIED
+    assert not os.path.exists(os.path.join(outside, 'new'))
+    assert not os.path.exists(os.path.join(outside, 'file'))
+    # The links themselves may be looked at and removed.
+    assert root.lstat('/secret').st_size == len('../secret')
+    assert root.readlink('/secret') == '../secret'
+    assert root.remove('/secret') == SFTP_OK
+    assert os.path.exists(os.path.join(outside, 'secret'))
+
+
+def test_dangling_symlink_escape(root):
+    outside = os.path.join(os.path.dirname(root.root), 'created')
+    root.symlink(outside, '/link')
+    assert os.path.islink(os.path.join(root.root, 'link'))
+    assert root.open(
+        '/link', os.O_WRONLY | os.O_CREAT, None
+    ) == SFTP_PERMISSION_DENIED
+    assert root.mkdir('/link', None) == SFTP_PERMISSION_DENIED
+    assert not os.path.exists(outside)
+
+
+def test_symlinks_inside(root):
+    os.symlink('dir', os.path.join(root.root, 'inside'))
+    os.symlink(
+        os.path.join(root.root, 'file'), os.path.join(root.root, 'absolute')
+    )
+    assert root.local('/inside') == os.path.join(root.root, 'dir')
+    assert root.list_folder('/inside') == []
+    assert root.readlink('/absolute') == '/file'
+    handle = root.open('/absolute', os.O_RDONLY, None)
+    assert handle.read(0, 100) == b'file'
+    handle.close()
+
+
+def test_filesystem_root():
+    root = SFTPRoot(None, '/')
+    assert root.local('/etc/../tmp') == os.path.realpath('/tmp')
+    assert root.virtual('/tmp') == '/tmp'